@@ -1,33 +1,43 @@
 from __future__ import annotations
 
-from datetime import date, datetime
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Literal, Mapping, Optional, Sequence
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import HTMLResponse
 from loguru import logger
-from pydantic import BaseModel
-from sqlalchemy import text
-
-from platform_common.db import get_engine, Base
-from transformations.runner import run_all as run_transformations
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import Row, select, text
+from sqlalchemy.engine import Engine
+
+from analytics import sketches
+from analytics.lake import get_lake
+from forecasting.serving import get_forecast_cache, reset_forecast_cache
+from platform_common import query_profiles
+from platform_common.config import settings
+from platform_common.db import ReadYourWritesMiddleware, get_read_engine, scatter
+from platform_common.metrics import instrument_app
+from platform_common.migrations import migrate_on_startup
 
 app = FastAPI(title="FFDP Analytics API", version="0.1.0")
+instrument_app(app, "analytics")
+app.add_middleware(ReadYourWritesMiddleware)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
-    # Ensure tables exist and run transformations once to create views
-    engine = get_engine()
-    # Register models
-    from ingestion.app import models as _ingestion_models  # noqa: F401
-    from forecasting import models as _forecast_models  # noqa: F401
-    Base.metadata.create_all(bind=engine)
+    # Tables and views are created once per database version, not on every boot
     try:
-        run_transformations()
+        migrate_on_startup()
     except Exception:
         # Views may depend on data; ignore failures on cold start
-        logger.warning("Transformations run failed or not needed on startup")
+        logger.warning("Migrations or transformations failed on startup; retrying next boot")
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    reset_forecast_cache()
+
 
 @app.get("/health")
 def health() -> dict[str, str]:
@@ -265,6 +275,32 @@ def dashboard() -> str:
     """
 
 
+def _gather(sql: str, params: Mapping[str, object]) -> list[Row[Any]]:
+    """The query's rows from every event shard, queried in parallel (one database when unsharded)."""
+    def fetch(engine: Engine) -> Sequence[Row[Any]]:
+        with engine.connect() as conn:
+            return conn.execute(text(sql), params).all()
+
+    return [row for rows in scatter(fetch) for row in rows]
+
+
+def _summed(rows: list[Row[Any]], keys: int) -> list[tuple[Any, ...]]:
+    """Rows merged across shards: the columns after the first `keys` summed per key, ordered by key.
+
+    Shards hold disjoint customers, so sums and counts of their facts add up to the whole.
+    """
+    merged: dict[tuple[Any, ...], list[Any]] = {}
+    for row in rows:
+        key = tuple(row[:keys])
+        values = merged.get(key)
+        if values is None:
+            merged[key] = list(row[keys:])
+        else:
+            for i, value in enumerate(row[keys:]):
+                values[i] += value
+    return [(*key, *values) for key, values in sorted(merged.items())]
+
+
 class RevenueByRegionResponse(BaseModel):
     rows: list[dict]
 
@@ -274,7 +310,9 @@ def revenue_by_region(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
 ):
-    engine = get_engine()
+    if settings.ANALYTICS_BACKEND == "lake":
+        facts = get_lake().fact("fact_revenue_daily", start_date, end_date)
+        return RevenueByRegionResponse(rows=[{k: r[k] for k in ("date_key", "region_key", "revenue_amount")} for r in facts])
     where = []
     params: dict[str, object] = {}
     if start_date:
@@ -289,10 +327,11 @@ def revenue_by_region(
         select date_key::date, region_key, revenue_amount::numeric
         from fact_revenue_daily
         {where_sql}
-        order by 1, 2
     """
-    with engine.begin() as conn:
-        rows = [dict(r._mapping) for r in conn.execute(text(sql), params)]
+    rows = [
+        {"date_key": date_key, "region_key": region_key, "revenue_amount": revenue}
+        for date_key, region_key, revenue in _summed(_gather(sql, params), keys=2)
+    ]
     return RevenueByRegionResponse(rows=rows)
 
 
@@ -305,7 +344,6 @@ class MRRResponse(BaseModel):
 def mrr(
     month: Optional[str] = Query(None, description="YYYY-MM"),
 ):
-    engine = get_engine()
     if month is None:
         # default to current month
         month = datetime.utcnow().strftime("%Y-%m")
@@ -313,15 +351,17 @@ def mrr(
         dt = datetime.strptime(month, "%Y-%m").date().replace(day=1)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid month format, expected YYYY-MM")
+    if settings.ANALYTICS_BACKEND == "lake":
+        month_end = (dt + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        rows = get_lake().fact("fact_revenue_daily", dt, month_end)
+        return MRRResponse(month=month, mrr=float(sum(r["revenue_amount"] for r in rows)))
 
     sql = """
         select coalesce(sum(revenue_amount),0)::numeric as mrr
         from fact_revenue_daily
         where date_trunc('month', date_key) = :month
     """
-    with engine.begin() as conn:
-        row = conn.execute(text(sql), {"month": dt}).first()
-        mrr_value = float(row[0]) if row else 0.0
+    mrr_value = float(sum(row[0] for row in _gather(sql, {"month": dt})))
     return MRRResponse(month=month, mrr=mrr_value)
 
 
@@ -336,39 +376,185 @@ class ChurnResponse(BaseModel):
 def churn(
     day: Optional[date] = Query(None),
 ):
-    engine = get_engine()
+    if settings.ANALYTICS_BACKEND == "lake":
+        churned = get_lake().churn(day)
+        if churned is None:
+            raise HTTPException(status_code=404, detail="No subscription data")
+        day, cancellations, prev_active_i = churned
+        churn_rate = float(cancellations / prev_active_i) if prev_active_i > 0 else 0.0
+        return ChurnResponse(date=day, cancellations=cancellations, prev_active=prev_active_i, churn_rate=churn_rate)
     if day is None:
-        with engine.begin() as conn:
-            latest = conn.execute(text("select max(date_key)::date from fact_subscriptions_snapshot")).scalar()
-        if latest is None:
+        latest = [row[0] for row in _gather("select max(date_key)::date from fact_subscriptions_snapshot", {}) if row[0] is not None]
+        if not latest:
             raise HTTPException(status_code=404, detail="No subscription data")
-        day = latest
-
-    with engine.begin() as conn:
-        prev_day = conn.execute(text("select :d::date - interval '1 day'"), {"d": day}).scalar()
-        cancels = conn.execute(
-            text("select count(*) from stg_subscription_events where event_date = :d and (payload::jsonb ->> 'action') = 'canceled'"),
-            {"d": day},
-        ).scalar()
-        prev_active = conn.execute(
-            text("select active_subscriptions from fact_subscriptions_snapshot where date_key = :d"),
-            {"d": prev_day},
-        ).scalar()
-    cancellations = int(cancels or 0)
-    prev_active_i = int(prev_active or 0)
+        day = max(latest)
+
+    # Counts per shard add up: each shard holds its customers' subscriptions
+    rows = _gather(
+        """
+        select (select count(*) from stg_subscription_events where event_date = :d and (payload::jsonb ->> 'action') = 'canceled'),
+               (select active_subscriptions from fact_subscriptions_snapshot where date_key = :prev_day)
+        """,
+        {"d": day, "prev_day": day - timedelta(days=1)},
+    )
+    cancellations = sum(int(cancels or 0) for cancels, _ in rows)
+    prev_active_i = sum(int(prev_active or 0) for _, prev_active in rows)
     churn_rate = float(cancellations / prev_active_i) if prev_active_i > 0 else 0.0
     return ChurnResponse(date=day, cancellations=cancellations, prev_active=prev_active_i, churn_rate=churn_rate)
 
 
+Granularity = Literal["day", "week", "month"]
+
+
+def _rollup_filters(granularity: str, start_date: Optional[date], end_date: Optional[date], **equal: Optional[str]) -> tuple[str, dict[str, object]]:
+    """Where clause over a rollup table: the periods overlapping [start_date, end_date], reported whole."""
+    where = ["granularity = :granularity"]
+    params: dict[str, object] = {"granularity": granularity}
+    if start_date:
+        if granularity == "week":
+            start_date -= timedelta(days=start_date.weekday())
+        elif granularity == "month":
+            start_date = start_date.replace(day=1)
+        where.append("period_start >= :start_date")
+        params["start_date"] = start_date
+    if end_date:
+        where.append("period_start <= :end_date")
+        params["end_date"] = end_date
+    for column, value in equal.items():
+        if value is not None:
+            where.append(f"{column} = :{column}")
+            params[column] = value
+    return " and ".join(where), params
+
+
+class GrossMarginRow(BaseModel):
+    period_start: date
+    region_key: str
+    revenue_amount: float
+    cost_amount: float
+    gross_margin: float
+    margin_pct: Optional[float]
+    payments_count: int
+    costs_count: int
+
+
+class GrossMarginResponse(BaseModel):
+    granularity: str
+    rows: list[GrossMarginRow]
+
+
+@app.get("/metrics/gross_margin", response_model=GrossMarginResponse)
+def gross_margin(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    granularity: Granularity = Query("day", description="Weeks start on Monday; periods are reported whole"),
+    region: Optional[str] = Query(None),
+):
+    """Revenue minus cost per period and region, from margin_rollup."""
+    where, params = _rollup_filters(granularity, start_date, end_date, region_key=region)
+    sql = f"""
+        select period_start, region_key, revenue_amount, cost_amount, payments_count, costs_count
+        from margin_rollup
+        where {where}
+    """
+    rows = []
+    for period_start, region_key, revenue_amount, cost_amount, payments_count, costs_count in _summed(_gather(sql, params), keys=2):
+        revenue, cost = float(revenue_amount), float(cost_amount)
+        rows.append(GrossMarginRow(
+            period_start=period_start,
+            region_key=region_key,
+            revenue_amount=revenue,
+            cost_amount=cost,
+            gross_margin=revenue - cost,
+            margin_pct=(revenue - cost) / revenue if revenue else None,
+            payments_count=payments_count,
+            costs_count=costs_count,
+        ))
+    return GrossMarginResponse(granularity=granularity, rows=rows)
+
+
+class UsageRow(BaseModel):
+    period_start: date
+    metric_name: Optional[str]
+    plan_id: Optional[str]
+    region_key: str
+    total_units: int
+    usage_events: int
+
+
+class UsageResponse(BaseModel):
+    granularity: str
+    rows: list[UsageRow]
+
+
+@app.get("/metrics/usage", response_model=UsageResponse)
+def usage(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    granularity: Granularity = Query("day", description="Weeks start on Monday; periods are reported whole"),
+    metric_name: Optional[str] = Query(None),
+    plan_id: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+):
+    """Usage units per period, metric, plan and region, from usage_rollup."""
+    where, params = _rollup_filters(granularity, start_date, end_date, metric_name=metric_name, plan_id=plan_id, region_key=region)
+    sql = f"""
+        select period_start, metric_name, plan_id, region_key, total_units, usage_events
+        from usage_rollup
+        where {where}
+    """
+    rows = [
+        # Events without a metric or plan are rolled up under ''
+        UsageRow(
+            period_start=period_start, metric_name=metric or None, plan_id=plan or None, region_key=region_key,
+            total_units=total_units, usage_events=usage_events,
+        )
+        for period_start, metric, plan, region_key, total_units, usage_events in _summed(_gather(sql, params), keys=4)
+    ]
+    return UsageResponse(granularity=granularity, rows=rows)
+
+
+class ActiveCustomersRow(BaseModel):
+    period_start: Optional[date]
+    region_key: Optional[str]
+    customers: int
+
+
+class ActiveCustomersResponse(BaseModel):
+    granularity: str
+    standard_error: float
+    rows: list[ActiveCustomersRow]
+
+
+@app.get("/metrics/active_customers", response_model=ActiveCustomersResponse)
+def active_customers(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    granularity: Literal["day", "week", "month", "total"] = Query("day", description="Weeks start on Monday; periods are reported whole"),
+    region: Optional[list[str]] = Query(None, description="Repeat to count customers across several regions"),
+    event_type: Optional[list[str]] = Query(None, description="Repeat for several; default every type"),
+    by_region: bool = Query(False, description="One row per region instead of one across the regions"),
+):
+    """Approximate distinct customers, merged from HyperLogLog sketches (analytics.sketches).
+
+    standard_error is the estimates' relative standard error: about 95% fall within twice it of the exact count.
+    """
+    rows = sketches.active_customers(start_date, end_date, granularity, region, event_type, by_region)
+    return ActiveCustomersResponse(
+        granularity=granularity, standard_error=sketches.STANDARD_ERROR, rows=[ActiveCustomersRow(**row) for row in rows]
+    )
+
+
 class ForecastVsActualRow(BaseModel):
     date: date
-    actual: float
+    actual: Optional[float]
     forecast: float
-    variance: float
-    variance_pct: float
+    variance: Optional[float]
+    variance_pct: Optional[float]
 
 
 class ForecastVsActualResponse(BaseModel):
+    run_id: Optional[int] = None
     rows: list[ForecastVsActualRow]
 
 
@@ -376,40 +562,197 @@ class ForecastVsActualResponse(BaseModel):
 def forecast_vs_actual(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    run_id: Optional[int] = Query(None, description="Model run id; defaults to the latest run for the target"),
+    target: Literal["revenue_daily", "subscriptions_daily"] = Query("revenue_daily"),
+    segment: str = Query("all", description="Region, or 'all' for the total forecast"),
 ):
-    engine = get_engine()
+    engine = get_read_engine()
+    with engine.begin() as conn:
+        if run_id is None:
+            run_id = conn.execute(
+                text("select max(id) from model_runs where target = :target and segment = :segment"),
+                {"target": target, "segment": segment},
+            ).scalar()
+            if run_id is None:
+                return ForecastVsActualResponse(run_id=None, rows=[])
+
+        where = ["run_id = :run_id", "segment = :segment"]
+        params: dict[str, object] = {"run_id": run_id, "segment": segment}
+        if start_date:
+            where.append("date_key >= :start_date")
+            params["start_date"] = start_date
+        if end_date:
+            where.append("date_key <= :end_date")
+            params["end_date"] = end_date
+
+        sql = f"""
+            select date_key, actual, forecast, variance, variance_pct
+            from fact_forecast_variance
+            where {" and ".join(where)}
+            order by date_key
+        """
+        rows = [
+            ForecastVsActualRow(
+                date=r[0],
+                actual=float(r[1]) if r[1] is not None else None,
+                forecast=float(r[2]),
+                variance=float(r[3]) if r[3] is not None else None,
+                variance_pct=float(r[4]) if r[4] is not None else None,
+            )
+            for r in conn.execute(text(sql), params)
+        ]
+    return ForecastVsActualResponse(run_id=run_id, rows=rows)
+
+
+class ForecastPoint(BaseModel):
+    date: date
+    yhat: float
+    yhat_lower: float
+    yhat_upper: float
+
+
+class ForecastResponse(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    run_id: int
+    target: str
+    segment: str
+    model_name: str
+    train_start: date
+    train_end: date
+    created_at: datetime
+    rows: list[ForecastPoint]
+
+
+@app.get("/forecasts/{target}", response_model=ForecastResponse)
+def forecasts(
+    target: Literal["revenue_daily", "subscriptions_daily"],
+    segment: str = Query("all", description="Region, or 'all' for the total forecast"),
+    run_id: Optional[int] = Query(None, description="Model run id; defaults to the latest run for the segment"),
+):
+    """A run's forecast horizon, served from memory once loaded (forecasting.serving)."""
+    forecast = get_forecast_cache().get(target, segment, run_id)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="No forecast run")
+    return ForecastResponse(
+        run_id=forecast.run_id,
+        target=forecast.target,
+        segment=forecast.segment,
+        model_name=forecast.model_name,
+        train_start=forecast.train_start,
+        train_end=forecast.train_end,
+        created_at=forecast.created_at,
+        rows=[ForecastPoint(date=d, yhat=y, yhat_lower=lo, yhat_upper=hi) for d, y, lo, hi in forecast.points],
+    )
+
+
+class ForecastAccuracyRow(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    target: str
+    segment: str
+    model_name: str
+    folds: int
+    first_origin: date
+    last_origin: date
+    mape: Optional[float]
+    smape: Optional[float]
+    mase: Optional[float]
+    coverage: Optional[float]
+
+
+class ForecastAccuracyResponse(BaseModel):
+    rows: list[ForecastAccuracyRow]
+
+
+@app.get("/metrics/forecast_accuracy", response_model=ForecastAccuracyResponse)
+def forecast_accuracy(
+    target: Optional[str] = Query(None),
+    segment: Optional[str] = Query(None),
+    since: Optional[date] = Query(None, description="Only folds with origin on or after this date"),
+):
+    engine = get_read_engine()
     where = []
     params: dict[str, object] = {}
-    if start_date:
-        where.append("a.date_key >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        where.append("a.date_key <= :end_date")
-        params["end_date"] = end_date
+    if target:
+        where.append("target = :target")
+        params["target"] = target
+    if segment:
+        where.append("segment = :segment")
+        params["segment"] = segment
+    if since:
+        where.append("fold_origin >= :since")
+        params["since"] = since
     where_sql = (" where " + " and ".join(where)) if where else ""
 
     sql = f"""
-        with latest_run as (
-            select max(id) as run_id
-            from model_runs
-            where target = 'revenue_daily'
-        )
-        select a.date_key::date as date,
-               a.revenue_amount::numeric as actual,
-               f.yhat::numeric as forecast,
-               (a.revenue_amount::numeric - f.yhat::numeric) as variance,
-               case when a.revenue_amount::numeric <> 0 then (a.revenue_amount::numeric - f.yhat::numeric)/a.revenue_amount::numeric else 0 end as variance_pct
-        from fact_revenue_daily a
-        join latest_run r on true
-        left join forecast_revenue_daily f on f.run_id = r.run_id and f.date_key = a.date_key
+        select target, segment, model_name, count(*) as folds,
+               min(fold_origin) as first_origin, max(fold_origin) as last_origin,
+               avg(mape) as mape, avg(smape) as smape, avg(mase) as mase, avg(coverage) as coverage
+        from backtest_results
         {where_sql}
-        order by 1
+        group by 1, 2, 3
+        order by 1, 2, 3
     """
     with engine.begin() as conn:
-        rows = [
-            ForecastVsActualRow(
-                date=r[0], actual=float(r[1] or 0), forecast=float(r[2] or 0), variance=float(r[3] or 0), variance_pct=float(r[4] or 0)
-            )
-            for r in conn.execute(text(sql), params)
-        ]
-    return ForecastVsActualResponse(rows=rows)
+        rows = [ForecastAccuracyRow(**dict(r._mapping)) for r in conn.execute(text(sql), params)]
+    return ForecastAccuracyResponse(rows=rows)
+
+
+class QueryStatsRow(BaseModel):
+    tag: str
+    fingerprint: str
+    statement: str
+    count: int
+    total_ms: float
+    mean_ms: float
+    p95_ms: float
+    max_ms: float
+
+
+class QueryStatsResponse(BaseModel):
+    since: datetime
+    rows: list[QueryStatsRow]
+
+
+@app.get("/admin/queries", response_model=QueryStatsResponse)
+def admin_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: Literal["total", "p95"] = Query("total"),
+):
+    """Top statements this process has run since it started, by total or p95 time."""
+    rows = [QueryStatsRow(**row) for row in query_profiles.top_statements(limit, order_by)]
+    return QueryStatsResponse(since=query_profiles.started_at, rows=rows)
+
+
+class QueryProfileRow(BaseModel):
+    captured_at: datetime
+    tag: str
+    fingerprint: str
+    duration_ms: float
+    statement: str
+    plan: Optional[Any] = None
+    plan_kind: str
+
+
+class QueryProfilesResponse(BaseModel):
+    rows: list[QueryProfileRow]
+
+
+@app.get("/admin/query_profiles", response_model=QueryProfilesResponse)
+def admin_query_profiles(
+    limit: int = Query(50, ge=1, le=500),
+    tag: Optional[str] = Query(None, description="e.g. 'GET /metrics/churn' or 'model:023_fact_subscriptions_snapshot'"),
+    source: Literal["table", "memory"] = Query("table", description="table: every process (API, scheduler); memory: this one"),
+):
+    """Slow statements captured with their EXPLAIN (ANALYZE, BUFFERS) plans, newest first."""
+    if source == "memory":
+        rows = [QueryProfileRow(**p) for p in query_profiles.recent_profiles(settings.QUERY_PROFILE_BUFFER) if tag is None or p["tag"] == tag]
+        return QueryProfilesResponse(rows=rows[:limit])
+    qp = query_profiles.QueryProfile
+    query = select(qp.captured_at, qp.tag, qp.fingerprint, qp.duration_ms, qp.statement, qp.plan, qp.plan_kind)
+    if tag is not None:
+        query = query.where(qp.tag == tag)
+    with get_read_engine().connect() as conn:
+        rows = [QueryProfileRow(**dict(r._mapping)) for r in conn.execute(query.order_by(qp.captured_at.desc()).limit(limit))]
+    return QueryProfilesResponse(rows=rows)
@@ -0,0 +1,379 @@
+"""Analytics over the lake with an embedded DuckDB: python -m analytics.lake [--full] compacts it.
+
+Every accepted event is also written to S3 as raw/{type}/dt=YYYY-MM-DD/{event_id}.json. The facts of
+transformations/sql are computed here from those objects instead of events_raw, so long historical scans do
+not load the database that ingestion writes to (ANALYTICS_BACKEND=lake).
+
+compact() rewrites each settled partition as one Parquet file under compact/{type}/dt=.../ and records it in
+compact/_manifest.json. Queries read compacted partitions as Parquet and the others as JSON, and only the
+partitions their date range can touch: an event's dt is its date in the offset it was sent with, so one day
+either side of the UTC dates asked for.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, NamedTuple, Optional
+
+from loguru import logger
+
+from platform_common.config import settings
+from platform_common.metrics import LAKE_QUERY_SECONDS, s3_call
+from platform_common.tracing import span
+
+EVENT_TYPES = ("subscription", "payment", "usage", "cost")
+MANIFEST = "compact/_manifest.json"
+
+# Columns of each event type's lake objects, as the stg_<type>_events views type them
+_BASE = {"event_id": "VARCHAR", "event_time": "TIMESTAMPTZ", "customer_id": "VARCHAR", "region": "VARCHAR"}
+COLUMNS: dict[str, dict[str, str]] = {
+    "subscription": {**_BASE, "action": "VARCHAR", "plan_id": "VARCHAR"},
+    "payment": {**_BASE, "amount": "DECIMAL(38, 10)", "currency": "VARCHAR", "payment_method": "VARCHAR"},
+    "usage": {**_BASE, "metric_name": "VARCHAR", "units": "BIGINT", "plan_id": "VARCHAR"},
+    "cost": {**_BASE, "amount": "DECIMAL(38, 10)", "cost_type": "VARCHAR"},
+}
+
+_NET_DELTA = "case action when 'created' then 1 when 'canceled' then -1 else 0 end"
+
+
+class Fact(NamedTuple):
+    event_type: str
+    sql: str  # over {src}, the staged events
+    cumulative: bool = False  # needs every partition up to the range, not just those in it
+
+
+FACTS: dict[str, Fact] = {
+    "fact_revenue_daily": Fact(
+        "payment",
+        "select event_date as date_key, region as region_key, sum(amount) as revenue_amount, count(*) as payments_count "
+        "from {src} group by 1, 2",
+    ),
+    "fact_costs_daily": Fact(
+        "cost",
+        "select event_date as date_key, region as region_key, sum(amount) as cost_amount, count(*) as costs_count "
+        "from {src} group by 1, 2",
+    ),
+    "fact_usage_daily": Fact(
+        "usage",
+        "select event_date as date_key, region as region_key, metric_name, sum(units) as total_units, count(*) as usage_events "
+        "from {src} group by 1, 2, 3",
+    ),
+    # Running count carried forward to today, like the view over subscriptions_active_daily
+    "fact_subscriptions_snapshot": Fact(
+        "subscription",
+        f"with daily as (select event_date as date_key, sum({_NET_DELTA}) as net_delta from {{src}} group by 1), "
+        "days as (select unnest(generate_series(min(date_key), greatest(max(date_key), current_date), interval 1 day))::date "
+        "as date_key from daily) "
+        "select d.date_key, sum(coalesce(daily.net_delta, 0)) over (order by d.date_key) as active_subscriptions "
+        "from days d left join daily on daily.date_key = d.date_key",
+        cumulative=True,
+    ),
+}
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _plain(value: Decimal) -> Decimal:
+    """Drop the trailing zeros of the fixed DECIMAL scale, so 108.6900000000 reads 108.69 as it does from Postgres."""
+    normalized = value.normalize()
+    return normalized.quantize(Decimal(1)) if normalized == normalized.to_integral_value() else normalized
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class Store:
+    """Listing and small-object IO under the lake root, a local directory or s3://bucket."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root.rstrip("/")
+        self.bucket = self.root[len("s3://"):] if self.root.startswith("s3://") else None
+
+    def url(self, key: str) -> str:
+        return f"{self.root}/{key}"
+
+    def partitions(self, event_type: str) -> list[date]:
+        prefix = f"raw/{event_type}/"
+        if self.bucket is None:
+            directory = os.path.join(self.root, prefix)
+            names = os.listdir(directory) if os.path.isdir(directory) else []
+        else:
+            names = []
+            with s3_call("list_objects_v2"):
+                for page in self._client().get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+                    names.extend(p["Prefix"][len(prefix):].rstrip("/") for p in page.get("CommonPrefixes", []))
+        days = []
+        for name in names:
+            if name.startswith("dt="):
+                try:
+                    days.append(date.fromisoformat(name[len("dt="):]))
+                except ValueError:
+                    pass
+        return sorted(days)
+
+    def count(self, prefix: str) -> int:
+        if self.bucket is None:
+            directory = os.path.join(self.root, prefix)
+            return len(os.listdir(directory)) if os.path.isdir(directory) else 0
+        from platform_common.s3 import list_keys
+
+        return len(list_keys(prefix, self.bucket))
+
+    def read_json(self, key: str) -> Any:
+        import orjson
+
+        if self.bucket is None:
+            path = os.path.join(self.root, key)
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as fh:
+                return orjson.loads(fh.read())
+        from platform_common.s3 import get_json, object_exists
+
+        return get_json(key, self.bucket) if object_exists(key, self.bucket) else None
+
+    def write_json(self, key: str, data: Any) -> None:
+        import orjson
+
+        body = orjson.dumps(data)
+        if self.bucket is None:
+            path = os.path.join(self.root, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as fh:
+                fh.write(body)
+            os.replace(path + ".tmp", path)
+            return
+        with s3_call("put_object"):
+            self._client().put_object(Bucket=self.bucket, Key=key, Body=body, ContentType="application/json")
+
+    def prepare(self, key: str) -> None:
+        """Make sure DuckDB can write the object: local directories must exist."""
+        if self.bucket is None:
+            os.makedirs(os.path.dirname(os.path.join(self.root, key)), exist_ok=True)
+
+    def delete(self, key: str) -> None:
+        if self.bucket is None:
+            try:
+                os.remove(os.path.join(self.root, key))
+            except FileNotFoundError:
+                pass
+            return
+        with s3_call("delete_object"):
+            self._client().delete_object(Bucket=self.bucket, Key=key)
+
+    def _client(self) -> Any:
+        from platform_common.s3 import get_s3_client
+
+        return get_s3_client()
+
+
+class Lake:
+    def __init__(self, root: str) -> None:
+        import duckdb
+
+        self.store = Store(root)
+        self.con = duckdb.connect()
+        self.con.execute("set TimeZone = 'UTC'")  # event_date is the UTC day, as in Postgres
+        self.con.execute(f"set memory_limit = {_quote(settings.LAKE_MEMORY_LIMIT)}")
+        if self.store.bucket is not None:
+            self._configure_s3()
+        self._lock = threading.Lock()
+        self._catalog: dict[str, dict[date, str]] = {}
+        self._loaded_at = float("-inf")
+
+    def _configure_s3(self) -> None:
+        self.con.execute("install httpfs")
+        self.con.execute("load httpfs")
+        options = {
+            "KEY_ID": settings.S3_ACCESS_KEY,
+            "SECRET": settings.S3_SECRET_KEY,
+            "REGION": settings.S3_REGION,
+            "URL_STYLE": "path" if settings.AWS_S3_FORCE_PATH_STYLE else "vhost",
+            "USE_SSL": "true" if settings.S3_SECURE else "false",
+        }
+        if settings.S3_ENDPOINT:
+            options["ENDPOINT"] = settings.S3_ENDPOINT.split("://", 1)[-1]
+        self.con.execute(f"create or replace secret lake (type s3, {', '.join(f'{k} {_quote(v)}' for k, v in options.items())})")
+
+    def catalog(self) -> dict[str, dict[date, str]]:
+        """Per event type, where each partition is read from: its Parquet file, or its raw JSON objects."""
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= settings.LAKE_CATALOG_TTL_SECONDS:
+                compacted = (self.store.read_json(MANIFEST) or {}).get("partitions", {})
+                catalog: dict[str, dict[date, str]] = {}
+                for event_type in EVENT_TYPES:
+                    catalog[event_type] = {}
+                    for day in self.store.partitions(event_type):
+                        entry = compacted.get(f"{event_type}/{day}")
+                        key = entry["file"] if entry else f"raw/{event_type}/dt={day}/*.json"
+                        catalog[event_type][day] = self.store.url(key)
+                self._catalog, self._loaded_at = catalog, time.monotonic()
+            return self._catalog
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = float("-inf")
+
+    def source(self, event_type: str, lo: Optional[date] = None, hi: Optional[date] = None) -> str:
+        """stg_<type>_events with event_date between lo and hi (inclusive, either may be open), as a subquery."""
+        cols = COLUMNS[event_type]
+        paths = [
+            path for day, path in self.catalog()[event_type].items()
+            if (lo is None or day >= lo - timedelta(days=1)) and (hi is None or day <= hi + timedelta(days=1))
+        ]
+        names = ", ".join(cols)
+        parquet = [p for p in paths if p.endswith(".parquet")]
+        raw = [p for p in paths if not p.endswith(".parquet")]
+        scans = []
+        if parquet:
+            scans.append(f"select {names} from read_parquet([{', '.join(map(_quote, parquet))}])")
+        if raw:
+            struct = ", ".join(f"{_quote(c)}: {_quote(t)}" for c, t in cols.items())
+            scans.append(f"select {names} from read_json([{', '.join(map(_quote, raw))}], columns = {{{struct}}}, format = 'auto')")
+        if not scans:
+            scans.append("select " + ", ".join(f"null::{t} as {c}" for c, t in cols.items()) + " where false")
+        where = [f"event_date >= date {_quote(lo.isoformat())}" if lo else "", f"event_date <= date {_quote(hi.isoformat())}" if hi else ""]
+        where_sql = " and ".join(w for w in where if w) or "true"
+        staged = f"select *, event_time::date as event_date from ({' union all '.join(scans)})"
+        return f"(select * from ({staged}) where {where_sql})"
+
+    def query(self, name: str, sql_for: Callable[[], str]) -> list[dict[str, Any]]:
+        """Run sql_for() (built from the current catalog) on a cursor of its own; a compaction may have replaced
+        a file since the catalog was read, so a missing file is retried once with a fresh one."""
+        import duckdb
+
+        started = time.perf_counter()
+        cursor = self.con.cursor()
+        try:
+            with span("lake.query", {"db.system": "duckdb", "ffdp.query": name}):
+                try:
+                    result = cursor.execute(sql_for())
+                except duckdb.IOException:
+                    self.invalidate()
+                    result = cursor.execute(sql_for())
+                columns = [d[0] for d in result.description]
+                return [{c: _plain(v) if isinstance(v, Decimal) else v for c, v in zip(columns, row)} for row in result.fetchall()]
+        finally:
+            cursor.close()
+            LAKE_QUERY_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+    def fact(self, name: str, lo: Optional[date] = None, hi: Optional[date] = None) -> list[dict[str, Any]]:
+        """Rows of a transformations/sql fact with date_key between lo and hi, ordered by its keys."""
+        spec = FACTS[name]
+        where = [f"date_key >= date {_quote(lo.isoformat())}" if lo else "", f"date_key <= date {_quote(hi.isoformat())}" if hi else ""]
+        where_sql = " and ".join(w for w in where if w) or "true"
+
+        def sql() -> str:
+            src = self.source(spec.event_type, None if spec.cumulative else lo, hi)
+            return f"select * from ({spec.sql.format(src=src)}) where {where_sql} order by all"
+
+        return self.query(name, sql)
+
+    def churn(self, day: Optional[date] = None) -> Optional[tuple[date, int, int]]:
+        """(day, cancellations that day, active subscriptions the day before); day defaults to the snapshot's last
+        day, today or the latest subscription event. None without subscription data."""
+        days = self.catalog()["subscription"]
+        if not days:
+            return None
+        if day is None:
+            latest = self.query("churn_latest", lambda: f"select max(event_date) as d from {self.source('subscription', max(days) - timedelta(days=1))}")
+            day = max(_today(), latest[0]["d"] or _today())
+        d = _quote(day.isoformat())
+        row = self.query("churn", lambda: (
+            f"select count(*) filter (where event_date = date {d} and action = 'canceled') as cancellations, "
+            f"coalesce(sum({_NET_DELTA}) filter (where event_date < date {d}), 0) as prev_active "
+            f"from {self.source('subscription', None, day)}"
+        ))[0]
+        return day, int(row["cancellations"]), int(row["prev_active"])
+
+
+_lake: Optional[Lake] = None
+_lake_lock = threading.Lock()
+
+
+def get_lake() -> Lake:
+    global _lake
+    with _lake_lock:
+        if _lake is None:
+            _lake = Lake(settings.LAKE_ROOT or f"s3://{settings.S3_BUCKET}")
+        return _lake
+
+
+def reset_lake() -> None:
+    global _lake
+    with _lake_lock:
+        if _lake is not None:
+            _lake.con.close()
+        _lake = None
+
+
+def compact(full: bool = False, today: Optional[date] = None) -> dict[str, int]:
+    """Rewrite settled raw partitions as one Parquet file each.
+
+    A partition is compacted once it is LAKE_COMPACT_MIN_AGE_DAYS old. Compacted partitions newer than
+    LAKE_COMPACT_LOOKBACK_DAYS (all of them with full=True) are rewritten when their raw object count changed,
+    i.e. late events arrived. The manifest is written before replaced files are deleted, so readers see either
+    the old file or the new one.
+    """
+    lake = get_lake()
+    store = lake.store
+    today = today or _today()
+    settled = today - timedelta(days=settings.LAKE_COMPACT_MIN_AGE_DAYS)
+    recheck_from = today - timedelta(days=settings.LAKE_COMPACT_LOOKBACK_DAYS)
+    manifest = store.read_json(MANIFEST) or {"partitions": {}}
+    entries: dict[str, dict[str, Any]] = manifest["partitions"]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    replaced: list[str] = []
+    counts: Counter[str] = Counter()
+    cursor = lake.con.cursor()
+    for event_type in EVENT_TYPES:
+        cols = COLUMNS[event_type]
+        struct = ", ".join(f"{_quote(c)}: {_quote(t)}" for c, t in cols.items())
+        for day in store.partitions(event_type):
+            entry = entries.get(f"{event_type}/{day}")
+            if day > settled or (entry is not None and day < recheck_from and not full):
+                counts["skipped"] += 1
+                continue
+            raw = f"raw/{event_type}/dt={day}/"
+            objects = store.count(raw)
+            if entry is not None and entry["objects"] == objects:
+                counts["unchanged"] += 1
+                continue
+            key = f"compact/{event_type}/dt={day}/part-{stamp}.parquet"
+            store.prepare(key)
+            # Counted before reading: objects landing in between make the next run rewrite the partition
+            cursor.execute(
+                f"copy (select {', '.join(cols)} from read_json({_quote(store.url(raw + '*.json'))}, columns = {{{struct}}}, "
+                f"format = 'auto') order by event_time, event_id) to {_quote(store.url(key))} (format parquet, compression zstd)"
+            )
+            if entry is not None:
+                replaced.append(entry["file"])
+            entries[f"{event_type}/{day}"] = {"file": key, "objects": objects, "compacted_at": datetime.now(timezone.utc).isoformat()}
+            counts["compacted"] += 1
+    cursor.close()
+    if counts["compacted"]:
+        store.write_json(MANIFEST, manifest)
+        for key in replaced:
+            store.delete(key)
+        lake.invalidate()
+    logger.info("Lake compaction: {}", dict(counts))
+    return dict(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="Re-check every compacted partition for late events")
+    args = parser.parse_args()
+    print(compact(full=args.full))
+
+
+if __name__ == "__main__":
+    main()
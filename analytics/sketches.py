@@ -0,0 +1,179 @@
+"""Approximate distinct customers from the HyperLogLog sketches of transformations/sql/026_customer_sketches.sql.
+
+Sketches are kept per day and per month, region and event type. A query merges the ones its periods, regions and
+event types cover (register-wise max) and estimates the count with Ertl's improved estimator ("New cardinality
+estimation algorithms for HyperLogLog sketches", 2017), which needs no bias tables or range corrections.
+
+Error: with 4096 registers the relative standard error is 1.04 / sqrt(4096) = 1.6%, so about 95% of estimates fall
+within 3.3% of the exact count and 99.7% within 4.9%. Small counts fare better: below about 50 customers the
+estimate is exact or off by one.
+"""
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.elements import BindParameter
+
+from platform_common.db import scatter
+
+P = 12  # register index bits; must match the model
+M = 1 << P
+Q = 64 - P  # value bits; a register holds 0..Q + 1
+STANDARD_ERROR = 1.04 / math.sqrt(M)
+
+
+def decode(registers: bytes) -> np.ndarray:
+    """A stored sketch as M uint8 registers; dense sketches are exactly M bytes, sparse ones 3 bytes per register."""
+    raw = np.frombuffer(registers, dtype=np.uint8)
+    if len(raw) == M:
+        return raw.copy()
+    entries = raw.reshape(-1, 3)
+    dense = np.zeros(M, dtype=np.uint8)
+    dense[(entries[:, 0].astype(np.int64) << 8) | entries[:, 1]] = entries[:, 2]
+    return dense
+
+
+def encode(dense: np.ndarray) -> bytes:
+    """The model's storage format for M registers."""
+    idx = np.flatnonzero(dense)
+    if len(idx) * 3 >= M:
+        return dense.astype(np.uint8).tobytes()
+    return np.column_stack([idx >> 8, idx & 0xFF, dense[idx]]).astype(np.uint8).tobytes()
+
+
+def merge(sketches: Iterable[bytes]) -> np.ndarray:
+    merged = np.zeros(M, dtype=np.uint8)
+    for registers in sketches:
+        np.maximum(merged, decode(registers), out=merged)
+    return merged
+
+
+def _sigma(x: float) -> float:
+    if x == 1.0:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        z_prev = z
+        z += x * y
+        y += y
+        if z == z_prev:
+            return z
+
+
+def _tau(x: float) -> float:
+    if x in (0.0, 1.0):
+        return 0.0
+    y, z = 1.0, 1.0 - x
+    while True:
+        x = math.sqrt(x)
+        z_prev = z
+        y *= 0.5
+        z -= (1.0 - x) ** 2 * y
+        if z == z_prev:
+            return z / 3.0
+
+
+def estimate(dense: np.ndarray) -> float:
+    counts = np.bincount(dense, minlength=Q + 2)
+    z = M * _tau(1.0 - counts[Q + 1] / M)
+    for k in range(Q, 0, -1):
+        z = 0.5 * (z + counts[k])
+    z += M * _sigma(counts[0] / M)
+    return M * M / (2.0 * math.log(2) * z) if z != math.inf else 0.0
+
+
+def _period(day: date, granularity: str) -> Optional[date]:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return None if granularity == "total" else day
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+Window = tuple[str, Optional[date], Optional[date]]  # sketch granularity, first and last period_start (None: open)
+
+
+def _windows(start_date: Optional[date], end_date: Optional[date], granularity: str) -> list[Window]:
+    if granularity == "month":
+        return [("month", start_date and start_date.replace(day=1), end_date)]
+    if granularity == "week":
+        # Whole weeks: from the Monday of the first to the Sunday of the last
+        return [("day", start_date and _period(start_date, "week"), end_date and end_date + timedelta(days=6 - end_date.weekday()))]
+    if granularity != "total":
+        return [("day", start_date, end_date)]
+    # Month sketches for the months wholly inside the range, day sketches for the days around them
+    first = start_date if start_date is None or start_date.day == 1 else _next_month(start_date)
+    last = end_date and ((end_date + timedelta(days=1)).replace(day=1) - timedelta(days=1)).replace(day=1)
+    if first is not None and last is not None and first > last:
+        return [("day", start_date, end_date)]
+    windows: list[Window] = [("month", first, last)]
+    if start_date is not None and first is not None and start_date < first:
+        windows.append(("day", start_date, first - timedelta(days=1)))
+    if end_date is not None and last is not None and _next_month(last) <= end_date:
+        windows.append(("day", _next_month(last), end_date))
+    return windows
+
+
+def active_customers(
+    start_date: Optional[date],
+    end_date: Optional[date],
+    granularity: str = "day",
+    regions: Optional[list[str]] = None,
+    event_types: Optional[list[str]] = None,
+    by_region: bool = False,
+) -> list[dict]:
+    """Estimated distinct customers per period (None for 'total') and, with by_region, per region.
+
+    Weeks and months overlapping the range are reported whole. 'total' merges the month sketches of the months
+    wholly inside the range and the day sketches of the days around them, so a long range reads few sketches.
+    Sketches from every event shard are merged the same way.
+    """
+    params: dict[str, object] = {}
+    windows = []
+    for i, (grain, lo, hi) in enumerate(_windows(start_date, end_date, granularity)):
+        clause = [f"granularity = :g{i}"]
+        params[f"g{i}"] = grain
+        if lo is not None:
+            clause.append(f"period_start >= :lo{i}")
+            params[f"lo{i}"] = lo
+        if hi is not None:
+            clause.append(f"period_start <= :hi{i}")
+            params[f"hi{i}"] = hi
+        windows.append("(" + " and ".join(clause) + ")")
+    where = ["(" + " or ".join(windows) + ")"]
+    bindparams: list[BindParameter] = []
+    if regions:
+        where.append("region_key in :regions")
+        params["regions"] = regions
+        bindparams.append(bindparam("regions", expanding=True))
+    if event_types:
+        where.append("event_type in :event_types")
+        params["event_types"] = event_types
+        bindparams.append(bindparam("event_types", expanding=True))
+    sql = text(f"select period_start, region_key, registers from customer_sketches where {' and '.join(where)}").bindparams(*bindparams)
+
+    def fetch(engine: Engine) -> list:
+        with engine.connect() as conn:
+            return list(conn.execute(sql, params))
+
+    merged: dict[tuple[Optional[date], Optional[str]], np.ndarray] = defaultdict(lambda: np.zeros(M, dtype=np.uint8))
+    for rows in scatter(fetch):
+        for period_start, region_key, registers in rows:
+            day = period_start if isinstance(period_start, date) else date.fromisoformat(period_start)
+            dense = merged[(_period(day, granularity), region_key if by_region else None)]
+            np.maximum(dense, decode(registers), out=dense)
+    return [
+        {"period_start": period, "region_key": region, "customers": int(round(estimate(dense)))}
+        for (period, region), dense in sorted(merged.items(), key=lambda item: (item[0][0] or date.min, item[0][1] or ""))
+    ]
@@ -0,0 +1,43 @@
+"""Compare two benchmark result files stage by stage: python -m benchmarks.compare base.json head.json"""
+from __future__ import annotations
+
+import argparse
+from typing import Optional
+
+from benchmarks.harness import BenchReport, load_report
+
+
+def _delta(base: Optional[float], head: Optional[float]) -> str:
+    if base is None or head is None or base == 0:
+        return "-"
+    return f"{(head - base) / base * 100:+.1f}%"
+
+
+def compare(base: BenchReport, head: BenchReport) -> str:
+    lines = [
+        f"base {base.commit or '?'} ({base.created_at:%Y-%m-%d %H:%M})  vs  head {head.commit or '?'} ({head.created_at:%Y-%m-%d %H:%M})",
+        f"{'stage':<40} {'ops/s base':>11} {'ops/s head':>11} {'Δ':>8} {'p95 base':>9} {'p95 head':>9} {'Δ':>8}",
+    ]
+    names = [s.stage for s in base.stages] + [s.stage for s in head.stages if base.stage(s.stage) is None]
+    for name in names:
+        b, h = base.stage(name), head.stage(name)
+        lines.append(
+            f"{name:<40} "
+            f"{(b.throughput if b else 0):>11.1f} {(h.throughput if h else 0):>11.1f} "
+            f"{_delta(b.throughput if b else None, h.throughput if h else None):>8} "
+            f"{(b.p95_ms if b and b.p95_ms is not None else 0):>9.2f} {(h.p95_ms if h and h.p95_ms is not None else 0):>9.2f} "
+            f"{_delta(b.p95_ms if b else None, h.p95_ms if h else None):>8}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    args = parser.parse_args()
+    print(compare(load_report(args.base), load_report(args.head)))
+
+
+if __name__ == "__main__":
+    main()
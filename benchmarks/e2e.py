@@ -0,0 +1,232 @@
+"""End-to-end load benchmark: ingestion API (single, batch), bulk ingest, transformations, forecasts, analytics.
+
+Runs in-process against the configured Postgres with moto standing in for S3 by default:
+
+    python -m benchmarks.e2e --fresh --events 20000 --out bench.json
+
+Pass --ingest-url/--analytics-url to drive running services instead (e.g. the compose stack with MinIO).
+"""
+from __future__ import annotations
+
+import argparse
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from typing import Any, Iterator, Optional
+
+import httpx
+from fastapi.testclient import TestClient
+from loguru import logger
+from sqlalchemy import text
+
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import BenchReport, format_table, measure, new_report, write_report
+from ingestion.app.schemas import EventType
+from platform_common.config import settings
+from platform_common.db import get_engine
+from platform_common.migrations import migrate
+
+# S3 endpoint that moto intercepts; MinIO-style endpoints would bypass the mock
+MOTO_ENDPOINT = "https://s3.us-east-1.amazonaws.com"
+
+
+@contextmanager
+def s3_backend(kind: str) -> Iterator[None]:
+    if kind != "moto":
+        yield
+        return
+    from moto import mock_aws
+
+    settings.S3_ENDPOINT = MOTO_ENDPOINT
+    settings.S3_REGION = "us-east-1"
+    with mock_aws():
+        yield
+
+
+def reset_database() -> None:
+    """Drop and recreate the public schema so runs start from the same state."""
+    with get_engine().begin() as conn:
+        conn.execute(text("drop schema public cascade"))
+        conn.execute(text("create schema public"))
+    migrate(include_transformations=False)
+
+
+def _client(stack: ExitStack, url: Optional[str], app_path: str) -> httpx.Client:
+    if url:
+        return stack.enter_context(httpx.Client(base_url=url, timeout=60.0))
+    if app_path == "ingestion":
+        from ingestion.app.main import app as ingestion_app
+
+        return stack.enter_context(TestClient(ingestion_app, raise_server_exceptions=False))
+    from analytics.app.main import app as analytics_app
+
+    return stack.enter_context(TestClient(analytics_app, raise_server_exceptions=False))
+
+
+def bench_ingest_single(report: BenchReport, client: httpx.Client, events: list[tuple[EventType, dict[str, Any]]]) -> None:
+    statuses: Counter[str] = Counter()
+    with measure("ingest_single", unit="events") as stage:
+        for et, payload in events:
+            with stage.op():
+                resp = client.post(f"/ingest/{et}", json=payload)
+            statuses[resp.json().get("status", str(resp.status_code)) if resp.status_code < 500 else "error"] += 1
+        stage.extra = {"statuses": dict(statuses)}
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def bench_ingest_batch(report: BenchReport, client: httpx.Client, events: list[tuple[EventType, dict[str, Any]]], batch_size: int) -> None:
+    by_type: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    for et, payload in events:
+        by_type[et].append(payload)
+    counts: Counter[str] = Counter()
+    with measure("ingest_batch", unit="events") as stage:
+        for event_type, payloads in by_type.items():
+            for i in range(0, len(payloads), batch_size):
+                batch = payloads[i:i + batch_size]
+                with stage.op():
+                    resp = client.post(f"/ingest/{event_type}/batch", json=batch)
+                body = resp.json()
+                for key in ("accepted", "duplicates", "quarantined"):
+                    counts[key] += body.get(key, 0)
+        stage.ops = len(events)
+        stage.extra = {"batch_size": batch_size, "batches": len(stage.latencies_ms), "latency_per": "batch", **counts}
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def bench_ingest_bulk(report: BenchReport, events: list[tuple[EventType, dict[str, Any]]], chunk_size: int, workers: int) -> None:
+    from ingestion.app.bulk import ingest_stream
+
+    with measure("ingest_bulk", unit="events") as stage:
+        result = ingest_stream(iter(events), chunk_size=chunk_size, workers=workers)
+        stage.ops = result.events
+        stage.extra = {"chunk_size": chunk_size, "workers": workers, "executor": result.executor, **result.counts()}
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def bench_transformations(report: BenchReport, repeat: int) -> None:
+    from transformations.runner import default_sql_dir, read_sql_models, run_sql
+
+    models = read_sql_models(default_sql_dir())
+    per_model: dict[str, list[float]] = defaultdict(list)
+    with measure("transform", unit="models") as stage:
+        for _ in range(repeat):
+            for name, sql in models:
+                with stage.op():
+                    run_sql([sql])
+                per_model[name].append(stage.latencies_ms[-1])
+        stage.extra = {"repeat": repeat, "per_model_ms": {name: round(min(ms), 3) for name, ms in per_model.items()}}
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def bench_forecasts(report: BenchReport, horizon: int) -> None:
+    from forecasting.arima import forecast_revenue_daily, forecast_subscriptions_daily
+
+    per_target: dict[str, float] = {}
+    with measure("forecast", unit="fits") as stage:
+        for target, fn in (("revenue_daily", forecast_revenue_daily), ("subscriptions_daily", forecast_subscriptions_daily)):
+            with stage.op():
+                fn(horizon)
+            per_target[target] = round(stage.latencies_ms[-1], 3)
+        stage.extra = {"horizon": horizon, "per_target_ms": per_target}
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def analytics_queries(month: str) -> list[tuple[str, str]]:
+    return [
+        ("revenue_by_region", "/metrics/revenue_by_region"),
+        ("mrr", f"/metrics/mrr?month={month}"),
+        ("churn", "/metrics/churn"),
+        ("forecast_vs_actual", "/metrics/forecast_vs_actual?target=revenue_daily"),
+        ("forecast_accuracy", "/metrics/forecast_accuracy"),
+    ]
+
+
+def bench_analytics(report: BenchReport, client: httpx.Client, month: str, queries: int) -> None:
+    for name, path in analytics_queries(month):
+        errors = 0
+        with measure(f"analytics:{name}", unit="requests") as stage:
+            for _ in range(queries):
+                with stage.op():
+                    resp = client.get(path)
+                errors += resp.status_code >= 500
+            stage.extra = {"path": path, "errors": errors}
+        assert stage.result is not None
+        report.stages.append(stage.result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20_000, help="Total generated events")
+    parser.add_argument("--single", type=int, default=500, help="Events sent one request at a time")
+    parser.add_argument("--batch-share", type=float, default=0.5, help="Share of the remaining events sent through the batch endpoint")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=settings.INGEST_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS)
+    parser.add_argument("--transform-repeat", type=int, default=3)
+    parser.add_argument("--horizon", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=50, help="Requests per analytics endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.02)
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    parser.add_argument("--late-ratio", type=float, default=0.05)
+    parser.add_argument("--s3", choices=["moto", "endpoint"], default="moto", help="moto in-process, or the configured S3_ENDPOINT (MinIO)")
+    parser.add_argument("--ingest-url", default=None, help="Drive a running ingestion service instead of the in-process app")
+    parser.add_argument("--analytics-url", default=None)
+    parser.add_argument("--fresh", action="store_true", help="DROP and recreate the public schema first")
+    parser.add_argument("--skip", action="append", default=[], choices=["single", "batch", "bulk", "transform", "forecast", "analytics"])
+    parser.add_argument("--out", default=None, help="Result JSON path (default benchmarks/results/)")
+    args = parser.parse_args()
+
+    gen_cfg = GeneratorConfig(
+        seed=args.seed,
+        customers=args.customers,
+        days=args.days,
+        duplicate_ratio=args.duplicate_ratio,
+        invalid_ratio=args.invalid_ratio,
+        late_ratio=args.late_ratio,
+    )
+    generator = EventGenerator(gen_cfg)
+    events = list(generator.events(args.events))
+    # Spread each ingestion path across the whole time range so every stage sees realistic data
+    single = events[:: max(1, len(events) // max(args.single, 1))][: args.single] if "single" not in args.skip else []
+    picked = {id(p) for _, p in single}
+    rest = [e for e in events if id(e[1]) not in picked]
+    cut = int(len(rest) * args.batch_share) if "batch" not in args.skip else 0
+    batch, bulk = rest[:cut], rest[cut:]
+    if "bulk" in args.skip:
+        bulk = []
+
+    report = new_report("e2e", {**vars(args), "generator": gen_cfg.model_dump(mode="json")})
+    with ExitStack() as stack:
+        stack.enter_context(s3_backend(args.s3))
+        if args.fresh:
+            reset_database()
+        if single or batch:
+            ingest = _client(stack, args.ingest_url, "ingestion")
+            if single:
+                bench_ingest_single(report, ingest, single)
+            if batch:
+                bench_ingest_batch(report, ingest, batch, args.batch_size)
+        if bulk:
+            bench_ingest_bulk(report, bulk, args.chunk_size, args.workers)
+        if "transform" not in args.skip:
+            bench_transformations(report, args.transform_repeat)
+        if "forecast" not in args.skip:
+            bench_forecasts(report, args.horizon)
+        if "analytics" not in args.skip:
+            analytics = _client(stack, args.analytics_url, "analytics")
+            bench_analytics(report, analytics, generator.end.strftime("%Y-%m"), args.queries)
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    logger.info("Wrote {} ({} stages)", path, len(report.stages))
+
+
+if __name__ == "__main__":
+    main()
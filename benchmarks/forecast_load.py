@@ -0,0 +1,193 @@
+"""Forecast training-data loads, pandas.read_sql vs the COPY loader: python -m benchmarks.forecast_load --fresh
+
+fact_revenue_daily and fact_subscriptions_snapshot are replaced by tables of synthetic history, 10 years x 1,000
+regions by default, built with generate_series in the configured Postgres. Each load runs in a fresh process,
+so its peak RSS is its own; `baseline` is such a process that only imports pandas and the loader.
+
+--fresh is required: the public schema is dropped and recreated, so only point this at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import time
+from typing import Any, Callable
+
+from benchmarks.e2e import reset_database
+from benchmarks.harness import StageResult, format_table, new_report, peak_rss_mb, write_report
+
+_FACTS = [
+    "drop view if exists fact_revenue_daily",
+    "drop view if exists fact_subscriptions_snapshot",
+    "create table fact_revenue_daily (date_key date, region_key text, revenue_amount numeric, payments_count bigint)",
+    # Regions start on different days and skip some, so both spans and gaps are exercised
+    """
+    insert into fact_revenue_daily
+    select d::date, 'region-' || lpad(r::text, 4, '0'), round((100 + r + 50 * sin(extract(doy from d) / 7.0))::numeric, 2), 1
+    from generate_series(1, {segments}) r,
+         generate_series(current_date - {days} + (r % 30), current_date, interval '1 day') d
+    where (r + extract(doy from d)::int) % 13 <> 0
+    """,
+    "create table fact_subscriptions_snapshot (date_key date, active_subscriptions bigint)",
+    "insert into fact_subscriptions_snapshot select d::date, 1000 + extract(doy from d)::int from generate_series(current_date - {days}, current_date, interval '1 day') d",
+    "analyze fact_revenue_daily",
+    "analyze fact_subscriptions_snapshot",
+]
+
+
+def _legacy_total() -> int:
+    """forecast_revenue_daily('all') before the loader."""
+    import pandas as pd
+    from sqlalchemy import text
+
+    from platform_common.db import get_read_engine
+
+    with get_read_engine().begin() as conn:
+        df = pd.read_sql(
+            text("select date_key::date as date_key, coalesce(sum(revenue_amount),0)::numeric as revenue_amount from fact_revenue_daily group by 1 order by 1"),
+            conn,
+        )
+    series = df.set_index(pd.DatetimeIndex(df["date_key"]))["revenue_amount"].astype(float).asfreq("D", fill_value=0.0)
+    return len(series)
+
+
+def _legacy_segments(sample: int) -> int:
+    """forecast_revenue_daily(segment) before the loader: one query per segment."""
+    import pandas as pd
+    from sqlalchemy import text
+
+    from platform_common.db import get_read_engine
+
+    with get_read_engine().begin() as conn:
+        segments = [r[0] for r in conn.execute(text("select distinct region_key from fact_revenue_daily order by 1 limit :n"), {"n": sample})]
+        for segment in segments:
+            df = pd.read_sql(
+                text("select date_key::date as date_key, coalesce(sum(revenue_amount),0)::numeric as revenue_amount from fact_revenue_daily "
+                     "where region_key = :segment group by 1 order by 1"),
+                conn,
+                params={"segment": segment},
+            )
+            df.set_index(pd.DatetimeIndex(df["date_key"]))["revenue_amount"].astype(float).asfreq("D", fill_value=0.0)
+    return len(segments)
+
+
+def _legacy_panel() -> int:
+    """backtest.load_series('revenue_daily') before the loader."""
+    import pandas as pd
+    from sqlalchemy import text
+
+    from platform_common.db import get_read_engine
+
+    with get_read_engine().begin() as conn:
+        df = pd.read_sql(text("select date_key::date as date_key, region_key as segment, coalesce(revenue_amount,0)::float8 as y from fact_revenue_daily"), conn)
+    df["date_key"] = pd.to_datetime(df["date_key"])
+    wide = df.pivot_table(index="date_key", columns="segment", values="y", aggfunc="sum")
+    wide["all"] = wide.sum(axis=1)
+    wide = wide.reindex(pd.date_range(wide.index.min(), wide.index.max(), freq="D")).fillna(0.0)
+    return len({str(seg): wide[seg].astype("float64").rename("y") for seg in wide.columns})
+
+
+def _panel() -> int:
+    from forecasting.data import load_panel
+
+    return len(load_panel("revenue_daily").all_series())
+
+
+def _panel_segments() -> int:
+    """Every segment's forecast series, the first call loading the panel for the run and the rest reusing it."""
+    from forecasting.data import load_panel
+
+    segments = load_panel("revenue_daily", "run").segments
+    for segment in ["all", *segments]:
+        load_panel("revenue_daily", "run").series(segment)
+    return len(segments) + 1
+
+
+def _subscriptions() -> int:
+    from forecasting.data import load_panel
+
+    return len(load_panel("subscriptions_daily").series())
+
+
+def _baseline() -> int:
+    import forecasting.data  # noqa: F401
+
+    return 0
+
+
+STAGES: dict[str, tuple[Callable[..., int], str]] = {
+    "baseline": (_baseline, "loads"),
+    "legacy_total": (_legacy_total, "loads"),
+    "legacy_segments": (_legacy_segments, "segments"),
+    "legacy_panel": (_legacy_panel, "segments"),
+    "panel": (_panel, "segments"),
+    "panel_segments": (_panel_segments, "segments"),
+    "subscriptions": (_subscriptions, "loads"),
+}
+
+
+def _child(name: str, sample: int) -> dict[str, Any]:
+    fn, _ = STAGES[name]
+    # Imports are not part of the load
+    import pandas  # noqa: F401
+
+    import forecasting.data  # noqa: F401
+    import platform_common.db  # noqa: F401
+
+    started = time.perf_counter()
+    ops = fn(sample) if name == "legacy_segments" else fn()
+    return {"seconds": time.perf_counter() - started, "ops": ops, "peak_rss_mb": peak_rss_mb()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=3652)
+    parser.add_argument("--segments", type=int, default=1000)
+    parser.add_argument("--segment-sample", type=int, default=20, help="Segments loaded one query each by legacy_segments")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fresh", action="store_true", help="Required: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if not args.fresh:
+        parser.error("this benchmark replaces the fact views with tables; pass --fresh to reset a scratch database")
+
+    from sqlalchemy import text
+
+    from platform_common.db import get_engine
+
+    report = new_report("forecast_load", vars(args))
+    reset_database()
+    with get_engine().begin() as conn:
+        for statement in _FACTS:
+            conn.execute(text(statement.format(days=args.days, segments=args.segments)))
+        report.config["rows"] = conn.execute(text("select count(*) from fact_revenue_daily")).scalar()
+
+    ctx = multiprocessing.get_context("spawn")
+    for name, (_, unit) in STAGES.items():
+        runs = []
+        for _ in range(args.repeat):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(_child, (name, args.segment_sample)))
+        latencies = sorted(run["seconds"] * 1000 for run in runs)
+        seconds = latencies[len(latencies) // 2] / 1000
+        report.stages.append(StageResult(
+            stage=name,
+            unit=unit,
+            ops=runs[0]["ops"],
+            seconds=round(seconds, 6),
+            throughput=round(runs[0]["ops"] / seconds, 3) if seconds > 0 else 0.0,
+            p50_ms=round(latencies[len(latencies) // 2], 3),
+            p95_ms=round(latencies[-1], 3),
+            p99_ms=round(latencies[-1], 3),
+            rss_mb=round(max(run["peak_rss_mb"] for run in runs), 2),
+            rss_delta_mb=0.0,
+            peak_rss_mb=round(max(run["peak_rss_mb"] for run in runs), 2),
+        ))
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print("rssMB is each load's process peak, including the imports in `baseline`")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Seeded synthetic event stream for benchmarks and demos."""
+from __future__ import annotations
+
+import argparse
+import gzip
+import random
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import IO, Any, Iterator, Optional
+
+import orjson
+from pydantic import BaseModel, Field
+
+from ingestion.app.quality import ALLOWED_REGIONS
+from ingestion.app.schemas import EventType
+from platform_common.config import settings
+
+PLANS = {"basic": 29.0, "pro": 99.0, "enterprise": 499.0}
+PLAN_WEIGHTS = (0.6, 0.3, 0.1)
+USAGE_METRICS = ("api_calls", "storage_gb", "seats")
+COST_TYPES = ("infra", "support", "payment_fees")
+
+
+class GeneratorConfig(BaseModel):
+    seed: int = 42
+    customers: int = Field(default=500, ge=1)
+    regions: list[str] = Field(default_factory=lambda: sorted(ALLOWED_REGIONS))
+    days: int = Field(default=90, ge=1, description="Event times span the last `days` days, oldest first")
+    duplicate_ratio: float = Field(default=0.02, ge=0, le=1, description="Exact replays of an earlier event")
+    invalid_ratio: float = Field(default=0.01, ge=0, le=1, description="Schema or quality failures")
+    late_ratio: float = Field(default=0.05, ge=0, le=1, description="Event time pushed back past LATE_ARRIVAL_DAYS")
+    mix: dict[EventType, float] = Field(default_factory=lambda: {"payment": 0.35, "usage": 0.4, "subscription": 0.1, "cost": 0.15})
+    end: Optional[datetime] = None  # defaults to now
+
+
+class _Customer(BaseModel):
+    customer_id: str
+    region: str
+    plan_id: str
+
+
+class EventGenerator:
+    """Deterministic for a given config: the same seed yields the same events, ids included."""
+
+    def __init__(self, config: Optional[GeneratorConfig] = None) -> None:
+        self.config = config or GeneratorConfig()
+        self.rng = random.Random(self.config.seed)
+        self.end = self.config.end or datetime.now(timezone.utc)
+        self.start = self.end - timedelta(days=self.config.days)
+        self.customers = [
+            _Customer(
+                customer_id=f"cust-{i:06d}",
+                region=self.rng.choice(self.config.regions),
+                plan_id=self.rng.choices(list(PLANS), weights=PLAN_WEIGHTS)[0],
+            )
+            for i in range(self.config.customers)
+        ]
+        self._types: list[EventType] = list(self.config.mix)
+        self._weights = [self.config.mix[t] for t in self._types]
+        self._recent: deque[tuple[EventType, dict[str, Any]]] = deque(maxlen=1000)
+
+    def _id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _payload(self, event_type: EventType, at: datetime) -> dict[str, Any]:
+        c = self.rng.choice(self.customers)
+        base = {"event_id": self._id(), "event_time": at.isoformat(), "customer_id": c.customer_id, "region": c.region}
+        weekday = 1.3 if at.weekday() < 5 else 1.0  # weekly seasonality for the forecasters
+        if event_type == "payment":
+            return {**base, "amount": round(PLANS[c.plan_id] * weekday * self.rng.uniform(0.8, 1.2), 2), "currency": "USD", "payment_method": self.rng.choice(["card", "card", "ach"])}
+        if event_type == "usage":
+            return {**base, "metric_name": self.rng.choice(USAGE_METRICS), "units": int(self.rng.lognormvariate(4, 1)), "plan_id": c.plan_id}
+        if event_type == "subscription":
+            action = self.rng.choices(["created", "upgraded", "downgraded", "canceled"], weights=(0.55, 0.15, 0.1, 0.2))[0]
+            return {**base, "action": action, "plan_id": c.plan_id}
+        return {**base, "amount": round(self.rng.uniform(5, 200), 2), "cost_type": self.rng.choice(COST_TYPES)}
+
+    def _invalidate(self, event_type: EventType, payload: dict[str, Any]) -> dict[str, Any]:
+        kind = self.rng.randrange(4)
+        if kind == 0:
+            payload.pop("customer_id")  # schema: missing required field
+        elif kind == 1:
+            key = {"payment": "amount", "cost": "amount", "usage": "units", "subscription": "action"}[event_type]
+            payload[key] = "bogus" if event_type == "subscription" else -1  # schema: out of range / bad literal
+        elif kind == 2:
+            payload["event_time"] = (self.end + timedelta(days=3)).isoformat()  # quality: too far in the future
+        else:
+            payload["region"] = ""  # quality: empty region
+        return payload
+
+    def events(self, n: int) -> Iterator[tuple[EventType, dict[str, Any]]]:
+        span = (self.end - self.start).total_seconds()
+        late_shift = timedelta(days=settings.LATE_ARRIVAL_DAYS + 1)
+        cfg = self.config
+        for i in range(n):
+            if self._recent and self.rng.random() < cfg.duplicate_ratio:
+                et, dup = self.rng.choice(self._recent)
+                yield et, dict(dup)
+                continue
+            at = self.start + timedelta(seconds=span * i / max(n, 1) + self.rng.uniform(0, 60))
+            if self.rng.random() < cfg.late_ratio:
+                at -= late_shift + timedelta(hours=self.rng.uniform(0, 72))
+            et = self.rng.choices(self._types, weights=self._weights)[0]
+            payload = self._payload(et, at)
+            if self.rng.random() < cfg.invalid_ratio:
+                payload = self._invalidate(et, payload)
+            self._recent.append((et, payload))
+            yield et, payload
+
+
+def write_ndjson(fh: IO[bytes], events: Iterator[tuple[EventType, dict[str, Any]]], event_type: Optional[EventType] = None) -> int:
+    """One event per line; raw payloads when event_type is set, else {"event_type", "payload"} records."""
+    n = 0
+    for et, payload in events:
+        if event_type is not None and et != event_type:
+            continue
+        fh.write(orjson.dumps(payload if event_type else {"event_type": et, "payload": payload}) + b"\n")
+        n += 1
+    return n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic NDJSON event file")
+    parser.add_argument("out", help="Output path; .gz is compressed")
+    parser.add_argument("-n", "--events", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.02)
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    parser.add_argument("--late-ratio", type=float, default=0.05)
+    parser.add_argument("--event-type", choices=["subscription", "payment", "usage", "cost"], default=None)
+    args = parser.parse_args()
+
+    cfg = GeneratorConfig(
+        seed=args.seed,
+        customers=args.customers,
+        days=args.days,
+        duplicate_ratio=args.duplicate_ratio,
+        invalid_ratio=args.invalid_ratio,
+        late_ratio=args.late_ratio,
+    )
+    fh: IO[bytes] = gzip.open(args.out, "wb") if args.out.endswith(".gz") else open(args.out, "wb")
+    with fh:
+        n = write_ndjson(fh, EventGenerator(cfg).events(args.events), args.event_type)
+    print(f"wrote {n} events to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Timing, percentiles and memory for benchmark stages, written as comparable JSON."""
+from __future__ import annotations
+
+import math
+import os
+import platform
+import resource
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+import orjson
+from pydantic import BaseModel, Field
+
+
+class StageResult(BaseModel):
+    stage: str
+    unit: str  # what `ops` counts: events, requests, models, fits
+    ops: int
+    seconds: float
+    throughput: float  # ops per second over the whole stage
+    p50_ms: Optional[float] = None  # per-operation latency, when operations were timed individually
+    p95_ms: Optional[float] = None
+    p99_ms: Optional[float] = None
+    rss_mb: float  # resident set size after the stage
+    rss_delta_mb: float
+    peak_rss_mb: float  # process high-water mark so far
+    extra: dict[str, Any] = Field(default_factory=dict)
+
+
+class BenchReport(BaseModel):
+    suite: str
+    commit: Optional[str]
+    created_at: datetime
+    python: str
+    config: dict[str, Any] = Field(default_factory=dict)
+    stages: list[StageResult] = Field(default_factory=list)
+
+    def stage(self, name: str) -> Optional[StageResult]:
+        return next((s for s in self.stages if s.stage == name), None)
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of unsorted values; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1_048_576
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return maxrss / 1_048_576 if platform.system() == "Darwin" else maxrss / 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Stage:
+    """Collects per-operation latencies; `ops` defaults to the number of timed operations."""
+
+    def __init__(self, name: str, unit: str) -> None:
+        self.name = name
+        self.unit = unit
+        self.latencies_ms: list[float] = []
+        self.ops: Optional[int] = None
+        self.extra: dict[str, Any] = {}
+        self.result: Optional[StageResult] = None
+
+    @contextmanager
+    def op(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latencies_ms.append((time.perf_counter() - started) * 1000)
+
+
+@contextmanager
+def measure(name: str, unit: str = "events") -> Iterator[Stage]:
+    stage = Stage(name, unit)
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    yield stage
+    seconds = time.perf_counter() - started
+    ops = stage.ops if stage.ops is not None else len(stage.latencies_ms)
+    rss_after = current_rss_mb()
+    stage.result = StageResult(
+        stage=name,
+        unit=unit,
+        ops=ops,
+        seconds=round(seconds, 6),
+        throughput=round(ops / seconds, 3) if seconds > 0 else 0.0,
+        p50_ms=percentile(stage.latencies_ms, 50),
+        p95_ms=percentile(stage.latencies_ms, 95),
+        p99_ms=percentile(stage.latencies_ms, 99),
+        rss_mb=round(rss_after, 2),
+        rss_delta_mb=round(rss_after - rss_before, 2),
+        peak_rss_mb=round(peak_rss_mb(), 2),
+        extra=stage.extra,
+    )
+
+
+def new_report(suite: str, config: Optional[dict[str, Any]] = None) -> BenchReport:
+    return BenchReport(
+        suite=suite,
+        commit=git_commit(),
+        created_at=datetime.now(timezone.utc),
+        python=platform.python_version(),
+        config=config or {},
+    )
+
+
+def write_report(report: BenchReport, path: Optional[str] = None) -> str:
+    """Write the report as JSON; defaults to benchmarks/results/<suite>-<commit>-<timestamp>.json."""
+    if path is None:
+        directory = os.path.join(os.path.dirname(__file__), "results")
+        os.makedirs(directory, exist_ok=True)
+        stamp = report.created_at.strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, f"{report.suite}-{report.commit or 'nocommit'}-{stamp}.json")
+    with open(path, "wb") as fh:
+        fh.write(orjson.dumps(report.model_dump(mode="json"), option=orjson.OPT_INDENT_2))
+    return path
+
+
+def load_report(path: str) -> BenchReport:
+    with open(path, "rb") as fh:
+        return BenchReport.model_validate(orjson.loads(fh.read()))
+
+
+def format_table(report: BenchReport) -> str:
+    def ms(v: Optional[float]) -> str:
+        return "-" if v is None else f"{v:.2f}"
+
+    lines = [f"{'stage':<40} {'ops':>8} {'unit':<9} {'ops/s':>10} {'p50ms':>9} {'p95ms':>9} {'p99ms':>9} {'rssMB':>8}"]
+    for s in report.stages:
+        lines.append(
+            f"{s.stage:<40} {s.ops:>8} {s.unit:<9} {s.throughput:>10.1f} {ms(s.p50_ms):>9} {ms(s.p95_ms):>9} {ms(s.p99_ms):>9} {s.rss_mb:>8.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,181 @@
+"""Metrics endpoints on Postgres vs the DuckDB lake backend: python -m benchmarks.lake --fresh --events 50000000
+
+The same synthetic events are generated with DuckDB, written to a local lake directory as raw/{type}/dt=.../
+NDJSON (one file per partition rather than one object per event, which would take far longer to write) and
+COPYed into events_raw of the configured Postgres, whose transformations are then run. Each endpoint is timed
+on Postgres, on the lake's JSON and on the lake after compaction to Parquet.
+
+--fresh is required: the public schema is dropped and recreated, so only point this at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from analytics import lake
+from benchmarks.e2e import reset_database
+from benchmarks.harness import BenchReport, Stage, format_table, measure, new_report, write_report
+from platform_common.config import settings
+from platform_common.db import get_engine
+from transformations.runner import run_all
+
+# One row per event: a type by position, times spread evenly over the span, values from hashes of the position
+_EVENTS = """
+create table events as
+select
+  'bench-' || i as event_id,
+  ['payment', 'payment', 'payment', 'payment', 'payment', 'usage', 'usage', 'usage', 'subscription', 'cost'][i % 10 + 1] as event_type,
+  timestamptz '{start} 00:00:00+00' + to_seconds(i * {seconds} // {n}) as event_time,
+  'cust-' || (hash(i, 1) % {customers}) as customer_id,
+  ['us-east', 'us-west', 'eu-west', 'eu-central', 'ap-south'][(hash(i, 2) % 5)::bigint + 1] as region,
+  round((hash(i, 3) % 100000)::bigint / 100.0, 2)::double as amount,
+  case when hash(i, 4) % 10 < 7 then 'created' else 'canceled' end as action,
+  'plan-' || (hash(i, 5) % 3) as plan_id,
+  (hash(i, 6) % 1000)::bigint as units
+from range({n}) t(i)
+order by event_time
+"""
+
+# Type-specific payload fields: name -> expression over the events table
+_FIELDS = {
+    "payment": {"amount": "amount", "currency": "'USD'", "payment_method": "'card'"},
+    "usage": {"metric_name": "'api_calls'", "units": "units", "plan_id": "plan_id"},
+    "subscription": {"action": "action", "plan_id": "plan_id"},
+    "cost": {"amount": "amount", "cost_type": "'infra'"},
+}
+_ISO = "strftime(event_time, '%Y-%m-%dT%H:%M:%SZ')"
+
+
+def generate(con, n: int, days: int, customers: int, start: date) -> None:
+    con.execute(_EVENTS.format(n=n, seconds=days * 86400, customers=customers, start=start.isoformat()))
+
+
+def write_lake(con, root: str, days: int, start: date) -> None:
+    for event_type, fields in _FIELDS.items():
+        columns = ", ".join(f"{expr} as {name}" for name, expr in fields.items())
+        for offset in range(days + 1):
+            day = start + timedelta(days=offset)
+            directory = os.path.join(root, "raw", event_type, f"dt={day.isoformat()}")
+            os.makedirs(directory, exist_ok=True)
+            # events is in time order, so the range filter only reads that day's row groups
+            con.execute(
+                f"copy (select event_id, {_ISO} as event_time, customer_id, region, {columns} from events "
+                f"where event_type = '{event_type}' and event_time >= timestamptz '{day} 00:00:00+00' "
+                f"and event_time < timestamptz '{day + timedelta(days=1)} 00:00:00+00') "
+                f"to '{directory}/part-0.json' (format json)"
+            )
+
+
+def load_postgres(con) -> None:
+    """COPY the events into events_raw with the payloads ingestion would have stored."""
+    payload = "case event_type " + " ".join(
+        f"when '{event_type}' then to_json(struct_pack(event_id := event_id, event_time := {_ISO}, customer_id := customer_id, "
+        f"region := region, {', '.join(f'{name} := {expr}' for name, expr in fields.items())}))"
+        for event_type, fields in _FIELDS.items()
+    ) + " end"
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        result = con.execute(f"select event_id, event_type, event_time, customer_id, region, ({payload})::varchar from events")
+        while rows := result.fetchmany(200_000):
+            buf = io.StringIO()
+            for row in rows:
+                buf.write("\t".join(str(v).replace("\\", "\\\\") for v in row) + "\tf\n")
+            buf.seek(0)
+            cursor.copy_expert("copy events_raw (event_id, event_type, event_time, customer_id, region, payload, is_late) from stdin", buf)
+        raw.commit()
+        cursor.execute("analyze events_raw")
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _record(report: BenchReport, stage: Stage) -> None:
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed requests per endpoint and backend")
+    parser.add_argument("--lake-dir", default=None, help="Lake directory (default: a new temporary directory)")
+    parser.add_argument("--fresh", action="store_true", help="Required: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if not args.fresh:
+        parser.error("this benchmark reloads events_raw; pass --fresh to reset a scratch database")
+
+    import duckdb
+
+    root = args.lake_dir or tempfile.mkdtemp(prefix="ffdp-lake-")
+    start = date.today() - timedelta(days=args.days)
+    report = new_report("lake", {**vars(args), "lake_dir": root, "start": start.isoformat()})
+    con = duckdb.connect()
+    con.execute("set TimeZone = 'UTC'")
+
+    reset_database()
+    with measure("generate", unit="events") as stage:
+        generate(con, args.events, args.days, args.customers, start)
+        stage.ops = args.events
+    _record(report, stage)
+    with measure("write_lake_json", unit="events") as stage:
+        write_lake(con, root, args.days, start)
+        stage.ops = args.events
+    _record(report, stage)
+    with measure("load_postgres", unit="events") as stage:
+        load_postgres(con)
+        stage.ops = args.events
+    _record(report, stage)
+    with measure("transformations", unit="runs") as stage:
+        with stage.op():
+            run_all()
+    _record(report, stage)
+    con.close()
+
+    month = (start + timedelta(days=args.days // 2)).strftime("%Y-%m")
+    last_30 = (date.today() - timedelta(days=30)).isoformat()
+    paths = {
+        "revenue_by_region": "/metrics/revenue_by_region",
+        "revenue_by_region_30d": f"/metrics/revenue_by_region?start_date={last_30}",
+        "mrr": f"/metrics/mrr?month={month}",
+        "churn": "/metrics/churn",
+    }
+
+    from analytics.app.main import app
+
+    settings.LAKE_ROOT = root
+    settings.LAKE_COMPACT_MIN_AGE_DAYS = 0
+    lake.reset_lake()
+    with TestClient(app) as client:
+        for backend in ("postgres", "lake_json", "lake_parquet"):
+            if backend == "lake_parquet":
+                with measure("compact", unit="partitions") as stage:
+                    with stage.op():
+                        stage.ops = lake.compact().get("compacted", 0)
+                _record(report, stage)
+            settings.ANALYTICS_BACKEND = "postgres" if backend == "postgres" else "lake"
+            for name, path in paths.items():
+                client.get(path)  # warm up
+                with measure(f"{backend}:{name}", unit="requests") as stage:
+                    for _ in range(args.repeat):
+                        with stage.op():
+                            response = client.get(path)
+                    stage.extra = {"status": response.status_code}
+                _record(report, stage)
+    path = write_report(report, args.out)
+    logger.info("Lake directory: {}", root)
+    print(format_table(report))
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
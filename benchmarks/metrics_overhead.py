@@ -0,0 +1,126 @@
+"""Cost of the Prometheus instrumentation on the ingestion hot path: python -m benchmarks.metrics_overhead
+
+Runs process_event on in-memory SQLite with S3 stubbed, alternating metrics on and off, so the
+difference is the instrumentation itself rather than the database or network.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+import timeit
+from typing import Any, Callable
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import ingestion.app.service as service
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import StageResult, current_rss_mb, format_table, new_report, peak_rss_mb, write_report
+from ingestion.app.schemas import EventType
+from platform_common import metrics
+from platform_common.db import Base
+
+
+def _ingest_round(events: list[tuple[EventType, dict[str, Any]]]) -> float:
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)()
+    started = time.perf_counter()
+    for et, payload in events:
+        service.process_event(session, et, payload)
+    elapsed = time.perf_counter() - started
+    session.close()
+    engine.dispose()
+    return elapsed
+
+
+async def _http_round(requests: int) -> float:
+    from ingestion.app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        started = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/health")
+        return time.perf_counter() - started
+
+
+def _primitive_ns(fn: Callable[[], None], n: int = 200_000) -> float:
+    return min(timeit.repeat(fn, number=n, repeat=5)) / n * 1e9
+
+
+def _timed_block() -> None:
+    with metrics.timed(metrics.STAGE["validate"]):
+        pass
+
+
+def _count() -> None:
+    metrics.count_event("payment", "accepted")
+
+
+def _result(name: str, unit: str, ops: int, seconds: float) -> StageResult:
+    return StageResult(
+        stage=name,
+        unit=unit,
+        ops=ops,
+        seconds=round(seconds, 6),
+        throughput=round(ops / seconds, 3),
+        p50_ms=round(seconds / ops * 1000, 6),  # mean per op of the best round
+        rss_mb=round(current_rss_mb(), 2),
+        rss_delta_mb=0.0,
+        peak_rss_mb=round(peak_rss_mb(), 2),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=6)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    service.put_json = lambda *a, **k: True  # type: ignore[assignment]
+    events = list(EventGenerator(GeneratorConfig(seed=1)).events(args.events))
+    report = new_report("metrics_overhead", vars(args))
+
+    # Per-call cost of the primitives; process_event makes ~5 timed blocks and one count per event
+    for enabled in (False, True):
+        metrics.set_enabled(enabled)
+        label = "on" if enabled else "off"
+        report.config[f"timed_block_ns_{label}"] = round(_primitive_ns(_timed_block), 1)
+        report.config[f"count_event_ns_{label}"] = round(_primitive_ns(_count), 1)
+
+    workloads: list[tuple[str, str, int, Callable[[], float]]] = [
+        ("process_event", "events", args.events, lambda: _ingest_round(events)),
+        ("http_request", "requests", args.requests, lambda: asyncio.run(_http_round(args.requests))),
+    ]
+    for name, unit, ops, run in workloads:
+        timings: dict[bool, list[float]] = {True: [], False: []}
+        run()  # warm-up: imports, metric children, SQLAlchemy compiled cache
+        for i in range(args.rounds):
+            # Alternate which mode goes first so drift does not favour one side
+            for enabled in ((False, True) if i % 2 == 0 else (True, False)):
+                metrics.set_enabled(enabled)
+                timings[enabled].append(run())
+        metrics.set_enabled(True)
+        off, on = min(timings[False]), min(timings[True])
+        report.stages.append(_result(f"{name}:metrics_off", unit, ops, off))
+        report.stages.append(_result(f"{name}:metrics_on", unit, ops, on))
+        report.config[f"{name}_overhead_us"] = round((on - off) / ops * 1e6, 3)
+        report.config[f"{name}_overhead_pct"] = round((on - off) / off * 100, 2)
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(
+        f"timed block: {report.config['timed_block_ns_on']} ns on / {report.config['timed_block_ns_off']} ns off; "
+        f"count_event: {report.config['count_event_ns_on']} ns on / {report.config['count_event_ns_off']} ns off"
+    )
+    for name, *_ in workloads:
+        print(f"{name}: {report.config[f'{name}_overhead_us']:+} us/op ({report.config[f'{name}_overhead_pct']:+}%)")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
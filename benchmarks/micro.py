@@ -0,0 +1,435 @@
+"""Micro-benchmarks of the hot functions, gated against a stored baseline: python -m benchmarks.micro --check
+
+Each case times one function on a fixed input: s3_key_for, schema validation and evaluate_quality per event type,
+process_event per outcome, _fit_and_forecast per series length, read_sql_files, and on Postgres run_sql and each
+analytics endpoint handler (called directly, without HTTP). S3 is stubbed in-process, so put_json and its
+metrics run but nothing leaves the process.
+
+    python -m benchmarks.micro --save-baseline                     # SQLite, a temporary file
+    python -m benchmarks.micro --check                             # exit 1 if a case regressed
+    python -m benchmarks.micro --backend postgres --fresh --check  # the configured Postgres
+
+A case is called enough times per repeat to take --min-time, and its time per call is the fastest repeat's, the
+least disturbed by the rest of the machine. A fixed loop of plain Python is timed after every repeat as a
+reference. --check compares each case with the baseline of the same backend (benchmarks/baselines/micro-<backend>.json,
+or --baseline), both in time and in units of the reference, so a shared runner slowing down as a whole does not
+read as a regression. A case slower by more than --threshold percent, or its own tolerance, in both is timed again
+and fails only if the second run is over too. Baselines are only comparable on the machine type they were recorded
+on: record them where --check runs, e.g. on the CI runner from the base branch.
+
+The Postgres backend drops the public schema (--fresh is required), so only point it at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import gc
+import inspect
+import itertools
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from loguru import logger
+from pydantic.fields import FieldInfo
+from sqlalchemy.orm import Session
+
+import platform_common.s3 as s3
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import BenchReport, StageResult, current_rss_mb, format_table, load_report, new_report, peak_rss_mb, write_report
+from forecasting.arima import _fit_and_forecast
+from forecasting.serving import reset_forecast_cache
+from ingestion.app.quality import evaluate_quality
+from ingestion.app.schemas import EventSchemaMap
+from ingestion.app.service import process_event, s3_key_for
+from platform_common import db
+from platform_common.config import settings
+from transformations.runner import default_sql_dir, read_sql_files, run_sql
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+SERIES_LENGTHS = (60, 180, 365)
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    # Called before every repeat (and the calibration); returns the function that is timed
+    prepare: Callable[[], Callable[[], Any]]
+    tolerance_pct: Optional[float] = None  # instead of --threshold, for cases noisier than the rest
+
+
+class FakeS3:
+    """head_object and put_object over a set of keys: the calls put_json makes."""
+
+    def __init__(self) -> None:
+        self.keys: set[str] = set()
+
+    def head_object(self, Bucket: str, Key: str) -> None:
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+    def put_object(self, Bucket: str, Key: str, **kwargs: Any) -> None:
+        self.keys.add(Key)
+
+
+def _fixed(fn: Callable[..., Any], *args: Any) -> Callable[[], Callable[[], Any]]:
+    return lambda: lambda: fn(*args)
+
+
+# Inputs
+
+def _payloads() -> dict[str, dict[str, Any]]:
+    """One valid payload per event type, as the generator makes them."""
+    config = GeneratorConfig(seed=1, duplicate_ratio=0.0, invalid_ratio=0.0, late_ratio=0.0)
+    payloads: dict[str, dict[str, Any]] = {}
+    for event_type, payload in EventGenerator(config).events(200):
+        payloads.setdefault(event_type, payload)
+    assert set(payloads) == set(EventSchemaMap)
+    return payloads
+
+
+def _series(length: int) -> pd.Series:
+    """Daily revenue with a trend, a weekly cycle and noise; seeded."""
+    rng = np.random.default_rng(length)
+    days = np.arange(length)
+    values = 1000 + 2 * days + 150 * np.sin(2 * np.pi * days / 7) + rng.normal(0, 40, length)
+    return pd.Series(values, index=pd.date_range("2024-01-01", periods=length, freq="D"), name="revenue_amount")
+
+
+# process_event: a session per repeat, committed before the next so its identity map does not keep growing
+
+_ids = itertools.count()
+_CHANGES: dict[str, dict[str, Any]] = {"quarantined": {"region": ""}, "invalid": {"amount": -1}}  # fails quality; fails the schema
+_session: Optional[Session] = None
+
+
+def _new_session() -> Session:
+    global _session
+    if _session is not None:
+        _session.commit()
+        _session.close()
+    _session = db.get_sessionmaker()()
+    return _session
+
+
+def _payment(**changes: Any) -> dict[str, Any]:
+    return {
+        "event_id": f"micro-{next(_ids)}",
+        "event_time": (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat(),
+        "customer_id": "cust-micro",
+        "region": "us-east",
+        "amount": 42.5,
+        "currency": "USD",
+        "payment_method": "card",
+        **changes,
+    }
+
+
+def _process(outcome: str) -> Callable[[], Callable[[], Any]]:
+    # Payloads that end as `outcome`; all but duplicate need an event id not seen before, built inside the timing
+    changes = _CHANGES.get(outcome, {})
+
+    def prepare() -> Callable[[], Any]:
+        session = _new_session()
+        if outcome == "duplicate":
+            seen = _payment()
+            process_event(session, "payment", seen)
+
+            def run() -> Any:
+                return process_event(session, "payment", seen)
+        else:
+            def run() -> Any:
+                return process_event(session, "payment", _payment(**changes))
+
+        status = run().status
+        assert status == ("quarantined" if outcome == "invalid" else outcome), status
+        return run
+
+    return prepare
+
+
+# Analytics handlers, called as FastAPI would with the query parameters left at their defaults
+
+def _handler(fn: Callable[..., Any], **params: Any) -> Callable[[], Callable[[], Any]]:
+    kwargs = {name: p.default.default for name, p in inspect.signature(fn).parameters.items() if isinstance(p.default, FieldInfo)}
+    kwargs.update(params)
+    return _fixed(lambda: fn(**kwargs))
+
+
+def _seed(events: int) -> str:
+    """Events through bulk ingestion, the transformations, both forecasts and a backtest; returns the last month."""
+    from forecasting.arima import forecast_revenue_daily, forecast_subscriptions_daily
+    from forecasting.backtest import run_backtests
+    from ingestion.app.bulk import ingest_stream
+    from transformations.runner import run_all
+
+    # No duplicates: the same event in two chunks ingested at once can deadlock on the unique keys
+    generator = EventGenerator(GeneratorConfig(seed=42, customers=300, days=120, duplicate_ratio=0.0))
+    ingest_stream(iter(list(generator.events(events))), chunk_size=500, workers=2)
+    run_all()
+    forecast_revenue_daily()
+    forecast_subscriptions_daily()
+    run_backtests(targets=["revenue_daily"], model_names=["SeasonalNaive(7)"], step=7, max_workers=1)
+    return generator.end.strftime("%Y-%m")
+
+
+def analytics_cases(month: str) -> list[Case]:
+    from analytics.app import main as api
+
+    return [
+        Case("handler:revenue_by_region", _handler(api.revenue_by_region)),
+        Case("handler:mrr", _handler(api.mrr, month=month)),
+        Case("handler:churn", _handler(api.churn)),
+        Case("handler:gross_margin", _handler(api.gross_margin)),
+        Case("handler:usage", _handler(api.usage)),
+        Case("handler:active_customers", _handler(api.active_customers)),
+        Case("handler:forecast_vs_actual", _handler(api.forecast_vs_actual)),
+        Case("handler:forecasts", _handler(api.forecasts, target="revenue_daily")),
+        Case("handler:forecast_accuracy", _handler(api.forecast_accuracy)),
+    ]
+
+
+def cases(backend: str, month: Optional[str] = None) -> list[Case]:
+    payloads = _payloads()
+    event_time = datetime(2024, 3, 1, 12, 30, tzinfo=timezone.utc)
+    found: list[Case] = [Case("s3_key_for", _fixed(s3_key_for, "payment", "evt-000000000001", event_time))]
+    for event_type, cls in EventSchemaMap.items():
+        found.append(Case(f"validate:{event_type}", _fixed(cls.model_validate, payloads[event_type])))
+    for event_type, cls in EventSchemaMap.items():
+        # What process_valid hands it: the model's JSON-mode dump
+        data = cls.model_validate(payloads[event_type]).model_dump(mode="json")
+        found.append(Case(f"evaluate_quality:{event_type}", _fixed(evaluate_quality, data, event_type)))
+    for outcome in ("accepted", "duplicate", "quarantined", "invalid"):
+        found.append(Case(f"process_event:{outcome}", _process(outcome)))
+    for length in SERIES_LENGTHS:
+        # One call per repeat: less averaging than the short cases, so more room
+        found.append(Case(f"_fit_and_forecast:{length}", _fixed(_fit_and_forecast, _series(length)), tolerance_pct=30.0))
+    found.append(Case("read_sql_files", _fixed(read_sql_files, default_sql_dir())))
+    if backend == "postgres":
+        statements = read_sql_files(default_sql_dir())
+        found.append(Case("run_sql", _fixed(run_sql, statements), tolerance_pct=30.0))
+        found.extend(analytics_cases(month or datetime.now(timezone.utc).strftime("%Y-%m")))
+    return found
+
+
+# Timing
+
+def _run(fn: Callable[[], Any], number: int) -> float:
+    # As timeit: no collections in the middle of a repeat
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - started
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _reference() -> Any:
+    """Fixed interpreter work, timed next to every repeat of every case: how fast the machine runs just then."""
+    counts: dict[str, int] = {}
+    for i in range(200):
+        key = f"k{i % 17}"
+        counts[key] = counts.get(key, 0) + i
+    return sorted(counts.items())
+
+
+def _calibrate(prepare: Callable[[], Callable[[], Any]], min_time: float) -> int:
+    """Calls per repeat so that one takes at least min_time, found as timeit.autorange does."""
+    number = 1
+    while True:
+        elapsed = _run(prepare(), number)
+        if elapsed >= min_time:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def time_case(case: Case, min_time: float, repeat: int) -> StageResult:
+    number = _calibrate(case.prepare, min_time)
+    reference_number = _calibrate(lambda: _reference, min_time / 4)
+    per_call: list[float] = []
+    reference: list[float] = []
+    for _ in range(repeat):
+        fn = case.prepare()
+        gc.collect()
+        per_call.append(_run(fn, number) / number)
+        reference.append(_run(_reference, reference_number) / reference_number)
+    best = min(per_call)
+    extra: dict[str, Any] = {
+        "best_ns": round(best * 1e9, 1),
+        "reference_ns": round(min(reference) * 1e9, 1),
+        "repeat": repeat,
+        "spread_pct": round((max(per_call) - best) / best * 100, 1),
+    }
+    if case.tolerance_pct is not None:
+        extra["tolerance_pct"] = case.tolerance_pct
+    return StageResult(
+        stage=case.name,
+        unit="calls",
+        ops=number,
+        seconds=round(best * number, 6),
+        throughput=round(1 / best, 3),
+        p50_ms=round(statistics.median(per_call) * 1000, 6),
+        rss_mb=round(current_rss_mb(), 2),
+        rss_delta_mb=0.0,
+        peak_rss_mb=round(peak_rss_mb(), 2),
+        extra=extra,
+    )
+
+
+# Gating
+
+def per_call_ns(result: StageResult) -> float:
+    return float(result.extra.get("best_ns", result.seconds / result.ops * 1e9))
+
+
+def change_pct(base: StageResult, head: StageResult) -> tuple[float, float]:
+    """How much slower head is than base: in time, and in units of the reference loop timed beside each."""
+    raw = (per_call_ns(head) - per_call_ns(base)) / per_call_ns(base) * 100
+    if "reference_ns" not in base.extra or "reference_ns" not in head.extra:
+        return raw, raw
+    base_relative = per_call_ns(base) / base.extra["reference_ns"]
+    return raw, (per_call_ns(head) / head.extra["reference_ns"] - base_relative) / base_relative * 100
+
+
+def regressions(baseline: BenchReport, head: BenchReport, threshold_pct: float) -> list[str]:
+    """Cases of head slower than in the baseline by more than their tolerance, or threshold_pct, both in time and
+    relative to the reference: a machine slowing down as a whole (other tenants, frequency scaling) slows the
+    reference as much, and an unlucky reference sample leaves the time alone, but a slower case shows in both."""
+    slower: list[str] = []
+    for result in head.stages:
+        base = baseline.stage(result.stage)
+        if base is None:
+            continue
+        limit = result.extra.get("tolerance_pct", threshold_pct)
+        if min(change_pct(base, result)) > limit:
+            slower.append(result.stage)
+    return slower
+
+
+def format_check(baseline: BenchReport, head: BenchReport, threshold_pct: float, failed: list[str]) -> str:
+    lines = [
+        f"baseline {baseline.commit or '?'} ({baseline.created_at:%Y-%m-%d %H:%M})  vs  head {head.commit or '?'}",
+        f"{'case':<32} {'base':>12} {'head':>12} {'Δ raw':>8} {'Δ':>8} {'limit':>7}  status",
+    ]
+    for result in head.stages:
+        base = baseline.stage(result.stage)
+        head_ns = per_call_ns(result)
+        if base is None:
+            lines.append(f"{result.stage:<32} {'-':>12} {_ns(head_ns):>12} {'-':>8} {'-':>8} {'-':>7}  new")
+            continue
+        raw, change = change_pct(base, result)
+        limit = result.extra.get("tolerance_pct", threshold_pct)
+        status = "REGRESSED" if result.stage in failed else "ok"
+        lines.append(f"{result.stage:<32} {_ns(per_call_ns(base)):>12} {_ns(head_ns):>12} {raw:>+7.1f}% {change:>+7.1f}% {limit:>6.0f}%  {status}")
+    return "\n".join(lines)
+
+
+def _ns(value: float) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.2f} {unit}"
+    return f"{value:.0f} ns"
+
+
+def run(selected: list[Case], min_time: float, repeat: int, report: BenchReport) -> None:
+    for case in selected:
+        report.stages.append(time_case(case, min_time, repeat))
+        print(f"{case.name:<32} {_ns(per_call_ns(report.stages[-1])):>12}", flush=True)
+
+
+def _setup(backend: str, directory: str, events: int) -> Optional[str]:
+    if backend == "sqlite":
+        settings.POSTGRES_DSN = f"sqlite+pysqlite:///{os.path.join(directory, 'micro.db')}"
+        db.reset_engine()
+        db.Base.metadata.create_all(bind=db.get_engine())
+        return None
+    from benchmarks.e2e import reset_database
+
+    reset_database()
+    return _seed(events)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--only", action="append", default=[], help="Run the cases matching this glob, e.g. 'process_event:*'; repeatable")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds each repeat of a case takes at least")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--events", type=int, default=5000, help="Events seeded for run_sql and the handlers (postgres)")
+    parser.add_argument("--baseline", default=None, help="Default benchmarks/baselines/micro-<backend>.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit 1 if a case is slower than the baseline beyond its limit")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Percent slower than the baseline that fails --check")
+    parser.add_argument("--fresh", action="store_true", help="Required with --backend postgres: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if args.backend == "postgres" and not args.fresh:
+        parser.error("the postgres backend reloads the database; pass --fresh to reset a scratch database")
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"micro-{args.backend}.json")
+    if args.check and not os.path.exists(baseline_path):
+        parser.error(f"no baseline at {baseline_path}; record one with --save-baseline")
+    baseline = load_report(baseline_path) if args.check else None
+
+    warnings.simplefilter("ignore")  # statsmodels' convergence warnings on every fit
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")  # run_sql logs each statement
+    fake = FakeS3()
+    s3.get_s3_client = lambda: fake  # type: ignore[assignment]
+    directory = tempfile.mkdtemp(prefix="ffdp-micro-")
+    month = _setup(args.backend, directory, args.events)
+    selected = [case for case in cases(args.backend, month) if not args.only or any(fnmatch.fnmatch(case.name, p) for p in args.only)]
+    report = new_report(f"micro-{args.backend}", {key: value for key, value in vars(args).items() if key != "check"})
+    report.config.update(machine=os.uname().machine, cpus=os.cpu_count())
+    try:
+        run(selected, args.min_time, args.repeat, report)
+        failed: list[str] = []
+        if baseline is not None:
+            failed = regressions(baseline, report, args.threshold)
+            if failed:
+                # Confirm on a second run, keeping the closer of the two to the baseline
+                print(f"re-timing {len(failed)} slower case(s): {', '.join(failed)}", flush=True)
+                for case in selected:
+                    base = baseline.stage(case.name)
+                    if case.name in failed and base is not None:
+                        i = next(i for i, result in enumerate(report.stages) if result.stage == case.name)
+                        again = time_case(case, args.min_time, args.repeat)
+                        if min(change_pct(base, again)) < min(change_pct(base, report.stages[i])):
+                            report.stages[i] = again
+                failed = regressions(baseline, report, args.threshold)
+            report.config["regressed"] = failed
+    finally:
+        if _session is not None:
+            _session.close()
+        reset_forecast_cache()  # the handlers' cache, listening on Postgres
+        db.reset_engine()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(f"wrote {path}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        print(f"baseline {write_report(report, baseline_path)}")
+    if baseline is not None:
+        print(format_check(baseline, report, args.threshold, failed))
+        if failed:
+            print(f"{len(failed)} case(s) regressed beyond their limit", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Gross margin and usage endpoints vs ad-hoc joins of the fact views: python -m benchmarks.rollups --fresh
+
+Synthetic payment, cost and usage events are inserted into events_raw of the configured Postgres with
+generate_series and the transformations are run. Each query shape is timed as the ad-hoc SQL over the views and
+as the endpoint over the rollups. Then a batch of new events over the last few days is inserted and the rollup
+models are re-run incrementally and checked against a full recomputation (transformations.verify).
+
+--fresh is required: the public schema is dropped and recreated, so only point this at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from benchmarks.e2e import reset_database
+from benchmarks.harness import BenchReport, Stage, format_table, measure, new_report, write_report
+from platform_common.db import get_engine
+from transformations.runner import run_all, run_models
+from transformations.verify import verify
+
+_MODELS = ["024_margin_rollup", "025_usage_rollup"]
+
+# Event i: a type by position, times spread evenly over the span (offset by `shift` seconds), values from i
+_INSERT = """
+insert into events_raw (event_id, event_type, event_time, customer_id, region, payload, is_late, inserted_at)
+select '{prefix}-' || i, t.event_type, ts, 'cust-' || (i * 104729 % {customers}), 'region-' || lpad((i * 7919 % {regions})::text, 3, '0'),
+       case t.event_type
+         when 'usage' then json_build_object('metric_name', 'metric-' || (i % 4), 'units', i % 1000, 'plan_id', 'plan-' || (i % 3))
+         else json_build_object('amount', round((i % 100000) / 100.0, 2), 'currency', 'USD')
+       end,
+       false, now() - interval '{age}'
+from generate_series(1::bigint, {n}) i,
+     lateral (select (array['payment', 'payment', 'cost', 'usage', 'usage'])[i % 5 + 1] as event_type,
+                     timestamptz '{start} 00:00:00+00' + ((i * {seconds}) / {n} + {shift}) * interval '1 second' as ts) t
+"""
+
+# What teams ran before the endpoints: the fact views joined and bucketed at query time
+_ADHOC = {
+    "gross_margin": """
+        select date_trunc(:granularity, coalesce(r.date_key, c.date_key))::date, coalesce(r.region_key, c.region_key),
+               sum(coalesce(r.revenue_amount, 0)) - sum(coalesce(c.cost_amount, 0))
+        from fact_revenue_daily r
+        full join fact_costs_daily c on c.date_key = r.date_key and c.region_key = r.region_key
+        where coalesce(r.date_key, c.date_key) >= :start_date
+        group by 1, 2 order by 1, 2
+    """,
+    "usage": """
+        select date_trunc(:granularity, event_date)::date, metric_name, plan_id, region, sum(units), count(*)
+        from stg_usage_events
+        where event_date >= :start_date
+        group by 1, 2, 3, 4 order by 1, 2, 3, 4
+    """,
+}
+
+
+def insert_events(
+    prefix: str, n: int, days: int, regions: int, start: date, shift_seconds: int = 0, age: str = "0 seconds", customers: int = 10007
+) -> None:
+    with get_engine().begin() as conn:
+        conn.execute(text(_INSERT.format(
+            prefix=prefix, n=n, regions=regions, customers=customers, start=start.isoformat(), seconds=days * 86400, shift=shift_seconds, age=age,
+        )))
+        conn.execute(text("analyze events_raw"))
+
+
+def _record(report: BenchReport, stage: Stage) -> None:
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--new-events", type=int, default=20_000, help="Events inserted before the incremental run")
+    parser.add_argument("--new-days", type=int, default=7, help="Days the new events are spread over, ending today")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fresh", action="store_true", help="Required: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if not args.fresh:
+        parser.error("this benchmark reloads events_raw; pass --fresh to reset a scratch database")
+
+    start = date.today() - timedelta(days=args.days)
+    report = new_report("rollups", {**vars(args), "start": start.isoformat()})
+    reset_database()
+    with measure("insert_events", unit="events") as stage:
+        # Inserted before the models' settle window, as a history would be, so incremental runs skip it
+        insert_events("bench", args.events, args.days, args.regions, start, age="1 hour")
+        stage.ops = args.events
+    _record(report, stage)
+    with measure("transformations", unit="runs") as stage:
+        with stage.op():
+            run_all()
+    _record(report, stage)
+
+    last_30 = (date.today() - timedelta(days=30)).isoformat()
+    shapes = {f"{g}_{span}": (g, since) for g in ("day", "month") for span, since in (("all", start.isoformat()), ("30d", last_30))}
+
+    from analytics.app.main import app
+
+    with TestClient(app) as client:
+        for metric, adhoc in _ADHOC.items():
+            for shape, (granularity, since) in shapes.items():
+                with get_engine().connect() as conn:
+                    with measure(f"adhoc:{metric}:{shape}", unit="queries") as stage:
+                        for _ in range(args.repeat):
+                            with stage.op():
+                                rows = conn.execute(text(adhoc), {"granularity": granularity, "start_date": since}).all()
+                        stage.extra = {"rows": len(rows)}
+                _record(report, stage)
+                path = f"/metrics/{metric}?granularity={granularity}&start_date={since}"
+                client.get(path)  # warm up
+                with measure(f"endpoint:{metric}:{shape}", unit="requests") as stage:
+                    for _ in range(args.repeat):
+                        with stage.op():
+                            response = client.get(path)
+                    stage.extra = {"status": response.status_code, "rows": len(response.json()["rows"])}
+                _record(report, stage)
+
+    insert_events("new", args.new_events, args.new_days, args.regions, date.today() - timedelta(days=args.new_days), shift_seconds=1)
+    with measure("incremental_rollups", unit="events") as stage:
+        with stage.op():
+            run_models(_MODELS)
+        stage.ops = args.new_events
+    _record(report, stage)
+    with measure("incremental_noop", unit="runs") as stage:
+        with stage.op():
+            run_models(_MODELS)
+    _record(report, stage)
+    mismatched = verify(["margin_rollup", "usage_rollup"])
+    report.config["verify"] = mismatched
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(f"verify: {mismatched}")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""/metrics/active_customers against exact count(distinct customer_id): python -m benchmarks.sketches --fresh
+
+Synthetic events are inserted into events_raw of the configured Postgres (benchmarks.rollups.insert_events) and the
+transformations are run. Each query shape is timed as the exact SQL over events_raw and as the endpoint over the
+customer sketches, and the estimates are compared with the exact counts. Then new events over the last few days
+are inserted and the sketch model is re-run incrementally and checked against a full recomputation.
+
+--fresh is required: the public schema is dropped and recreated, so only point this at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from benchmarks.e2e import reset_database
+from benchmarks.harness import BenchReport, Stage, format_table, measure, new_report, write_report
+from benchmarks.rollups import insert_events
+from platform_common.db import get_engine
+from transformations.runner import run_all, run_models
+from transformations.verify import verify
+
+_MODEL = "026_customer_sketches"
+
+_PERIOD = {
+    "total": "null::date",
+    "month": "date_trunc('month', event_time)::date",
+    "day": "date_trunc('day', event_time)::date",
+}
+
+
+def _exact_sql(granularity: str, by_region: bool) -> str:
+    region = "region" if by_region else "null"
+    return f"""
+        select {_PERIOD[granularity]}, {region}, count(distinct customer_id)
+        from events_raw
+        where customer_id <> '' and event_time >= :start_date and event_time < :end_date
+          and (cast(:region as text) is null or region = :region)
+        group by 1, 2
+    """
+
+
+def _record(report: BenchReport, stage: Stage) -> None:
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--customers", type=int, default=1_000_003)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--regions", type=int, default=10)
+    parser.add_argument("--new-events", type=int, default=20_000, help="Events inserted before the incremental run")
+    parser.add_argument("--new-days", type=int, default=7, help="Days the new events are spread over, ending today")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fresh", action="store_true", help="Required: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if not args.fresh:
+        parser.error("this benchmark reloads events_raw; pass --fresh to reset a scratch database")
+
+    today = date.today()
+    start = today - timedelta(days=args.days)
+    report = new_report("sketches", {**vars(args), "start": start.isoformat()})
+    reset_database()
+    with measure("insert_events", unit="events") as stage:
+        # Inserted before the model's settle window, as a history would be, so incremental runs skip it
+        insert_events("bench", args.events, args.days, args.regions, start, age="1 hour", customers=args.customers)
+        stage.ops = args.events
+    _record(report, stage)
+    with measure("transformations", unit="runs") as stage:
+        with stage.op():
+            run_all()
+    _record(report, stage)
+    with get_engine().connect() as conn:
+        report.config["sketch_bytes"] = int(conn.execute(text("select coalesce(sum(length(registers)), 0) from customer_sketches")).scalar_one())
+        report.config["sketches"] = int(conn.execute(text("select count(*) from customer_sketches")).scalar_one())
+
+    # name: (granularity, start_date, end_date, region, by_region)
+    tomorrow = today + timedelta(days=1)
+    shapes = {
+        "total_all": ("total", start, tomorrow, None, False),
+        "total_90d": ("total", today - timedelta(days=90), tomorrow, None, False),
+        "total_year_region": ("total", today - timedelta(days=365), tomorrow, "region-000", False),
+        "month_by_region": ("month", start.replace(day=1), tomorrow, None, True),
+        "day_by_region_30d": ("day", today - timedelta(days=30), tomorrow, None, True),
+    }
+    errors: dict[str, dict[str, float]] = {}
+
+    from analytics.app.main import app
+
+    with TestClient(app) as client:
+        for shape, (granularity, start_date, end_date, region, by_region) in shapes.items():
+            params = {"start_date": start_date, "end_date": end_date, "region": region}
+            with get_engine().connect() as conn:
+                with measure(f"exact:{shape}", unit="queries") as stage:
+                    for _ in range(args.repeat):
+                        with stage.op():
+                            rows = conn.execute(text(_exact_sql(granularity, by_region)), params).all()
+                    stage.extra = {"rows": len(rows)}
+            _record(report, stage)
+            exact = {(p and p.isoformat(), r): n for p, r, n in rows}
+
+            path = (f"/metrics/active_customers?granularity={granularity}&by_region={str(by_region).lower()}"
+                    f"&start_date={start_date}&end_date={end_date - timedelta(days=1)}" + (f"&region={region}" if region else ""))
+            client.get(path)  # warm up
+            with measure(f"endpoint:{shape}", unit="requests") as stage:
+                for _ in range(args.repeat):
+                    with stage.op():
+                        response = client.get(path)
+                estimated = {(r["period_start"], r["region_key"]): r["customers"] for r in response.json()["rows"]}
+                relative = [abs(estimated.get(key, 0) / n - 1) for key, n in exact.items()]
+                errors[shape] = {"max": max(relative), "mean": sum(relative) / len(relative)}
+                stage.extra = {"status": response.status_code, "rows": len(estimated), **errors[shape]}
+            _record(report, stage)
+    report.config["relative_error"] = errors
+
+    insert_events("new", args.new_events, args.new_days, args.regions, today - timedelta(days=args.new_days),
+                  shift_seconds=1, customers=args.customers)
+    with measure("incremental_sketches", unit="events") as stage:
+        with stage.op():
+            run_models([_MODEL])
+        stage.ops = args.new_events
+    _record(report, stage)
+    mismatched = verify(["customer_sketches"])
+    report.config["verify"] = mismatched
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    for shape, error in errors.items():
+        print(f"{shape}: relative error max {error['max']:.2%}, mean {error['mean']:.2%}")
+    print(f"sketches: {report.config['sketches']} ({report.config['sketch_bytes'] / 1e6:.1f} MB), verify: {mismatched}")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
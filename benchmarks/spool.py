@@ -0,0 +1,108 @@
+"""Acknowledgement latency and apply throughput with and without the spool: python -m benchmarks.spool
+
+Concurrent clients ingest single events in-process, the way the single-event endpoint does, first directly
+(one transaction per event against the configured Postgres) and then through the spool (the event is durable
+on local disk). The spooled events are then drained, and the same number of new events is applied item by
+item, so apply throughput compares per-event transactions with the drainer's large batches. S3 writes are
+stubbed so the numbers are about the database and the disk.
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+import orjson
+
+import ingestion.app.service as service
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import Stage, format_table, measure, new_report, write_report
+from ingestion.app.schemas import EventType
+from ingestion.app.spool import Spool, drain_once, spool_items
+from ingestion.app.validation import Item, validate_event
+from platform_common.config import settings
+from platform_common.db import get_sessionmaker, session_scope
+
+
+def _items(seed: int, n: int) -> list[Item]:
+    # No replays: concurrent direct clients would race on the same event_id
+    events: list[tuple[EventType, dict[str, Any]]] = list(EventGenerator(GeneratorConfig(seed=seed, duplicate_ratio=0.0)).events(n))
+    return [validate_event(orjson.dumps(payload), et) for et, payload in events]
+
+
+def _direct(item: Item) -> None:
+    with session_scope() as session:
+        service.process_item(session, item)
+
+
+def _spool(spool: Spool, item: Item) -> None:
+    spool_items(spool, [item])
+
+
+def _clients(stage: Stage, items: list[Item], clients: int, ingest: Callable[[Item], None]) -> None:
+    def run(part: list[Item]) -> None:
+        for item in part:
+            with stage.op():
+                ingest(item)
+
+    threads = [threading.Thread(target=run, args=(items[i::clients],)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--fsync-ms", type=float, default=settings.SPOOL_FSYNC_INTERVAL_MS)
+    parser.add_argument("--drain-batch", type=int, default=settings.SPOOL_DRAIN_BATCH)
+    parser.add_argument("--dir", default=None, help="Spool directory (default: a new temporary directory)")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    service.put_json = lambda *a, **k: True  # type: ignore[assignment]
+    get_sessionmaker()  # build the shared engine before the client threads race to create it
+    seed = int(time.time())
+    report = new_report("spool", {**vars(args), "seed": seed})
+    directory = args.dir or tempfile.mkdtemp(prefix="ffdp-spool-")
+    spool = Spool(directory, settings.SPOOL_SEGMENT_BYTES, args.fsync_ms / 1000)
+    try:
+        direct, spooled, per_item = _items(seed, args.events), _items(seed + 1, args.events), _items(seed + 2, args.events)
+
+        with measure("ack:direct", unit="events") as stage:
+            _clients(stage, direct, args.clients, _direct)
+        assert stage.result is not None
+        report.stages.append(stage.result)
+
+        with measure("ack:spool", unit="events") as stage:
+            _clients(stage, spooled, args.clients, lambda item: _spool(spool, item))
+        assert stage.result is not None
+        report.stages.append(stage.result)
+
+        with measure("apply:drain", unit="events") as stage:
+            stage.ops = 0
+            while (n := drain_once(spool, args.drain_batch)):
+                stage.ops += n
+        assert stage.result is not None
+        report.stages.append(stage.result)
+
+        with measure("apply:per_item", unit="events") as stage:
+            stage.ops = len(per_item)
+            for item in per_item:
+                _direct(item)
+        assert stage.result is not None
+        report.stages.append(stage.result)
+    finally:
+        spool.close()
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Cold-start benchmark: time to first healthy response and RSS per service, plus flow import cost.
+
+    python -m benchmarks.startup --boots 5
+
+Each boot is a fresh `uvicorn` process polled on /health. Ingestion needs a bucket, so by default a
+moto server stands in for S3. --cold clears schema_migrations before each service's first boot, so
+that boot includes the migration work.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import httpx
+from sqlalchemy import text
+
+from benchmarks.harness import StageResult, format_table, new_report, percentile, write_report
+from platform_common.config import settings
+from platform_common.db import get_engine
+
+SERVICES = {"ingestion": "ingestion.app.main:app", "analytics": "analytics.app.main:app"}
+IMPORTS = {"flows": "orchestration.flows", "scheduler": "orchestration.run", "forecasting": "forecasting.arima"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+@contextmanager
+def moto_s3(env: dict[str, str]) -> Iterator[None]:
+    from moto.server import ThreadedMotoServer
+
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    env.update(S3_ENDPOINT=f"http://127.0.0.1:{port}", S3_ACCESS_KEY="bench", S3_SECRET_KEY="bench", S3_REGION="us-east-1")
+    try:
+        yield
+    finally:
+        server.stop()
+
+
+@contextmanager
+def serve(app: str, env: dict[str, str], timeout: float = 60.0, launcher: Optional[str] = None) -> Iterator[tuple[str, int, float]]:
+    """Run `app` under uvicorn until the block exits; yields (base url, pid, seconds until /health was 200).
+
+    `launcher` is Python source run instead of the uvicorn CLI; it gets APP and PORT as globals.
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    argv = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if launcher is not None:
+        argv = [sys.executable, "-c", f"APP, PORT = {app!r}, {port}\n{launcher}"]
+    proc = subprocess.Popen(
+        argv,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        with httpx.Client(timeout=0.5) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"{app} exited during startup: {proc.stderr.read().decode()[-2000:] if proc.stderr else ''}")
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"{app} not healthy after {timeout}s")
+                time.sleep(0.005)
+        yield f"http://127.0.0.1:{port}", proc.pid, time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def boot_service(app: str, env: dict[str, str], timeout: float = 60.0) -> tuple[float, float]:
+    """Seconds from process start to the first 200 on /health, and the service's RSS at that point."""
+    with serve(app, env, timeout) as (_, pid, elapsed):
+        return elapsed, rss_mb(pid)
+
+
+def import_cost(module: str, env: dict[str, str]) -> tuple[float, float]:
+    """Wall time and peak RSS of a fresh interpreter importing `module`."""
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", f"import {module}"], env=env)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed")
+    return time.perf_counter() - started, usage.ru_maxrss / 1024
+
+
+def _stage(name: str, unit: str, seconds: list[float], rss: list[float], extra: Optional[dict] = None) -> StageResult:
+    ms = [s * 1000 for s in seconds]
+    return StageResult(
+        stage=name,
+        unit=unit,
+        ops=len(seconds),
+        seconds=round(sum(seconds), 6),
+        throughput=round(len(seconds) / sum(seconds), 3),
+        p50_ms=percentile(ms, 50),
+        p95_ms=percentile(ms, 95),
+        p99_ms=percentile(ms, 99),
+        rss_mb=round(statistics.median(rss), 2),
+        rss_delta_mb=0.0,
+        peak_rss_mb=round(max(rss), 2),
+        extra={"runs_ms": [round(v, 1) for v in ms], **(extra or {})},
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boots", type=int, default=5)
+    parser.add_argument("--s3", choices=["moto", "endpoint"], default="moto")
+    parser.add_argument("--cold", action="store_true", help="Clear schema_migrations before each service's first boot")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    env = {**os.environ, "POSTGRES_DSN": settings.POSTGRES_DSN, "PYTHONPATH": os.getcwd()}
+    report = new_report("startup", vars(args))
+    with moto_s3(env) if args.s3 == "moto" else contextmanager(lambda: iter([None]))():
+        for service, app in SERVICES.items():
+            if args.cold:
+                with get_engine().begin() as conn:
+                    conn.execute(text("delete from schema_migrations"))
+            boots = [boot_service(app, env) for _ in range(args.boots)]
+            report.stages.append(_stage(f"boot:{service}", "boots", [b[0] for b in boots], [b[1] for b in boots], {"cold_first_boot": args.cold}))
+        for name, module in IMPORTS.items():
+            runs = [import_cost(module, env) for _ in range(args.boots)]
+            report.stages.append(_stage(f"import:{name}", "imports", [r[0] for r in runs], [r[1] for r in runs], {"module": module}))
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
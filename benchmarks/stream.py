@@ -0,0 +1,135 @@
+"""Server memory while ingesting one large upload: python -m benchmarks.stream --events 20000 100000
+
+For each size, a fresh ingestion service (uvicorn, configured Postgres, moto for S3) receives the same events
+twice: as a gzip NDJSON stream generated on the fly to /ingest/stream, and as one JSON array to /ingest/batch.
+The service's RSS is sampled during each upload. A flat stream peak across sizes means memory does not grow
+with the upload. Each run uses a new seed, so events are new rather than duplicates of an earlier run.
+
+By default S3 writes are stubbed inside the service: a moto server makes every accepted event a slow HTTP
+round trip on a small machine, and in-process moto keeps every object in the service's memory.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+from typing import Any, Iterator
+
+import httpx
+import orjson
+
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import StageResult, format_table, new_report, write_report
+from benchmarks.startup import moto_s3, rss_mb, serve
+from ingestion.app.schemas import EventType
+from platform_common.config import settings
+
+
+def _gzip_ndjson(events: Iterator[tuple[EventType, dict[str, Any]]], lines_per_block: int = 1000) -> Iterator[bytes]:
+    gz = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    block: list[bytes] = []
+    for et, payload in events:
+        block.append(orjson.dumps({"event_type": et, "payload": payload}))
+        if len(block) >= lines_per_block:
+            yield gz.compress(b"\n".join(block) + b"\n")
+            block = []
+    yield gz.compress(b"\n".join(block) + b"\n") + gz.flush()
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.05) -> None:
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.peak = 0.0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.is_set():
+            self.peak = max(self.peak, rss_mb(self.pid))
+            time.sleep(self.interval)
+
+    def __enter__(self) -> _RssSampler:
+        self.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._done.set()
+        self.join()
+
+
+_STUB_S3 = """
+import uvicorn
+import ingestion.app.main as main
+import ingestion.app.service as service
+main.ensure_bucket = lambda *a, **k: None
+service.put_json = lambda *a, **k: True
+uvicorn.run(main.app, host="127.0.0.1", port=PORT, log_level="warning")
+"""
+
+
+def _upload(name: str, env: dict[str, str], events: int, seed: int, stub_s3: bool) -> StageResult:
+    generator = EventGenerator(GeneratorConfig(seed=seed))
+    with serve("ingestion.app.main:app", env, launcher=_STUB_S3 if stub_s3 else None) as (url, pid, _):
+        idle = rss_mb(pid)
+        with httpx.Client(base_url=url, timeout=None) as client, _RssSampler(pid) as sampler:
+            started = time.perf_counter()
+            if name == "stream":
+                resp = client.post(
+                    "/ingest/stream",
+                    content=_gzip_ndjson(generator.events(events)),
+                    headers={"content-type": "application/x-ndjson", "content-encoding": "gzip"},
+                )
+            else:
+                body = orjson.dumps([{"event_type": et, "payload": p} for et, p in generator.events(events)])
+                resp = client.post("/ingest/batch", content=body, headers={"content-type": "application/json"})
+            seconds = time.perf_counter() - started
+        resp.raise_for_status()
+        summary = resp.json()
+    return StageResult(
+        stage=f"{name}:{events}",
+        unit="events",
+        ops=events,
+        seconds=round(seconds, 6),
+        throughput=round(events / seconds, 3),
+        rss_mb=round(idle, 2),
+        rss_delta_mb=round(sampler.peak - idle, 2),
+        peak_rss_mb=round(sampler.peak, 2),
+        extra={
+            "accepted": summary["accepted"],
+            "duplicates": summary["duplicates"],
+            "quarantined": summary["quarantined"],
+            "response_bytes": len(resp.content),
+        },
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[20_000, 100_000])
+    parser.add_argument("--s3", choices=["stub", "moto"], default="stub")
+    parser.add_argument("--skip-batch", action="store_true", help="Only measure the streaming endpoint")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    env = {**os.environ, "POSTGRES_DSN": settings.POSTGRES_DSN, "PYTHONPATH": os.getcwd()}
+    seed = int(time.time())
+    report = new_report("stream", {**vars(args), "seed": seed, "chunk_size": settings.INGEST_CHUNK_SIZE})
+    with moto_s3(env) if args.s3 == "moto" else nullcontext():
+        for n in args.events:
+            for name in ("stream",) if args.skip_batch else ("stream", "batch"):
+                seed += 1
+                report.stages.append(_upload(name, env, n, seed, args.s3 == "stub"))
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print("rssMB is the idle service; peak and delta are sampled during the upload")
+    for stage in report.stages:
+        print(f"{stage.stage}: peak {stage.peak_rss_mb} MB (+{stage.rss_delta_mb}), response {stage.extra['response_bytes']} bytes")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
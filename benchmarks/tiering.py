@@ -0,0 +1,179 @@
+"""events_raw size and scan speed before and after payload tiering: python -m benchmarks.tiering --fresh
+
+Synthetic events are inserted into events_raw of the configured Postgres with payloads shaped as ingestion
+writes them (the envelope fields plus the type's own) and inserted_at in the past. Table sizes and scans over
+the payloads (the staging views and facts) are measured, the payloads are tiered, and both are measured again
+after VACUUM and after VACUUM FULL. The fact queries must give the same answers before and after. Full payloads
+of a sample of tiered rows are then read back through full_payloads() from moto's S3, cold and cached.
+
+--fresh is required: the public schema is dropped and recreated, so only point this at a scratch database.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+from datetime import timedelta
+
+from sqlalchemy import select, text
+
+from benchmarks.e2e import reset_database, s3_backend
+from benchmarks.harness import BenchReport, Stage, format_table, measure, new_report, write_report
+from ingestion.app.models import EventRaw
+from ingestion.app.tiering import clear_cache, full_payloads, tier_payloads
+from platform_common.db import get_engine, session_scope
+from platform_common.s3 import ensure_bucket, put_json
+from transformations.runner import run_all
+from transformations.verify import REFERENCE, verify
+
+# Event i: a type by position, times spread evenly over `days`, payloads as ingestion's model_dump(mode="json")
+_INSERT = """
+insert into events_raw (event_id, event_type, event_time, customer_id, region, payload, s3_key, is_late, inserted_at)
+select e.event_id, e.event_type, e.event_time, e.customer_id, e.region,
+       json_build_object('event_id', e.event_id, 'event_time', to_char(e.event_time at time zone 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+                         'customer_id', e.customer_id, 'region', e.region)::jsonb || case e.event_type
+         when 'payment' then jsonb_build_object('amount', round((i % 100000) / 100.0, 2), 'currency', 'USD', 'payment_method', 'card')
+         when 'cost' then jsonb_build_object('amount', round((i % 50000) / 100.0, 2), 'cost_type', 'compute')
+         when 'usage' then jsonb_build_object('metric_name', 'metric-' || (i % 4), 'units', i % 1000, 'plan_id', 'plan-' || (i % 3))
+         else jsonb_build_object('action', (array['created', 'created', 'canceled', 'upgraded'])[i % 4 + 1], 'plan_id', 'plan-' || (i % 3))
+       end,
+       'raw/' || e.event_type || '/dt=' || to_char(e.event_time, 'YYYY-MM-DD') || '/' || e.event_id || '.json',
+       false, now() - interval '60 days'
+from generate_series(1::bigint, {n}) i,
+     lateral (select 'evt-' || lpad(i::text, 12, '0') as event_id,
+                     (array['payment', 'payment', 'cost', 'usage', 'subscription'])[i % 5 + 1] as event_type,
+                     timestamptz '2024-01-01 00:00:00+00' + ((i * {seconds}) / {n}) * interval '1 second' as event_time,
+                     'cust-' || (i * 104729 % 10007) as customer_id,
+                     'region-' || lpad((i * 7919 % 20)::text, 3, '0') as region) e
+"""
+
+_SIZES = """
+select pg_total_relation_size('events_raw'), pg_relation_size('events_raw'),
+       coalesce(pg_total_relation_size(nullif(reltoastrelid, 0)), 0), pg_indexes_size('events_raw')
+from pg_class where oid = 'events_raw'::regclass
+"""
+
+# Reads of the payload column as the transformations do it, and a scan of the table without it
+_SCANS = {
+    "fact_revenue_daily": "select count(*), sum(revenue_amount) from fact_revenue_daily",
+    "stg_usage_events": "select count(*), sum(units) from stg_usage_events",
+    "stg_subscription_events": "select action, count(*) from stg_subscription_events group by 1 order by 1",
+    "events_raw_region": "select count(*) from events_raw where region = 'region-007'",
+}
+
+_CHECKED = ["margin_rollup", "usage_rollup", "fact_subscriptions_snapshot"]
+
+
+def _record(report: BenchReport, stage: Stage) -> None:
+    assert stage.result is not None
+    report.stages.append(stage.result)
+
+
+def _sizes() -> dict[str, float]:
+    with get_engine().connect() as conn:
+        total, heap, toast, indexes = conn.execute(text(_SIZES)).one()
+        avg_payload = conn.execute(text("select avg(pg_column_size(payload)) from events_raw")).scalar_one()
+    return {"total_mb": round(total / 1e6, 1), "heap_mb": round(heap / 1e6, 1), "toast_mb": round(toast / 1e6, 1),
+            "indexes_mb": round(indexes / 1e6, 1), "avg_payload_bytes": round(float(avg_payload), 1)}
+
+
+def _vacuum(full: bool) -> None:
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("vacuum (full, analyze) events_raw" if full else "vacuum (analyze) events_raw"))
+
+
+def _scan(report: BenchReport, phase: str, repeat: int) -> dict[str, str]:
+    answers: dict[str, str] = {}
+    with get_engine().connect() as conn:
+        for name, sql in _SCANS.items():
+            conn.execute(text(sql)).all()  # warm up
+            with measure(f"scan:{phase}:{name}", unit="queries") as stage:
+                for _ in range(repeat):
+                    with stage.op():
+                        rows = conn.execute(text(sql)).all()
+            _record(report, stage)
+            answers[name] = repr(rows)
+        for relation in _CHECKED:
+            lines = sorted(map(repr, conn.execute(text(REFERENCE[relation]))))
+            answers[relation] = hashlib.sha256("\n".join(lines).encode()).hexdigest()
+    return answers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--sample", type=int, default=2000, help="Tiered rows whose full payloads are read back from the lake")
+    parser.add_argument("--fresh", action="store_true", help="Required: drop and recreate the public schema first")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    if not args.fresh:
+        parser.error("this benchmark reloads events_raw; pass --fresh to reset a scratch database")
+
+    report = new_report("tiering", vars(args))
+    reset_database()
+    with measure("insert_events", unit="events") as stage:
+        with get_engine().begin() as conn:
+            conn.execute(text(_INSERT.format(n=args.events, seconds=args.days * 86400)))
+        stage.ops = args.events
+    _record(report, stage)
+    run_all()
+    _vacuum(full=False)
+    sizes = {"before": _sizes()}
+    before = _scan(report, "before", args.repeat)
+
+    with measure("tier_payloads", unit="rows") as stage:
+        result = tier_payloads(timedelta(days=30), chunk_size=args.chunk_size)
+        stage.ops = result.tiered
+        stage.extra = {"chunks": result.chunks, "by_type": result.by_type}
+    _record(report, stage)
+    sizes["tiered"] = _sizes()
+    with measure("vacuum", unit="runs") as stage:
+        with stage.op():
+            _vacuum(full=False)
+    _record(report, stage)
+    sizes["vacuumed"] = _sizes()
+    after_vacuum = _scan(report, "vacuumed", args.repeat)
+    with measure("vacuum_full", unit="runs") as stage:
+        with stage.op():
+            _vacuum(full=True)
+    _record(report, stage)
+    _vacuum(full=False)  # VACUUM FULL leaves the visibility map empty: no index-only scans until this
+    sizes["vacuum_full"] = _sizes()
+    after = _scan(report, "vacuum_full", args.repeat)
+    unchanged = {name: before[name] == after_vacuum[name] == after[name] for name in before}
+    mismatched = verify()
+
+    with s3_backend("moto"):
+        ensure_bucket()
+        with session_scope() as session:
+            sample = list(session.scalars(select(EventRaw).order_by(EventRaw.id).limit(args.sample)))
+            for event in sample:
+                # What ingestion would have written: the envelope plus the fields tiering kept
+                assert event.s3_key is not None
+                envelope = {"event_id": event.event_id, "event_time": event.event_time.isoformat(), "customer_id": event.customer_id, "region": event.region}
+                put_json(event.s3_key, {**envelope, **event.payload})
+            clear_cache()
+            batches = [sample[i:i + 100] for i in range(0, len(sample), 100)]
+            for phase in ("cold", "cached"):
+                with measure(f"full_payloads:{phase}", unit="events") as stage:
+                    for batch in batches:
+                        with stage.op():
+                            payloads = full_payloads(batch)
+                    stage.ops = len(sample)
+                    stage.extra = {"batch": 100}
+                _record(report, stage)
+            assert payloads[0]["event_id"] == batches[-1][0].event_id
+
+    report.config.update(sizes=sizes, unchanged=unchanged, verify=mismatched)
+    path = write_report(report, args.out)
+    print(format_table(report))
+    for phase, values in sizes.items():
+        print(f"{phase}: " + ", ".join(f"{k} {v}" for k, v in values.items()))
+    print(f"same answers: {unchanged}, verify: {mismatched}")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
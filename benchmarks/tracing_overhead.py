@@ -0,0 +1,201 @@
+"""Cost of tracing on the ingestion hot path: python -m benchmarks.tracing_overhead
+
+Runs process_event on in-memory SQLite, and single-event POSTs through the ingestion app on a SQLite file, with
+S3 stubbed, in three modes: tracing off, on with nothing sampled, and on with everything sampled (memory
+exporter). Each event or request is its own trace, as a request is in production.
+
+An unsampled span costs under a microsecond, far inside the run-to-run noise of these workloads (an off-vs-off
+comparison differs by as much), so the unsampled overhead per operation is taken as the spans it would have
+(counted in the sampled runs) times the measured cost of an unsampled span, plus an unsampled root. The overhead at sample ratio r, unsampled + r x sampled, is checked
+against --budget-pct.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import tempfile
+import time
+import timeit
+from pathlib import Path
+from typing import Any, Callable
+
+import httpx
+import orjson
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import ingestion.app.service as service
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import StageResult, current_rss_mb, format_table, new_report, peak_rss_mb, write_report
+from ingestion.app.schemas import EventType
+from platform_common import db, tracing
+from platform_common.config import settings
+from platform_common.db import Base
+
+MODES = {"off": None, "unsampled": 0.0, "sampled": 1.0}
+
+
+def _set_mode(mode: str) -> None:
+    ratio = MODES[mode]
+    settings.TRACING_ENABLED = ratio is not None
+    settings.TRACE_SAMPLE_RATIO = ratio or 0.0
+    tracing.configure()
+
+
+def _ingest_round(events: list[tuple[EventType, dict[str, Any]]]) -> float:
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)()
+    started = time.perf_counter()
+    for et, payload in events:
+        with tracing.span("event", root="request"):
+            service.process_event(session, et, payload)
+    elapsed = time.perf_counter() - started
+    session.close()
+    engine.dispose()
+    return elapsed
+
+
+async def _http_round(bodies: list[tuple[EventType, bytes]], directory: str) -> float:
+    from ingestion.app.main import app
+
+    # A fresh database each round, so every POST is accepted rather than a duplicate
+    settings.POSTGRES_DSN = f"sqlite+pysqlite:///{tempfile.mktemp(dir=directory, suffix='.db')}"
+    db.reset_engine()
+    Base.metadata.create_all(bind=db.get_engine())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        started = time.perf_counter()
+        for et, body in bodies:
+            response = await client.post(f"/ingest/{et}", content=body)
+            assert response.status_code == 202, response.text
+        return time.perf_counter() - started
+
+
+def _primitive_ns(fn: Callable[[], None], n: int = 100_000) -> float:
+    return min(timeit.repeat(fn, number=n, repeat=5)) / n * 1e9
+
+
+def _child() -> None:
+    with tracing.span("child"):
+        pass
+
+
+def _root() -> None:
+    with tracing.span("root", root="request"):
+        pass
+
+
+def _sampled_child() -> None:
+    with tracing.span("root", root="request"):
+        for _ in range(10):
+            with tracing.span("child"):
+                pass
+
+
+def _result(name: str, unit: str, ops: int, seconds: float) -> StageResult:
+    return StageResult(
+        stage=name,
+        unit=unit,
+        ops=ops,
+        seconds=round(seconds, 6),
+        throughput=round(ops / seconds, 3),
+        p50_ms=round(seconds / ops * 1000, 6),  # mean per op of the best round
+        rss_mb=round(current_rss_mb(), 2),
+        rss_delta_mb=0.0,
+        peak_rss_mb=round(peak_rss_mb(), 2),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=3000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--ratio", type=float, default=settings.TRACE_SAMPLE_RATIO, help="Sample ratio checked against the budget")
+    parser.add_argument("--budget-pct", type=float, default=2.0, help="Largest acceptable overhead at --ratio")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    service.put_json = lambda *a, **k: True  # type: ignore[assignment]
+    settings.TRACE_EXPORTER = "memory"
+    settings.TRACE_MEMORY_SPANS = 100_000
+    settings.TRACE_JOB_SAMPLE_RATIO = 0.0
+    settings.ADMISSION_ENABLED = False
+    events = list(EventGenerator(GeneratorConfig(seed=1)).events(args.events))
+    bodies = [(et, orjson.dumps(payload)) for et, payload in EventGenerator(GeneratorConfig(seed=2)).events(args.requests)]
+    report = new_report("tracing_overhead", vars(args))
+    directory = tempfile.mkdtemp(prefix="ffdp-tracing-")
+
+    primitives: dict[str, float] = {}
+    for mode in MODES:
+        _set_mode(mode)
+        primitives[f"child_{mode}"] = _primitive_ns(_child)
+        primitives[f"root_{mode}"] = _primitive_ns(_root, n=10_000 if mode == "sampled" else 100_000)
+        if mode == "sampled":
+            primitives["sampled_span"] = (_primitive_ns(_sampled_child, n=5000) - primitives["root_sampled"]) / 10
+        tracing.clear_spans()
+    report.config.update({f"{name}_ns": round(ns, 1) for name, ns in primitives.items()})
+    # What a would-be span costs when its trace is not sampled, and a root that is sampled out, over tracing off
+    child_ns = primitives["child_unsampled"] - primitives["child_off"]
+    root_ns = primitives["root_unsampled"] - primitives["root_off"]
+
+    workloads: list[tuple[str, str, int, Callable[[], float]]] = [
+        ("process_event", "events", args.events, lambda: _ingest_round(events)),
+        ("http_ingest", "requests", args.requests, lambda: asyncio.run(_http_round(bodies, directory))),
+    ]
+    within = True
+    for name, unit, ops, run in workloads:
+        timings: dict[str, list[float]] = {mode: [] for mode in MODES}
+        run()  # warm-up: imports, SQLAlchemy compiled cache
+        for i in range(args.rounds):
+            # Rotate which mode goes first so drift does not favour one
+            order = list(MODES)[i % 3:] + list(MODES)[:i % 3]
+            for mode in order:
+                _set_mode(mode)
+                gc.collect()  # the sampled rounds' spans would otherwise be collected on the next round's time
+                timings[mode].append(run())
+                tracing.clear_spans()
+        _set_mode("sampled")
+        run()
+        spans = len(tracing.finished_spans()) / ops - 1  # besides the root
+        tracing.clear_spans()
+        best = {mode: min(values) for mode, values in timings.items()}
+        for mode, seconds in best.items():
+            report.stages.append(_result(f"{name}:{mode}", unit, ops, seconds))
+        off_us = best["off"] / ops * 1e6
+        unsampled_us = (root_ns + spans * child_ns) / 1000
+        sampled_us = (best["sampled"] - best["off"]) / ops * 1e6
+        at_ratio = (unsampled_us + args.ratio * sampled_us) / off_us * 100
+        report.config[f"{name}_spans_per_op"] = round(spans, 1)
+        report.config[f"{name}_unsampled_us"] = round(unsampled_us, 2)
+        report.config[f"{name}_unsampled_measured_pct"] = round((best["unsampled"] - best["off"]) / best["off"] * 100, 2)
+        report.config[f"{name}_sampled_us"] = round(sampled_us, 2)
+        report.config[f"{name}_sampled_pct"] = round(sampled_us / off_us * 100, 2)
+        report.config[f"{name}_at_ratio_pct"] = round(at_ratio, 2)
+        within = within and at_ratio <= args.budget_pct
+    report.config["within_budget"] = within
+
+    _set_mode("off")
+    for database in Path(directory).glob("*.db"):
+        database.unlink()
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print(
+        f"span: {primitives['child_off']:.0f} ns off, {primitives['child_unsampled']:.0f} ns unsampled, "
+        f"{primitives['sampled_span']:.0f} ns sampled; root: {primitives['root_off']:.0f} ns off, "
+        f"{primitives['root_unsampled']:.0f} ns unsampled, {primitives['root_sampled']:.0f} ns sampled"
+    )
+    for name, *_ in workloads:
+        c = report.config
+        print(
+            f"{name}: {c[f'{name}_spans_per_op']} spans/op; unsampled {c[f'{name}_unsampled_us']:+} us/op "
+            f"(end to end {c[f'{name}_unsampled_measured_pct']:+}%), sampled {c[f'{name}_sampled_us']:+} us/op "
+            f"({c[f'{name}_sampled_pct']:+}%); at ratio {args.ratio}: {c[f'{name}_at_ratio_pct']:+}%"
+        )
+    print(f"{'within' if within else 'OVER'} the {args.budget_pct}% budget at ratio {args.ratio}")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
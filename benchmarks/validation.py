@@ -0,0 +1,124 @@
+"""Validation cost per 10k events: python -m benchmarks.validation
+
+Compares the old path with the batch path:
+- dict_per_item: what the old endpoint did for a `list[dict[str, Any]]` body. FastAPI parses the JSON,
+  validates it as a list of dicts, then each item goes through `schema_cls(**payload)`, which raises one
+  ValidationError per bad item.
+- typed_batch: ingestion.app.validation.validate_batch on the raw bytes of one single-type batch per type.
+- mixed_batch: validate_batch on one mixed body of {"event_type", "payload"} envelopes.
+
+No database or S3 is involved. Each ratio in --invalid-ratios is a separate run, because bad batches take the
+slower error path.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+import orjson
+from pydantic import TypeAdapter, ValidationError
+
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import StageResult, current_rss_mb, format_table, new_report, peak_rss_mb, write_report
+from ingestion.app.schemas import EventSchemaMap, EventType
+from ingestion.app.validation import InvalidItem, validate_batch
+from platform_common import metrics
+
+PER = 10_000
+
+
+_FASTAPI_BODY: TypeAdapter[Optional[list[dict[str, Any]]]] = TypeAdapter(Optional[list[dict[str, Any]]])
+
+
+def _dict_per_item(bodies: dict[EventType, bytes]) -> int:
+    invalid = 0
+    for et, body in bodies.items():
+        schema_cls = EventSchemaMap[et]
+        for payload in _FASTAPI_BODY.validate_python(json.loads(body)) or []:
+            try:
+                schema_cls(**payload)
+            except ValidationError:
+                invalid += 1
+    return invalid
+
+
+def _typed_batch(bodies: dict[EventType, bytes]) -> int:
+    return sum(sum(isinstance(i, InvalidItem) for i in validate_batch(body, et)) for et, body in bodies.items())
+
+
+def _mixed_batch(body: bytes) -> int:
+    return sum(isinstance(i, InvalidItem) for i in validate_batch(body))
+
+
+def _best(workloads: list[tuple[str, Callable[[], int]]], rounds: int) -> dict[str, tuple[float, int]]:
+    """Best round per workload; rounds are interleaved so drift on a busy machine hits every workload alike."""
+    timings: dict[str, list[float]] = {name: [] for name, _ in workloads}
+    invalid: dict[str, int] = {}
+    for _, fn in workloads:
+        fn()  # warm-up: schema and validator construction
+    for _ in range(rounds):
+        for name, fn in workloads:
+            started = time.perf_counter()
+            invalid[name] = fn()
+            timings[name].append(time.perf_counter() - started)
+    return {name: (min(timings[name]), invalid[name]) for name, _ in workloads}
+
+
+def _result(name: str, events: int, seconds: float, extra: dict[str, Any]) -> StageResult:
+    return StageResult(
+        stage=name,
+        unit="events",
+        ops=events,
+        seconds=round(seconds, 6),
+        throughput=round(events / seconds, 3),
+        p50_ms=round(seconds / events * PER * 1000, 3),  # best round, scaled to ms per 10k events
+        rss_mb=round(current_rss_mb(), 2),
+        rss_delta_mb=0.0,
+        peak_rss_mb=round(peak_rss_mb(), 2),
+        extra=extra,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=PER)
+    parser.add_argument("--invalid-ratios", type=float, nargs="+", default=[0.0, 0.01, 0.1])
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    metrics.set_enabled(False)
+    report = new_report("validation", vars(args))
+    for ratio in args.invalid_ratios:
+        events = list(EventGenerator(GeneratorConfig(seed=1, invalid_ratio=ratio, duplicate_ratio=0)).events(args.events))
+        by_type: dict[EventType, list[dict[str, Any]]] = defaultdict(list)
+        for et, payload in events:
+            by_type[et].append(payload)
+        bodies = {et: orjson.dumps(items) for et, items in by_type.items()}
+        mixed = orjson.dumps([{"event_type": et, "payload": payload} for et, payload in events])
+
+        workloads: list[tuple[str, Callable[[], int]]] = [
+            ("dict_per_item", lambda: _dict_per_item(bodies)),
+            ("typed_batch", lambda: _typed_batch(bodies)),
+            ("mixed_batch", lambda: _mixed_batch(mixed)),
+        ]
+        best = _best(workloads, args.rounds)
+        baseline = best["dict_per_item"][0]
+        for name, (seconds, invalid) in best.items():
+            report.stages.append(
+                _result(f"{name}:invalid={ratio:g}", len(events), seconds, {"invalid": invalid, "speedup": round(baseline / seconds, 2)})
+            )
+
+    path = write_report(report, args.out)
+    print(format_table(report))
+    print("p50_ms is the best round in ms per 10k events")
+    for stage in report.stages:
+        print(f"{stage.stage}: {stage.extra['speedup']}x vs dict_per_item")
+    print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
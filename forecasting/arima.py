@@ -1,82 +1,98 @@
 from __future__ import annotations
 
 from datetime import date, datetime
-from typing import Iterable, Tuple
+from typing import Iterable, Optional, Tuple
 
 import pandas as pd
-from sqlalchemy import text
 from sqlalchemy.orm import Session
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
-from platform_common.db import get_engine, session_scope
-from platform_common.db import Base
+from platform_common.db import session_scope
+from platform_common.metrics import FORECAST_FIT_SECONDS, timed
+from platform_common.tracing import span, traced
 from forecasting.models import (
     ModelRun,
     ForecastRevenueDaily,
     ForecastSubscriptionsDaily,
 )
-
-
-def _fit_and_forecast(series: pd.Series, horizon: int = 30) -> Tuple[pd.Series, pd.DataFrame]:
+from forecasting.data import load_panel
+from forecasting.serving import notify_run
+from forecasting.variance import refresh_forecast_variance
+
+
+def _fit_and_forecast(
+    series: pd.Series,
+    horizon: int = 30,
+    order: Tuple[int, int, int] = (1, 1, 1),
+    seasonal_order: Tuple[int, int, int, int] = (1, 0, 1, 7),
+    target: str = "adhoc",
+) -> Tuple[pd.Series, pd.DataFrame]:
     # Simple baseline SARIMAX with weekly seasonality
-    model = SARIMAX(series, order=(1, 1, 1), seasonal_order=(1, 0, 1, 7), enforce_stationarity=False, enforce_invertibility=False)
-    results = model.fit(disp=False)
+    model = SARIMAX(series, order=order, seasonal_order=seasonal_order, enforce_stationarity=False, enforce_invertibility=False)
+    model_name = f"SARIMAX{order}{seasonal_order}"
+    attributes = {"ffdp.target": target, "ffdp.forecast_model": model_name, "ffdp.observations": len(series), "ffdp.horizon": horizon}
+    with timed(FORECAST_FIT_SECONDS.labels(target, model_name)), span("forecast.fit", attributes):
+        results = model.fit(disp=False)
     forecast_res = results.get_forecast(steps=horizon)
     yhat = forecast_res.predicted_mean
     ci = forecast_res.conf_int(alpha=0.2)  # 80% interval
     return yhat, ci
 
 
-def _upsert_model_run(session: Session, target: str, train_start: date, train_end: date) -> int:
-    mr = ModelRun(target=target, model_name="SARIMAX(1,1,1)(1,0,1,7)", params={"alpha": 0.2}, train_start=train_start, train_end=train_end)
+def _upsert_model_run(session: Session, target: str, train_start: date, train_end: date, segment: str = "all") -> int:
+    mr = ModelRun(target=target, segment=segment, model_name="SARIMAX(1,1,1)(1,0,1,7)", params={"alpha": 0.2}, train_start=train_start, train_end=train_end)
     session.add(mr)
     session.flush()
+    notify_run(session, mr.id)
     return mr.id
 
 
-def forecast_revenue_daily(horizon: int = 30) -> int:
-    engine = get_engine()
-    Base.metadata.create_all(bind=engine)
-    with engine.begin() as conn:
-        df = pd.read_sql(text("select date_key::date as date_key, coalesce(revenue_amount,0)::numeric as revenue_amount from fact_revenue_daily order by 1"), conn)
-    if df.empty:
+@traced("forecast revenue_daily", root="job")
+def forecast_revenue_daily(horizon: int = 30, segment: str = "all", input_mark: Optional[str] = None) -> int:
+    """input_mark: the inputs' high-water mark; forecasts passing the same one share one load of all segments."""
+    # A daily DatetimeIndex makes the forecast index real dates; days without payments are zero revenue
+    series = load_panel("revenue_daily", input_mark).series(segment).rename("revenue_amount")
+    if series.empty:
         return 0
 
-    series = df.set_index("date_key")["revenue_amount"].astype(float)
-    yhat, ci = _fit_and_forecast(series, horizon)
+    yhat, ci = _fit_and_forecast(series, horizon, target="revenue_daily")
 
     with session_scope() as session:
-        run_id = _upsert_model_run(session, target="revenue_daily", train_start=series.index.min(), train_end=series.index.max())
+        run_id = _upsert_model_run(session, target="revenue_daily", train_start=series.index.min().date(), train_end=series.index.max().date(), segment=segment)
         for d, y in yhat.items():
             lower = float(ci.loc[d, "lower revenue_amount"]) if "lower revenue_amount" in ci.columns else float(y * 0.9)
             upper = float(ci.loc[d, "upper revenue_amount"]) if "upper revenue_amount" in ci.columns else float(y * 1.1)
             row = ForecastRevenueDaily(run_id=run_id, date_key=pd.to_datetime(d).date(), yhat=float(y), yhat_lower=lower, yhat_upper=upper)
             session.add(row)
+    refresh_forecast_variance([run_id])
     return len(yhat)
 
 
-def forecast_subscriptions_daily(horizon: int = 30) -> int:
-    engine = get_engine()
-    Base.metadata.create_all(bind=engine)
-    with engine.begin() as conn:
-        df = pd.read_sql(text("select date_key::date as date_key, coalesce(active_subscriptions,0)::int as y from fact_subscriptions_snapshot order by 1"), conn)
-    if df.empty:
+@traced("forecast subscriptions_daily", root="job")
+def forecast_subscriptions_daily(horizon: int = 30, segment: str = "all", input_mark: Optional[str] = None) -> int:
+    if segment != "all":
+        raise ValueError("Subscriptions are only forecast in total (segment='all')")
+    series = load_panel("subscriptions_daily", input_mark).series()
+    if series.empty:
         return 0
 
-    series = df.set_index("date_key")["y"].astype(float)
-    yhat, ci = _fit_and_forecast(series, horizon)
+    yhat, ci = _fit_and_forecast(series, horizon, target="subscriptions_daily")
 
     with session_scope() as session:
-        run_id = _upsert_model_run(session, target="subscriptions_daily", train_start=series.index.min(), train_end=series.index.max())
+        run_id = _upsert_model_run(session, target="subscriptions_daily", train_start=series.index.min().date(), train_end=series.index.max().date())
         for d, y in yhat.items():
             lower = float(ci.loc[d, "lower y"]) if "lower y" in ci.columns else float(y * 0.9)
             upper = float(ci.loc[d, "upper y"]) if "upper y" in ci.columns else float(y * 1.1)
             row = ForecastSubscriptionsDaily(run_id=run_id, date_key=pd.to_datetime(d).date(), yhat=float(y), yhat_lower=lower, yhat_upper=upper)
             session.add(row)
+    refresh_forecast_variance([run_id])
     return len(yhat)
 
 
 if __name__ == "__main__":
+    from platform_common.migrations import migrate
+
+    migrate(include_transformations=False)
     n1 = forecast_revenue_daily()
     n2 = forecast_subscriptions_daily()
     print({"revenue_forecasts": n1, "subscriptions_forecasts": n2})
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from statistics import NormalDist
+from typing import Any, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import select
+
+from platform_common.config import settings
+from platform_common.db import session_scope
+from platform_common.migrations import migrate
+from platform_common.tracing import attached, inject, span, traced
+from forecasting.arima import _fit_and_forecast
+from forecasting.data import TARGETS, load_panel
+from forecasting.models import BacktestResult
+
+
+# Model specs are hashed into the fold cache key, so changing an order invalidates its cached folds.
+MODEL_SPECS: dict[str, dict[str, Any]] = {
+    "SARIMAX(1,1,1)(1,0,1,7)": {"kind": "sarimax", "order": [1, 1, 1], "seasonal_order": [1, 0, 1, 7]},
+    "SeasonalNaive(7)": {"kind": "seasonal_naive", "season": 7},
+}
+
+ALPHA = 0.2  # 80% interval, same as the production forecasts
+MASE_SEASON = 7
+
+
+def mape(actual: np.ndarray, predicted: np.ndarray) -> Optional[float]:
+    mask = actual != 0
+    if not mask.any():
+        return None
+    return float(np.mean(np.abs((actual[mask] - predicted[mask]) / actual[mask])))
+
+
+def smape(actual: np.ndarray, predicted: np.ndarray) -> float:
+    denom = (np.abs(actual) + np.abs(predicted)) / 2.0
+    mask = denom != 0
+    if not mask.any():
+        return 0.0
+    # Points where both actual and forecast are zero count as perfect
+    return float(np.sum(np.abs(actual[mask] - predicted[mask]) / denom[mask]) / len(actual))
+
+
+def mase(actual: np.ndarray, predicted: np.ndarray, train: np.ndarray, season: int = MASE_SEASON) -> Optional[float]:
+    if len(train) <= season:
+        return None
+    scale = float(np.mean(np.abs(train[season:] - train[:-season])))
+    if scale == 0:
+        return None
+    return float(np.mean(np.abs(actual - predicted)) / scale)
+
+
+def interval_coverage(actual: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> float:
+    return float(np.mean((actual >= lower) & (actual <= upper)))
+
+
+def _seasonal_naive(train: pd.Series, horizon: int, season: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    values = train.to_numpy(dtype=float)
+    steps = np.arange(horizon)
+    yhat = values[-season + (steps % season)] if len(values) >= season else np.repeat(values[-1], horizon)
+    resid = values[season:] - values[:-season]
+    sigma = float(np.std(resid)) if len(resid) > 1 else 0.0
+    z = NormalDist().inv_cdf(1 - ALPHA / 2)
+    width = z * sigma * np.sqrt(steps // season + 1)
+    return yhat, yhat - width, yhat + width
+
+
+def _predict(model_name: str, train: pd.Series, horizon: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    spec = MODEL_SPECS[model_name]
+    if spec["kind"] == "seasonal_naive":
+        return _seasonal_naive(train, horizon, int(spec["season"]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yhat, ci = _fit_and_forecast(
+            train, horizon, order=tuple(spec["order"]), seasonal_order=tuple(spec["seasonal_order"]), target="backtest"  # type: ignore[arg-type]
+        )
+    return yhat.to_numpy(dtype=float), ci.iloc[:, 0].to_numpy(dtype=float), ci.iloc[:, 1].to_numpy(dtype=float)
+
+
+def fold_cache_key(window: pd.Series, origin: date, model_name: str, horizon: int) -> str:
+    # Only the slice a fold reads is hashed, so appending new days leaves earlier folds cached
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(window, index=True).to_numpy().tobytes())
+    h.update(origin.isoformat().encode())
+    h.update(json.dumps({"model": model_name, "spec": MODEL_SPECS[model_name], "horizon": horizon}, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _evaluate_fold(job: dict[str, Any], traceparent: Optional[str] = None) -> dict[str, Any]:
+    attributes = {"ffdp.target": job["target"], "ffdp.segment": job["segment"], "ffdp.forecast_model": job["model_name"]}
+    with attached(traceparent), span("backtest.fold", attributes):
+        return _score_fold(job)
+
+
+def _score_fold(job: dict[str, Any]) -> dict[str, Any]:
+    train: pd.Series = job["train"]
+    actual_s: pd.Series = job["actual"]
+    horizon = len(actual_s)
+    yhat, lower, upper = _predict(job["model_name"], train, horizon)
+    actual = actual_s.to_numpy(dtype=float)
+    train_values = train.to_numpy(dtype=float)
+    return {
+        "cache_key": job["cache_key"],
+        "target": job["target"],
+        "segment": job["segment"],
+        "model_name": job["model_name"],
+        "fold_origin": actual_s.index[0].date(),
+        "horizon": horizon,
+        "train_start": train.index[0].date(),
+        "train_end": train.index[-1].date(),
+        "mape": mape(actual, yhat),
+        "smape": smape(actual, yhat),
+        "mase": mase(actual, yhat, train_values),
+        "coverage": interval_coverage(actual, lower, upper),
+    }
+
+
+def plan_folds(
+    series: pd.Series,
+    target: str,
+    segment: str,
+    model_names: Iterable[str],
+    known_keys: set[str],
+    horizon: int,
+    min_train: int,
+    step: int,
+) -> list[dict[str, Any]]:
+    """Rolling-origin folds anchored at the first observation; only folds with a full test window are planned."""
+    jobs: list[dict[str, Any]] = []
+    for origin in range(min_train, len(series) - horizon + 1, step):
+        window = series.iloc[: origin + horizon]
+        origin_date = series.index[origin].date()
+        for model_name in model_names:
+            key = fold_cache_key(window, origin_date, model_name, horizon)
+            if key in known_keys:
+                continue
+            jobs.append(
+                {
+                    "cache_key": key,
+                    "target": target,
+                    "segment": segment,
+                    "model_name": model_name,
+                    "train": series.iloc[:origin],
+                    "actual": series.iloc[origin:origin + horizon],
+                }
+            )
+    return jobs
+
+
+def evaluate_folds(jobs: list[dict[str, Any]], max_workers: int = 1) -> list[dict[str, Any]]:
+    if max_workers <= 1 or len(jobs) <= 1:
+        return [_evaluate_fold(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_evaluate_fold, jobs, itertools.repeat(inject()), chunksize=max(1, len(jobs) // (max_workers * 4))))
+
+
+def load_series(target: str) -> dict[str, pd.Series]:
+    """Daily series per segment for a target, plus an 'all' total when the target is segmented."""
+    return load_panel(target).all_series()
+
+
+@traced("backtests", root="job")
+def run_backtests(
+    targets: Optional[Iterable[str]] = None,
+    model_names: Optional[Iterable[str]] = None,
+    horizon: Optional[int] = None,
+    min_train: Optional[int] = None,
+    step: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> int:
+    migrate(include_transformations=False)
+    models = list(model_names or MODEL_SPECS)
+    horizon = horizon or settings.BACKTEST_HORIZON_DAYS
+    min_train = min_train or settings.BACKTEST_MIN_TRAIN_DAYS
+    step = step or settings.BACKTEST_STEP_DAYS
+
+    with session_scope() as session:
+        known_keys = set(session.scalars(select(BacktestResult.cache_key)))
+
+    jobs: list[dict[str, Any]] = []
+    for target in targets or TARGETS:
+        for segment, series in load_series(target).items():
+            jobs.extend(plan_folds(series, target, segment, models, known_keys, horizon, min_train, step))
+    logger.info("Backtesting {} new folds ({} cached)", len(jobs), len(known_keys))
+    if not jobs:
+        return 0
+
+    rows = evaluate_folds(jobs, max_workers=max_workers or settings.BACKTEST_MAX_WORKERS)
+    with session_scope() as session:
+        session.add_all([BacktestResult(**row) for row in rows])
+    return len(rows)
+
+
+if __name__ == "__main__":
+    print({"backtest_folds": run_backtests()})
@@ -0,0 +1,172 @@
+"""Training series for the forecasts and backtests, loaded as float64 arrays.
+
+A target's daily facts are cast to float8 by the database and streamed out with COPY into pandas' C CSV
+reader with fixed column types, so no Decimal objects or SQLAlchemy rows are built; with event shards each
+shard streams its facts in parallel and they are summed per day and segment. The rows become a
+dense days x segments matrix over one daily index (Panel). Loads made with an input mark are cached: the
+forecasts of one flow run pass the same mark, so all segments of a target share one load.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from platform_common.db import scatter
+
+
+class Target(NamedTuple):
+    sql: str  # date_key, segment, y: at most one row per day and segment
+    fill: str  # days without a row: "zero" (nothing happened) or "ffill" (the level carries forward)
+
+
+# The facts are already aggregated to one row per day and region (or day); aggregating them again only costs a sort.
+# Gaps in revenue mean no payments that day; the subscription snapshot carries its level forward.
+TARGETS: dict[str, Target] = {
+    "revenue_daily": Target(
+        "select date_key, region_key as segment, cast(coalesce(revenue_amount, 0) as double precision) as y from fact_revenue_daily",
+        "zero",
+    ),
+    "subscriptions_daily": Target(
+        "select date_key, 'all' as segment, cast(coalesce(active_subscriptions, 0) as double precision) as y from fact_subscriptions_snapshot",
+        "ffill",
+    ),
+}
+
+_COLUMNS = {"day": "int32", "segment": "category", "y": "float64"}  # day: days since 1970-01-01
+
+
+@dataclass(frozen=True)
+class Panel:
+    """A target's values, one row per day from its first to its last and one column per segment; NaN where a
+    segment has no row that day."""
+
+    target: str
+    index: pd.DatetimeIndex
+    segments: list[str]
+    values: np.ndarray
+    fill: str
+
+    def series(self, segment: str = "all", own_span: bool = True) -> pd.Series:
+        """A segment's daily series with gaps filled; 'all' is the total when the target is segmented.
+
+        own_span trims it to the days from the segment's first row to its last, as its own query would return;
+        otherwise it covers the whole panel.
+        """
+        if segment in self.segments:
+            column = self.values[:, self.segments.index(segment)]
+        elif segment == "all" and self.segments:
+            present = ~np.isnan(self.values).all(axis=1)
+            column = np.where(present, np.nansum(self.values, axis=1), np.nan)
+        else:
+            return pd.Series([], index=pd.DatetimeIndex([], freq="D"), dtype="float64", name="y")
+        index = self.index
+        if own_span:
+            rows = np.flatnonzero(~np.isnan(column))
+            if not len(rows):
+                return pd.Series([], index=pd.DatetimeIndex([], freq="D"), dtype="float64", name="y")
+            column, index = column[rows[0]:rows[-1] + 1], index[rows[0]:rows[-1] + 1]
+        series = pd.Series(column, index=index, name="y")
+        return series.fillna(0.0) if self.fill == "zero" else series.ffill().fillna(0.0)
+
+    def all_series(self) -> dict[str, pd.Series]:
+        """Every segment over the whole panel, plus the 'all' total."""
+        names = self.segments if "all" in self.segments or not self.segments else [*self.segments, "all"]
+        return {name: self.series(name, own_span=False) for name in names}
+
+
+def _read_copy(cursor: Any, statement: str) -> pd.DataFrame:
+    """COPY ... TO STDOUT (CSV) parsed while it streams: the driver writes into a pipe on a thread of its own."""
+    read_fd, write_fd = os.pipe()
+    failed: list[BaseException] = []
+
+    def produce() -> None:
+        with os.fdopen(write_fd, "wb") as writer:
+            try:
+                cursor.copy_expert(statement, writer)
+            except BaseException as exc:  # re-raised by the reader
+                failed.append(exc)
+
+    thread = threading.Thread(target=produce, name="copy-out", daemon=True)
+    thread.start()
+    reader = os.fdopen(read_fd, "rb")
+    try:
+        frame = pd.read_csv(reader, header=None, names=list(_COLUMNS), dtype=_COLUMNS, engine="c")
+    except pd.errors.EmptyDataError:
+        frame = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in _COLUMNS.items()})
+    finally:
+        reader.close()  # a writer blocked on a full pipe fails instead of hanging
+        thread.join()
+    if failed:
+        raise failed[0]
+    return frame
+
+
+def _fetch_shard(engine: Engine, sql: str) -> pd.DataFrame:
+    if engine.dialect.name != "postgresql":
+        with engine.connect() as conn:
+            rows = conn.execute(text(sql)).all()
+        frame = pd.DataFrame(rows, columns=["date_key", "segment", "y"])
+        days = pd.to_datetime(frame["date_key"]).to_numpy("datetime64[D]").astype("int64").astype("int32")
+        return pd.DataFrame({"day": days, "segment": frame["segment"].astype(str).astype("category"), "y": frame["y"].astype("float64")})
+    raw = engine.raw_connection()
+    try:
+        return _read_copy(raw.cursor(), f"copy (select date_key::date - date '1970-01-01', segment, y from ({sql}) s) to stdout with (format csv)")
+    finally:
+        raw.close()
+
+
+def _fetch(sql: str) -> pd.DataFrame:
+    frames = scatter(lambda engine: _fetch_shard(engine, sql))
+    if len(frames) == 1:
+        return frames[0]
+    # Shards hold disjoint customers: a day and segment's value is the sum of the shards' values
+    frame = pd.concat(frames, ignore_index=True)
+    frame = frame.astype({"segment": str}).groupby(["day", "segment"], as_index=False, sort=False)["y"].sum()
+    return frame.astype(_COLUMNS)
+
+
+def _load(target: str) -> Panel:
+    spec = TARGETS[target]
+    frame = _fetch(spec.sql)
+    if frame.empty:
+        return Panel(target, pd.DatetimeIndex([], freq="D"), [], np.empty((0, 0)), spec.fill)
+    day = frame["day"].to_numpy()
+    first = int(day.min())
+    segments = frame["segment"].cat
+    values = np.full((int(day.max()) - first + 1, len(segments.categories)), np.nan)
+    values[day - first, segments.codes.to_numpy()] = frame["y"].to_numpy()
+    index = pd.date_range(pd.Timestamp(first, unit="D"), periods=len(values), freq="D")
+    logger.debug("Loaded {}: {} days x {} segments from {} rows", target, len(index), values.shape[1], len(frame))
+    return Panel(target, index, [str(s) for s in segments.categories], values, spec.fill)
+
+
+_cache: dict[str, tuple[str, Panel]] = {}  # target -> (input mark, panel)
+_locks = {target: threading.Lock() for target in TARGETS}
+
+
+def load_panel(target: str, input_mark: Optional[str] = None) -> Panel:
+    """A target's panel; with an input mark, the panel already loaded for that mark if there is one.
+
+    Concurrent callers for the same target wait for one load. Only the latest mark is kept per target.
+    """
+    if input_mark is None:
+        return _load(target)
+    with _locks[target]:
+        cached = _cache.get(target)
+        if cached is not None and cached[0] == input_mark:
+            return cached[1]
+        panel = _load(target)
+        _cache[target] = (input_mark, panel)
+        return panel
+
+
+def clear_cache() -> None:
+    _cache.clear()
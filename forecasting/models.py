@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import Date, DateTime, Integer, Numeric, String, JSON, func
+from sqlalchemy import Date, DateTime, Float, Index, Integer, Numeric, String, JSON, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from platform_common.db import Base
@@ -14,12 +14,17 @@ class ModelRun(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     target: Mapped[str] = mapped_column(String(64), nullable=False)  # e.g., revenue_daily, subscriptions_daily
+    segment: Mapped[str] = mapped_column(String(64), nullable=False, default="all", server_default="all")  # region or 'all'
     model_name: Mapped[str] = mapped_column(String(128), nullable=False)
     params: Mapped[dict] = mapped_column(JSON, nullable=False)
     train_start: Mapped[date] = mapped_column(Date, nullable=False)
     train_end: Mapped[date] = mapped_column(Date, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    __table_args__ = (
+        Index("ix_model_runs_target_segment_id", "target", "segment", "id"),
+    )
+
 
 class ForecastRevenueDaily(Base):
     __tablename__ = "forecast_revenue_daily"
@@ -32,6 +37,10 @@ class ForecastRevenueDaily(Base):
     yhat_upper: Mapped[float] = mapped_column(Numeric(18, 4), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    __table_args__ = (
+        Index("ix_forecast_revenue_daily_run_date", "run_id", "date_key"),
+    )
+
 
 class ForecastSubscriptionsDaily(Base):
     __tablename__ = "forecast_subscriptions_daily"
@@ -43,3 +52,60 @@ class ForecastSubscriptionsDaily(Base):
     yhat_lower: Mapped[float] = mapped_column(Numeric(18, 4), nullable=False)
     yhat_upper: Mapped[float] = mapped_column(Numeric(18, 4), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_forecast_subscriptions_daily_run_date", "run_id", "date_key"),
+    )
+
+
+class ForecastVariance(Base):
+    """Forecast vs actual per run at the forecast grain; refreshed by forecasting.variance."""
+
+    __tablename__ = "fact_forecast_variance"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    run_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    target: Mapped[str] = mapped_column(String(64), nullable=False)
+    segment: Mapped[str] = mapped_column(String(64), nullable=False)
+    date_key: Mapped[date] = mapped_column(Date, nullable=False)
+    forecast: Mapped[float] = mapped_column(Numeric(18, 4), nullable=False)
+    actual: Mapped[Optional[float]] = mapped_column(Numeric(18, 4), nullable=True)
+    variance: Mapped[Optional[float]] = mapped_column(Numeric(18, 4), nullable=True)
+    variance_pct: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Covers run + date-range reads so the endpoint is served by an index-only scan
+        Index(
+            "ux_fact_forecast_variance_run_segment_date",
+            "run_id",
+            "segment",
+            "date_key",
+            unique=True,
+            postgresql_include=["forecast", "actual", "variance", "variance_pct"],
+        ),
+    )
+
+
+class BacktestResult(Base):
+    __tablename__ = "backtest_results"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of (series slice seen by the fold, fold origin, model spec); lets reruns skip known folds
+    cache_key: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    target: Mapped[str] = mapped_column(String(64), nullable=False)
+    segment: Mapped[str] = mapped_column(String(64), nullable=False)
+    model_name: Mapped[str] = mapped_column(String(128), nullable=False)
+    fold_origin: Mapped[date] = mapped_column(Date, nullable=False)
+    horizon: Mapped[int] = mapped_column(Integer, nullable=False)
+    train_start: Mapped[date] = mapped_column(Date, nullable=False)
+    train_end: Mapped[date] = mapped_column(Date, nullable=False)
+    mape: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    smape: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    mase: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    coverage: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_backtest_results_target_segment_model", "target", "segment", "model_name", "fold_origin"),
+    )
@@ -0,0 +1,188 @@
+"""Forecasts served from memory: /forecasts/{target} in the analytics API.
+
+A run's forecast rows are committed with its model_runs row and never change, so a run loaded once is kept (up to
+FORECAST_CACHE_MAX_RUNS). Only which run is latest per (target, segment) can change. On Postgres the forecasting
+jobs NOTIFY each new run id on commit and a listener thread marks the cache stale, so steady-state reads run no
+SQL. Without a listener (another database, FORECAST_CACHE_LISTEN off, or while it reconnects) the newest run id is
+re-checked at most every FORECAST_CACHE_CHECK_SECONDS.
+"""
+from __future__ import annotations
+
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, NamedTuple, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from platform_common.config import settings
+from platform_common.db import get_engine, get_read_engine
+from platform_common.metrics import FORECAST_CACHE_LOADS, enabled
+
+CHANNEL = "forecast_runs"
+TABLES = {"revenue_daily": "forecast_revenue_daily", "subscriptions_daily": "forecast_subscriptions_daily"}
+
+
+class Forecast(NamedTuple):
+    run_id: int
+    target: str
+    segment: str
+    model_name: str
+    train_start: date
+    train_end: date
+    created_at: datetime
+    points: list[tuple[date, float, float, float]]  # date_key, yhat, yhat_lower, yhat_upper
+
+
+def notify_run(session: Session, run_id: int) -> None:
+    """Announce a new run to the serving caches; Postgres delivers it only if the transaction commits."""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("select pg_notify(:channel, :run_id)"), {"channel": CHANNEL, "run_id": str(run_id)})
+
+
+class ForecastCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latest: dict[tuple[str, str], int] = {}
+        self._runs: OrderedDict[int, Forecast] = OrderedDict()
+        self._version = -1  # newest model_runs id that _latest reflects
+        self._notified = 0  # newest run id announced by NOTIFY
+        self._checked_at = float("-inf")
+        self._listener: Optional[_Listener] = None
+
+    def get(self, target: str, segment: str = "all", run_id: Optional[int] = None) -> Optional[Forecast]:
+        """The run's forecast, or the latest run's for the segment; None if there is none for the target."""
+        with self._lock:
+            if run_id is None:
+                self._refresh()
+                run_id = self._latest.get((target, segment))
+                if run_id is None:
+                    return None
+            forecast = self._runs.get(run_id)
+            if forecast is not None:
+                self._runs.move_to_end(run_id)
+            else:
+                forecast = self._load(run_id)
+                if forecast is None:
+                    return None
+                self._runs[run_id] = forecast
+                while len(self._runs) > settings.FORECAST_CACHE_MAX_RUNS:
+                    self._runs.popitem(last=False)
+                if enabled():
+                    FORECAST_CACHE_LOADS.inc()
+        return forecast if forecast.target == target else None
+
+    def notified(self, run_id: int) -> None:
+        self._notified = max(self._notified, run_id)
+
+    def invalidate(self) -> None:
+        """Re-check the latest runs on the next read, e.g. when notifications may have been missed."""
+        with self._lock:
+            self._checked_at = float("-inf")
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _listening(self) -> bool:
+        if self._listener is None and settings.FORECAST_CACHE_LISTEN and get_engine().dialect.driver == "psycopg2":
+            self._listener = _Listener(self)
+            self._listener.start()
+        return self._listener is not None and self._listener.connected
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        # A replica may not have replayed a notified run yet; the check repeats until it has
+        if self._notified <= self._version:
+            if self._checked_at > float("-inf") and self._listening():
+                return
+            if now - self._checked_at < settings.FORECAST_CACHE_CHECK_SECONDS:
+                return
+        with get_read_engine().connect() as conn:
+            version = conn.execute(text("select coalesce(max(id), 0) from model_runs")).scalar_one()
+            if version != self._version:
+                rows = conn.execute(text("select target, segment, max(id) from model_runs group by target, segment"))
+                self._latest = {(target, segment): run_id for target, segment, run_id in rows}
+                self._version = version
+        self._checked_at = now
+
+    def _load(self, run_id: int) -> Optional[Forecast]:
+        with get_read_engine().connect() as conn:
+            run = conn.execute(
+                text("select target, segment, model_name, train_start, train_end, created_at from model_runs where id = :id"), {"id": run_id}
+            ).first()
+            if run is None or run.target not in TABLES:
+                return None
+            points = [
+                (r[0], float(r[1]), float(r[2]), float(r[3]))
+                for r in conn.execute(
+                    text(f"select date_key, yhat, yhat_lower, yhat_upper from {TABLES[run.target]} where run_id = :id order by date_key"),
+                    {"id": run_id},
+                )
+            ]
+        return Forecast(run_id, run.target, run.segment, run.model_name, run.train_start, run.train_end, run.created_at, points)
+
+
+class _Listener(threading.Thread):
+    """LISTENs on the primary (notifications are not replicated) and reconnects after FORECAST_CACHE_CHECK_SECONDS."""
+
+    def __init__(self, cache: ForecastCache) -> None:
+        super().__init__(name="forecast-runs-listener", daemon=True)
+        self.cache = cache
+        self.connected = False
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception as exc:
+                logger.warning("Forecast run listener disconnected, polling until it reconnects: {}", exc)
+            self.connected = False
+            self._stopped.wait(settings.FORECAST_CACHE_CHECK_SECONDS)
+
+    def _listen(self) -> None:
+        # A connection of its own rather than one held out of the pool for the listener's lifetime
+        engine = get_engine()
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        conn: Any = engine.dialect.connect(*cargs, **cparams)
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f"listen {CHANNEL}")
+            self.connected = True
+            self.cache.invalidate()  # runs committed while nobody was listening
+            while not self._stopped.is_set():
+                if select.select([conn], [], [], 1.0)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        self.cache.notified(int(conn.notifies.pop(0).payload))
+        finally:
+            conn.close()
+
+
+_cache: Optional[ForecastCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_forecast_cache() -> ForecastCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ForecastCache()
+        return _cache
+
+
+def reset_forecast_cache() -> None:
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = None
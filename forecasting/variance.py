@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+from datetime import date, timedelta
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+
+from platform_common.config import settings
+from platform_common.db import get_engine, scatter
+
+
+# Actuals are summed to the run's segment (one region, or all regions) before the join.
+_ACTUALS = {
+    "revenue_daily": ("forecast_revenue_daily", "select date_key, sum(revenue_amount) as actual from fact_revenue_daily where date_key between :lo and :hi and (:segment = 'all' or region_key = :segment) group by 1"),
+    "subscriptions_daily": ("forecast_subscriptions_daily", "select date_key, active_subscriptions as actual from fact_subscriptions_snapshot where date_key between :lo and :hi"),
+}
+
+# With event shards the facts are not in this database: the actuals are summed over the shards and passed in
+_PASSED_ACTUALS = "select date_key, actual from json_to_recordset(cast(:actuals as json)) as a(date_key date, actual numeric)"
+
+_UPSERT = """
+    insert into fact_forecast_variance (run_id, target, segment, date_key, forecast, actual, variance, variance_pct, refreshed_at)
+    select f.run_id, :target, :segment, f.date_key, f.yhat, a.actual,
+           a.actual - f.yhat,
+           case when a.actual <> 0 then cast(a.actual - f.yhat as double precision) / a.actual when a.actual = 0 then 0 end,
+           current_timestamp
+    from {forecast_table} f
+    left join ({actuals_sql}) a on a.date_key = f.date_key
+    where f.run_id = :run_id
+    on conflict (run_id, segment, date_key) do update
+      set actual = excluded.actual,
+          variance = excluded.variance,
+          variance_pct = excluded.variance_pct,
+          refreshed_at = excluded.refreshed_at
+"""
+
+
+def refresh_run(conn: Connection, run_id: int, target: str, segment: str = "all") -> int:
+    forecast_table, actuals_sql = _ACTUALS[target]
+    bounds = conn.execute(
+        text(f"select min(date_key), max(date_key) from {forecast_table} where run_id = :run_id"), {"run_id": run_id}
+    ).first()
+    if bounds is None or bounds[0] is None:
+        return 0
+    params: dict[str, Any] = {"run_id": run_id, "target": target, "segment": segment, "lo": bounds[0], "hi": bounds[1]}
+    if settings.SHARD_DSNS:
+        params["actuals"] = _shard_actuals(actuals_sql, params)
+        actuals_sql = _PASSED_ACTUALS
+    sql = _UPSERT.format(forecast_table=forecast_table, actuals_sql=actuals_sql)
+    res = conn.execute(text(sql), params)
+    return int(res.rowcount or 0)
+
+
+def _shard_actuals(actuals_sql: str, params: dict[str, Any]) -> str:
+    def fetch(engine: Engine) -> list[Any]:
+        with engine.connect() as conn:
+            return list(conn.execute(text(actuals_sql), params))
+
+    totals: dict[str, Any] = {}
+    for rows in scatter(fetch, read=False):
+        for date_key, actual in rows:
+            if actual is not None:
+                totals[date_key.isoformat()] = totals.get(date_key.isoformat(), 0) + actual
+    return json.dumps([{"date_key": day, "actual": str(actual)} for day, actual in totals.items()])
+
+
+def refresh_forecast_variance(run_ids: Optional[Iterable[int]] = None) -> int:
+    """Refresh the given runs, or every run whose horizon can still receive (late) actuals."""
+    engine = get_engine()
+    with engine.begin() as conn:
+        if run_ids is None:
+            runs = conn.execute(
+                text(
+                    """
+                    select r.id, r.target, r.segment
+                    from model_runs r
+                    where exists (
+                        select 1 from forecast_revenue_daily f
+                        where f.run_id = r.id and f.date_key >= :since
+                        union all
+                        select 1 from forecast_subscriptions_daily f
+                        where f.run_id = r.id and f.date_key >= :since
+                    )
+                    """
+                ),
+                {"since": date.today() - timedelta(days=settings.LATE_ARRIVAL_DAYS)},
+            ).all()
+        else:
+            ids = list(run_ids)
+            if not ids:
+                return 0
+            sql = text("select id, target, segment from model_runs where id in :ids").bindparams(bindparam("ids", expanding=True))
+            runs = conn.execute(sql, {"ids": ids}).all()
+        return sum(refresh_run(conn, run_id, target, segment) for run_id, target, segment in runs if target in _ACTUALS)
@@ -0,0 +1,244 @@
+"""Admission control for the ingestion API: concurrency limits with load shedding, and per-tenant rate limits.
+
+Concurrency is limited per endpoint class (single, batch, stream) by AdmissionMiddleware, before the body is read or
+a threadpool worker or database connection is taken. Requests over the limit wait in a bounded FIFO queue; when the
+queue is full, or a request has waited ADMISSION_QUEUE_TIMEOUT_SECONDS, it is answered 503 with Retry-After.
+
+Rate limits are token buckets charged in events once a single or batch body is validated: one bucket per client
+(the ADMISSION_CLIENT_HEADER value, else the peer address) and one per customer_id in the body. A request is admitted
+whole or refused whole (429 with Retry-After). A batch larger than a bucket's burst is admitted when the bucket is
+full and leaves it in debt, so the average rate still holds. Streaming uploads are only limited in concurrency.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Any, Iterable, Mapping, Optional
+
+from starlette.responses import JSONResponse
+
+from platform_common.config import settings
+from platform_common.metrics import INGEST_ADMISSION_IN_FLIGHT, INGEST_ADMISSION_QUEUED, INGEST_SHED, INGEST_THROTTLED, enabled
+
+from .validation import Item, item_customer_id
+
+ENDPOINTS = ("single", "batch", "stream")
+
+
+def endpoint_class(method: str, path: str) -> Optional[str]:
+    """The concurrency class of an ingestion request; None for everything else."""
+    parts = path.strip("/").split("/")
+    if method != "POST" or parts[0] != "ingest" or not 2 <= len(parts) <= 3:
+        return None
+    if parts[-1] in ("stream", "batch"):
+        return parts[-1]
+    return "single" if len(parts) == 2 else None
+
+
+class Throttled(Exception):
+    def __init__(self, limit: str, tenant: str, retry_after: float) -> None:
+        super().__init__(f"{limit} {tenant} is over its rate limit")
+        self.limit = limit
+        self.tenant = tenant
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, n: int, now: float) -> float:
+        """Seconds until n tokens (at most the burst) are available; 0 when they are now."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        need = min(n, self.burst)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per key; the least recently used key is forgotten past max_keys (it starts full again)."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+
+class Admission:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()  # endpoints run in the threadpool
+        self.limiters: dict[str, RateLimiter] = {}
+        for limit, rate, burst in (
+            ("client", settings.ADMISSION_CLIENT_EVENTS_PER_SECOND, settings.ADMISSION_CLIENT_BURST),
+            ("customer", settings.ADMISSION_CUSTOMER_EVENTS_PER_SECOND, settings.ADMISSION_CUSTOMER_BURST),
+        ):
+            if rate > 0:
+                self.limiters[limit] = RateLimiter(rate, burst, settings.ADMISSION_MAX_TENANTS)
+        self._labelled: set[str] = set()
+
+    def admit(self, client: str, items: Iterable[Item]) -> None:
+        """Charge the client's and customers' buckets for the items, or raise Throttled and charge nothing."""
+        if not self.limiters:
+            return
+        costs: dict[tuple[str, str], int] = {}
+        items = list(items)
+        if "client" in self.limiters:
+            costs[("client", client)] = len(items)
+        if "customer" in self.limiters:
+            per_customer = Counter(customer for customer in map(item_customer_id, items) if customer is not None)
+            costs.update({("customer", customer): n for customer, n in per_customer.items()})
+        if not costs:
+            return
+        with self._lock:
+            now = time.monotonic()
+            buckets = {key: self.limiters[key[0]].bucket(key[1], now) for key in costs}
+            waits = {key: bucket.wait(costs[key], now) for key, bucket in buckets.items()}
+            limit, tenant = max(waits, key=lambda key: waits[key])
+            if waits[(limit, tenant)] > 0:
+                self._count(limit, tenant)
+                raise Throttled(limit, tenant, waits[(limit, tenant)])
+            for key, bucket in buckets.items():
+                bucket.tokens -= costs[key]
+
+    def _count(self, limit: str, tenant: str) -> None:
+        if not enabled():
+            return
+        # Tenant labels are capped so a flood of customer ids cannot blow up the series count
+        if tenant not in self._labelled:
+            if len(self._labelled) >= settings.ADMISSION_METRICS_MAX_TENANTS:
+                tenant = "other"
+            else:
+                self._labelled.add(tenant)
+        INGEST_THROTTLED.labels(limit, tenant).inc()
+
+
+class Gate:
+    """At most `limit` requests in flight; up to `queue` more wait, first come first served, for at most `timeout`."""
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        INGEST_ADMISSION_IN_FLIGHT.labels(name).set_function(lambda: self.in_flight)
+        INGEST_ADMISSION_QUEUED.labels(name).set_function(lambda: len(self._waiters))
+
+    async def acquire(self) -> Optional[str]:
+        """None once a slot is held, else why the request is shed."""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return None
+        if len(self._waiters) >= self.queue:
+            return "queue_full"
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            # The client went away while queued; a slot handed over meanwhile goes to the next waiter
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        if waiter.done():
+            return None
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        return "queue_timeout"
+
+    def release(self) -> None:
+        # The slot passes straight to the oldest waiter, so a newcomer cannot overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+_admission: Optional[Admission] = None
+_gates: Optional[dict[str, Gate]] = None
+
+
+def get_admission() -> Admission:
+    global _admission
+    if _admission is None:
+        _admission = Admission()
+    return _admission
+
+
+def gates() -> dict[str, Gate]:
+    global _gates
+    if _gates is None:
+        concurrency, depth = settings.ADMISSION_CONCURRENCY, settings.ADMISSION_QUEUE_DEPTH
+        _gates = {
+            name: Gate(name, concurrency[name], depth.get(name, 0), settings.ADMISSION_QUEUE_TIMEOUT_SECONDS)
+            for name in ENDPOINTS if concurrency.get(name, 0) > 0
+        }
+    return _gates
+
+
+def reset_admission() -> None:
+    """Rebuild limits from settings on next use; for tests."""
+    global _admission, _gates
+    _admission = None
+    _gates = None
+
+
+def client_key(headers: Mapping[str, str], client: Any) -> str:
+    key = headers.get(settings.ADMISSION_CLIENT_HEADER.lower()) if settings.ADMISSION_CLIENT_HEADER else None
+    return key or (client[0] if client else "unknown")
+
+
+def retry_after(seconds: float) -> dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class AdmissionMiddleware:
+    """Pure ASGI, like MetricsMiddleware: a shed request never reaches routing, body parsing or the threadpool."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        endpoint = endpoint_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        gate = gates().get(endpoint) if settings.ADMISSION_ENABLED and endpoint else None
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await gate.acquire()
+        if reason is not None:
+            if enabled():
+                INGEST_SHED.labels(gate.name, reason).inc()
+            response = JSONResponse(
+                status_code=503, content={"detail": f"Ingestion overloaded ({reason})"}, headers=retry_after(gate.timeout)
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import gzip
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, Optional, Union
+
+import orjson
+from loguru import logger
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from platform_common.config import settings
+from platform_common.db import get_sessionmaker, reset_engine, session_scope
+from platform_common.s3 import get_json, list_keys
+from platform_common.tracing import attached, inject, span, traced
+
+from .models import EventQuarantine, EventRaw
+from .schemas import EventSchemaMap, EventType, IngestionResult
+from .service import item_shards, process_batch, process_event, process_item, shard_positions
+from .validation import Item, item_event_type
+
+# A payload, or a lake key that the worker fetches itself so GETs are spread across the pool
+EventItem = tuple[EventType, Union[dict[str, Any], str]]
+
+_STATUS_FIELD = {"accepted": "accepted", "duplicate": "duplicates", "quarantined": "quarantined"}
+
+
+class ChunkResult(BaseModel):
+    index: int
+    events: int
+    accepted: int = 0
+    duplicates: int = 0
+    quarantined: int = 0
+    failed: int = 0
+    isolated: bool = False  # chunk transaction failed and was replayed event by event
+    seconds: float = 0.0
+
+
+class BulkIngestReport(BaseModel):
+    events: int
+    chunks: int
+    isolated_chunks: int
+    accepted: int
+    duplicates: int
+    quarantined: int
+    failed: int
+    seconds: float
+    events_per_sec: float
+    chunk_size: int
+    workers: int
+    executor: str
+
+    def counts(self) -> dict[str, int]:
+        return {"accepted": self.accepted, "duplicates": self.duplicates, "quarantined": self.quarantined, "failed": self.failed}
+
+
+def iter_events_from_file(path: str, event_type: Optional[EventType] = None) -> Iterator[EventItem]:
+    """NDJSON (optionally .gz): raw payloads when event_type is given, else {"event_type": ..., "payload": {...}} lines."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as gz:
+            yield from iter_events_from_lines(gz, event_type)
+    else:
+        with open(path, "rb") as fh:
+            yield from iter_events_from_lines(fh, event_type)
+
+
+def iter_events_from_lines(fh: Iterable[bytes], event_type: Optional[EventType] = None) -> Iterator[EventItem]:
+    for line in fh:
+        line = line.strip()
+        if not line:
+            continue
+        record = orjson.loads(line)
+        if event_type is not None:
+            yield event_type, record
+        else:
+            yield record["event_type"], record["payload"]
+
+
+def iter_events_from_s3_prefix(prefix: str) -> Iterator[EventItem]:
+    """Keys under a lake prefix such as raw/payment/dt=2024-01-01/; the event type comes from the key."""
+    for key in list_keys(prefix):
+        parts = key.split("/")
+        if len(parts) < 3 or parts[0] != "raw" or parts[1] not in EventSchemaMap:
+            logger.warning("Skipping non-event lake object {}", key)
+            continue
+        yield parts[1], key  # type: ignore[misc]
+
+
+def _chunked(events: Iterable[EventItem], size: int) -> Iterator[list[EventItem]]:
+    chunk: list[EventItem] = []
+    for item in events:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _resolve(payload: Union[dict[str, Any], str]) -> dict[str, Any]:
+    return get_json(payload) if isinstance(payload, str) else payload
+
+
+def _by_shard(chunk: list[EventItem]) -> dict[int, list[EventItem]]:
+    """The chunk per event shard. Sharded, lake keys are fetched here: the payload's customer_id picks the shard."""
+    if not settings.SHARD_DSNS:
+        return {0: chunk}
+    resolved: list[EventItem] = []
+    for et, payload in chunk:
+        try:
+            payload = _resolve(payload)
+        except Exception:
+            pass  # fetched again, and counted as failed, when ingested
+        resolved.append((et, payload))
+    customer_ids = [p.get("customer_id") if isinstance(p, dict) else None for _, p in resolved]
+    positions = shard_positions([c if isinstance(c, str) else None for c in customer_ids])
+    return {shard: [resolved[i] for i in indexes] for shard, indexes in positions.items()}
+
+
+def _stored(session: Session, event_id: Any) -> bool:
+    """Whether event_id is in events_raw or events_quarantine: an IntegrityError on it lost a race with a
+    concurrent writer of the same event, rather than breaking some other constraint."""
+    if not isinstance(event_id, str) or not event_id:
+        return False
+    return any(
+        session.scalar(select(model.event_id).where(model.event_id == event_id)) is not None for model in (EventRaw, EventQuarantine)
+    )
+
+
+def _ingest_isolated(shard: int, chunk: list[EventItem]) -> Counter[str]:
+    # One savepoint per event so a poison event only loses itself
+    counts: Counter[str] = Counter()
+    try:
+        with session_scope(shard) as session:
+            for et, payload in chunk:
+                event_id = None
+                try:
+                    with session.begin_nested():
+                        event = _resolve(payload)
+                        event_id = event.get("event_id")
+                        counts[process_event(session, et, event).status] += 1
+                except IntegrityError as e:
+                    if _stored(session, event_id):
+                        counts["duplicate"] += 1  # a concurrent chunk committed the same event first
+                    else:
+                        logger.warning("Bulk item failed: {}", e)
+                        counts["failed"] += 1
+                except Exception as e:
+                    logger.warning("Bulk item failed: {}", e)
+                    counts["failed"] += 1
+    except Exception:
+        logger.exception("Chunk replay failed; counting remaining events as failed")
+        counts["failed"] = len(chunk) - sum(v for k, v in counts.items() if k != "failed")
+    return counts
+
+
+def ingest_chunk(index: int, chunk: list[EventItem], traceparent: Optional[str] = None) -> ChunkResult:
+    """Process one chunk in its own transaction and session (one per event shard it touches); traceparent
+    continues the submitting job's trace in a worker process."""
+    with attached(traceparent), span("bulk.chunk", {"bulk.chunk": index, "bulk.events": len(chunk)}):
+        return _ingest_chunk(index, chunk)
+
+
+def _ingest_chunk(index: int, chunk: list[EventItem]) -> ChunkResult:
+    started = time.perf_counter()
+    isolated = False
+    counts: Counter[str] = Counter()
+    for shard, part in _by_shard(chunk).items():
+        part_counts: Counter[str] = Counter()
+        try:
+            with session_scope(shard) as session:
+                for et, payload in part:
+                    part_counts[process_event(session, et, _resolve(payload)).status] += 1
+        except Exception as e:
+            logger.warning("Chunk {} rolled back ({}); replaying event by event", index, e)
+            part_counts = _ingest_isolated(shard, part)
+            isolated = True
+        counts.update(part_counts)
+    fields = {_STATUS_FIELD[k]: v for k, v in counts.items() if k in _STATUS_FIELD}
+    return ChunkResult(
+        index=index,
+        events=len(chunk),
+        failed=counts.get("failed", 0),
+        isolated=isolated,
+        seconds=time.perf_counter() - started,
+        **fields,
+    )
+
+
+def _failed(item: Item) -> IngestionResult:
+    return IngestionResult(status="quarantined", event_id=item.event_id or "unknown", event_type=item_event_type(item), issues=["exception"])
+
+
+def _ingest_items_isolated(shard: int, items: list[Item]) -> list[IngestionResult]:
+    # Same fallback as _ingest_isolated, for items that were validated from raw bytes
+    results: list[IngestionResult] = []
+    with session_scope(shard) as session:
+        for item in items:
+            try:
+                with session.begin_nested():
+                    results.append(process_item(session, item))
+            except IntegrityError as e:
+                if _stored(session, item.event_id):
+                    results.append(IngestionResult(status="duplicate", event_id=item.event_id or "unknown", event_type=item_event_type(item)))
+                else:
+                    logger.warning("Bulk item failed: {}", e)
+                    results.append(_failed(item))
+            except Exception as e:
+                logger.warning("Bulk item failed: {}", e)
+                results.append(_failed(item))
+    return results
+
+
+def _ingest_shard_items(shard: int, items: list[Item]) -> list[IngestionResult]:
+    try:
+        with session_scope(shard) as session:
+            return process_batch(session, items, settings.INGEST_S3_CONCURRENCY)
+    except Exception as e:
+        logger.warning("Chunk of {} items rolled back ({}); replaying event by event", len(items), e)
+        return _ingest_items_isolated(shard, items)
+
+
+def apply_item(item: Item) -> IngestionResult:
+    """Ingest one item in its own transaction, raising whatever fails instead of reporting it as failed."""
+    shard = next(iter(item_shards([item])))
+    with session_scope(shard) as session:
+        return process_item(session, item)
+
+
+def ingest_items(items: list[Item]) -> list[IngestionResult]:
+    """Ingest validated items in one transaction per event shard with batched lookups and writes; results line
+    up with items."""
+    shards = item_shards(items)
+    if len(shards) == 1:
+        shard, _ = shards.popitem()
+        return _ingest_shard_items(shard, items)
+    results: dict[int, IngestionResult] = {}
+    for shard, positions in shards.items():
+        results.update(zip(positions, _ingest_shard_items(shard, [items[i] for i in positions])))
+    return [results[i] for i in range(len(items))]
+
+
+@traced("bulk ingest", root="job")
+def ingest_stream(
+    events: Iterable[EventItem],
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    use_processes: bool = False,
+) -> BulkIngestReport:
+    """Ingest an event stream in chunks on a worker pool; at most 2 x workers chunks are held in memory."""
+    size = chunk_size or settings.INGEST_CHUNK_SIZE
+    n_workers = workers or settings.INGEST_WORKERS
+    executor = "process" if use_processes and n_workers > 1 else ("thread" if n_workers > 1 else "inline")
+    started = time.perf_counter()
+    results: list[ChunkResult] = []
+
+    if n_workers <= 1:
+        results = [ingest_chunk(i, chunk) for i, chunk in enumerate(_chunked(events, size))]
+    else:
+        get_sessionmaker()  # build the shared engine before threads race to create it
+        pool: Executor = (
+            ProcessPoolExecutor(max_workers=n_workers, initializer=reset_engine)
+            if use_processes
+            else ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="bulk-ingest")
+        )
+        with pool:
+            in_flight: set[Future[ChunkResult]] = set()
+            for i, chunk in enumerate(_chunked(events, size)):
+                if len(in_flight) >= n_workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(f.result() for f in done)
+                in_flight.add(pool.submit(ingest_chunk, i, chunk, inject()))
+            results.extend(f.result() for f in in_flight)
+
+    seconds = time.perf_counter() - started
+    total = sum(r.events for r in results)
+    report = BulkIngestReport(
+        events=total,
+        chunks=len(results),
+        isolated_chunks=sum(1 for r in results if r.isolated),
+        accepted=sum(r.accepted for r in results),
+        duplicates=sum(r.duplicates for r in results),
+        quarantined=sum(r.quarantined for r in results),
+        failed=sum(r.failed for r in results),
+        seconds=seconds,
+        events_per_sec=total / seconds if seconds > 0 else 0.0,
+        chunk_size=size,
+        workers=n_workers,
+        executor=executor,
+    )
+    logger.info(
+        "Bulk ingest: {} events in {} chunks, {:.0f} events/sec (chunk_size={} workers={} executor={})",
+        report.events, report.chunks, report.events_per_sec, size, n_workers, executor,
+    )
+    return report
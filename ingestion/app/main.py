@@ -1,29 +1,44 @@
 from __future__ import annotations
 
-from typing import Any, Literal
+from typing import Any
 
-from fastapi import FastAPI, HTTPException, Path
+from fastapi import Depends, FastAPI, HTTPException, Path, Request
 from fastapi.responses import JSONResponse
 from loguru import logger
 
-from platform_common.db import Base, get_engine, session_scope
+from platform_common.db import session_scope, shard_for
+from platform_common.metrics import instrument_app
+from platform_common.migrations import migrate_on_startup
 from platform_common.s3 import ensure_bucket
 from platform_common.config import settings
 
-from .schemas import BatchIngestionResponse, EventType, IngestionResult
-from .service import process_event
-from .models import EventRaw, EventQuarantine
+from .admission import AdmissionMiddleware, Throttled, client_key, get_admission, retry_after
+from .schemas import BatchIngestionResponse, EventType, IngestionResult, StoredEvent, StreamIngestionResponse
+from .service import item_shards, process_item
+from .spool import SpoolError, active_spool, spool_items, start_spool, stop_spool
+from .stream import ENCODINGS, NDJSON_TYPES, StreamError, ingest_ndjson
+from .tiering import find_event
+from .validation import BodyError, Item, item_customer_id, item_event_type, validate_batch, validate_event
 
 app = FastAPI(title="FFDP Ingestion API", version="0.1.0")
+app.add_middleware(AdmissionMiddleware)  # inside the metrics middleware, so shed requests are still timed
+instrument_app(app, "ingestion")
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     logger.add(lambda msg: print(msg, end=""))
-    logger.info("Starting up: creating tables and ensuring bucket")
-    engine = get_engine()
-    Base.metadata.create_all(bind=engine)
+    logger.info("Starting up: applying pending migrations and ensuring bucket")
+    migrate_on_startup(include_transformations=False)
     ensure_bucket()
+    if settings.SPOOL_ENABLED:
+        start_spool()
+        logger.info("Spooling single and batch ingestion to {}", settings.SPOOL_DIR)
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    stop_spool()
 
 
 @app.get("/health")
@@ -31,44 +46,155 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/ingest/{event_type}", response_model=IngestionResult)
-def ingest_event(event_type: EventType = Path(...), payload: dict[str, Any] | None = None):
-    if payload is None:
-        raise HTTPException(status_code=400, detail="Missing JSON body")
+@app.get("/spool")
+def spool_status() -> dict[str, Any]:
+    active = active_spool()
+    if active is None:
+        raise HTTPException(status_code=404, detail="Spool disabled")
+    return {**active.status(), "lag_seconds": round(active.lag_seconds(), 3)}
+
+
+@app.get("/events/{event_id}", response_model=StoredEvent)
+def get_event(event_id: str):
+    """An accepted event; a tiered payload is read back from the lake."""
+    event = find_event(event_id)
+    if event is None:
+        raise HTTPException(status_code=404, detail=f"No accepted event {event_id}")
+    return event
+
+
+async def raw_body(request: Request) -> bytes:
+    # Validation parses the bytes itself; a dict body would parse the JSON twice
+    return await request.body()
+
+
+def _json_body(schema: dict[str, Any]) -> dict[str, Any]:
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+
+_NDJSON_BODY = {"requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"type": "string"}}}}}
+
+
+def _admit(request: Request, items: list[Item]) -> None:
+    try:
+        get_admission().admit(client_key(request.headers, request.client), items)
+    except Throttled as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after(e.retry_after))
+
+
+def _spooled(items: list[Item]) -> list[IngestionResult] | None:
+    """Results for items queued on the spool, or None when ingestion is direct."""
+    active = active_spool()
+    if active is None:
+        return None
+    try:
+        return spool_items(active, items)
+    except SpoolError as e:
+        logger.error("Spool append failed: {}", e)
+        raise HTTPException(status_code=503, detail="Ingestion spool unavailable")
+
+
+def _ingest_items(request: Request, items: list[Item]) -> BatchIngestionResponse:
+    _admit(request, items)
+    spooled = _spooled(items)
+    if spooled is not None:
+        # Outcomes are decided when the spool is drained
+        return BatchIngestionResponse(accepted=0, duplicates=0, quarantined=0, spooled=len(spooled), results=spooled)
+
+    counts = {"accepted": 0, "duplicate": 0, "quarantined": 0}
+    results: dict[int, IngestionResult] = {}
 
-    with session_scope() as session:
+    # One transaction per event shard the batch touches
+    for shard, positions in item_shards(items).items():
+        with session_scope(shard) as session:
+            for i in positions:
+                item = items[i]
+                try:
+                    result = process_item(session, item)
+                except Exception as e:
+                    logger.exception("Batch item failed: {}", e)
+                    result = IngestionResult(status="quarantined", event_id=item.event_id or "unknown", event_type=item_event_type(item), issues=["exception"], is_late=False)
+                counts[result.status] += 1
+                results[i] = result
+
+    return BatchIngestionResponse(
+        accepted=counts["accepted"], duplicates=counts["duplicate"], quarantined=counts["quarantined"], results=[results[i] for i in range(len(items))]
+    )
+
+
+def _batch(body: bytes, event_type: EventType | None) -> list[Item]:
+    try:
+        items = validate_batch(body, event_type)
+    except BodyError as e:
+        raise HTTPException(status_code=400, detail=f"Body must be a JSON array: {e}")
+    if not items:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    return items
+
+
+async def _stream(request: Request, event_type: EventType | None) -> StreamIngestionResponse:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in NDJSON_TYPES:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be one of {', '.join(NDJSON_TYPES)}")
+    encoding = request.headers.get("content-encoding", "identity").strip().lower() or "identity"
+    if encoding not in ENCODINGS:
+        raise HTTPException(status_code=415, detail=f"Content-Encoding must be one of {', '.join(ENCODINGS)}")
+    try:
+        return await ingest_ndjson(request.stream(), event_type, encoding)
+    except StreamError as e:
+        # Chunks before the error are committed; resending the whole upload is safe
+        raise HTTPException(status_code=400, detail={"error": str(e), "summary": e.summary.model_dump() if e.summary else None})
+
+
+# Declared before /ingest/{event_type} so "batch" and "stream" are not read as event types
+@app.post("/ingest/stream", response_model=StreamIngestionResponse, openapi_extra=_NDJSON_BODY)
+async def ingest_mixed_stream(request: Request):
+    """NDJSON of {"event_type": ..., "payload": {...}} lines, optionally gzip or zstd encoded."""
+    return await _stream(request, None)
+
+
+@app.post("/ingest/{event_type}/stream", response_model=StreamIngestionResponse, openapi_extra=_NDJSON_BODY)
+async def ingest_stream(request: Request, event_type: EventType = Path(...)):
+    """NDJSON with one raw payload per line, optionally gzip or zstd encoded."""
+    return await _stream(request, event_type)
+
+
+@app.post(
+    "/ingest/batch",
+    response_model=BatchIngestionResponse,
+    openapi_extra=_json_body({"type": "array", "items": {"type": "object", "required": ["event_type", "payload"]}}),
+)
+def ingest_mixed_batch(request: Request, body: bytes = Depends(raw_body)):
+    """Events of any type as [{"event_type": ..., "payload": {...}}, ...]."""
+    return _ingest_items(request, _batch(body, None))
+
+
+@app.post("/ingest/{event_type}", response_model=IngestionResult, openapi_extra=_json_body({"type": "object"}))
+def ingest_event(request: Request, event_type: EventType = Path(...), body: bytes = Depends(raw_body)):
+    if not body:
+        raise HTTPException(status_code=400, detail="Missing JSON body")
+    try:
+        item = validate_event(body, event_type)
+    except BodyError as e:
+        raise HTTPException(status_code=400, detail=f"Body must be a JSON object: {e}")
+
+    _admit(request, [item])
+    spooled = _spooled([item])
+    if spooled is not None:
+        return JSONResponse(status_code=202, content=spooled[0].model_dump())
+    with session_scope(shard_for(item_customer_id(item) or "")) as session:
         try:
-            result = process_event(session, event_type, payload)
+            result = process_item(session, item)
             return JSONResponse(status_code=202, content=result.model_dump())
         except Exception as e:
             logger.exception("Failed to ingest event: {}", e)
             raise HTTPException(status_code=500, detail="Internal error")
 
 
-@app.post("/ingest/{event_type}/batch", response_model=BatchIngestionResponse)
-def ingest_batch(event_type: EventType = Path(...), payloads: list[dict[str, Any]] | None = None):
-    if not payloads:
-        raise HTTPException(status_code=400, detail="Empty batch")
-
-    accepted = 0
-    duplicates = 0
-    quarantined = 0
-    results: list[IngestionResult] = []
-
-    with session_scope() as session:
-        for payload in payloads:
-            try:
-                result = process_event(session, event_type, payload)
-                if result.status == "accepted":
-                    accepted += 1
-                elif result.status == "duplicate":
-                    duplicates += 1
-                elif result.status == "quarantined":
-                    quarantined += 1
-                results.append(result)
-            except Exception as e:
-                logger.exception("Batch item failed: {}", e)
-                quarantined += 1
-                results.append(IngestionResult(status="quarantined", event_id=payload.get("event_id", "unknown"), event_type=event_type, issues=["exception"], is_late=False))
-
-    return BatchIngestionResponse(accepted=accepted, duplicates=duplicates, quarantined=quarantined, results=results)
+@app.post(
+    "/ingest/{event_type}/batch",
+    response_model=BatchIngestionResponse,
+    openapi_extra=_json_body({"type": "array", "items": {"type": "object"}}),
+)
+def ingest_batch(request: Request, event_type: EventType = Path(...), body: bytes = Depends(raw_body)):
+    return _ingest_items(request, _batch(body, event_type))
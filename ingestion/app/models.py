@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import JSON, Boolean, DateTime, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy import JSON, Boolean, DateTime, Index, Integer, String, Text, UniqueConstraint, func, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from platform_common.db import Base
@@ -20,10 +20,24 @@ class EventRaw(Base):
 
     payload: Mapped[dict] = mapped_column(JSON, nullable=False)
     s3_key: Mapped[str | None] = mapped_column(String(512), nullable=True, unique=True)
+    # Set once the payload is stripped to its staged fields; the full one is the lake object at s3_key
+    payload_tiered_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     is_late: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     inserted_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    __table_args__ = (
+        # Per-type high-water mark lookups for the scheduler
+        Index("ix_events_raw_type_inserted_at", "event_type", "inserted_at"),
+        # New-event windows of the incrementally maintained tables (dim_customer, subscription state)
+        Index("ix_events_raw_inserted_at", "inserted_at"),
+        # Rows payload tiering has yet to visit; small once the history is tiered
+        Index(
+            "ix_events_raw_untiered_id", "id",
+            postgresql_where=text("payload_tiered_at is null"), sqlite_where=text("payload_tiered_at is null"),
+        ),
+    )
+
 
 class EventQuarantine(Base):
     __tablename__ = "events_quarantine"
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Literal, Optional
+from typing import Annotated, Any, Literal, Optional, Union
 
 from pydantic import BaseModel, Field, confloat, conint
+from typing_extensions import TypedDict  # pydantic needs typing_extensions' TypedDict before 3.12
 
 EventType = Literal["subscription", "payment", "usage", "cost"]
 
@@ -37,18 +38,51 @@ class CostEvent(EventBase):
     cost_type: str
 
 
-EventSchemaMap = {
+EventSchemaMap: dict[str, type[EventBase]] = {
     "subscription": SubscriptionEvent,
     "payment": PaymentEvent,
     "usage": UsageEvent,
     "cost": CostEvent,
 }
+EventTypeOf: dict[type[EventBase], EventType] = {cls: et for et, cls in EventSchemaMap.items()}  # type: ignore[misc]
+
+
+# Mixed batches carry {"event_type": ..., "payload": {...}} items, the same shape as mixed NDJSON files.
+# TypedDicts: the envelope is transport only, and a model instance per item would cost more than the tag lookup
+class SubscriptionEnvelope(TypedDict):
+    event_type: Literal["subscription"]
+    payload: SubscriptionEvent
+
+
+class PaymentEnvelope(TypedDict):
+    event_type: Literal["payment"]
+    payload: PaymentEvent
+
+
+class UsageEnvelope(TypedDict):
+    event_type: Literal["usage"]
+    payload: UsageEvent
+
+
+class CostEnvelope(TypedDict):
+    event_type: Literal["cost"]
+    payload: CostEvent
+
+
+MixedEvent = Annotated[
+    Union[SubscriptionEnvelope, PaymentEnvelope, UsageEnvelope, CostEnvelope], Field(discriminator="event_type")
+]
+
+# Quarantined mixed-batch items whose envelope names no known event type
+UNKNOWN_EVENT_TYPE: Literal["unknown"] = "unknown"
+ResultEventType = Union[EventType, Literal["unknown"]]
 
 
 class IngestionResult(BaseModel):
-    status: Literal["accepted", "duplicate", "quarantined"]
+    # "spooled": durably queued on the ingestion spool; the drainer decides the final outcome
+    status: Literal["accepted", "duplicate", "quarantined", "spooled"]
     event_id: str
-    event_type: EventType
+    event_type: ResultEventType
     issues: list[str] = Field(default_factory=list)
     is_late: bool = False
     s3_key: Optional[str] = None
@@ -59,3 +93,35 @@ class BatchIngestionResponse(BaseModel):
     duplicates: int
     quarantined: int
     results: list[IngestionResult]
+    spooled: int = 0
+
+
+class StreamItemResult(IngestionResult):
+    line: int  # 1-based line in the decoded NDJSON upload
+
+
+class StreamIngestionResponse(BaseModel):
+    events: int
+    accepted: int
+    duplicates: int
+    quarantined: int
+    chunks: int
+    seconds: float
+    # Only what was not accepted, capped at INGEST_STREAM_MAX_REPORTED, so the response stays small
+    not_accepted: list[StreamItemResult]
+    truncated: bool = False
+
+
+class StoredEvent(BaseModel):
+    """An accepted event as events_raw holds it, with its full payload even once the stored one was tiered."""
+
+    event_id: str
+    event_type: EventType
+    event_time: datetime
+    customer_id: str
+    region: str
+    is_late: bool
+    s3_key: Optional[str] = None
+    inserted_at: datetime
+    payload_tiered_at: Optional[datetime] = None
+    payload: dict[str, Any]
@@ -1,16 +1,21 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any
-import json
+from typing import Any, Optional
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from platform_common.config import settings
+from platform_common.db import shard_for
+from platform_common.metrics import INGEST_BATCH_STAGE, STAGE, count_event, timed
 from platform_common.s3 import put_json
+from platform_common.tracing import carry, span
 from .models import EventRaw, EventQuarantine
-from .schemas import EventSchemaMap, EventType, IngestionResult
+from .schemas import EventBase, EventSchemaMap, EventType, EventTypeOf, IngestionResult
 from .quality import evaluate_quality
+from .validation import InvalidItem, Item, error_messages, item_customer_id, item_event_type
 from pydantic import ValidationError
 from datetime import timezone
 
@@ -20,72 +25,224 @@ def s3_key_for(event_type: str, event_id: str, event_time: datetime) -> str:
     return f"raw/{event_type}/dt={dt}/{event_id}.json"
 
 
+def shard_positions(customer_ids: list[Optional[str]]) -> dict[int, list[int]]:
+    """Positions of the events per event shard, in order; events without a customer_id go to the shard of ''.
+
+    A customer's events always land on one shard, so duplicate detection by event_id stays within it.
+    """
+    if not settings.SHARD_DSNS:
+        return {0: list(range(len(customer_ids)))}
+    positions: dict[int, list[int]] = {}
+    for i, customer_id in enumerate(customer_ids):
+        positions.setdefault(shard_for(customer_id or ""), []).append(i)
+    return positions
+
+
+def item_shards(items: list[Item]) -> dict[int, list[int]]:
+    if not settings.SHARD_DSNS:
+        return {0: list(range(len(items)))}
+    return shard_positions([item_customer_id(item) for item in items])
+
+
+def _invalid_row(item: InvalidItem, event_id: str, payload: dict[str, Any], now: datetime) -> EventQuarantine:
+    # Populate minimal required fields for quarantine row
+    return EventQuarantine(
+        event_id=event_id,
+        event_type=item.event_type,
+        event_time=now,
+        customer_id=str(payload.get("customer_id", "unknown")),
+        region=str(payload.get("region", "unknown")),
+        payload=payload,
+        issues="validation_error: " + "; ".join(item.errors),
+    )
+
+
+def _quality_row(event_type: EventType, obj: EventBase, data: dict[str, Any], issues: list[str]) -> EventQuarantine:
+    return EventQuarantine(
+        event_id=obj.event_id,
+        event_type=event_type,
+        event_time=obj.event_time,
+        customer_id=obj.customer_id,
+        region=obj.region,
+        payload=data,
+        issues=",".join(issues),
+    )
+
+
+def _raw_row(event_type: EventType, obj: EventBase, data: dict[str, Any], key: str, is_late: bool) -> EventRaw:
+    return EventRaw(
+        event_id=obj.event_id,
+        event_type=event_type,
+        event_time=obj.event_time,
+        customer_id=obj.customer_id,
+        region=obj.region,
+        payload=data,
+        s3_key=key,
+        is_late=is_late,
+    )
+
+
 def process_event(session: Session, event_type: EventType, payload: dict[str, Any]) -> IngestionResult:
-    # Parse by type with validation; quarantine on failure
-    schema_cls = EventSchemaMap[event_type]
-    try:
-        obj = schema_cls(**payload)
-    except ValidationError as ve:
-        # Populate minimal required fields for quarantine row
-        now = datetime.now(timezone.utc)
-        event_id = str(payload.get("event_id", f"invalid-{now.timestamp()}"))
-        customer_id = str(payload.get("customer_id", "unknown"))
-        region = str(payload.get("region", "unknown"))
-        eq = EventQuarantine(
-            event_id=event_id,
-            event_type=event_type,
-            event_time=now,
-            customer_id=customer_id,
-            region=region,
-            payload=payload,
-            issues="validation_error: " + "; ".join([e.get("msg", "error") for e in ve.errors()]),
-        )
-        session.add(eq)
+    with span("process_event", {"event.type": event_type}) as current:
+        # Parse by type with validation; quarantine on failure
+        schema_cls = EventSchemaMap[event_type]
+        try:
+            with timed(STAGE["validate"]), span("ingest.validate"):
+                obj = schema_cls.model_validate(payload)
+        except ValidationError as ve:
+            result = quarantine_invalid(session, InvalidItem(event_type, payload, error_messages(ve.errors())))
+        else:
+            result = process_valid(session, event_type, obj)
+        if current is not None:
+            current.set_attribute("ingest.status", result.status)
+        return result
+
+
+def process_item(session: Session, item: Item) -> IngestionResult:
+    """Ingest an item from ingestion.app.validation, which has already been validated."""
+    with span("process_item", {"event.type": item_event_type(item)}) as current:
+        result = quarantine_invalid(session, item) if isinstance(item, InvalidItem) else process_valid(session, EventTypeOf[type(item)], item)
+        if current is not None:
+            current.set_attribute("ingest.status", result.status)
+        return result
+
+
+def quarantine_invalid(session: Session, item: InvalidItem) -> IngestionResult:
+    now = datetime.now(timezone.utc)
+    payload = item.payload if isinstance(item.payload, dict) else {"raw": item.payload}
+    event_id = item.event_id or f"invalid-{now.timestamp()}"
+    # A replayed invalid event must not trip the quarantine unique constraint
+    with timed(STAGE["dedup_lookup"]), span("ingest.dedup_lookup"):
+        replayed = session.scalar(select(EventQuarantine.id).where(EventQuarantine.event_id == event_id).limit(1)) is not None
+    if replayed:
+        count_event(item.event_type, "duplicate")
+        return IngestionResult(status="duplicate", event_id=event_id, event_type=item.event_type)
+    session.add(_invalid_row(item, event_id, payload, now))
+    with timed(STAGE["db_flush"]), span("ingest.db_flush"):
         session.flush()
-        return IngestionResult(status="quarantined", event_id=event_id, event_type=event_type, issues=["validation_error"], is_late=False)
+    count_event(item.event_type, "quarantined", ["validation_error"])
+    return IngestionResult(status="quarantined", event_id=event_id, event_type=item.event_type, issues=["validation_error"], is_late=False)
+
 
+def process_valid(session: Session, event_type: EventType, obj: EventBase) -> IngestionResult:
     # Duplicate detection across raw and quarantine
-    exists_raw = session.scalar(select(EventRaw.id).where(EventRaw.event_id == obj.event_id).limit(1))
-    if exists_raw is not None:
+    with timed(STAGE["dedup_lookup"]), span("ingest.dedup_lookup"):
+        exists_raw = session.scalar(select(EventRaw.id).where(EventRaw.event_id == obj.event_id).limit(1))
+        exists_q = None if exists_raw is not None else session.scalar(select(EventQuarantine.id).where(EventQuarantine.event_id == obj.event_id).limit(1))
+    if exists_raw is not None or exists_q is not None:
+        count_event(event_type, "duplicate")
         return IngestionResult(status="duplicate", event_id=obj.event_id, event_type=event_type)
 
-    exists_q = session.scalar(select(EventQuarantine.id).where(EventQuarantine.event_id == obj.event_id).limit(1))
-    if exists_q is not None:
-        return IngestionResult(status="duplicate", event_id=obj.event_id, event_type=event_type)
+    # One JSON-mode dump serves the quality rules, the lake object and the payload column
+    data = obj.model_dump(mode="json")
 
     # Quality evaluation
-    q = evaluate_quality(json.loads(obj.model_dump_json()), event_type)
+    with timed(STAGE["quality"]), span("ingest.quality"):
+        q = evaluate_quality(data, event_type)
 
     if not q.is_valid:
-        # Quarantine record
-        eq = EventQuarantine(
-            event_id=obj.event_id,
-            event_type=event_type,
-            event_time=obj.event_time,
-            customer_id=obj.customer_id,
-            region=obj.region,
-            payload=json.loads(obj.model_dump_json()),
-            issues=",".join(q.issues),
-        )
-        session.add(eq)
-        session.flush()
+        session.add(_quality_row(event_type, obj, data, q.issues))
+        with timed(STAGE["db_flush"]), span("ingest.db_flush"):
+            session.flush()
+        count_event(event_type, "quarantined", q.issues)
         return IngestionResult(status="quarantined", event_id=obj.event_id, event_type=event_type, issues=q.issues, is_late=q.is_late)
 
     # Accepted: write to S3 (idempotent write)
     key = s3_key_for(event_type, obj.event_id, obj.event_time)
-    put_json(key, json.loads(obj.model_dump_json()))
+    with timed(STAGE["s3_put"]), span("ingest.s3_put"):
+        put_json(key, data)
 
-    er = EventRaw(
-        event_id=obj.event_id,
-        event_type=event_type,
-        event_time=obj.event_time,
-        customer_id=obj.customer_id,
-        region=obj.region,
-        payload=json.loads(obj.model_dump_json()),
-        s3_key=key,
-        is_late=q.is_late,
-    )
-    session.add(er)
-    session.flush()
+    session.add(_raw_row(event_type, obj, data, key, q.is_late))
+    with timed(STAGE["db_flush"]), span("ingest.db_flush"):
+        session.flush()
 
+    count_event(event_type, "accepted", q.issues)
     return IngestionResult(status="accepted", event_id=obj.event_id, event_type=event_type, is_late=q.is_late, s3_key=key)
+
+
+_LOOKUP_CHUNK = 500  # event ids per IN (...) lookup
+
+
+def put_many(puts: list[tuple[str, dict[str, Any]]], workers: int) -> None:
+    """Write lake objects, up to `workers` at a time; raises if any write fails."""
+    with timed(INGEST_BATCH_STAGE["s3_put"]), span("ingest.s3_put", {"ingest.objects": len(puts)}):
+        if len(puts) > 1 and workers > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(puts)), thread_name_prefix="lake-put") as pool:
+                list(pool.map(carry(lambda kv: put_json(*kv)), puts))
+        else:
+            for key, data in puts:
+                put_json(key, data)
+
+
+def _existing_ids(session: Session, event_ids: list[str]) -> tuple[set[str], set[str]]:
+    raw: set[str] = set()
+    quarantined: set[str] = set()
+    for i in range(0, len(event_ids), _LOOKUP_CHUNK):
+        chunk = event_ids[i:i + _LOOKUP_CHUNK]
+        raw.update(session.scalars(select(EventRaw.event_id).where(EventRaw.event_id.in_(chunk))))
+        quarantined.update(session.scalars(select(EventQuarantine.event_id).where(EventQuarantine.event_id.in_(chunk))))
+    return raw, quarantined
+
+
+def process_batch(session: Session, items: list[Item], put_workers: int = 8) -> list[IngestionResult]:
+    """Ingest items in order with the outcomes process_item would give them one at a time.
+
+    Duplicates are found with one lookup per 500 ids instead of up to two queries per event, lake objects
+    are written concurrently, and all rows go out in one flush.
+    """
+    with span("process_batch", {"ingest.items": len(items)}):
+        return _process_batch(session, items, put_workers)
+
+
+def _process_batch(session: Session, items: list[Item], put_workers: int) -> list[IngestionResult]:
+    now = datetime.now(timezone.utc)
+    with timed(INGEST_BATCH_STAGE["dedup_lookup"]), span("ingest.dedup_lookup"):
+        raw, quarantined = _existing_ids(session, [event_id for item in items if (event_id := item.event_id)])
+
+    results: list[IngestionResult] = []
+    rows: list[Any] = []
+    puts: list[tuple[str, dict[str, Any]]] = []
+    issues_of: list[list[str]] = []
+    for item in items:
+        if isinstance(item, InvalidItem):
+            payload = item.payload if isinstance(item.payload, dict) else {"raw": item.payload}
+            event_id = item.event_id or f"invalid-{now.timestamp()}-{len(results)}"
+            # As in quarantine_invalid, only an earlier quarantine row makes an invalid event a duplicate
+            if event_id in quarantined:
+                results.append(IngestionResult(status="duplicate", event_id=event_id, event_type=item.event_type))
+            else:
+                quarantined.add(event_id)
+                rows.append(_invalid_row(item, event_id, payload, now))
+                results.append(IngestionResult(status="quarantined", event_id=event_id, event_type=item.event_type, issues=["validation_error"], is_late=False))
+            issues_of.append(["validation_error"])
+            continue
+
+        event_type = EventTypeOf[type(item)]
+        if item.event_id in raw or item.event_id in quarantined:
+            results.append(IngestionResult(status="duplicate", event_id=item.event_id, event_type=event_type))
+            issues_of.append([])
+            continue
+        data = item.model_dump(mode="json")
+        with timed(INGEST_BATCH_STAGE["quality"]):
+            q = evaluate_quality(data, event_type)
+        issues_of.append(q.issues)
+        if not q.is_valid:
+            quarantined.add(item.event_id)
+            rows.append(_quality_row(event_type, item, data, q.issues))
+            results.append(IngestionResult(status="quarantined", event_id=item.event_id, event_type=event_type, issues=q.issues, is_late=q.is_late))
+            continue
+        raw.add(item.event_id)
+        key = s3_key_for(event_type, item.event_id, item.event_time)
+        puts.append((key, data))
+        rows.append(_raw_row(event_type, item, data, key, q.is_late))
+        results.append(IngestionResult(status="accepted", event_id=item.event_id, event_type=event_type, is_late=q.is_late, s3_key=key))
+
+    # Lake first, as in process_valid: a failed flush leaves objects that a replay overwrites, never rows without objects
+    put_many(puts, put_workers)
+    session.add_all(rows)
+    with timed(INGEST_BATCH_STAGE["db_flush"]), span("ingest.db_flush", {"ingest.rows": len(rows)}):
+        session.flush()
+
+    for result, issues in zip(results, issues_of):
+        count_event(result.event_type, result.status, issues if result.status != "duplicate" else None)
+    return results
@@ -0,0 +1,515 @@
+"""Durable local write-ahead spool: acknowledge events once they are on disk, apply them to the database later.
+
+Records are appended to preallocated, memory-mapped segment files ({n:012d}.seg). Each record is a header
+(payload length, CRC32 of the payload, append time) followed by a JSON payload; a zero length marks the
+end of the written part of a segment. Appends from concurrent requests are made durable together by one
+flusher thread (group commit), and append() returns only once its records are covered by an msync.
+
+A drainer thread reads durable records in large batches, applies them through the bulk ingestion path and
+then advances a checkpoint file. Segments entirely before the checkpoint are deleted. On restart, records
+from the checkpoint up to the first torn or zeroed record are replayed; since ingestion is idempotent by
+event_id, a batch applied just before a crash but not yet checkpointed becomes duplicates.
+
+A record that can never be applied (undecodable, or rejected by the database whatever the retry) is appended
+to dead-letter.ndjson in the spool directory with its error, so it does not hold back the records after it.
+Outages (database or lake unreachable) leave the whole batch on the spool to be retried.
+
+Only one process may own a spool directory; a second one fails to take the directory lock.
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import orjson
+import pydantic_core
+from botocore.exceptions import BotoCoreError, ClientError
+from loguru import logger
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from platform_common.config import settings
+from platform_common.metrics import (
+    SPOOL_APPENDED,
+    SPOOL_DEAD_LETTERED,
+    SPOOL_DRAIN_SECONDS,
+    SPOOL_DRAINED,
+    SPOOL_FSYNC_RECORDS,
+    SPOOL_FSYNC_SECONDS,
+    SPOOL_LAG_BYTES,
+    SPOOL_LAG_RECORDS,
+    SPOOL_LAG_SECONDS,
+    timed,
+)
+from platform_common.tracing import span
+
+from .bulk import apply_item, ingest_items
+from .schemas import EventTypeOf, IngestionResult
+from .validation import BodyError, InvalidItem, Item, validate_batch
+
+_HEADER = struct.Struct("<IId")  # payload length, crc32 of payload, append time (epoch seconds)
+_SUFFIX = ".seg"
+_CHECKPOINT = "checkpoint"
+_DEAD_LETTER = "dead-letter.ndjson"
+
+Position = tuple[int, int]  # (segment number, byte offset of the next record)
+
+
+class SpoolError(RuntimeError):
+    """The spool cannot take or persist records (directory locked, disk full, flusher failed)."""
+
+
+@dataclass
+class SpoolBatch:
+    payloads: list[bytes]
+    end: Position
+    bytes: int
+
+
+def _segment_path(directory: Path, number: int) -> Path:
+    return directory / f"{number:012d}{_SUFFIX}"
+
+
+def _fsync_dir(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _scan(path: Path, offset: int) -> tuple[int, int, int, Optional[float]]:
+    """Walk the intact records of a segment from offset: (end offset, records, bytes, first append time)."""
+    records = size = 0
+    first: Optional[float] = None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while offset + _HEADER.size <= len(data):
+            length, crc, ts = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + length
+            if length == 0 or end > len(data) or zlib.crc32(data[offset + _HEADER.size:end]) != crc:
+                break
+            first = ts if first is None else first
+            records += 1
+            size += end - offset
+            offset = end
+    return offset, records, size, first
+
+
+class _Segment:
+    def __init__(self, path: Path, size: int) -> None:
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # Reserve the blocks now: a sparse file would turn a full disk into SIGBUS on a page write
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.number = int(path.stem)
+        self.size = size
+        self.offset = 0
+
+    def close(self) -> None:
+        self.mm.flush()
+        self.mm.close()
+
+
+class Spool:
+    def __init__(self, directory: str | Path, segment_bytes: int, fsync_interval: float) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_fd = os.open(self.directory / "lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock_fd)
+            raise SpoolError(f"spool {self.directory} is owned by another process") from None
+
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._cond = threading.Condition()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+
+        # Recovery: the intact records of every segment from the checkpoint onwards are still to be drained
+        self._checkpoint = self._read_checkpoint()
+        self._ends: dict[int, int] = {}
+        self.lag_records = self.lag_bytes = 0
+        for number in self._segment_numbers():
+            if number < self._checkpoint[0]:
+                _segment_path(self.directory, number).unlink()
+                continue
+            start = self._checkpoint[1] if number == self._checkpoint[0] else 0
+            end, records, size, _ = _scan(_segment_path(self.directory, number), start)
+            self._ends[number] = end
+            self.lag_records += records
+            self.lag_bytes += size
+        if self.lag_records:
+            logger.info("Spool {} recovered {} undrained records", self.directory, self.lag_records)
+
+        # New appends always go to a fresh segment, so recovered ones are never written again
+        numbers = self._segment_numbers()
+        self._active = _Segment(_segment_path(self.directory, max(numbers, default=self._checkpoint[0] - 1) + 1), segment_bytes)
+        _fsync_dir(self.directory)
+        self._retired: list[_Segment] = []
+        self._appended = self._synced = 0  # records since open
+        self._appended_bytes = self._synced_bytes = 0
+        self._durable: Position = (self._active.number, 0)
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="spool-flusher", daemon=True)
+        self._flusher.start()
+
+    def _segment_numbers(self) -> list[int]:
+        return sorted(int(p.stem) for p in self.directory.glob(f"*{_SUFFIX}"))
+
+    def _read_checkpoint(self) -> Position:
+        try:
+            data = orjson.loads((self.directory / _CHECKPOINT).read_bytes())
+            return int(data["segment"]), int(data["offset"])
+        except FileNotFoundError:
+            return min(self._segment_numbers(), default=1), 0
+
+    # -- writing ------------------------------------------------------------------------------------------
+
+    def append(self, payloads: list[bytes]) -> None:
+        """Append records and return once they are durable. Raises SpoolError if they cannot be."""
+        now = time.time()
+        records = [_HEADER.pack(len(p), zlib.crc32(p), now) + p for p in payloads]
+        with self._cond:
+            if self._error is not None or self._closed:
+                raise SpoolError("spool is not accepting records") from self._error
+            for record in records:
+                # Leave room for a zero header after the last record, the end-of-segment marker
+                if len(record) + _HEADER.size > self.segment_bytes:
+                    raise SpoolError(f"record of {len(record)} bytes does not fit a {self.segment_bytes}-byte segment")
+                if self._active.offset + len(record) + _HEADER.size > self._active.size:
+                    self._roll()
+                seg = self._active
+                seg.mm[seg.offset:seg.offset + len(record)] = record
+                seg.offset += len(record)
+            self._appended += len(records)
+            self._appended_bytes += sum(map(len, records))
+            target = self._appended
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._synced >= target or self._error is not None)
+            if self._synced < target:
+                raise SpoolError("spool flush failed") from self._error
+        SPOOL_APPENDED.inc(len(records))
+
+    def _roll(self) -> None:
+        self._ends[self._active.number] = self._active.offset
+        self._retired.append(self._active)
+        self._active = _Segment(_segment_path(self.directory, self._active.number + 1), self.segment_bytes)
+        _fsync_dir(self.directory)
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._appended > self._synced or self._closed)
+                if self._appended == self._synced and self._closed:
+                    return
+            if self.fsync_interval:
+                time.sleep(self.fsync_interval)  # let concurrent appends join this commit
+            with self._cond:
+                target, target_bytes = self._appended, self._appended_bytes
+                retired, active, offset = self._retired, self._active, self._active.offset
+                self._retired = []
+            try:
+                with timed(SPOOL_FSYNC_SECONDS):
+                    for seg in retired:
+                        seg.close()
+                    active.mm.flush()
+            except BaseException as e:
+                logger.exception("Spool flush failed: {}", e)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                SPOOL_FSYNC_RECORDS.observe(target - self._synced)
+                self.lag_records += target - self._synced
+                self.lag_bytes += target_bytes - self._synced_bytes
+                self._synced, self._synced_bytes = target, target_bytes
+                self._durable = (active.number, offset)
+                self._cond.notify_all()
+
+    # -- draining -----------------------------------------------------------------------------------------
+
+    def _limit(self, number: int) -> int:
+        # Sealed segments end where recovery or the writer left them; the active one at its last flush
+        return self._durable[1] if number == self._durable[0] else self._ends.get(number, 0)
+
+    def _normalize(self, pos: Position) -> Position:
+        number, offset = pos
+        while number < self._durable[0] and offset >= self._limit(number):
+            number, offset = number + 1, 0
+        return number, offset
+
+    def read(self, max_records: int) -> SpoolBatch:
+        """Durable records after the checkpoint, up to max_records; reading does not consume them."""
+        with self._cond:
+            number, offset = self._normalize(self._checkpoint)
+            durable = self._durable
+        payloads: list[bytes] = []
+        size = 0
+        while len(payloads) < max_records and (number, offset) < durable:
+            with self._cond:
+                limit = self._limit(number)
+            if offset >= limit:
+                number, offset = number + 1, 0
+                continue
+            start = offset
+            with open(_segment_path(self.directory, number), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while len(payloads) < max_records and offset < limit:
+                    length = _HEADER.unpack_from(data, offset)[0]
+                    payloads.append(data[offset + _HEADER.size:offset + _HEADER.size + length])
+                    offset += _HEADER.size + length
+            size += offset - start
+        return SpoolBatch(payloads, (number, offset), size)
+
+    def commit(self, batch: SpoolBatch) -> None:
+        """Mark a batch from read() as applied: advance the checkpoint and delete finished segments."""
+        with self._cond:
+            end = self._normalize(batch.end)
+        tmp = self.directory / f"{_CHECKPOINT}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps({"segment": end[0], "offset": end[1]}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.directory / _CHECKPOINT)
+        _fsync_dir(self.directory)
+        with self._cond:
+            self._checkpoint = end
+            self.lag_records -= len(batch.payloads)
+            self.lag_bytes -= batch.bytes
+            finished = [n for n in self._ends if n < end[0]]
+            for n in finished:
+                del self._ends[n]
+        for n in finished:
+            _segment_path(self.directory, n).unlink(missing_ok=True)
+
+    def dead_letter(self, payload: bytes, error: str) -> None:
+        """Durably set aside a record that can never be applied, with the reason."""
+        line = orjson.dumps({"at": time.time(), "error": error, "payload": payload.decode("utf-8", "replace")}) + b"\n"
+        with open(self.directory / _DEAD_LETTER, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        logger.error("Spool record dead-lettered in {}: {}", self.directory / _DEAD_LETTER, error)
+        SPOOL_DEAD_LETTERED.inc()
+
+    def lag_seconds(self) -> float:
+        """Age of the oldest durable record not yet drained; 0 when caught up."""
+        with self._cond:
+            number, offset = self._normalize(self._checkpoint)
+            if (number, offset) >= self._durable:
+                return 0.0
+        with open(_segment_path(self.directory, number), "rb") as f:
+            f.seek(offset)
+            header = f.read(_HEADER.size)
+        return max(time.time() - _HEADER.unpack(header)[2], 0.0)
+
+    def status(self) -> dict[str, object]:
+        with self._cond:
+            return {
+                "directory": str(self.directory),
+                "lag_records": self.lag_records,
+                "lag_bytes": self.lag_bytes,
+                "checkpoint": list(self._checkpoint),
+                "durable": list(self._durable),
+                "segments": len(self._ends) + 1,
+                "dead_letter_bytes": dead.stat().st_size if (dead := self.directory / _DEAD_LETTER).exists() else 0,
+            }
+
+    def close(self) -> None:
+        """Flush pending appends and release the directory."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        for seg in self._retired + [self._active]:
+            seg.close()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        os.close(self._lock_fd)
+
+
+# -- records ----------------------------------------------------------------------------------------------
+
+
+def encode(item: Item) -> bytes:
+    if isinstance(item, InvalidItem):
+        # Rejected by validation: kept with its errors so the drainer quarantines it as the direct path would
+        return orjson.dumps({"invalid": {"event_type": item.event_type, "payload": item.payload, "errors": item.errors}})
+    return b'{"event_type":"' + EventTypeOf[type(item)].encode() + b'","payload":' + pydantic_core.to_json(item) + b"}"
+
+
+def decode(payloads: list[bytes]) -> list[Item]:
+    """Rebuild items from spool records, validating the valid ones again in one mixed-batch call."""
+    items: list[Optional[Item]] = [None] * len(payloads)
+    valid: list[int] = []
+    for i, payload in enumerate(payloads):
+        if payload.startswith(b'{"invalid":'):
+            try:
+                raw = orjson.loads(payload)["invalid"]
+                items[i] = InvalidItem(raw["event_type"], raw["payload"], raw["errors"])
+            except (ValueError, KeyError, TypeError):
+                raise SpoolError("undecodable spool record") from None
+        else:
+            valid.append(i)
+    if valid:
+        try:
+            revalidated = validate_batch(b"[" + b",".join(payloads[i] for i in valid) + b"]")
+        except BodyError:
+            # Only records written by encode() are ever read back, so this is a corrupt spool
+            raise SpoolError("undecodable spool batch") from None
+        for i, item in zip(valid, revalidated):
+            items[i] = item
+    return [item for item in items if item is not None]
+
+
+def spool_items(spool: Spool, items: list[Item]) -> list[IngestionResult]:
+    """Durably queue items; each result is "spooled" (with issues=["validation_error"] for invalid ones)."""
+    spool.append([encode(item) for item in items])
+    return [
+        IngestionResult(status="spooled", event_id=item.event_id or "unknown", event_type=item.event_type, issues=["validation_error"])
+        if isinstance(item, InvalidItem)
+        else IngestionResult(status="spooled", event_id=item.event_id, event_type=EventTypeOf[type(item)])
+        for item in items
+    ]
+
+
+def _transient(exc: BaseException) -> bool:
+    """Whether a failure is an outage that a retry can outlast, rather than something wrong with the record."""
+    return isinstance(exc, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError, OSError, BotoCoreError, ClientError))
+
+
+def _decode_each(spool: Spool, payloads: list[bytes]) -> list[Item]:
+    # A corrupt record spoils the batch's decode; find it and set it aside
+    items: list[Item] = []
+    for payload in payloads:
+        try:
+            items.extend(decode([payload]))
+        except SpoolError as e:
+            spool.dead_letter(payload, str(e))
+    return items
+
+
+def drain_once(spool: Spool, max_records: int) -> int:
+    """Apply one batch of spooled records and checkpoint it; returns the number read.
+
+    A record that fails is retried on its own: if that fails for good it is dead-lettered, if the database or
+    lake is unavailable SpoolError is raised and the batch stays on the spool.
+    """
+    batch = spool.read(max_records)
+    if not batch.payloads:
+        return 0
+    # A trace of its own: the requests that spooled these records have long been answered
+    with timed(SPOOL_DRAIN_SECONDS), span("spool.drain", {"spool.records": len(batch.payloads)}, root="job"):
+        try:
+            items = decode(batch.payloads)
+        except SpoolError:
+            items = _decode_each(spool, batch.payloads)
+        results = ingest_items(items)
+        for item, result in zip(items, results):
+            if "exception" not in result.issues:
+                continue
+            try:
+                apply_item(item)
+            except Exception as e:
+                if _transient(e):
+                    # Already acknowledged: replayed next time, where the records that did apply come back as duplicates
+                    raise SpoolError(f"spooled records could not be applied: {e}") from e
+                spool.dead_letter(encode(item), f"{type(e).__name__}: {e}")
+    spool.commit(batch)
+    SPOOL_DRAINED.inc(len(batch.payloads))
+    return len(batch.payloads)
+
+
+class Drainer(threading.Thread):
+    def __init__(self, spool: Spool, max_records: int, idle: float) -> None:
+        super().__init__(name="spool-drainer", daemon=True)
+        self.spool, self.max_records, self.idle = spool, max_records, idle
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        backoff = self.idle
+        while not self._done.is_set():
+            try:
+                drained = drain_once(self.spool, self.max_records)
+                backoff = self.idle
+            except Exception as e:
+                # Database or lake unavailable: the batch stays on the spool and is retried
+                logger.warning("Spool drain failed, retrying in {:.1f}s: {}", backoff, e)
+                self._done.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            if drained < self.max_records:
+                self._done.wait(self.idle)
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+_spool: Optional[Spool] = None
+_drainer: Optional[Drainer] = None
+
+
+def active_spool() -> Optional[Spool]:
+    return _spool
+
+
+def open_spool() -> Spool:
+    return Spool(settings.SPOOL_DIR, settings.SPOOL_SEGMENT_BYTES, settings.SPOOL_FSYNC_INTERVAL_MS / 1000)
+
+
+def start_spool() -> Spool:
+    """Open the configured spool and start draining it (service startup)."""
+    global _spool, _drainer
+    _spool = open_spool()
+    SPOOL_LAG_RECORDS.set_function(lambda: _spool.lag_records if _spool else 0)
+    SPOOL_LAG_BYTES.set_function(lambda: _spool.lag_bytes if _spool else 0)
+    SPOOL_LAG_SECONDS.set_function(lambda: _spool.lag_seconds() if _spool else 0)
+    _drainer = Drainer(_spool, settings.SPOOL_DRAIN_BATCH, settings.SPOOL_DRAIN_IDLE_MS / 1000)
+    _drainer.start()
+    return _spool
+
+
+def stop_spool() -> None:
+    """Stop draining and close the spool; undrained records are picked up at the next start."""
+    global _spool, _drainer
+    if _drainer is not None:
+        _drainer.stop()
+    if _spool is not None:
+        _spool.close()
+    _spool = _drainer = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or drain the ingestion spool while the service is stopped")
+    parser.add_argument("command", choices=["status", "drain"])
+    args = parser.parse_args()
+    spool = open_spool()
+    try:
+        if args.command == "drain":
+            while drain_once(spool, settings.SPOOL_DRAIN_BATCH):
+                pass
+        print(orjson.dumps(spool.status(), option=orjson.OPT_INDENT_2).decode())
+    finally:
+        spool.close()
+
+
+if __name__ == "__main__":
+    main()
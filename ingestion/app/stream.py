@@ -0,0 +1,240 @@
+"""Streaming NDJSON ingestion: decode, split and ingest an upload in bounded chunks while it is still arriving.
+
+At most two chunks are held at a time: one being read from the socket and one being validated and written
+in the threadpool. Memory therefore depends on the chunk size, not the upload size. Each chunk commits on its
+own, so an upload cut off midway keeps its committed chunks, and resending it is safe because ingestion is
+idempotent by event_id.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+from typing import AsyncIterator, Optional, Union
+
+import zstandard
+from starlette.concurrency import run_in_threadpool
+
+from platform_common.config import settings
+
+from .bulk import ingest_items
+from .schemas import UNKNOWN_EVENT_TYPE, EventType, IngestionResult, StreamIngestionResponse, StreamItemResult
+from .validation import BodyError, InvalidItem, Item, validate_batch
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+ENCODINGS = ("identity", "gzip", "zstd")
+
+_DECODE_STEP = 1 << 20  # decompressed bytes per step, so a small compressed body cannot expand all at once
+
+
+class StreamError(ValueError):
+    """The upload cannot be read further: bad or truncated compression, or a line over INGEST_STREAM_MAX_LINE_BYTES."""
+
+    summary: Optional[StreamIngestionResponse] = None  # what was ingested before the error
+
+
+class _Gzip:
+    """Gzip with concatenated members, as produced by appending to a .gz file or by pigz."""
+
+    def __init__(self) -> None:
+        self._d = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        self._fed = False
+        self.unconsumed_tail = b""
+
+    @property
+    def eof(self) -> bool:
+        """Whether the input so far ends on a member boundary (or there was none)."""
+        return self._d.eof or not self._fed
+
+    def decompress(self, data: bytes, max_length: int = 0) -> bytes:
+        self._fed = self._fed or bool(data)
+        out = self._d.decompress(data, max_length)
+        self.unconsumed_tail = self._d.unconsumed_tail
+        if self._d.eof and self._d.unused_data:
+            rest = self._d.unused_data
+            self._d = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            self.unconsumed_tail = rest
+        return out
+
+
+class _Zstd:
+    """Zstd with concatenated frames, with the same output limit as _Gzip.
+
+    zstandard's decompressobj has no output limit, so input goes in a slice at a time: a 4-byte block (3-byte
+    header and one RLE byte) can expand to 128 KiB, so a slice decodes to at most ~1 MiB.
+    """
+
+    _SLICE = 32
+
+    def __init__(self) -> None:
+        self._d = zstandard.ZstdDecompressor().decompressobj()
+        self._fed = False
+        self.unconsumed_tail = b""
+
+    @property
+    def eof(self) -> bool:
+        """Whether the input so far ends on a frame boundary (or there was none)."""
+        return self._d.eof or not self._fed
+
+    def decompress(self, data: bytes, max_length: int = 0) -> bytes:
+        out: list[bytes] = []
+        size = pos = 0
+        while pos < len(data) and (not max_length or size < max_length):
+            if self._d.eof:
+                self._d = zstandard.ZstdDecompressor().decompressobj()
+            piece = data[pos:pos + self._SLICE]
+            pos += len(piece)
+            self._fed = True
+            decoded = self._d.decompress(piece)
+            if self._d.eof and self._d.unused_data:
+                pos -= len(self._d.unused_data)  # the next frame starts within this slice
+            out.append(decoded)
+            size += len(decoded)
+        self.unconsumed_tail = data[pos:]
+        return b"".join(out)
+
+
+async def decode(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    if encoding == "identity":
+        async for chunk in chunks:
+            yield chunk
+        return
+    decoder: Union[_Gzip, _Zstd] = _Zstd() if encoding == "zstd" else _Gzip()
+    async for chunk in chunks:
+        data = chunk
+        while data:
+            try:
+                out = decoder.decompress(data, _DECODE_STEP)
+            except (zlib.error, zstandard.ZstdError) as e:
+                raise StreamError(f"{encoding}: {e}") from None
+            if out:
+                yield out
+            data = decoder.unconsumed_tail
+    if not decoder.eof:
+        raise StreamError(f"{encoding}: upload ends mid-{'frame' if encoding == 'zstd' else 'member'}")
+
+
+async def split_lines(chunks: AsyncIterator[bytes], chunk_size: int, max_line: int) -> AsyncIterator[tuple[list[int], list[bytes]]]:
+    """Group non-empty lines into lists of up to chunk_size, with their 1-based line numbers."""
+    buffer = bytearray()
+    numbers: list[int] = []
+    lines: list[bytes] = []
+    line_no = 0
+    async for data in chunks:
+        buffer += data
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            line_no += 1
+            line = bytes(buffer[start:end]).strip()
+            start = end + 1
+            if not line:
+                continue
+            numbers.append(line_no)
+            lines.append(line)
+            if len(lines) >= chunk_size:
+                yield numbers, lines
+                numbers, lines = [], []
+        del buffer[:start]
+        if len(buffer) > max_line:
+            raise StreamError(f"line {line_no + 1} exceeds {max_line} bytes")
+    tail = bytes(buffer).strip()
+    if tail:
+        numbers.append(line_no + 1)
+        lines.append(tail)
+    if lines:
+        yield numbers, lines
+
+
+def _validate_lines(lines: list[bytes], event_type: Optional[EventType]) -> list[Item]:
+    try:
+        # The lines already are JSON values: joining them is cheaper than parsing each
+        items = validate_batch(b"[" + b",".join(lines) + b"]", event_type)
+        if len(items) == len(lines):
+            return items
+    except BodyError:
+        pass
+    # A malformed line (or one holding several values) spoils the joined array: fall back to line by line
+    return [_validate_line(line, event_type) for line in lines]
+
+
+def _validate_line(line: bytes, event_type: Optional[EventType]) -> Item:
+    try:
+        items = validate_batch(b"[" + line + b"]", event_type)
+    except BodyError as e:
+        return InvalidItem(event_type or UNKNOWN_EVENT_TYPE, line.decode(errors="replace"), [str(e)])
+    if len(items) != 1:
+        return InvalidItem(event_type or UNKNOWN_EVENT_TYPE, line.decode(errors="replace"), ["expected one JSON value per line"])
+    return items[0]
+
+
+def ingest_lines(lines: list[bytes], event_type: Optional[EventType]) -> list[IngestionResult]:
+    """Validate and ingest one chunk of NDJSON lines in its own transaction."""
+    return ingest_items(_validate_lines(lines, event_type))
+
+
+class _Summary:
+    def __init__(self, max_reported: int) -> None:
+        self.counts = {"accepted": 0, "duplicate": 0, "quarantined": 0}
+        self.events = 0
+        self.chunks = 0
+        self.not_accepted: list[StreamItemResult] = []
+        self.max_reported = max_reported
+        self.truncated = False
+
+    def add(self, numbers: list[int], results: list[IngestionResult]) -> None:
+        self.chunks += 1
+        self.events += len(results)
+        for line, result in zip(numbers, results):
+            self.counts[result.status] += 1
+            if result.status == "accepted":
+                continue
+            if len(self.not_accepted) >= self.max_reported:
+                self.truncated = True
+                continue
+            self.not_accepted.append(StreamItemResult(line=line, **result.model_dump()))
+
+    def response(self, seconds: float) -> StreamIngestionResponse:
+        return StreamIngestionResponse(
+            events=self.events,
+            accepted=self.counts["accepted"],
+            duplicates=self.counts["duplicate"],
+            quarantined=self.counts["quarantined"],
+            chunks=self.chunks,
+            seconds=round(seconds, 3),
+            not_accepted=self.not_accepted,
+            truncated=self.truncated,
+        )
+
+
+async def ingest_ndjson(
+    body: AsyncIterator[bytes],
+    event_type: Optional[EventType],
+    encoding: str = "identity",
+    chunk_size: Optional[int] = None,
+) -> StreamIngestionResponse:
+    """Ingest an NDJSON stream: raw payloads when event_type is set, else {"event_type", "payload"} lines.
+
+    Raises StreamError when the stream cannot be read further; chunks ingested before that stay committed.
+    """
+    started = time.perf_counter()
+    summary = _Summary(settings.INGEST_STREAM_MAX_REPORTED)
+    pending: Optional[tuple[list[int], asyncio.Future[list[IngestionResult]]]] = None
+    chunks = split_lines(decode(body, encoding), chunk_size or settings.INGEST_CHUNK_SIZE, settings.INGEST_STREAM_MAX_LINE_BYTES)
+    try:
+        async for numbers, lines in chunks:
+            # Read the next chunk while the previous one is written, but never run ahead further than that
+            if pending is not None:
+                summary.add(pending[0], await pending[1])
+            pending = (numbers, asyncio.ensure_future(run_in_threadpool(ingest_lines, lines, event_type)))
+    except StreamError as e:
+        if pending is not None:
+            summary.add(pending[0], await pending[1])
+        e.summary = summary.response(time.perf_counter() - started)
+        raise
+    finally:
+        # Client gone or stream broken: let the chunk in flight finish rather than abandon its transaction
+        if pending is not None and not pending[1].done():
+            await asyncio.shield(pending[1])
+    if pending is not None:
+        summary.add(pending[0], await pending[1])
+    return summary.response(time.perf_counter() - started)
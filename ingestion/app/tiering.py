@@ -0,0 +1,213 @@
+"""Hot/cold payload tiering for events_raw: python -m ingestion.app.tiering [--older-than-days N] [--dry-run]
+
+Every accepted event is stored twice: its full JSON in events_raw.payload and the same JSON as the lake object
+at s3_key, which is never rewritten. Once the staging views have the typed fields, the payload column is mostly
+dead weight. Rows inserted at least PAYLOAD_TIER_AGE_DAYS ago are stripped down to the fields of their event
+type's schema (STAGED_FIELDS), which are the ones the views and models read; event_id, event_time, customer_id
+and region are columns already. payload_tiered_at marks a stripped row. Rows without a lake object are kept whole.
+
+Stripping rewrites each row, so the space only becomes reusable after a VACUUM (--vacuum); the files only
+shrink with VACUUM FULL or pg_repack. full_payloads() reads tiered payloads back from the lake, concurrently
+for a list of events, through a bounded LRU cache.
+"""
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Sequence
+
+import orjson
+from loguru import logger
+from pydantic import BaseModel, Field
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import BindParameter
+
+from platform_common.config import settings
+from platform_common.db import get_shard_engines, session_scope, shard_count
+from platform_common.metrics import PAYLOAD_LAKE_LOADS, PAYLOADS_TIERED, enabled
+from platform_common.s3 import get_json, get_s3_client
+from platform_common.tracing import carry
+
+from .models import EventRaw
+from .schemas import EventBase, EventSchemaMap, StoredEvent
+
+# What a tiered payload keeps: every field of the type's schema beyond the envelope columns
+STAGED_FIELDS: dict[str, list[str]] = {
+    event_type: [name for name in schema.model_fields if name not in EventBase.model_fields]
+    for event_type, schema in EventSchemaMap.items()
+}
+_KEEP = [f"{event_type}:{name}" for event_type, names in STAGED_FIELDS.items() for name in names]
+
+_STRIPPED = {
+    "postgresql": "(select coalesce(json_object_agg(f.key, f.value), '{{}}') from json_each(events_raw.payload) f where {keep})",
+    "sqlite": "(select json_group_object(f.key, f.value) from json_each(events_raw.payload) f where {keep})",
+}
+_ELIGIBLE = "payload_tiered_at is null and s3_key is not null and inserted_at < :cutoff"
+# Typed, so they are written as the columns are (on SQLite, strings that compare in time order)
+_TIMES: tuple[BindParameter[Any], ...] = (bindparam("now", type_=EventRaw.payload_tiered_at.type), bindparam("cutoff", type_=EventRaw.inserted_at.type))
+
+
+class TieringReport(BaseModel):
+    tiered: int = 0  # in a dry run: would be tiered
+    chunks: int = 0
+    dry_run: bool = False
+    cutoff: Optional[datetime] = None
+    seconds: float = 0.0
+    by_type: dict[str, int] = Field(default_factory=dict)
+
+
+def _strip_statement(dialect: str) -> Any:
+    keep = "events_raw.event_type || ':' || f.key in :keep"
+    return text(f"""
+        update events_raw set payload = {_STRIPPED[dialect].format(keep=keep)}, payload_tiered_at = :now
+        where id in (select id from events_raw where {_ELIGIBLE} and id > :last_id order by id limit :chunk_size)
+        returning id, event_type
+    """).bindparams(bindparam("keep", expanding=True), *_TIMES)
+
+
+def _count_eligible(session: Session, cutoff: datetime) -> Counter[str]:
+    statement = text(f"select event_type, count(*) from events_raw where {_ELIGIBLE} group by event_type").bindparams(_TIMES[1])
+    rows = session.execute(statement, {"cutoff": cutoff})
+    return Counter({event_type: n for event_type, n in rows})
+
+
+def _vacuum(shard: int) -> None:
+    engine = get_shard_engines()[shard]
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("vacuum (analyze) events_raw"))
+
+
+def tier_payloads(
+    older_than: Optional[timedelta] = None,
+    shard: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    dry_run: bool = False,
+    vacuum: bool = False,
+) -> TieringReport:
+    """Strip the payloads of rows inserted before now - older_than (default PAYLOAD_TIER_AGE_DAYS), on one event
+    shard or all of them; each chunk commits on its own, so an interrupted run resumes where it stopped."""
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    cutoff = now - (older_than if older_than is not None else timedelta(days=settings.PAYLOAD_TIER_AGE_DAYS))
+    report = TieringReport(dry_run=dry_run, cutoff=cutoff)
+    by_type: Counter[str] = Counter()
+    for current in range(shard_count()) if shard is None else [shard]:
+        if dry_run:
+            with session_scope(current) as session:
+                by_type.update(_count_eligible(session, cutoff))
+            continue
+        last_id = 0
+        while True:
+            with session_scope(current) as session:
+                statement = _strip_statement(session.get_bind().dialect.name)
+                rows = session.execute(statement, {
+                    "keep": _KEEP, "now": now, "cutoff": cutoff, "last_id": last_id, "chunk_size": chunk_size or settings.PAYLOAD_TIER_CHUNK_SIZE,
+                }).all()
+            if not rows:
+                break
+            last_id = max(row.id for row in rows)
+            chunk = Counter(row.event_type for row in rows)
+            by_type.update(chunk)
+            report.chunks += 1
+            if enabled():
+                for event_type, n in chunk.items():
+                    PAYLOADS_TIERED.labels(event_type).inc(n)
+        if vacuum:
+            _vacuum(current)
+    report.by_type = dict(sorted(by_type.items()))
+    report.tiered = sum(by_type.values())
+    report.seconds = round(time.perf_counter() - started, 3)
+    logger.info("Payload tiering{}: {} rows before {} in {}s", " (dry run)" if dry_run else "", report.tiered, cutoff, report.seconds)
+    return report
+
+
+_cache: OrderedDict[str, dict[str, Any]] = OrderedDict()  # s3_key -> full payload
+_cache_lock = threading.Lock()
+
+
+def _lake_key(event: EventRaw) -> Optional[str]:
+    return event.s3_key if event.payload_tiered_at is not None else None
+
+
+def full_payloads(events: Sequence[EventRaw]) -> list[dict[str, Any]]:
+    """The events' full payloads, in order: the stored one, or for a tiered event its lake object.
+
+    Lake objects not in the cache are read PAYLOAD_FETCH_WORKERS at a time. They never change once written, so
+    cached ones are never stale.
+    """
+    wanted = {key for key in map(_lake_key, events) if key is not None}
+    found: dict[str, dict[str, Any]] = {}
+    with _cache_lock:
+        for key in wanted & _cache.keys():
+            _cache.move_to_end(key)
+            found[key] = _cache[key]
+    missing = sorted(wanted - found.keys())
+    if missing:
+        client = get_s3_client()  # one for all reads: creating one costs more than a GET
+        workers = min(settings.PAYLOAD_FETCH_WORKERS, len(missing))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="payload-get") as pool:
+                fetched = list(pool.map(carry(lambda key: get_json(key, client=client)), missing))
+        else:
+            fetched = [get_json(key, client=client) for key in missing]
+        found.update(zip(missing, fetched))
+        with _cache_lock:
+            _cache.update(zip(missing, fetched))
+            while len(_cache) > settings.PAYLOAD_CACHE_SIZE:
+                _cache.popitem(last=False)
+    if enabled() and wanted:
+        PAYLOAD_LAKE_LOADS.labels("cache").inc(len(wanted) - len(missing))
+        PAYLOAD_LAKE_LOADS.labels("lake").inc(len(missing))
+    # Copies: callers get their own dicts, not the cached ones
+    return [dict(found[key]) if key is not None else event.payload for key, event in zip(map(_lake_key, events), events)]
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def find_event(event_id: str) -> Optional[StoredEvent]:
+    """An accepted event with its full payload; its shard is not known from the id, so each one is asked."""
+    for shard in range(shard_count()):
+        with session_scope(shard) as session:
+            event = session.scalar(select(EventRaw).where(EventRaw.event_id == event_id))
+            if event is not None:
+                fields = {name: getattr(event, name) for name in StoredEvent.model_fields if name != "payload"}
+                return StoredEvent(**fields, payload=full_payloads([event])[0])
+    return None
+
+
+def tiering_status() -> dict[str, int]:
+    """Rows with a full and with a tiered payload, over all event shards."""
+    counts: Counter[str] = Counter()
+    for shard in range(shard_count()):
+        with session_scope(shard) as session:
+            tiered = func.count(EventRaw.payload_tiered_at)
+            total, stripped = session.execute(select(func.count(), tiered).select_from(EventRaw)).one()
+            counts.update({"full": total - stripped, "tiered": stripped})
+    return dict(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Strip old events_raw payloads to their staged fields; full ones stay in the lake")
+    parser.add_argument("--older-than-days", type=float, help=f"Default: PAYLOAD_TIER_AGE_DAYS ({settings.PAYLOAD_TIER_AGE_DAYS})")
+    parser.add_argument("--shard", type=int, help="Only this event shard")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--dry-run", action="store_true", help="Count the rows that would be tiered")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM (ANALYZE) events_raw afterwards so the space is reused")
+    args = parser.parse_args()
+    older_than = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    report = tier_payloads(older_than, args.shard, args.chunk_size, args.dry_run, args.vacuum)
+    print(orjson.dumps({**report.model_dump(mode="json"), "rows": tiering_status()}, option=orjson.OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
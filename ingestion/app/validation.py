@@ -0,0 +1,129 @@
+"""Event validation straight from request bytes.
+
+A batch is one TypeAdapter call over the raw body. Each item is a left-to-right union of the event schema
+and `Any`, so a bad item comes back as its parsed JSON instead of failing the batch and forcing valid items
+to be validated again. The error messages for the bad items then come from one more call over just those
+items, so there is one ValidationError per batch rather than one per item.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Annotated, Any, Optional, Union, cast
+
+import orjson
+from pydantic import Field, TypeAdapter, ValidationError
+from pydantic_core import ErrorDetails
+
+from platform_common.metrics import INGEST_BATCH_VALIDATE_SECONDS, STAGE, timed
+
+from .schemas import UNKNOWN_EVENT_TYPE, EventBase, EventSchemaMap, EventType, EventTypeOf, MixedEvent, ResultEventType
+
+_LENIENT = Field(union_mode="left_to_right")
+
+_BATCH: dict[str, TypeAdapter[list[Any]]] = {
+    et: TypeAdapter(list[Annotated[Union[cls, Any], _LENIENT]]) for et, cls in EventSchemaMap.items()  # type: ignore[valid-type]
+}
+_MIXED: TypeAdapter[list[Any]] = TypeAdapter(list[Annotated[Union[MixedEvent, Any], _LENIENT]])
+
+# Strict counterparts, only run over the items that fell through to Any
+_BATCH_ERRORS: dict[str, TypeAdapter[list[Any]]] = {et: TypeAdapter(list[cls]) for et, cls in EventSchemaMap.items()}  # type: ignore[valid-type]
+_MIXED_ERRORS: TypeAdapter[list[Any]] = TypeAdapter(list[MixedEvent])
+
+
+class BodyError(ValueError):
+    """The body is not JSON of the expected shape (an object for one event, an array for a batch)."""
+
+
+@dataclass
+class InvalidItem:
+    event_type: ResultEventType  # UNKNOWN_EVENT_TYPE when a mixed-batch envelope names no known type
+    payload: Any
+    errors: list[str]
+
+    @property
+    def event_id(self) -> Optional[str]:
+        event_id = self.payload.get("event_id") if isinstance(self.payload, dict) else None
+        return None if event_id is None else str(event_id)
+
+
+# Valid items are the schema instances themselves (their type is EventTypeOf[type(item)]): no wrapper per item
+Item = Union[EventBase, InvalidItem]
+
+
+def item_event_type(item: Item) -> ResultEventType:
+    return item.event_type if isinstance(item, InvalidItem) else EventTypeOf[type(item)]
+
+
+def item_customer_id(item: Item) -> Optional[str]:
+    """The customer_id of a valid item, or of an invalid one whose payload has a string customer_id."""
+    if isinstance(item, InvalidItem):
+        customer_id = item.payload.get("customer_id") if isinstance(item.payload, dict) else None
+        return customer_id if isinstance(customer_id, str) else None
+    return item.customer_id
+
+
+def error_messages(errors: list[ErrorDetails]) -> list[str]:
+    return [e.get("msg", "error") for e in errors]
+
+
+def _errors_by_index(adapter: TypeAdapter[list[Any]], raws: list[Any]) -> dict[int, list[str]]:
+    try:
+        adapter.validate_json(orjson.dumps(raws))  # JSON mode, as in the first pass
+    except ValidationError as ve:
+        by_index: dict[int, list[ErrorDetails]] = {}
+        for err in ve.errors(include_url=False):
+            by_index.setdefault(cast(int, err["loc"][0]), []).append(err)
+        return {i: error_messages(errs) for i, errs in by_index.items()}
+    return {}
+
+
+def _invalid_mixed(raw: Any, errors: list[str]) -> InvalidItem:
+    if not isinstance(raw, dict):
+        return InvalidItem(UNKNOWN_EVENT_TYPE, raw, errors)
+    event_type = raw.get("event_type")
+    if not isinstance(event_type, str) or event_type not in EventSchemaMap:
+        return InvalidItem(UNKNOWN_EVENT_TYPE, raw.get("payload", raw), errors)
+    return InvalidItem(cast(EventType, event_type), raw.get("payload"), errors)
+
+
+def validate_batch(body: bytes, event_type: Optional[EventType] = None) -> list[Item]:
+    """Validate a JSON array of events of one type, or of mixed envelopes when event_type is None.
+
+    Items come back in input order. Raises BodyError when the body itself is unusable.
+    """
+    with timed(INGEST_BATCH_VALIDATE_SECONDS):
+        try:
+            parsed = (_MIXED if event_type is None else _BATCH[event_type]).validate_json(body)
+        except ValidationError as ve:
+            # Items cannot fail, so this is malformed JSON or a body that is not an array
+            raise BodyError(ve.errors(include_url=False)[0]["msg"]) from None
+
+        items: list[Any] = parsed if event_type is not None else [_unwrap(item) for item in parsed]
+        # type() lookups: isinstance against a pydantic model goes through a Python-level __instancecheck__
+        bad = [i for i, item in enumerate(items) if type(item) not in EventTypeOf]
+        if not bad:
+            return items
+
+        errors = _errors_by_index(_MIXED_ERRORS if event_type is None else _BATCH_ERRORS[event_type], [parsed[i] for i in bad])
+        for n, i in enumerate(bad):
+            messages = errors.get(n, ["invalid"])
+            items[i] = _invalid_mixed(parsed[i], messages) if event_type is None else InvalidItem(event_type, parsed[i], messages)
+    return items
+
+
+def _unwrap(item: Any) -> Any:
+    # A validated envelope holds a model; a raw fallback keeps its dict (or whatever was sent)
+    payload = item.get("payload") if isinstance(item, dict) else None
+    return payload if type(payload) in EventTypeOf else item
+
+
+def validate_event(body: bytes, event_type: EventType) -> Item:
+    """Validate one JSON object of the given type. Raises BodyError when the body is not a JSON object."""
+    try:
+        with timed(STAGE["validate"]):
+            return EventSchemaMap[event_type].model_validate_json(body)
+    except ValidationError as ve:
+        errors = ve.errors(include_url=False)
+    if any(not err["loc"] for err in errors):
+        raise BodyError(errors[0]["msg"])
+    return InvalidItem(event_type, orjson.loads(body), error_messages(errors))
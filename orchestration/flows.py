@@ -1,64 +1,377 @@
+"""Orchestration flows for the Financial Forecasting Data Platform."""
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Any
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
 
 from prefect import flow, task
+from prefect.futures import PrefectFuture
+from prefect.task_runners import BaseTaskRunner, ConcurrentTaskRunner, SequentialTaskRunner
+from prefect.tasks import task_input_hash
+from prefect.utilities.asyncutils import Sync
 from loguru import logger
 
-from platform_common.db import Base, get_engine, session_scope
-from transformations.runner import run_all as run_transformations
-from forecasting.arima import forecast_revenue_daily, forecast_subscriptions_daily
-from ingestion.app.service import process_event
+from platform_common.config import settings
+from platform_common.db import get_engine, primary_lsn, read_your_writes, session_scope, shard_count
+from platform_common.migrations import migrate
+from platform_common.tracing import traced
+from transformations.runner import default_sql_dir, read_sql_models, run_models
+from forecasting.variance import refresh_forecast_variance
+from ingestion.app.bulk import EventItem, iter_events_from_file, iter_events_from_s3_prefix, ingest_stream
+from ingestion.app.reprocess import ReprocessReport, reprocess_quarantine
 from ingestion.app.schemas import EventType
+from ingestion.app.tiering import TieringReport, tier_payloads
+from orchestration import watermarks
 
 
-@task
-def transformations_task() -> None:
-    logger.info("Running SQL transformations")
-    engine = get_engine()
-    # Ensure models are registered so Base.metadata knows about them
-    from ingestion.app import models as _ingestion_models  # noqa: F401
-    from forecasting import models as _forecast_models  # noqa: F401
-    Base.metadata.create_all(bind=engine)  # ensure base tables exist
-    run_transformations()
+# Function names in forecasting.arima, resolved on first use: importing it pulls in pandas and
+# statsmodels (~1.5s), which ingestion-only flows and the scheduler's planning never need
+FORECASTERS: dict[str, str] = {
+    "revenue_daily": "forecast_revenue_daily",
+    "subscriptions_daily": "forecast_subscriptions_daily",
+}
+SEGMENTED_TARGETS = {"revenue_daily"}
+
+def _task_runner() -> BaseTaskRunner:
+    return SequentialTaskRunner() if settings.PREFECT_TASK_RUNNER == "sequential" else ConcurrentTaskRunner()
+
+
+def forecast_jobs(targets: Optional[list[str]] = None) -> list[tuple[str, str]]:
+    """(target, segment) pairs to forecast: all targets when None, none for an empty list."""
+    jobs: list[tuple[str, str]] = []
+    for target in targets if targets is not None else list(FORECASTERS):
+        segments = settings.FORECAST_SEGMENTS if target in SEGMENTED_TARGETS else ["all"]
+        jobs.extend((target, segment) for segment in segments)
+    return jobs
+
+
+def _forecaster(target: str) -> Callable[..., int]:
+    from forecasting import arima
+
+    return getattr(arima, FORECASTERS[target])
+
+
+def _count(results: list[Any]) -> dict[str, int]:
+    totals: Counter[str] = Counter()
+    for res in results:
+        totals.update({"accepted": 0, "duplicates": 0, "quarantined": 0, "failed": 0})
+        totals.update(res)
+    return dict(totals)
+
+
+def _ingest(events: list[tuple[EventType, dict[str, Any]]]) -> dict[str, int]:
+    return ingest_stream(events, workers=1).counts()
 
 
 @task
-def forecast_task() -> dict[str, int]:
-    logger.info("Running forecasts")
-    n1 = forecast_revenue_daily()
-    n2 = forecast_subscriptions_daily()
-    logger.info("Forecasted revenue days: {} subscriptions days: {}", n1, n2)
-    return {"revenue": n1, "subscriptions": n2}
+def ensure_schema_task() -> None:
+    # Skips after one lookup when the database is current; transformations run as graph tasks
+    migrate(include_transformations=False)
+
+
+@task(cache_key_fn=task_input_hash, retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def run_model_task(name: str, sql_checksum: str, input_marks: dict[str, str]) -> float:
+    """The cache key covers the model definition and the input high-water marks it ran against."""
+    started = time.perf_counter()
+    run_models([name])
+    return (time.perf_counter() - started) * 1000
+
+
+@task(cache_key_fn=task_input_hash, retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def forecast_target_task(target: str, segment: str, input_mark: str) -> float:
+    started = time.perf_counter()
+    # The models this forecast waited for were written moments ago; a replica serves it only once it has them
+    with read_your_writes(primary_lsn()):
+        n = _forecaster(target)(segment=segment, input_mark=input_mark)
+    logger.info("Forecasted {} {} days: {}", target, segment, n)
+    return (time.perf_counter() - started) * 1000
+
+
+@task(retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def refresh_variance_task() -> int:
+    # New actuals may land inside the horizon of recent runs
+    return refresh_forecast_variance()
+
+
+@task(cache_key_fn=task_input_hash, cache_expiration=timedelta(days=1), retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def ingest_partition_task(partition: str, events: list[tuple[EventType, dict[str, Any]]]) -> dict[str, int]:
+    # Retries are safe: process_event is idempotent on event_id
+    res = _ingest(events)
+    logger.info("Partition {} ingested: {}", partition, res)
+    return res
+
+
+@task(retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def replay_lake_partition_task(event_type: EventType, day: date) -> dict[str, int]:
+    res = ingest_stream(iter_events_from_s3_prefix(f"raw/{event_type}/dt={day.isoformat()}/"), workers=1).counts()
+    logger.info("Replayed {}/{}: {}", event_type, day, res)
+    return res
+
+
+@task(retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def compact_lake_task(full: bool) -> dict[str, int]:
+    # Retries are safe: a partition is only recorded as compacted once its Parquet file is written
+    from analytics.lake import compact
+
+    return compact(full=full)
+
+
+@task(retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def reprocess_partition_task(partition: tuple[int, int], filters: dict[str, Any], dry_run: bool) -> dict[str, Any]:
+    # Retries are safe: moved rows leave the quarantine in the same transaction that inserts them
+    return reprocess_quarantine(partition=partition, dry_run=dry_run, **filters).model_dump()
+
+
+@task(retries=settings.TASK_RETRIES, retry_delay_seconds=settings.TASK_RETRY_DELAY_SECONDS)
+def tier_payloads_task(shard: int, older_than_days: Optional[float], dry_run: bool, vacuum: bool) -> dict[str, Any]:
+    # Retries are safe: each chunk commits on its own and a stripped row is not picked again
+    older_than = timedelta(days=older_than_days) if older_than_days is not None else None
+    return tier_payloads(older_than, shard=shard, dry_run=dry_run, vacuum=vacuum).model_dump(mode="json")
 
 
 @task
-def batch_ingest_task(events: list[tuple[EventType, dict[str, Any]]]) -> dict[str, int]:
-    logger.info("Batch ingesting {} events", len(events))
-    from ingestion.app.models import EventRaw, EventQuarantine  # ensure tables registered
+def batch_ingest_task(
+    events: Optional[list[tuple[EventType, dict[str, Any]]]] = None,
+    path: Optional[str] = None,
+    s3_prefix: Optional[str] = None,
+    event_type: Optional[EventType] = None,
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    use_processes: bool = False,
+) -> dict[str, Any]:
+    """Chunked ingestion of an in-memory list, an NDJSON file or a lake prefix; each chunk commits on its own."""
+    source: Iterable[EventItem]
+    if events is not None:
+        source = events  # type: ignore[assignment]
+    elif path is not None:
+        source = iter_events_from_file(path, event_type)
+    elif s3_prefix is not None:
+        source = iter_events_from_s3_prefix(s3_prefix)
+    else:
+        raise ValueError("One of events, path or s3_prefix is required")
+    report = ingest_stream(source, chunk_size=chunk_size, workers=workers, use_processes=use_processes)
+    return report.model_dump()
+
+
+def submit_transformations(
+    snap: watermarks.SourceSnapshot, only: Optional[set[str]] = None
+) -> dict[str, PrefectFuture[float, Sync]]:
+    """One task per SQL model, each waiting only on the upstream models it references."""
+    models = read_sql_models(default_sql_dir())
+    upstream = watermarks.upstream_models(models)
+    inputs = watermarks.model_inputs(models)
+    futures: dict[str, PrefectFuture[float, Sync]] = {}
+    for name, sql in models:
+        if only is not None and name not in only:
+            continue
+        # Views do not depend on data, so only materialized models key their cache on input marks
+        marks = {} if watermarks.is_view_only(sql) else {
+            et: ts.isoformat() for et, ts in snap.events.items() if et in inputs[name] and ts is not None
+        }
+        futures[name] = run_model_task.submit(
+            name, snap.checksums[name], marks, wait_for=[futures[up] for up in upstream[name] if up in futures]
+        )  # type: ignore[call-overload]
+    return futures
 
-    accepted = duplicates = quarantined = 0
+
+def submit_forecasts(
+    snap: watermarks.SourceSnapshot, model_futures: dict[str, PrefectFuture[float, Sync]], targets: Optional[list[str]] = None
+) -> dict[tuple[str, str], PrefectFuture[float, Sync]]:
+    futures: dict[tuple[str, str], PrefectFuture[float, Sync]] = {}
+    for target, segment in forecast_jobs(targets):
+        _, reads = watermarks.FORECAST_INPUTS[target]
+        futures[(target, segment)] = forecast_target_task.submit(
+            target,
+            segment,
+            watermarks.forecast_input_mark(target, snap),
+            wait_for=[model_futures[m] for m in reads if m in model_futures],
+        )  # type: ignore[call-overload]
+    return futures
+
+
+def take_snapshot() -> watermarks.SourceSnapshot:
+    models = read_sql_models(default_sql_dir())
+    with get_engine().begin() as conn:
+        return watermarks.snapshot(conn, models)
+
+
+def plan_incremental() -> tuple[watermarks.Plan, watermarks.SourceSnapshot]:
+    models = read_sql_models(default_sql_dir())
+    snap = take_snapshot()
     with session_scope() as session:
-        for et, payload in events:
-            res = process_event(session, et, payload)
-            if res.status == "accepted":
-                accepted += 1
-            elif res.status == "duplicate":
-                duplicates += 1
-            else:
-                quarantined += 1
-    logger.info("Batch ingest results: accepted={} duplicates={} quarantined={}", accepted, duplicates, quarantined)
-    return {"accepted": accepted, "duplicates": duplicates, "quarantined": quarantined}
-
-
-@flow(name="daily-transform-and-forecast")
-def daily_transform_and_forecast() -> dict[str, int]:
-    transformations_task()
-    res = forecast_task()
-    return res
+        state = watermarks.load_state(session)
+    return watermarks.plan(models, snap, state), snap
+
+
+def _finish_stage(stage: str, reason: str | None, future: PrefectFuture[float, Sync]) -> str:
+    state = future.wait()
+    if state.is_completed():
+        duration = state.result()
+        status = "skipped" if state.name == "Cached" else "ran"
+        reason = "skipped: cached result for unchanged inputs" if status == "skipped" else reason
+        logger.info("Stage {} {} in {:.1f} ms ({})", stage, status, duration, reason)
+    else:
+        duration, status = None, "failed"
+        reason = f"{reason}; error: {state.message}"
+        logger.error("Stage {} failed: {}", stage, state.message)
+    with session_scope() as session:
+        watermarks.record_stage(session, stage, status, reason, duration)
+    return status
+
+
+@flow(name="daily-transform-and-forecast", task_runner=_task_runner())
+@traced("flow daily-transform-and-forecast", root="job")
+def daily_transform_and_forecast() -> dict[str, str]:
+    ensure_schema_task()
+    snap = take_snapshot()
+    model_futures = submit_transformations(snap)
+    forecast_futures = submit_forecasts(snap, model_futures)
+    refresh_variance_task.submit(wait_for=list(model_futures.values()) + list(forecast_futures.values()))  # type: ignore[call-overload]
+    return {f"{t}:{s}": f.wait().name or "unknown" for (t, s), f in forecast_futures.items()}
+
 
+@flow(name="incremental-transform-and-forecast", task_runner=_task_runner())
+@traced("flow incremental-transform-and-forecast", root="job")
+def incremental_transform_and_forecast() -> dict[str, str]:
+    """Run only the transformations and forecasts whose inputs moved past their high-water marks."""
+    plan, snap = plan_incremental()
+    inputs = watermarks.model_inputs(read_sql_models(default_sql_dir()))
+    outcome: dict[str, str] = {}
 
-@flow(name="scheduled-batch-ingestion")
+    model_futures = submit_transformations(snap, only=set(plan.models))
+    forecast_futures = submit_forecasts(snap, model_futures, targets=plan.targets)
+
+    for name, future in model_futures.items():
+        stage = f"transform:{name}"
+        outcome[stage] = _finish_stage(stage, plan.reasons.get(stage), future)
+        if outcome[stage] != "failed":
+            with session_scope() as session:
+                watermarks.mark_model_done(session, name, snap, inputs[name])
+    if plan.models:
+        refresh_variance_task()
+    failed_targets: set[str] = set()
+    for (target, segment), future in forecast_futures.items():
+        stage = f"forecast:{target}" if segment == "all" else f"forecast:{target}:{segment}"
+        outcome[stage] = _finish_stage(stage, plan.reasons.get(f"forecast:{target}"), future)
+        if outcome[stage] == "failed":
+            failed_targets.add(target)
+    with session_scope() as session:
+        for target in set(plan.targets) - failed_targets:
+            watermarks.mark_forecast_done(session, target, snap)
+
+    with session_scope() as session:
+        for stage, reason in plan.reasons.items():
+            if reason.startswith("skipped") and stage not in outcome:
+                watermarks.record_stage(session, stage, "skipped", reason)
+                outcome[stage] = "skipped"
+    return outcome
+
+
+@flow(name="scheduled-batch-ingestion", task_runner=_task_runner())
+@traced("flow scheduled-batch-ingestion", root="job")
 def scheduled_batch_ingestion(events: list[tuple[EventType, dict[str, Any]]]) -> dict[str, int]:
-    return batch_ingest_task(events)
+    # Partition by type and event date; partitions are ingested concurrently
+    partitions: dict[str, list[tuple[EventType, dict[str, Any]]]] = defaultdict(list)
+    for et, payload in events:
+        day = str(payload.get("event_time", ""))[:10] or "unknown"
+        partitions[f"{et}/dt={day}"].append((et, payload))
+    futures = [ingest_partition_task.submit(key, part) for key, part in sorted(partitions.items())]
+    return _count([f.result() for f in futures])
+
+
+@flow(name="backfill", task_runner=_task_runner())
+@traced("flow backfill", root="job")
+def backfill(
+    start_date: date,
+    end_date: date,
+    event_types: Optional[list[EventType]] = None,
+    max_parallel: Optional[int] = None,
+    run_downstream: bool = True,
+) -> dict[str, int]:
+    """Replay lake partitions raw/{type}/dt=... for a date range into the warehouse, then rebuild downstream."""
+    limit = max(1, max_parallel or settings.BACKFILL_MAX_PARALLEL)
+    types: list[EventType] = event_types or ["subscription", "payment", "usage", "cost"]
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    partitions = [(et, day) for day in days for et in types]
+    logger.info("Backfilling {} partitions from {} to {} ({} at a time)", len(partitions), start_date, end_date, limit)
+
+    ensure_schema_task()
+    results: list[dict[str, int]] = []
+    for i in range(0, len(partitions), limit):
+        window = [replay_lake_partition_task.submit(et, day) for et, day in partitions[i:i + limit]]
+        results.extend(f.result() for f in window)
+    totals = _count(results)
+
+    if run_downstream and totals.get("accepted"):
+        snap = take_snapshot()
+        model_futures = submit_transformations(snap)
+        forecast_futures = submit_forecasts(snap, model_futures)
+        refresh_variance_task.submit(wait_for=list(model_futures.values()) + list(forecast_futures.values())).wait()  # type: ignore[call-overload]
+    totals["partitions"] = len(partitions)
+    return totals
+
+
+@flow(name="bulk-ingestion")
+@traced("flow bulk-ingestion", root="job")
+def bulk_ingestion(
+    path: Optional[str] = None,
+    s3_prefix: Optional[str] = None,
+    event_type: Optional[EventType] = None,
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    use_processes: bool = False,
+) -> dict[str, Any]:
+    return batch_ingest_task(
+        path=path, s3_prefix=s3_prefix, event_type=event_type, chunk_size=chunk_size, workers=workers, use_processes=use_processes
+    )
+
+
+@flow(name="quarantine-reprocessing", task_runner=_task_runner())
+@traced("flow quarantine-reprocessing", root="job")
+def quarantine_reprocessing(
+    issue: Optional[str] = None,
+    event_types: Optional[list[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    partitions: Optional[int] = None,
+    dry_run: bool = False,
+    run_downstream: bool = True,
+) -> dict[str, Any]:
+    """Replay quarantined events under the current rules, one task per id partition, then rebuild downstream."""
+    n = max(1, partitions or settings.INGEST_WORKERS)
+    filters = {"issue": issue, "event_types": event_types, "since": since, "until": until}
+    futures = [reprocess_partition_task.submit((i, n), filters, dry_run) for i in range(n)]
+    report = ReprocessReport(dry_run=dry_run)
+    for f in futures:
+        report = report.merge(ReprocessReport.model_validate(f.result()))
+
+    if run_downstream and report.moved and not dry_run:
+        snap = take_snapshot()
+        model_futures = submit_transformations(snap)
+        forecast_futures = submit_forecasts(snap, model_futures)
+        refresh_variance_task.submit(wait_for=list(model_futures.values()) + list(forecast_futures.values())).wait()  # type: ignore[call-overload]
+    return report.model_dump()
+
+
+@flow(name="payload-tiering", task_runner=_task_runner())
+@traced("flow payload-tiering", root="job")
+def payload_tiering(older_than_days: Optional[float] = None, dry_run: bool = False, vacuum: bool = True) -> dict[str, Any]:
+    """Strip old events_raw payloads to their staged fields, one task per event shard; the lake keeps them whole."""
+    futures = [tier_payloads_task.submit(shard, older_than_days, dry_run, vacuum) for shard in range(shard_count())]
+    reports = [TieringReport.model_validate(f.result()) for f in futures]
+    by_type: Counter[str] = Counter()
+    for report in reports:
+        by_type.update(report.by_type)
+    return {
+        "tiered": sum(r.tiered for r in reports), "chunks": sum(r.chunks for r in reports), "dry_run": dry_run,
+        "seconds": max(r.seconds for r in reports), "by_type": dict(sorted(by_type.items())),
+    }
+
+
+@flow(name="lake-compaction")
+@traced("flow lake-compaction", root="job")
+def lake_compaction(full: bool = False) -> dict[str, int]:
+    """Rewrite settled lake partitions as Parquet for the lake analytics backend."""
+    return compact_lake_task(full)
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import JSON, DateTime, Float, Index, Integer, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from platform_common.db import Base
+
+
+class PipelineWatermark(Base):
+    __tablename__ = "pipeline_watermarks"
+
+    # e.g. transform:020_fact_revenue_daily
+    name: Mapped[str] = mapped_column(String(128), primary_key=True)
+    value: Mapped[dict] = mapped_column(JSON, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class PipelineStageRun(Base):
+    __tablename__ = "pipeline_stage_runs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    stage: Mapped[str] = mapped_column(String(128), nullable=False)  # transform:<model> or forecast:<target>
+    status: Mapped[str] = mapped_column(String(16), nullable=False)  # ran, skipped, failed
+    reason: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    duration_ms: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_pipeline_stage_runs_stage_started", "stage", "started_at"),
+    )
@@ -1,23 +1,48 @@
 from __future__ import annotations
 
-import os
 import time
 from loguru import logger
+from prometheus_client import start_http_server
 
-from .flows import daily_transform_and_forecast
+from platform_common.config import settings
+from platform_common.migrations import migrate
+
+from .flows import incremental_transform_and_forecast, plan_incremental
 
 
 def main() -> None:
-    interval = int(os.getenv("SCHEDULE_INTERVAL_SECONDS", "3600"))
-    logger.info("Scheduler starting, interval={}s", interval)
+    poll = settings.SCHEDULER_POLL_SECONDS
+    debounce = settings.SCHEDULER_DEBOUNCE_SECONDS
+    max_delay = settings.SCHEDULER_MAX_DELAY_SECONDS
+    logger.info("Scheduler starting, poll={}s debounce={}s max_delay={}s", poll, debounce, max_delay)
+    if settings.SCHEDULER_METRICS_PORT:
+        # Transformation and forecast timings are recorded in this process
+        start_http_server(settings.SCHEDULER_METRICS_PORT)
+
+    # Schema once at boot; transformation models are run by the flow itself
+    migrate(include_transformations=False)
+
+    last_snapshot = None
+    last_change = pending_since = time.monotonic()
     while True:
         try:
-            logger.info("Running daily_transform_and_forecast flow")
-            res = daily_transform_and_forecast()
-            logger.info("Flow result: {}", res)
+            plan, snap = plan_incremental()
+            now = time.monotonic()
+            if snap != last_snapshot:
+                last_snapshot, last_change = snap, now
+            if not plan.has_work:
+                pending_since = now
+            elif now - last_change >= debounce or now - pending_since >= max_delay:
+                # Bursts are coalesced: run once the marks have been quiet for the debounce window
+                logger.info("Running incremental flow: models={} targets={}", plan.models, plan.targets)
+                res = incremental_transform_and_forecast()
+                logger.info("Flow result: {}", res)
+                pending_since = time.monotonic()
+            else:
+                logger.debug("Debouncing {} pending stages", len(plan.models) + len(plan.targets))
         except Exception:
-            logger.exception("Flow run failed")
-        time.sleep(interval)
+            logger.exception("Scheduler cycle failed")
+        time.sleep(poll)
 
 
 if __name__ == "__main__":
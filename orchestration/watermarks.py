@@ -0,0 +1,213 @@
+"""High-water marks and change detection for the incremental scheduler."""
+from __future__ import annotations
+
+import hashlib
+import re
+from datetime import datetime
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from orchestration.models import PipelineStageRun, PipelineWatermark
+from platform_common.config import settings
+from platform_common.db import scatter
+
+
+EVENT_TYPES = ("subscription", "payment", "usage", "cost")
+
+# Forecast target -> (event types it is fit on, transformation models it reads)
+FORECAST_INPUTS: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {
+    "revenue_daily": (("payment",), ("002_stg_payment_events", "020_fact_revenue_daily")),
+    "subscriptions_daily": (("subscription",), ("001_stg_subscription_events", "013_dim_time", "023_fact_subscriptions_snapshot")),
+}
+
+_CREATES = re.compile(r"create\s+(?:or\s+replace\s+)?(?:view|table|materialized\s+view)\s+(?:if\s+not\s+exists\s+)?(\w+)", re.I)
+_EVENT_FILTER = re.compile(r"event_type\s*=\s*'(\w+)'", re.I)
+_ONLY_VIEW = re.compile(r"(?:\s|--[^\n]*\n)*create\s+or\s+replace\s+view\b[^;]*;?\s*", re.I)
+
+
+class SourceSnapshot(BaseModel):
+    events: dict[str, Optional[datetime]] = Field(default_factory=dict)  # max(inserted_at) per event type
+    runs: dict[str, tuple[int, datetime]] = Field(default_factory=dict)  # latest total (segment 'all') run (id, created_at) per target
+    checksums: dict[str, str] = Field(default_factory=dict)  # transformation model -> sql sha256
+
+
+class Plan(BaseModel):
+    models: list[str] = Field(default_factory=list)
+    targets: list[str] = Field(default_factory=list)
+    reasons: dict[str, str] = Field(default_factory=dict)  # stage -> why it runs or is skipped
+
+    @property
+    def has_work(self) -> bool:
+        return bool(self.models or self.targets)
+
+
+def is_view_only(sql: str) -> bool:
+    """Views are computed on read, so new events never require re-running them."""
+    return _ONLY_VIEW.fullmatch(sql) is not None
+
+
+def model_inputs(models: list[tuple[str, str]]) -> dict[str, set[str]]:
+    """Event types each model reads, resolved through upstream models in file order."""
+    owner: dict[str, str] = {}
+    for name, sql in models:
+        for obj in _CREATES.findall(sql):
+            owner[obj.lower()] = name
+
+    inputs: dict[str, set[str]] = {}
+    for name, sql in models:
+        lowered = sql.lower()
+        types: set[str] = set()
+        if re.search(r"\bevents_raw\b", lowered):
+            filtered = set(_EVENT_FILTER.findall(sql))
+            types |= filtered or set(EVENT_TYPES)
+        for obj, upstream in owner.items():
+            if upstream != name and upstream in inputs and re.search(rf"\b{obj}\b", lowered):
+                types |= inputs[upstream]
+        inputs[name] = types
+    return inputs
+
+
+def upstream_models(models: list[tuple[str, str]]) -> dict[str, set[str]]:
+    owner: dict[str, str] = {}
+    for name, sql in models:
+        for obj in _CREATES.findall(sql):
+            owner[obj.lower()] = name
+    return {
+        name: {up for obj, up in owner.items() if up != name and re.search(rf"\b{obj}\b", sql.lower())}
+        for name, sql in models
+    }
+
+
+def checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def _event_marks(conn: Connection) -> dict[str, Optional[datetime]]:
+    # One index-only lookup per type on ix_events_raw_type_inserted_at instead of a grouped scan
+    return {
+        et: conn.execute(text("select max(inserted_at) from events_raw where event_type = :t"), {"t": et}).scalar()
+        for et in EVENT_TYPES
+    }
+
+
+def _shard_event_marks(engine: Engine) -> dict[str, Optional[datetime]]:
+    with engine.connect() as conn:
+        return _event_marks(conn)
+
+
+def snapshot(conn: Connection, models: list[tuple[str, str]]) -> SourceSnapshot:
+    """Event marks from the event shards (conn's database when unsharded); runs from conn's database."""
+    if settings.SHARD_DSNS:
+        per_shard = scatter(_shard_event_marks, read=False)
+        events = {et: max((mark for m in per_shard if (mark := m[et]) is not None), default=None) for et in EVENT_TYPES}
+    else:
+        events = _event_marks(conn)
+    runs = {
+        target: (run_id, created_at)
+        for target, run_id, created_at in conn.execute(
+            text("select distinct on (target) target, id, created_at from model_runs where segment = 'all' order by target, id desc")
+        )
+    }
+    return SourceSnapshot(events=events, runs=runs, checksums={name: checksum(sql) for name, sql in models})
+
+
+def load_state(session: Session) -> dict[str, dict[str, Any]]:
+    return {wm.name: wm.value for wm in session.scalars(select(PipelineWatermark))}
+
+
+def _newer(types: set[str] | tuple[str, ...], current: dict[str, Optional[datetime]], seen: dict[str, Any]) -> list[str]:
+    changed = []
+    for et in sorted(types):
+        cur = current.get(et)
+        if cur is None:
+            continue
+        prev = seen.get(et)
+        if prev is None or cur > datetime.fromisoformat(prev):
+            changed.append(et)
+    return changed
+
+
+def plan(models: list[tuple[str, str]], snap: SourceSnapshot, state: dict[str, dict[str, Any]]) -> Plan:
+    inputs = model_inputs(models)
+    upstream = upstream_models(models)
+    result = Plan()
+    redefined: set[str] = set()
+
+    for name, sql in models:
+        stage = f"transform:{name}"
+        prev = state.get(stage)
+        if prev is None:
+            result.models.append(name)
+            redefined.add(name)
+            result.reasons[stage] = "never run"
+        elif prev.get("checksum") != snap.checksums[name]:
+            result.models.append(name)
+            redefined.add(name)
+            result.reasons[stage] = "definition changed"
+        elif is_view_only(sql):
+            result.reasons[stage] = "skipped: view with unchanged definition"
+        elif upstream[name] & set(result.models):
+            result.models.append(name)
+            result.reasons[stage] = "upstream re-run: " + ",".join(sorted(upstream[name] & set(result.models)))
+        else:
+            changed = _newer(inputs[name], snap.events, prev.get("inputs", {}))
+            if changed:
+                result.models.append(name)
+                result.reasons[stage] = "new events: " + ",".join(changed)
+            else:
+                result.reasons[stage] = "skipped: no new input events"
+
+    for target, (types, reads) in FORECAST_INPUTS.items():
+        stage = f"forecast:{target}"
+        last = snap.runs.get(target)
+        if last is not None:
+            run_id, created_at = last
+            since, seen = f"run {run_id}", {et: created_at.isoformat() for et in types}
+        elif stage in state:
+            # Forecast before without a run: there was nothing to fit on
+            since, seen = "the last attempt", state[stage].get("inputs", {})
+        else:
+            result.targets.append(target)
+            result.reasons[stage] = "no previous run"
+            continue
+        changed = _newer(types, snap.events, seen)
+        if changed:
+            result.targets.append(target)
+            result.reasons[stage] = f"new events since {since}: " + ",".join(changed)
+        elif redefined & set(reads):
+            result.targets.append(target)
+            result.reasons[stage] = "input model redefined: " + ",".join(sorted(redefined & set(reads)))
+        else:
+            result.reasons[stage] = f"skipped: no new events since {since}"
+    return result
+
+
+def mark_model_done(session: Session, name: str, snap: SourceSnapshot, types: set[str]) -> None:
+    # Store the marks seen at planning time so rows landing mid-run are picked up next cycle
+    value = {
+        "checksum": snap.checksums[name],
+        "inputs": {et: ts.isoformat() for et, ts in snap.events.items() if et in types and ts is not None},
+    }
+    session.merge(PipelineWatermark(name=f"transform:{name}", value=value))
+
+
+def mark_forecast_done(session: Session, target: str, snap: SourceSnapshot) -> None:
+    # Kept even when no run was recorded, so a target with nothing to fit waits for new events
+    types, _ = FORECAST_INPUTS[target]
+    value = {"inputs": {et: ts.isoformat() for et, ts in snap.events.items() if et in types and ts is not None}}
+    session.merge(PipelineWatermark(name=f"forecast:{target}", value=value))
+
+
+def record_stage(session: Session, stage: str, status: str, reason: Optional[str] = None, duration_ms: Optional[float] = None) -> None:
+    session.add(PipelineStageRun(stage=stage, status=status, reason=reason, duration_ms=duration_ms))
+
+
+def forecast_input_mark(target: str, snap: SourceSnapshot) -> str:
+    """Digest of everything a forecast reads; used as its task cache input."""
+    types, reads = FORECAST_INPUTS[target]
+    parts = [f"{et}={snap.events.get(et)}" for et in types] + [f"{name}={snap.checksums.get(name)}" for name in reads]
+    return checksum("|".join(parts))
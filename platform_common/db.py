@@ -1,13 +1,25 @@
 from __future__ import annotations
 
+import contextvars
+import hashlib
+import itertools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator
+from contextvars import ContextVar
+from typing import Any, Callable, Generator, Optional, TypeVar
 
-from sqlalchemy import create_engine
+from loguru import logger
+from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import DeclarativeBase, sessionmaker, Session
+from sqlalchemy.pool import QueuePool
 
 from .config import settings
+from .tracing import span
 
 
 class Base(DeclarativeBase):
@@ -16,29 +28,296 @@ class Base(DeclarativeBase):
 
 _engine: Engine | None = None
 _SessionLocal: sessionmaker[Session] | None = None
+_replicas: list[_Replica] | None = None
+_replicas_lock = threading.Lock()
+_next_replica = itertools.count()
+_shards: list[Engine] | None = None
+_shard_sessions: dict[int, sessionmaker[Session]] = {}
+_shards_lock = threading.Lock()
+_scatter_pool: ThreadPoolExecutor | None = None
+
+T = TypeVar("T")
+
+PRIMARY = "primary"
+# Read routing for the current context: None reads from any replica within READ_MAX_LAG_SECONDS,
+# PRIMARY from the primary, anything else is a primary WAL position (LSN) a replica must have replayed
+_read_after: ContextVar[Optional[str]] = ContextVar("ffdp_read_after", default=None)
+
+_LAG_SQL = """
+    select case when not pg_is_in_recovery() then 0
+                -- Caught up only while still streaming: a disconnected standby has replayed all it received
+                when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                     and exists (select 1 from pg_stat_wal_receiver where status = 'streaming') then 0
+                else extract(epoch from now() - pg_last_xact_replay_timestamp()) end as lag,
+           case when pg_is_in_recovery() then pg_last_wal_replay_lsn()::text end as replayed
+"""
 
 
 def get_engine() -> Engine:
     global _engine
     if _engine is None:
         _engine = create_engine(settings.POSTGRES_DSN, pool_pre_ping=True, future=True)
+        from .metrics import instrument_engine
+
+        instrument_engine(_engine)
     return _engine
 
 
-def get_sessionmaker() -> sessionmaker[Session]:
+def _pool_stats(engine: Engine | None) -> dict[str, int]:
+    if engine is None or not isinstance(engine.pool, QueuePool):
+        return {}
+    pool = engine.pool
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "idle": pool.checkedin(), "overflow": max(pool.overflow(), 0)}
+
+
+def pool_stats() -> dict[str, int]:
+    """Connection pool state of the cached engine; empty until the engine is created."""
+    return _pool_stats(_engine)
+
+
+def read_pool_stats() -> dict[str, dict[str, int]]:
+    """Pool state per read replica; empty until the first routed read."""
+    return {replica.name: _pool_stats(replica.engine) for replica in _replicas or ()}
+
+
+def shard_pool_stats() -> dict[str, dict[str, int]]:
+    """Pool state per event shard; empty until the first sharded query or when unsharded."""
+    return {str(i): _pool_stats(engine) for i, engine in enumerate(_shards or ())}
+
+
+_LSN = re.compile(r"^[0-9A-Fa-f]+/[0-9A-Fa-f]+$")
+
+
+def _lsn(value: str) -> int:
+    high, low = value.split("/")
+    return int(high, 16) << 32 | int(low, 16)
+
+
+class _Replica:
+    """A read replica's engine and its last measured lag, reused for READ_LAG_CHECK_SECONDS."""
+
+    def __init__(self, dsn: str) -> None:
+        self.engine = create_engine(dsn, pool_pre_ping=True, pool_size=settings.READ_POOL_SIZE, future=True)
+        url = self.engine.url
+        self.name = f"{url.host}:{url.port}/{url.database}"
+        self.lag: Optional[float] = None  # None: unreachable, or nothing replayed yet
+        self.replayed: Optional[int] = None  # replayed WAL position; None when it is not a standby
+        self.checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def probe(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self.checked_at < settings.READ_LAG_CHECK_SECONDS:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self.checked_at < settings.READ_LAG_CHECK_SECONDS:
+                return  # another thread probed while this one waited
+            lag: Optional[float] = 0.0
+            replayed: Optional[int] = None
+            try:
+                with self.engine.connect() as conn:
+                    if conn.dialect.name == "postgresql":
+                        row = conn.execute(text(_LAG_SQL)).one()
+                        lag = None if row.lag is None else float(row.lag)
+                        replayed = None if row.replayed is None else _lsn(row.replayed)
+            except SQLAlchemyError as exc:
+                logger.warning("Read replica {} unavailable: {}", self.name, exc)
+                lag = None
+            self.lag, self.replayed, self.checked_at = lag, replayed, time.monotonic()
+            from .metrics import DB_REPLICA_LAG_SECONDS
+
+            DB_REPLICA_LAG_SECONDS.labels(self.name).set(-1 if lag is None else lag)
+
+    def usable(self, after: Optional[int]) -> bool:
+        self.probe()
+        if after is not None and self.replayed is not None and self.replayed < after:
+            self.probe(force=True)  # the cached position may predate the write being waited for
+            if self.replayed is not None and self.replayed < after:
+                return False
+        return self.lag is not None and self.lag <= settings.READ_MAX_LAG_SECONDS
+
+
+def _get_replicas() -> list[_Replica]:
+    global _replicas
+    if _replicas is None:
+        with _replicas_lock:
+            if _replicas is None:
+                from .metrics import instrument_engine
+
+                replicas = [_Replica(dsn) for dsn in settings.READ_DSNS]
+                for replica in replicas:
+                    instrument_engine(replica.engine)
+                _replicas = replicas
+    return _replicas
+
+
+def get_read_engine() -> Engine:
+    """Engine for reads that tolerate replication lag: a replica within READ_MAX_LAG_SECONDS, else the primary.
+
+    Replicas are taken round robin; inside read_your_writes() the primary, or replicas that have caught up.
+    """
+    replicas = _get_replicas()
+    if not replicas:
+        return get_engine()
+    from .metrics import READ_ROUTE
+
+    after = _read_after.get()
+    if after == PRIMARY:
+        READ_ROUTE["read_your_writes"].inc()
+        return get_engine()
+    position = None if after is None else _lsn(after)
+    start = next(_next_replica)
+    for i in range(len(replicas)):
+        replica = replicas[(start + i) % len(replicas)]
+        if replica.usable(position):
+            READ_ROUTE["replica"].inc()
+            return replica.engine
+    READ_ROUTE["fallback"].inc()
+    return get_engine()
+
+
+def primary_lsn() -> Optional[str]:
+    """The primary's current WAL position, covering every write committed so far; None without replicas."""
+    if not settings.READ_DSNS:
+        return None
+    with get_engine().connect() as conn:
+        if conn.dialect.name != "postgresql":
+            return None
+        return str(conn.execute(text("select pg_current_wal_lsn()::text")).scalar_one())
+
+
+@contextmanager
+def read_your_writes(lsn: Optional[str] = None) -> Generator[None, None, None]:
+    """Route get_read_engine() in this context to the primary, or, given primary_lsn() taken after the
+    writes, to replicas that have replayed them. Raises ValueError for an lsn that is not a WAL position."""
+    if lsn is not None and not _LSN.match(lsn):
+        raise ValueError(f"not a WAL position: {lsn!r}")
+    token = _read_after.set(lsn or PRIMARY)
+    try:
+        yield
+    finally:
+        _read_after.reset(token)
+
+
+class ReadYourWritesMiddleware:
+    """Per-request override: "X-Read-Your-Writes: 1" reads from the primary, an LSN from a caught-up replica."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        value = None
+        if scope["type"] == "http":
+            value = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"x-read-your-writes"), None)
+        if not value:
+            await self.app(scope, receive, send)
+            return
+        if "/" in value and not _LSN.match(value):
+            from starlette.responses import JSONResponse
+
+            response = JSONResponse(status_code=400, content={"detail": "X-Read-Your-Writes must be 1 or a WAL position like 0/16B3748"})
+            await response(scope, receive, send)
+            return
+        with read_your_writes(value if "/" in value else None):
+            await self.app(scope, receive, send)
+
+
+def shard_count() -> int:
+    return len(settings.SHARD_DSNS) or 1
+
+
+def _jump(key: int, buckets: int) -> int:
+    # Jump consistent hash (Lamping and Veach): growing from n to n + 1 buckets moves only 1/(n + 1) of the keys
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(customer_id: str) -> int:
+    """The event shard of a customer; the same in every process (unlike hash())."""
+    n = shard_count()
+    if n == 1:
+        return 0
+    return _jump(int.from_bytes(hashlib.blake2b(customer_id.encode(), digest_size=8).digest(), "big"), n)
+
+
+def get_shard_engines() -> list[Engine]:
+    """One engine per event shard (SHARD_DSNS); the primary's engine alone when unsharded."""
+    global _shards
+    if not settings.SHARD_DSNS:
+        return [get_engine()]
+    if _shards is None:
+        with _shards_lock:
+            if _shards is None:
+                from .metrics import instrument_engine
+
+                shards = [create_engine(dsn, pool_pre_ping=True, pool_size=settings.SHARD_POOL_SIZE, future=True) for dsn in settings.SHARD_DSNS]
+                for engine in shards:
+                    instrument_engine(engine)
+                _shards = shards
+    return _shards
+
+
+def scatter(fn: Callable[[Engine], T], read: bool = True) -> list[T]:
+    """fn(engine) on every event shard at once; results in shard order.
+
+    Unsharded it is one call, on get_read_engine() for reads (read=True) and on the primary otherwise. Each call
+    runs in a copy of the caller's context, so route labels and query tags carry over to the worker threads.
+    """
+    global _scatter_pool
+    if not settings.SHARD_DSNS:
+        return [fn(get_read_engine() if read else get_engine())]
+    engines = get_shard_engines()
+    if _scatter_pool is None:
+        with _shards_lock:
+            if _scatter_pool is None:
+                _scatter_pool = ThreadPoolExecutor(max_workers=len(engines) * settings.SHARD_POOL_SIZE, thread_name_prefix="shard")
+    futures = [_scatter_pool.submit(contextvars.copy_context().run, fn, engine) for engine in engines]
+    return [future.result() for future in futures]
+
+
+def get_sessionmaker(shard: Optional[int] = None) -> sessionmaker[Session]:
+    """Sessions on the primary, or with a shard number on that event shard (the primary when unsharded)."""
     global _SessionLocal
+    if shard is not None and settings.SHARD_DSNS:
+        factory = _shard_sessions.get(shard)
+        if factory is None:
+            factory = _shard_sessions.setdefault(
+                shard, sessionmaker(bind=get_shard_engines()[shard], autoflush=False, autocommit=False, expire_on_commit=False)
+            )
+        return factory
     if _SessionLocal is None:
         _SessionLocal = sessionmaker(bind=get_engine(), autoflush=False, autocommit=False, expire_on_commit=False)
     return _SessionLocal
 
 
+def reset_engine() -> None:
+    """Forget the cached engines, e.g. in a forked worker so it opens its own connections."""
+    global _engine, _SessionLocal, _replicas, _shards, _scatter_pool
+    if _engine is not None:
+        _engine.dispose(close=False)
+    for replica in _replicas or ():
+        replica.engine.dispose(close=False)
+    for engine in _shards or ():
+        engine.dispose(close=False)
+    _engine = None
+    _SessionLocal = None
+    _replicas = None
+    _shards = None
+    _shard_sessions.clear()
+    _scatter_pool = None  # threads do not survive a fork; the old pool's idle workers exit with the process
+
+
 @contextmanager
-def session_scope() -> Generator[Session, None, None]:
-    SessionLocal = get_sessionmaker()
+def session_scope(shard: Optional[int] = None) -> Generator[Session, None, None]:
+    SessionLocal = get_sessionmaker(shard)
     session = SessionLocal()
     try:
         yield session
-        session.commit()
+        with span("db.commit"):
+            session.commit()
     except Exception:
         session.rollback()
         raise
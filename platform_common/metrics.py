@@ -0,0 +1,242 @@
+"""Prometheus metrics shared by the services, flows and forecasting jobs."""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from . import tracing
+from .config import settings
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+    from sqlalchemy.engine import Engine
+
+# Sub-millisecond buckets for per-event stages, up to seconds for queries and fits
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_SLOW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+INGEST_STAGE_SECONDS = Histogram(
+    "ffdp_ingest_stage_seconds", "Time per ingestion stage for one event", ["stage"], buckets=_FAST_BUCKETS
+)
+INGEST_BATCH_VALIDATE_SECONDS = Histogram(
+    "ffdp_ingest_batch_validate_seconds", "Time to validate one ingestion batch", buckets=_FAST_BUCKETS
+)
+INGEST_BATCH_STAGE_SECONDS = Histogram(
+    "ffdp_ingest_batch_stage_seconds", "Time per ingestion stage for one batch of events", ["stage"], buckets=_FAST_BUCKETS
+)
+INGEST_EVENTS = Counter("ffdp_ingest_events_total", "Ingested events by outcome", ["event_type", "status"])
+QUALITY_ISSUES = Counter("ffdp_quality_issues_total", "Data quality issues raised", ["event_type", "issue"])
+INGEST_THROTTLED = Counter("ffdp_ingest_throttled_total", "Ingestion requests refused by a rate limit", ["limit", "tenant"])
+INGEST_SHED = Counter("ffdp_ingest_shed_total", "Ingestion requests shed by admission control", ["endpoint", "reason"])
+INGEST_ADMISSION_IN_FLIGHT = Gauge("ffdp_ingest_admission_in_flight", "Ingestion requests holding a concurrency slot", ["endpoint"])
+INGEST_ADMISSION_QUEUED = Gauge("ffdp_ingest_admission_queued", "Ingestion requests waiting for a concurrency slot", ["endpoint"])
+PAYLOADS_TIERED = Counter("ffdp_payloads_tiered_total", "events_raw payloads stripped to their staged fields", ["event_type"])
+PAYLOAD_LAKE_LOADS = Counter("ffdp_payload_lake_loads_total", "Full payloads of tiered events asked for, by where they came from", ["source"])
+
+S3_REQUEST_SECONDS = Histogram("ffdp_s3_request_seconds", "S3 call latency", ["operation"], buckets=_FAST_BUCKETS)
+S3_IN_FLIGHT = Gauge("ffdp_s3_requests_in_flight", "S3 calls currently in progress")
+
+SPOOL_APPENDED = Counter("ffdp_spool_appended_total", "Records appended to the ingestion spool")
+SPOOL_DRAINED = Counter("ffdp_spool_drained_total", "Spooled records applied to the database")
+SPOOL_DEAD_LETTERED = Counter("ffdp_spool_dead_lettered_total", "Spooled records set aside because they can never be applied")
+SPOOL_FSYNC_SECONDS = Histogram("ffdp_spool_fsync_seconds", "Time for one group commit of the spool", buckets=_FAST_BUCKETS)
+SPOOL_FSYNC_RECORDS = Histogram(
+    "ffdp_spool_fsync_records", "Records made durable by one group commit", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+SPOOL_DRAIN_SECONDS = Histogram("ffdp_spool_drain_seconds", "Time to apply one batch of spooled records", buckets=_SLOW_BUCKETS)
+SPOOL_LAG_RECORDS = Gauge("ffdp_spool_lag_records", "Durable spool records not yet applied to the database")
+SPOOL_LAG_BYTES = Gauge("ffdp_spool_lag_bytes", "Bytes of durable spool records not yet applied to the database")
+SPOOL_LAG_SECONDS = Gauge("ffdp_spool_lag_seconds", "Age of the oldest spool record not yet applied to the database")
+
+DB_READ_ROUTE = Counter("ffdp_db_read_route_total", "Lag-tolerant reads by where they were routed", ["target"])
+DB_REPLICA_LAG_SECONDS = Gauge("ffdp_db_replica_lag_seconds", "Last measured replication lag per read replica; -1 when unreachable", ["replica"])
+DB_QUERY_SECONDS = Histogram("ffdp_db_query_seconds", "SQL statement latency by calling route", ["route"], buckets=_FAST_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram(
+    "ffdp_http_request_seconds", "HTTP request latency", ["app", "method", "route", "status"], buckets=_FAST_BUCKETS
+)
+
+LAKE_QUERY_SECONDS = Histogram("ffdp_lake_query_seconds", "DuckDB query time over the lake", ["query"], buckets=_SLOW_BUCKETS)
+TRANSFORM_MODEL_SECONDS = Histogram("ffdp_transform_model_seconds", "Transformation model run time", ["model"], buckets=_SLOW_BUCKETS)
+FORECAST_FIT_SECONDS = Histogram("ffdp_forecast_fit_seconds", "Forecast model fit time", ["target", "model"], buckets=_SLOW_BUCKETS)
+FORECAST_CACHE_LOADS = Counter("ffdp_forecast_cache_loads_total", "Forecast runs loaded into the serving cache")
+
+@contextmanager
+def s3_call(operation: str) -> Iterator[None]:
+    with tracing.span(f"s3 {operation}", {"rpc.system": "aws-api", "rpc.service": "S3", "rpc.method": operation}):
+        if not _enabled:
+            yield
+            return
+        S3_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            S3_IN_FLIGHT.dec()
+            S3_REQUEST_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+# Children are resolved once; .labels() on every event would cost more than the observation
+STAGE = {name: INGEST_STAGE_SECONDS.labels(name) for name in ("validate", "dedup_lookup", "quality", "s3_put", "db_flush")}
+READ_ROUTE = {name: DB_READ_ROUTE.labels(name) for name in ("replica", "fallback", "read_your_writes")}
+INGEST_BATCH_STAGE = {name: INGEST_BATCH_STAGE_SECONDS.labels(name) for name in ("dedup_lookup", "quality", "s3_put", "db_flush")}
+
+# ASGI scope of the request being served; the router records the matched route in it, so DB time
+# can be attributed to a route template without unbounded statement labels
+current_scope: ContextVar[Optional[dict[str, Any]]] = ContextVar("ffdp_current_scope", default=None)
+
+_enabled = settings.METRICS_ENABLED
+_event_children: dict[tuple[str, str], Any] = {}
+_issue_children: dict[tuple[str, str], Any] = {}
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool) -> None:
+    """Toggle recording at runtime, e.g. to measure the instrumentation overhead."""
+    global _enabled
+    _enabled = value
+
+
+class timed:
+    """Observe elapsed seconds on a histogram (or labelled child); a class is cheaper than @contextmanager."""
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Any) -> None:
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        if _enabled:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        if _enabled and self.started:
+            self.histogram.observe(time.perf_counter() - self.started)
+
+
+def count_event(event_type: str, status: str, issues: Optional[list[str]] = None) -> None:
+    if not _enabled:
+        return
+    key = (event_type, status)
+    child = _event_children.get(key)
+    if child is None:
+        child = _event_children[key] = INGEST_EVENTS.labels(event_type, status)
+    child.inc()
+    for issue in issues or ():
+        ikey = (event_type, issue)
+        ichild = _issue_children.get(ikey)
+        if ichild is None:
+            ichild = _issue_children[ikey] = QUALITY_ISSUES.labels(event_type, issue)
+        ichild.inc()
+
+
+def _route(scope: Optional[dict[str, Any]]) -> str:
+    if scope is None:
+        return "none"
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class _PoolCollector(Collector):
+    """Reads SQLAlchemy pool state at scrape time instead of tracking every checkout."""
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        from .db import pool_stats, read_pool_stats, shard_pool_stats
+
+        family = GaugeMetricFamily("ffdp_db_pool_connections", "SQLAlchemy connection pool state", labels=["state"])
+        for state, value in pool_stats().items():
+            family.add_metric([state], value)
+        yield family
+        replicas = GaugeMetricFamily("ffdp_db_read_pool_connections", "Connection pool state per read replica", labels=["replica", "state"])
+        for name, stats in read_pool_stats().items():
+            for state, value in stats.items():
+                replicas.add_metric([name, state], value)
+        yield replicas
+        shards = GaugeMetricFamily("ffdp_db_shard_pool_connections", "Connection pool state per event shard", labels=["shard", "state"])
+        for name, stats in shard_pool_stats().items():
+            for state, value in stats.items():
+                shards.add_metric([name, state], value)
+        yield shards
+
+
+REGISTRY.register(_PoolCollector())
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Time every statement on the engine, labelled with the current route, and feed the query profiler; in a
+    sampled trace each statement is also a span."""
+    from sqlalchemy import event
+
+    from . import query_profiles
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool) -> None:
+        conn.info["ffdp_query_start"] = time.perf_counter()
+        conn.info["ffdp_query_span"] = tracing.start_statement(engine.dialect.name, statement, executemany)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool) -> None:
+        elapsed = time.perf_counter() - conn.info["ffdp_query_start"]
+        tracing.end(conn.info.pop("ffdp_query_span", None))
+        if _enabled:
+            DB_QUERY_SECONDS.labels(_route(current_scope.get())).observe(elapsed)
+        if settings.QUERY_PROFILING_ENABLED:
+            query_profiles.record(engine, statement, parameters, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context: Any) -> None:
+        if context.connection is not None:
+            tracing.end(context.connection.info.pop("ffdp_query_span", None), context.original_exception)
+
+
+class MetricsMiddleware:
+    """Pure ASGI request timing; BaseHTTPMiddleware costs ~100us per request in an extra task."""
+
+    def __init__(self, app: Any, name: str) -> None:
+        self.app = app
+        self.name = name
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not _enabled or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_scope.reset(token)
+            # Route templates keep label cardinality bounded (/ingest/{event_type}, not every path)
+            HTTP_REQUEST_SECONDS.labels(self.name, scope["method"], _route(scope), str(status)).observe(time.perf_counter() - started)
+
+
+def instrument_app(app: FastAPI, name: str) -> None:
+    """Add request timing and tracing middleware and a /metrics endpoint to a FastAPI app."""
+    from starlette.requests import Request
+    from starlette.responses import Response
+
+    app.add_middleware(MetricsMiddleware, name=name)
+    app.add_middleware(tracing.TracingMiddleware, name=name)  # outermost: its span covers the metrics too
+
+    # A plain Starlette route: exact match, so /metrics/<name> analytics endpoints are unaffected
+    async def metrics(request: Request) -> Response:
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+    app.add_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,173 @@
+"""Versioned schema setup. Each step runs once per database and is recorded in schema_migrations,
+so service boots only pay for one lookup once the database is current. With SHARD_DSNS every shard gets the
+tables and the transformation models; the primary gets the tables only, as it holds no events.
+
+    python -m platform_common.migrations            # tables, indexes and transformation models
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Callable, Optional
+
+from loguru import logger
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .config import settings
+from .db import Base, get_engine, get_shard_engines
+
+TRANSFORMATIONS = "transformations"
+_LOCK_KEY = 0x66666470  # pg advisory lock shared by every booting service
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", String(128), primary_key=True),
+    Column("checksum", String(64), nullable=True),  # transformation SQL digest; null for schema steps
+    Column("applied_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+
+def register_models() -> None:
+    """Import every model module so Base.metadata knows all tables."""
+    from ingestion.app import models as _ingestion_models  # noqa: F401
+    from forecasting import models as _forecast_models  # noqa: F401
+    from orchestration import models as _orchestration_models  # noqa: F401
+    from platform_common import query_profiles as _query_profiles  # noqa: F401
+
+
+def _create_missing_tables(conn: Connection) -> None:
+    Base.metadata.create_all(bind=conn)
+
+
+def _create_indexes(conn: Connection, names: set[str]) -> None:
+    """Create the named indexes of the current models where missing. By name, not all of them: an index a
+    later step introduces may need columns that step has yet to add."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+def _segments_and_indexes(conn: Connection) -> None:
+    # Databases created before model_runs.segment; create_all never alters existing tables
+    if "segment" not in {c["name"] for c in inspect(conn).get_columns("model_runs")}:
+        conn.execute(text("alter table model_runs add column segment varchar(64) not null default 'all'"))
+    _create_indexes(conn, {
+        "ix_events_raw_type_inserted_at",
+        "ix_model_runs_target_segment_id",
+        "ix_forecast_revenue_daily_run_date",
+        "ix_forecast_subscriptions_daily_run_date",
+        "ux_fact_forecast_variance_run_segment_date",
+        "ix_backtest_results_target_segment_model",
+        "ix_pipeline_stage_runs_stage_started",
+    })
+
+
+def _inserted_at_index(conn: Connection) -> None:
+    _create_indexes(conn, {"ix_events_raw_inserted_at"})
+
+
+def _payload_tiering(conn: Connection) -> None:
+    if "payload_tiered_at" not in {c["name"] for c in inspect(conn).get_columns("events_raw")}:
+        conn.execute(text("alter table events_raw add column payload_tiered_at timestamp with time zone"))
+    _create_indexes(conn, {"ix_events_raw_untiered_id"})
+
+
+# Append only; a new table needs a step that calls _create_missing_tables again, a new index one that names it
+MIGRATIONS: list[tuple[str, str, Callable[[Connection], None]]] = [
+    ("0001", "base tables", _create_missing_tables),
+    ("0002", "model_runs.segment and read-path indexes", _segments_and_indexes),
+    ("0003", "events_raw.inserted_at index", _inserted_at_index),
+    ("0004", "query_profiles", _create_missing_tables),
+    ("0005", "events_raw.payload_tiered_at", _payload_tiering),
+]
+
+
+def _models_checksum(models: list[tuple[str, str]]) -> str:
+    h = hashlib.sha256()
+    for name, sql in models:
+        h.update(name.encode())
+        h.update(sql.encode())
+    return h.hexdigest()
+
+
+def _applied(conn: Connection) -> dict[str, Optional[str]]:
+    if not inspect(conn).has_table(schema_migrations.name):
+        return {}
+    return {version: checksum for version, checksum in conn.execute(select(schema_migrations.c.version, schema_migrations.c.checksum))}
+
+
+def _is_current(applied: dict[str, Optional[str]], sql_checksum: Optional[str]) -> bool:
+    if any(version not in applied for version, _, _ in MIGRATIONS):
+        return False
+    return sql_checksum is None or applied.get(TRANSFORMATIONS) == sql_checksum
+
+
+def migrate(include_transformations: bool = True, sql_dir: Optional[str] = None) -> list[str]:
+    """Apply pending steps; returns what ran (empty when the database was already current).
+
+    Transformation models are re-run only when their SQL changed since the last recorded run.
+    """
+    models: Optional[list[tuple[str, str]]] = None
+    if include_transformations:
+        from transformations.runner import default_sql_dir, read_sql_models
+
+        models = read_sql_models(sql_dir or default_sql_dir())
+    if not settings.SHARD_DSNS:
+        return _migrate(get_engine(), models)
+    ran = _migrate(get_engine(), None)
+    for shard, engine in enumerate(get_shard_engines()):
+        ran.extend(f"shard{shard}:{step}" for step in _migrate(engine, models))
+    return ran
+
+
+def _migrate(engine: Engine, models: Optional[list[tuple[str, str]]]) -> list[str]:
+    sql_checksum = None if models is None else _models_checksum(models)
+    with engine.connect() as conn:
+        if _is_current(_applied(conn), sql_checksum):
+            return []
+
+    # Model modules only matter when something has to be created
+    register_models()
+    ran: list[str] = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Services booting together wait here instead of racing on DDL
+            conn.execute(text("select pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+        _meta.create_all(bind=conn)
+        applied = _applied(conn)
+        for version, description, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info("Applying migration {}: {}", version, description)
+            apply(conn)
+            conn.execute(schema_migrations.insert().values(version=version))
+            ran.append(version)
+
+    if models is not None and applied.get(TRANSFORMATIONS) != sql_checksum:
+        from transformations.runner import execute_models
+
+        # Separate transaction: a failing model leaves the schema steps applied and is retried next boot
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("select pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+            if _applied(conn).get(TRANSFORMATIONS) != sql_checksum:
+                logger.info("Running {} transformation models (definitions changed)", len(models))
+                execute_models(conn, models)
+                conn.execute(schema_migrations.delete().where(schema_migrations.c.version == TRANSFORMATIONS))
+                conn.execute(schema_migrations.insert().values(version=TRANSFORMATIONS, checksum=sql_checksum))
+                ran.append(TRANSFORMATIONS)
+    return ran
+
+
+def migrate_on_startup(include_transformations: bool = True) -> list[str]:
+    if not settings.MIGRATE_ON_STARTUP:
+        return []
+    return migrate(include_transformations=include_transformations)
+
+
+if __name__ == "__main__":
+    applied_now = migrate()
+    print({"applied": applied_now})
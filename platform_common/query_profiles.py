@@ -0,0 +1,294 @@
+"""Per-statement timing and EXPLAIN capture for slow statements.
+
+Every statement on an instrumented engine is timed and aggregated in process under a tag (the HTTP route,
+or whatever tagged() set, e.g. a transformation model) and a fingerprint (the statement with literals
+replaced). Slow statements are sampled into a ring buffer and the query_profiles table:
+
+- reads (SELECT/WITH) are re-run on a background thread as EXPLAIN (ANALYZE, BUFFERS) in a read-only
+  transaction that is rolled back, so the caller never waits for the plan;
+- writes are never re-run: the transformation runner executes a statement that was slow last time as
+  EXPLAIN (ANALYZE, BUFFERS) itself (see explain_inline), which performs it and returns its plan.
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Generator, Optional
+
+from loguru import logger
+from sqlalchemy import JSON, DateTime, Float, Index, Integer, String, Text, func, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .config import settings
+from .db import Base, get_engine
+
+EXPLAIN = "explain (analyze, buffers, format json) "
+
+
+class QueryProfile(Base):
+    __tablename__ = "query_profiles"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    captured_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    tag: Mapped[str] = mapped_column(String(256), nullable=False)
+    fingerprint: Mapped[str] = mapped_column(String(16), nullable=False)
+    duration_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    statement: Mapped[str] = mapped_column(Text, nullable=False)
+    plan: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    plan_kind: Mapped[str] = mapped_column(String(16), nullable=False)  # analyze | none (not explainable) | failed
+
+    __table_args__ = (Index("ix_query_profiles_captured_at", "captured_at"),)
+
+
+# Set by tagged(); otherwise statements are tagged with the HTTP route being served
+query_tag: ContextVar[Optional[str]] = ContextVar("ffdp_query_tag", default=None)
+# True on the profiler's own thread, whose statements are not profiled
+_internal: ContextVar[bool] = ContextVar("ffdp_query_profiler", default=False)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|%s))*\s*\)")
+_SPACE = re.compile(r"\s+")
+_LEADING_COMMENTS = re.compile(r"\s*(?:--[^\n]*(?:\n|$)\s*|/\*.*?\*/\s*)*", re.S)
+_READ = re.compile(r"(?:select|with)\b", re.I)
+_WRITE = re.compile(r"\b(?:insert\s+into|update\s+\w+\s+set|delete\s+from|merge\s+into|for\s+(?:no\s+key\s+)?update|for\s+share)\b", re.I)
+_EXPLAINABLE = re.compile(r"(?:select|with|insert|update|delete|merge)\b", re.I)
+_STATEMENT_CHARS = 4000
+_RECENT = 256  # durations kept per statement for its p95
+
+
+@contextmanager
+def tagged(tag: str) -> Generator[None, None, None]:
+    token = query_tag.set(tag)
+    try:
+        yield
+    finally:
+        query_tag.reset(token)
+
+
+def current_tag() -> str:
+    tag = query_tag.get()
+    if tag is not None:
+        return tag
+    from .metrics import _route, current_scope
+
+    scope = current_scope.get()
+    return "untagged" if scope is None else f"{scope.get('method', '')} {_route(scope)}".strip()
+
+
+_fingerprints: dict[str, tuple[str, str]] = {}
+
+
+def fingerprint(statement: str) -> tuple[str, str]:
+    """(id, normalized text): literals become ?, IN lists (?), whitespace is collapsed."""
+    cached = _fingerprints.get(statement)
+    if cached is not None:
+        return cached
+    # %% is how pyformat drivers receive a literal %; the runner's explain_inline() sees the source text
+    normalized = _SPACE.sub(" ", _IN_LISTS.sub("(?)", _LITERALS.sub("?", statement.replace("%%", "%")))).strip()[:_STATEMENT_CHARS]
+    result = (hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized)
+    if len(_fingerprints) >= 4096:
+        _fingerprints.clear()  # statements are mostly compiled-cache strings; a reset is cheaper than LRU upkeep
+    _fingerprints[statement] = result
+    return result
+
+
+class StatementStats:
+    __slots__ = ("tag", "fingerprint", "statement", "count", "total", "max", "recent", "slow_at_last_run")
+
+    def __init__(self, tag: str, fp: str, statement: str) -> None:
+        self.tag = tag
+        self.fingerprint = fp
+        self.statement = statement
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=_RECENT)
+        self.slow_at_last_run = False
+
+    @property
+    def p95(self) -> float:
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "tag": self.tag,
+            "fingerprint": self.fingerprint,
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p95_ms": round(self.p95 * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+_lock = threading.Lock()
+_stats: dict[tuple[str, str], StatementStats] = {}
+_explained_at: dict[str, float] = {}  # fingerprint -> monotonic time of its last capture
+_profiles: deque[dict[str, Any]] = deque(maxlen=settings.QUERY_PROFILE_BUFFER)
+_work: queue.Queue[tuple[Optional[Engine], dict[str, Any], Any]] = queue.Queue(maxsize=64)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+started_at = datetime.now(timezone.utc)
+
+
+def _head(statement: str) -> str:
+    match = _LEADING_COMMENTS.match(statement)
+    return statement[match.end():] if match else statement
+
+
+def is_read(statement: str) -> bool:
+    return _READ.match(_head(statement)) is not None and _WRITE.search(statement) is None
+
+
+def _sampled(fp: str) -> bool:
+    """At most one capture per statement per interval, and only for a sample of those."""
+    now = time.monotonic()
+    last = _explained_at.get(fp)
+    if last is not None and now - last < settings.SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS:
+        return False
+    if random.random() >= settings.SLOW_QUERY_SAMPLE_RATE:
+        return False
+    _explained_at[fp] = now
+    return True
+
+
+def record(engine: Engine, statement: str, parameters: Any, seconds: float) -> None:
+    """Called for every statement the engine runs."""
+    if _internal.get() or _head(statement)[:8].lower() == "explain ":
+        return
+    tag = current_tag()
+    fp, normalized = fingerprint(statement)
+    slow = seconds * 1000 >= settings.SLOW_QUERY_MS
+    with _lock:
+        stats = _stats.get((tag, fp))
+        if stats is None:
+            if len(_stats) >= settings.QUERY_STATS_MAX_STATEMENTS:
+                return
+            stats = _stats[(tag, fp)] = StatementStats(tag, fp, normalized)
+        stats.count += 1
+        stats.total += seconds
+        stats.recent.append(seconds)
+        if seconds > stats.max:
+            stats.max = seconds
+        stats.slow_at_last_run = slow
+        if not slow or not _sampled(fp):
+            return
+    profile = {"tag": tag, "fingerprint": fp, "duration_ms": round(seconds * 1000, 3), "statement": statement[:_STATEMENT_CHARS]}
+    if engine.dialect.name == "postgresql" and is_read(statement):
+        _submit(engine, profile, parameters)
+    else:
+        _submit(None, {**profile, "plan": None, "plan_kind": "none"}, None)
+
+
+def explain_inline(statement: str) -> bool:
+    """Whether the caller should run this write as EXPLAIN (ANALYZE, BUFFERS) and hand the plan to capture():
+    it was slow the last time it ran under the current tag, and it is sampled."""
+    if not _EXPLAINABLE.match(_head(statement)) or is_read(statement):
+        return False
+    fp, _ = fingerprint(statement)
+    with _lock:
+        stats = _stats.get((current_tag(), fp))
+        return stats is not None and stats.slow_at_last_run and _sampled("inline:" + fp)
+
+
+def capture(statement: str, seconds: float, plan: Any) -> None:
+    """Record a statement that the caller ran under EXPLAIN ANALYZE itself."""
+    tag = current_tag()
+    fp, normalized = fingerprint(statement)
+    with _lock:
+        stats = _stats.get((tag, fp))
+        if stats is not None:
+            stats.count += 1
+            stats.total += seconds
+            stats.recent.append(seconds)
+            stats.max = max(stats.max, seconds)
+            stats.slow_at_last_run = seconds * 1000 >= settings.SLOW_QUERY_MS
+    profile = {"tag": tag, "fingerprint": fp, "duration_ms": round(seconds * 1000, 3), "statement": statement[:_STATEMENT_CHARS]}
+    _submit(None, {**profile, "plan": plan, "plan_kind": "analyze"}, None)
+
+
+def _submit(engine: Optional[Engine], profile: dict[str, Any], parameters: Any) -> None:
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run, name="query-profiler", daemon=True)
+                _worker.start()
+    try:
+        _work.put_nowait((engine, profile, parameters))
+    except queue.Full:
+        pass  # the profiler is behind; dropping a sample beats slowing the caller
+
+
+def _explain(engine: Engine, statement: str, parameters: Any) -> tuple[Any, str]:
+    try:
+        with engine.connect() as conn:
+            with conn.begin() as trans:
+                conn.exec_driver_sql("set transaction read only")
+                conn.exec_driver_sql(f"set local statement_timeout = {int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS * 1000)}")
+                plan = conn.exec_driver_sql(EXPLAIN + statement, parameters or ()).scalar()
+                trans.rollback()
+        return plan, "analyze"
+    except SQLAlchemyError as exc:
+        logger.debug("EXPLAIN failed for a slow statement: {}", exc)
+        return None, "failed"
+
+
+def _run() -> None:
+    _internal.set(True)
+    while True:
+        engine, profile, parameters = _work.get()
+        try:
+            if engine is not None:
+                profile["plan"], profile["plan_kind"] = _explain(engine, profile["statement"], parameters)
+            profile["captured_at"] = datetime.now(timezone.utc)
+            _profiles.append(profile)
+            if settings.QUERY_PROFILES_PERSIST:
+                with get_engine().begin() as conn:
+                    conn.execute(insert(QueryProfile), [profile])
+        except Exception as exc:  # a profiler failure must not take the thread down
+            logger.warning("Could not store a query profile: {}", exc)
+        finally:
+            _work.task_done()
+
+
+def flush(timeout: float = 5.0) -> None:
+    """Wait (bounded) for pending captures, e.g. before a short-lived CLI exits."""
+    deadline = time.monotonic() + timeout
+    while _work.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+atexit.register(flush)
+
+
+def top_statements(limit: int = 20, order_by: str = "total") -> list[dict[str, Any]]:
+    with _lock:
+        rows = [stats.as_dict() for stats in _stats.values()]
+    key = "p95_ms" if order_by == "p95" else "total_ms"
+    return sorted(rows, key=lambda row: row[key], reverse=True)[:limit]
+
+
+def recent_profiles(limit: int = 50) -> list[dict[str, Any]]:
+    return list(_profiles)[-limit:][::-1]
+
+
+def reset() -> None:
+    global started_at
+    with _lock:
+        _stats.clear()
+        _explained_at.clear()
+        _profiles.clear()
+    started_at = datetime.now(timezone.utc)
@@ -7,6 +7,7 @@ from botocore.client import Config
 from botocore.exceptions import ClientError
 
 from .config import settings
+from .metrics import s3_call
 
 
 def get_s3_client():
@@ -39,7 +40,8 @@ def object_exists(key: str, bucket: str | None = None) -> bool:
     client = get_s3_client()
     bucket_name = bucket or settings.S3_BUCKET
     try:
-        client.head_object(Bucket=bucket_name, Key=key)
+        with s3_call("head_object"):
+            client.head_object(Bucket=bucket_name, Key=key)
         return True
     except ClientError as e:
         code = e.response.get("Error", {}).get("Code")
@@ -56,5 +58,27 @@ def put_json(key: str, data: Any, bucket: str | None = None) -> bool:
         return False
     import orjson
 
-    client.put_object(Bucket=bucket_name, Key=key, Body=orjson.dumps(data), ContentType="application/json")
+    with s3_call("put_object"):
+        client.put_object(Bucket=bucket_name, Key=key, Body=orjson.dumps(data), ContentType="application/json")
     return True
+
+
+def list_keys(prefix: str, bucket: str | None = None) -> list[str]:
+    client = get_s3_client()
+    bucket_name = bucket or settings.S3_BUCKET
+    keys: list[str] = []
+    with s3_call("list_objects_v2"):
+        for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def get_json(key: str, bucket: str | None = None, client: Any = None) -> Any:
+    """client: one from get_s3_client() to reuse, e.g. across threads reading many objects."""
+    client = client or get_s3_client()
+    bucket_name = bucket or settings.S3_BUCKET
+    import orjson
+
+    with s3_call("get_object"):
+        body = client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    return orjson.loads(body)
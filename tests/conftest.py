@@ -1,8 +1,75 @@
 from __future__ import annotations
 
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
 
 # Ensure repository root is on sys.path for imports like `ingestion.app...`
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(ROOT))
+
+from platform_common import db  # noqa: E402
+from platform_common.config import settings  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_dsn(tmp_path, monkeypatch) -> Iterator[str]:
+    """POSTGRES_DSN pointed at a new SQLite file, with the cached engines forgotten before and after the test."""
+    dsn = f"sqlite+pysqlite:///{tmp_path / 'test.db'}"
+    monkeypatch.setattr(settings, "POSTGRES_DSN", dsn)
+    db.reset_engine()
+    yield dsn
+    db.reset_engine()
+
+
+@pytest.fixture
+def sqlite_db(sqlite_dsn):
+    """sqlite_dsn with the ORM tables created; the engine."""
+    engine = db.get_engine()
+    db.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def no_lake(monkeypatch) -> None:
+    """Ingestion's lake writes (put_json) stubbed out as successful."""
+    monkeypatch.setattr("ingestion.app.service.put_json", lambda *args, **kwargs: True)
+
+
+@pytest.fixture
+def payment() -> Callable[..., dict[str, Any]]:
+    """payment(event_id, **overrides): a valid payment event happening now."""
+
+    def build(event_id: str, **overrides: Any) -> dict[str, Any]:
+        return {
+            "event_id": event_id,
+            "event_time": datetime.now(timezone.utc).isoformat(),
+            "customer_id": "cust-1",
+            "region": "us-east",
+            "amount": 10.0,
+            "currency": "USD",
+            **overrides,
+        }
+
+    return build
+
+
+@pytest.fixture
+def usage() -> Callable[..., dict[str, Any]]:
+    """usage(event_id, **overrides): a valid usage event happening now."""
+
+    def build(event_id: str, **overrides: Any) -> dict[str, Any]:
+        return {
+            "event_id": event_id,
+            "event_time": datetime.now(timezone.utc).isoformat(),
+            "customer_id": "cust-1",
+            "region": "us-east",
+            "metric_name": "api_calls",
+            "units": 3,
+            **overrides,
+        }
+
+    return build
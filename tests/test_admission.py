@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import orjson
+from prometheus_client import REGISTRY
+
+from ingestion.app import admission
+from ingestion.app.main import app
+from platform_common.config import settings
+
+
+def test_rate_limits_refuse_whole_requests_per_client_and_customer(sqlite_db, no_lake, payment, monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_EVENTS_PER_SECOND", 0.01)  # no refill during the test
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_BURST", 6.0)
+    monkeypatch.setattr(settings, "ADMISSION_CUSTOMER_EVENTS_PER_SECOND", 0.01)
+    monkeypatch.setattr(settings, "ADMISSION_CUSTOMER_BURST", 3.0)
+    admission.reset_admission()
+
+    async def post(path: str, body, client: str) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.post(path, content=orjson.dumps(body), headers={"X-Client-Id": client})
+
+    try:
+        ok = asyncio.run(post("/ingest/payment/batch", [payment(f"a-{i}", customer_id=f"c{i % 2}") for i in range(4)], "a"))
+        assert ok.status_code == 200 and ok.json()["accepted"] == 4
+
+        # c0 has 1 of 3 tokens left: the whole batch is refused, nothing is charged
+        refused = asyncio.run(post("/ingest/payment/batch", [payment("a-4", customer_id="c0"), payment("a-5", customer_id="c0"), payment("a-6", customer_id="c9")], "b"))
+        assert refused.status_code == 429 and "customer c0" in refused.json()["detail"]
+        assert int(refused.headers["Retry-After"]) >= 100
+        assert asyncio.run(post("/ingest/payment", payment("a-7", customer_id="c9"), "b")).status_code == 202
+
+        # Client a has 2 of 6 tokens left; a batch larger than that is refused for a, not for another client
+        batch = [payment(f"a-{i}", customer_id=f"n{i}") for i in range(8, 11)]
+        assert asyncio.run(post("/ingest/payment/batch", batch, "a")).status_code == 429
+        assert asyncio.run(post("/ingest/payment/batch", batch, "c")).status_code == 200
+        assert (REGISTRY.get_sample_value("ffdp_ingest_throttled_total", {"limit": "customer", "tenant": "c0"}) or 0) >= 1
+    finally:
+        admission.reset_admission()
+
+
+def test_requests_over_the_concurrency_limit_queue_then_are_shed(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_CONCURRENCY", {"batch": 1})
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_DEPTH", {"batch": 1})
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_TIMEOUT_SECONDS", 0.2)
+    admission.reset_admission()
+    order: list[str] = []
+
+    async def backend(scope, receive, send) -> None:
+        order.append(scope["path"])
+        await asyncio.sleep(0.05 if scope["path"].endswith("batch") else 0.1)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def run() -> list[httpx.Response]:
+        transport = httpx.ASGITransport(app=admission.AdmissionMiddleware(backend))  # type: ignore[arg-type]
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            first = asyncio.create_task(http.post("/ingest/payment/batch"))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(http.post("/ingest/batch"))  # waits for the first
+            await asyncio.sleep(0.01)
+            third = await http.post("/ingest/usage/batch")  # queue full
+            unlimited = await http.post("/ingest/payment")  # no limit for single events here
+            return [await first, await second, third, unlimited]
+
+    try:
+        first, second, third, unlimited = asyncio.run(run())
+        assert [r.status_code for r in (first, second, third, unlimited)] == [200, 200, 503, 200]
+        assert third.headers["Retry-After"] == "1" and "queue_full" in third.json()["detail"]
+        assert order == ["/ingest/payment/batch", "/ingest/payment", "/ingest/batch"]
+        assert admission.gates()["batch"].in_flight == 0
+
+        gate = admission.Gate("batch", limit=1, queue=1, timeout=0.01)
+
+        async def timeout() -> list:
+            assert await gate.acquire() is None
+            reason = await gate.acquire()
+            gate.release()
+            return [reason, gate.in_flight]
+
+        assert asyncio.run(timeout()) == ["queue_timeout", 0]
+    finally:
+        admission.reset_admission()
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from forecasting.backtest import evaluate_folds, mape, mase, plan_folds, smape
+
+
+def make_series(days: int) -> pd.Series:
+    idx = pd.date_range("2024-01-01", periods=days, freq="D")
+    return pd.Series(100 + 10 * np.sin(np.arange(days) * 2 * np.pi / 7), index=idx, name="y")
+
+
+def test_point_metrics():
+    actual = np.array([100.0, 0.0, 50.0])
+    predicted = np.array([90.0, 0.0, 55.0])
+    assert mape(actual, predicted) == np.mean([0.1, 0.1])
+    assert smape(np.zeros(3), np.zeros(3)) == 0.0
+    assert mase(actual, predicted, np.array([1.0, 1.0]), season=7) is None
+
+
+def test_folds_are_cached_and_only_new_fold_is_planned():
+    series = make_series(40)
+    jobs = plan_folds(series, "revenue_daily", "all", ["SeasonalNaive(7)"], set(), horizon=7, min_train=21, step=1)
+    assert len(jobs) == 40 - 7 - 21 + 1
+
+    rows = evaluate_folds(jobs)
+    known = {r["cache_key"] for r in rows}
+    assert all(r["coverage"] == 1.0 for r in rows)
+
+    longer = make_series(41)
+    new_jobs = plan_folds(longer, "revenue_daily", "all", ["SeasonalNaive(7)"], known, horizon=7, min_train=21, step=1)
+    assert len(new_jobs) == 1
+    assert new_jobs[0]["actual"].index[-1] == longer.index[-1]
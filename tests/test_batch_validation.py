@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from sqlalchemy import select
+
+from ingestion.app.main import app
+from ingestion.app.models import EventQuarantine, EventRaw
+from ingestion.app.schemas import PaymentEvent, UsageEvent
+from ingestion.app.validation import BodyError, InvalidItem, validate_batch
+from platform_common import db
+
+
+def test_validate_batch_keeps_order_and_collects_item_errors(payment, usage):
+    body = orjson.dumps([
+        {"event_type": "payment", "payload": payment("p-1")},
+        {"event_type": "payment", "payload": payment("p-2", amount=-1)},
+        {"event_type": "refund", "payload": payment("r-1")},
+        {"event_type": "usage", "payload": usage("u-1")},
+    ])
+
+    items = validate_batch(body)
+
+    assert isinstance(items[0], PaymentEvent) and isinstance(items[3], UsageEvent)
+    assert isinstance(items[1], InvalidItem) and items[1].event_type == "payment" and items[1].event_id == "p-2"
+    assert items[1].errors == ["Input should be greater than or equal to 0"]
+    assert isinstance(items[2], InvalidItem) and items[2].event_type == "unknown" and items[2].payload["event_id"] == "r-1"
+
+    typed = validate_batch(orjson.dumps([payment("p-3"), {"event_id": "p-4"}]), "payment")
+    assert isinstance(typed[0], PaymentEvent) and isinstance(typed[1], InvalidItem)
+    with pytest.raises(BodyError):
+        validate_batch(b'{"event_id": "not-a-list"}', "payment")
+
+
+def test_mixed_batch_endpoint_ingests_and_quarantines(sqlite_db, no_lake, payment, usage, monkeypatch):
+
+    batch = [
+        {"event_type": "payment", "payload": payment("m-1")},
+        {"event_type": "usage", "payload": usage("m-2")},
+        {"event_type": "usage", "payload": {"event_id": "m-3"}},
+        {"event_type": "payment", "payload": payment("m-1")},
+        "not-an-event",
+    ]
+
+    async def post() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [
+                await client.post("/ingest/batch", content=orjson.dumps(batch)),
+                await client.post("/ingest/batch", content=b"[1, 2"),
+                await client.post("/ingest/payment/batch", content=b"[]"),
+            ]
+
+    ok, malformed, empty = asyncio.run(post())
+    assert ok.status_code == 200
+    body = ok.json()
+    assert (body["accepted"], body["duplicates"], body["quarantined"]) == (2, 1, 2)
+    assert [r["status"] for r in body["results"]] == ["accepted", "accepted", "quarantined", "duplicate", "quarantined"]
+    assert malformed.status_code == 400 and empty.status_code == 400
+
+    with db.session_scope() as session:
+        assert set(session.scalars(select(EventRaw.event_type))) == {"payment", "usage"}
+        quarantined = {q.event_id: q.event_type for q in session.scalars(select(EventQuarantine))}
+    assert quarantined["m-3"] == "usage"
+    assert "unknown" in quarantined.values()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from ingestion.app import bulk
+from ingestion.app.models import EventRaw
+from ingestion.app.service import process_event, process_item
+from ingestion.app.validation import validate_batch
+from platform_common import db
+
+
+def test_chunks_commit_independently_and_isolate_poison_events(sqlite_db, no_lake, payment, monkeypatch):
+    def flaky(session, event_type, payload):
+        if payload["event_id"] == "evt-7":
+            raise RuntimeError("poison")
+        return process_event(session, event_type, payload)
+
+    monkeypatch.setattr(bulk, "process_event", flaky)
+
+    report = bulk.ingest_stream((("payment", payment(f"evt-{i}")) for i in range(10)), chunk_size=4, workers=1)
+
+    assert report.chunks == 3
+    assert report.isolated_chunks == 1
+    assert report.accepted == 9
+    assert report.failed == 1
+    with db.session_scope() as session:
+        assert session.scalar(select(func.count()).select_from(EventRaw)) == 9
+
+
+def test_only_integrity_errors_on_stored_events_count_as_duplicates(sqlite_db, no_lake, payment, monkeypatch):
+    bulk.ingest_items(validate_batch(orjson.dumps([payment("evt-3")]), "payment"))
+    racing = {"evt-3", "evt-7"}  # evt-3 as if committed by a concurrent chunk after the lookup; evt-7 breaks another constraint
+
+    def process(session, event_id, ingest, *args):
+        if event_id in racing:
+            raise IntegrityError("insert into events_raw", {}, Exception("constraint failed"))
+        return ingest(session, *args)
+
+    monkeypatch.setattr(bulk, "process_event", lambda session, et, payload: process(session, payload["event_id"], process_event, et, payload))
+    report = bulk.ingest_stream((("payment", payment(f"evt-{i}")) for i in range(10)), chunk_size=10, workers=1)
+    assert (report.isolated_chunks, report.accepted, report.duplicates, report.failed) == (1, 8, 1, 1)
+
+    def fail_batch(*args):
+        raise IntegrityError("insert into events_raw", {}, Exception("constraint failed"))
+
+    monkeypatch.setattr(bulk, "process_batch", fail_batch)
+    monkeypatch.setattr(bulk, "process_item", lambda session, item: process(session, item.event_id, process_item, item))
+    results = bulk.ingest_items(validate_batch(orjson.dumps([payment("evt-3"), payment("evt-7"), payment("evt-10")]), "payment"))
+    assert [(r.status, r.issues) for r in results] == [("duplicate", []), ("quarantined", ["exception"]), ("accepted", [])]
+
+
+def test_iter_events_from_file(tmp_path, payment):
+    path = tmp_path / "events.ndjson"
+    path.write_bytes(b"\n".join(orjson.dumps({"event_type": "payment", "payload": payment(f"evt-{i}")}) for i in range(3)))
+
+    items = list(bulk.iter_events_from_file(str(path)))
+    assert [et for et, _ in items] == ["payment"] * 3
+    last = items[2][1]
+    assert isinstance(last, dict) and last["event_id"] == "evt-2"
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+from prefect.testing.utilities import prefect_test_harness
+from sqlalchemy import select
+
+from orchestration import flows, watermarks
+from orchestration.models import PipelineStageRun
+from orchestration.watermarks import Plan, SourceSnapshot
+from platform_common import db
+
+
+@pytest.fixture(scope="module")
+def prefect_api():
+    with prefect_test_harness():
+        yield
+
+
+def test_incremental_flow_forecasts_only_planned_targets(prefect_api, sqlite_db, monkeypatch):
+    now = datetime.now(timezone.utc)
+    snap = SourceSnapshot(events={"payment": now, "subscription": now}, runs={}, checksums={})
+    skipped = {"forecast:revenue_daily": "skipped: no new events since run 1", "forecast:subscriptions_daily": "skipped: no new events since run 2"}
+    forecasted: list[tuple[str, str]] = []
+
+    def forecaster(target: str):
+        def forecast(segment: str, input_mark: str) -> int:
+            forecasted.append((target, segment))
+            return 1
+        return forecast
+
+    monkeypatch.setattr(flows, "_forecaster", forecaster)
+
+    monkeypatch.setattr(flows, "plan_incremental", lambda: (Plan(reasons=skipped), snap))
+    assert flows.incremental_transform_and_forecast() == {stage: "skipped" for stage in skipped}
+    assert forecasted == []  # an empty plan is not "every target"
+
+    reasons = {**skipped, "forecast:subscriptions_daily": "new events since run 2: subscription"}
+    monkeypatch.setattr(flows, "plan_incremental", lambda: (Plan(targets=["subscriptions_daily"], reasons=reasons), snap))
+    assert flows.incremental_transform_and_forecast() == {"forecast:subscriptions_daily": "ran", "forecast:revenue_daily": "skipped"}
+    assert forecasted == [("subscriptions_daily", "all")]
+
+    with db.session_scope() as session:
+        runs = [(r.stage, r.status) for r in session.scalars(select(PipelineStageRun).order_by(PipelineStageRun.id))]
+        assert runs[2:] == [("forecast:subscriptions_daily", "ran"), ("forecast:revenue_daily", "skipped")]
+        # Marked even though the forecaster recorded no run, so the next plan waits for new events
+        assert watermarks.load_state(session) == {"forecast:subscriptions_daily": {"inputs": {"subscription": now.isoformat()}}}
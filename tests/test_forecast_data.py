@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from forecasting import data
+
+
+class _CopyCursor:
+    def __init__(self, body: bytes, error: Exception | None = None) -> None:
+        self.body = body
+        self.error = error
+
+    def copy_expert(self, statement: str, file) -> None:
+        for i in range(0, len(self.body), 7):  # arrives in pieces, as from the server
+            file.write(self.body[i:i + 7])
+        if self.error is not None:
+            raise self.error
+
+
+def test_copy_output_is_parsed_into_typed_columns():
+    frame = data._read_copy(_CopyCursor(b"19723,eu,10.5\n19725,us,2\n"), "copy ...")
+    assert [str(t) for t in frame.dtypes] == ["int32", "category", "float64"]
+    assert frame["y"].tolist() == [10.5, 2.0]
+    assert data._read_copy(_CopyCursor(b""), "copy ...").empty
+    with pytest.raises(RuntimeError):
+        data._read_copy(_CopyCursor(b"19723,eu,1\n", RuntimeError("connection lost")), "copy ...")
+
+
+def test_panel_fills_gaps_per_target_and_is_shared_within_a_run(sqlite_dsn, monkeypatch):
+    engine = create_engine(sqlite_dsn)
+    with engine.begin() as conn:
+        conn.execute(text("create table fact_revenue_daily (date_key date, region_key text, revenue_amount numeric)"))
+        conn.execute(text("create table fact_subscriptions_snapshot (date_key date, active_subscriptions int)"))
+        conn.execute(text(
+            "insert into fact_revenue_daily values ('2024-01-01', 'eu', 10), ('2024-01-04', 'eu', 5), "
+            "('2024-01-02', 'us', 1), ('2024-01-03', 'us', 2.5)"
+        ))
+        conn.execute(text("insert into fact_subscriptions_snapshot values ('2024-01-01', 3), ('2024-01-03', 4)"))
+    engine.dispose()
+    data.clear_cache()
+
+    loads = []
+    fetch = data._fetch
+
+    def counted(sql: str):
+        loads.append(sql)
+        return fetch(sql)
+
+    monkeypatch.setattr(data, "_fetch", counted)
+    try:
+        panel = data.load_panel("revenue_daily", "mark-1")
+        assert panel.segments == ["eu", "us"] and panel.values.dtype == "float64"
+        assert panel.series("eu").tolist() == [10.0, 0.0, 0.0, 5.0]
+        us = panel.series("us")
+        assert us.index.freqstr == "D" and [d.day for d in us.index] == [2, 3]  # its own first to last day
+        assert panel.series("all").tolist() == [10.0, 1.0, 2.5, 5.0]
+        assert panel.series("apac").empty
+        assert {name: s.tolist() for name, s in panel.all_series().items()}["us"] == [0.0, 1.0, 2.5, 0.0]
+
+        assert data.load_panel("revenue_daily", "mark-1") is panel
+        assert len(loads) == 1
+        data.load_panel("revenue_daily", "mark-2")
+        assert len(loads) == 2
+
+        assert data.load_panel("subscriptions_daily").series().tolist() == [3.0, 3.0, 4.0]
+    finally:
+        data.clear_cache()
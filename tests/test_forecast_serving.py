@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+from sqlalchemy import event, text
+
+from analytics.app.main import app
+from forecasting import serving
+from platform_common import db
+from platform_common.config import settings
+from platform_common.migrations import migrate
+
+
+def _add_run(conn, target: str, segment: str, yhat: float) -> int:
+    run_id = conn.execute(text(
+        "insert into model_runs (target, segment, model_name, params, train_start, train_end, created_at) "
+        "values (:target, :segment, 'SARIMAX', '{}', '2024-01-01', '2024-03-31', '2024-04-01 00:00:00') returning id"
+    ), {"target": target, "segment": segment}).scalar_one()
+    table = serving.TABLES[target]
+    for day in ("2024-04-01", "2024-04-02"):
+        conn.execute(text(f"insert into {table} (run_id, date_key, yhat, yhat_lower, yhat_upper) values (:r, :d, :y, :y - 1, :y + 1)"),
+                     {"r": run_id, "d": day, "y": yhat})
+    return run_id
+
+
+def test_latest_forecasts_are_served_from_memory_until_a_new_run(sqlite_dsn, monkeypatch):
+    monkeypatch.setattr(settings, "READ_DSNS", [])
+    monkeypatch.setattr(settings, "FORECAST_CACHE_CHECK_SECONDS", 3600.0)
+    serving.reset_forecast_cache()
+    migrate(include_transformations=False)
+    engine = db.get_engine()
+    with engine.begin() as conn:
+        first = _add_run(conn, "revenue_daily", "all", 10.0)
+        _add_run(conn, "revenue_daily", "eu", 3.0)
+
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+
+    async def get(path: str) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(path)
+
+    try:
+        body = asyncio.run(get("/forecasts/revenue_daily")).json()
+        assert body["run_id"] == first and [r["yhat"] for r in body["rows"]] == [10.0, 10.0]
+        assert asyncio.run(get("/forecasts/revenue_daily?segment=eu")).json()["rows"][0]["yhat_lower"] == 2.0
+        loaded = len(statements)
+        assert asyncio.run(get("/forecasts/revenue_daily")).json()["run_id"] == first
+        assert len(statements) == loaded  # steady state: no SQL
+
+        with engine.begin() as conn:
+            second = _add_run(conn, "revenue_daily", "all", 20.0)
+        assert asyncio.run(get("/forecasts/revenue_daily")).json()["run_id"] == first  # not announced yet
+        serving.get_forecast_cache().notified(second)  # what the listener does on NOTIFY
+        assert asyncio.run(get("/forecasts/revenue_daily")).json()["rows"][0]["yhat"] == 20.0
+        assert asyncio.run(get(f"/forecasts/revenue_daily?run_id={first}")).json()["rows"][0]["yhat"] == 10.0
+
+        assert asyncio.run(get(f"/forecasts/subscriptions_daily?run_id={first}")).status_code == 404
+        assert asyncio.run(get("/forecasts/subscriptions_daily")).status_code == 404
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        serving.reset_forecast_cache()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import text
+
+from analytics.app.main import app
+from forecasting.variance import refresh_forecast_variance
+from platform_common import db
+from platform_common.config import settings
+from platform_common.migrations import migrate
+
+DAYS = [date.today() - timedelta(days=n) for n in (2, 1, 0)]
+
+
+def _add_run(conn, target: str, segment: str, yhat: float, days: list[date]) -> int:
+    run_id = conn.execute(text(
+        "insert into model_runs (target, segment, model_name, params, train_start, train_end) "
+        "values (:target, :segment, 'SARIMAX', '{}', '2024-01-01', '2024-03-31') returning id"
+    ), {"target": target, "segment": segment}).scalar_one()
+    table = "forecast_revenue_daily" if target == "revenue_daily" else "forecast_subscriptions_daily"
+    for day in days:
+        conn.execute(text(f"insert into {table} (run_id, date_key, yhat, yhat_lower, yhat_upper) values (:r, :d, :y, :y - 1, :y + 1)"),
+                     {"r": run_id, "d": day, "y": yhat})
+    return run_id
+
+
+def test_variance_is_upserted_per_run_and_served_by_run_or_target(sqlite_dsn, monkeypatch):
+    monkeypatch.setattr(settings, "READ_DSNS", [])
+    migrate(include_transformations=False)
+    with db.get_engine().begin() as conn:
+        conn.execute(text("create table fact_revenue_daily (date_key date, region_key text, revenue_amount numeric)"))
+        conn.execute(text("create table fact_subscriptions_snapshot (date_key date, active_subscriptions integer)"))
+        conn.execute(text("insert into fact_revenue_daily values (:d0, 'eu', 60), (:d0, 'us', 60), (:d1, 'eu', 40)"),
+                     {"d0": DAYS[0], "d1": DAYS[1]})
+        conn.execute(text("insert into fact_subscriptions_snapshot values (:d0, 12)"), {"d0": DAYS[0]})
+        total = _add_run(conn, "revenue_daily", "all", 100.0, DAYS)
+        eu = _add_run(conn, "revenue_daily", "eu", 50.0, DAYS[:2])
+        subscriptions = _add_run(conn, "subscriptions_daily", "all", 10.0, DAYS[:1])
+
+    assert refresh_forecast_variance([total, eu, subscriptions]) == 6
+
+    async def get(path: str) -> dict:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(path)
+            assert response.status_code == 200, response.text
+            return response.json()
+
+    def variance(query: str = "") -> tuple[int, list[tuple]]:
+        body = asyncio.run(get(f"/metrics/forecast_vs_actual{query}"))
+        return body["run_id"], [(r["actual"], r["forecast"], r["variance"], r["variance_pct"]) for r in body["rows"]]
+
+    # Actuals summed to the run's segment; a day without them has no variance yet
+    assert variance() == (total, [(120.0, 100.0, 20.0, 20 / 120), (40.0, 100.0, -60.0, -1.5), (None, 100.0, None, None)])
+    assert variance("?segment=eu") == (eu, [(60.0, 50.0, 10.0, 10 / 60), (40.0, 50.0, -10.0, -0.25)])
+    assert variance("?target=subscriptions_daily") == (subscriptions, [(12.0, 10.0, 2.0, 2 / 12)])
+    assert variance(f"?run_id={total}&start_date={DAYS[1]}&end_date={DAYS[1]}")[1] == [(40.0, 100.0, -60.0, -1.5)]
+
+    # A late actual is picked up by the next refresh, which updates rows in place
+    with db.get_engine().begin() as conn:
+        conn.execute(text("insert into fact_revenue_daily values (:d2, 'us', 80)"), {"d2": DAYS[2]})
+    assert refresh_forecast_variance() == 6
+    assert refresh_forecast_variance() == 6
+    assert variance(f"?run_id={total}&start_date={DAYS[2]}")[1] == [(80.0, 100.0, -20.0, -0.25)]
+    with db.get_engine().connect() as conn:
+        assert conn.execute(text("select count(*) from fact_forecast_variance")).scalar_one() == 6
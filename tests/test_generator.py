@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from pydantic import ValidationError
+
+from benchmarks.generator import EventGenerator, GeneratorConfig
+from benchmarks.harness import measure, percentile
+from ingestion.app.schemas import EventSchemaMap
+
+
+def test_generator_is_seeded_and_honours_ratios():
+    cfg = GeneratorConfig(seed=7, customers=50, duplicate_ratio=0.1, invalid_ratio=0.1, late_ratio=0.0)
+    first = list(EventGenerator(cfg).events(2000))
+    second = list(EventGenerator(cfg).events(2000))
+    assert [p["event_id"] for _, p in first] == [p["event_id"] for _, p in second]
+    assert {et for et, _ in first} == set(EventSchemaMap)
+
+    ids = [p["event_id"] for _, p in first]
+    duplicates = len(ids) - len(set(ids))
+    assert 120 < duplicates < 280
+
+    schema_invalid = 0
+    for et, payload in first:
+        try:
+            EventSchemaMap[et](**payload)
+        except ValidationError:
+            schema_invalid += 1
+    assert 40 < schema_invalid < 200
+
+
+def test_measure_reports_percentiles():
+    assert percentile([], 50) is None
+    assert percentile([float(i) for i in range(1, 101)], 95) == 95.0
+    with measure("noop", unit="ops") as stage:
+        for _ in range(10):
+            with stage.op():
+                pass
+    assert stage.result is not None
+    assert stage.result.ops == 10
+    assert stage.result.p99_ms is not None
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from datetime import date
+
+import httpx
+import orjson
+
+from analytics import lake
+from analytics.app.main import app
+from platform_common.config import settings
+
+
+def _put(root, event_type: str, dt: str, event: dict) -> None:
+    path = os.path.join(root, "raw", event_type, f"dt={dt}", f"{event['event_id']}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(orjson.dumps(event))
+
+
+def _payment(event_id: str, event_time: str, region: str, amount: float) -> dict:
+    return {"event_id": event_id, "event_time": event_time, "customer_id": "c1", "region": region, "amount": amount, "currency": "USD", "payment_method": None}
+
+
+def _subscription(event_id: str, event_time: str, customer_id: str, action: str) -> dict:
+    return {"event_id": event_id, "event_time": event_time, "customer_id": customer_id, "region": "eu", "action": action, "plan_id": "basic"}
+
+
+def test_lake_facts_from_json_and_compacted_partitions(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ANALYTICS_BACKEND", "lake")
+    monkeypatch.setattr(settings, "LAKE_ROOT", str(tmp_path))
+    monkeypatch.setattr(settings, "LAKE_CATALOG_TTL_SECONDS", 0.0)
+    lake.reset_lake()
+    _put(tmp_path, "payment", "2024-03-01", _payment("p1", "2024-03-01T10:00:00Z", "eu", 10.25))
+    _put(tmp_path, "payment", "2024-03-01", _payment("p2", "2024-03-01T23:30:00-05:00", "eu", 5.5))  # UTC day is 03-02
+    _put(tmp_path, "payment", "2024-03-02", _payment("p3", "2024-03-02T08:00:00Z", "us", 1.0))
+    _put(tmp_path, "payment", "2024-04-01", _payment("p4", "2024-04-01T08:00:00Z", "us", 7.0))
+    for i, (day, action) in enumerate([("2024-03-01", "created"), ("2024-03-01", "created"), ("2024-03-02", "canceled")]):
+        _put(tmp_path, "subscription", day, _subscription(f"s{i}", f"{day}T12:00:00Z", f"c{i}", action))
+
+    async def get(path: str) -> dict:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return (await client.get(path)).json()
+
+    def answers() -> tuple:
+        return (
+            asyncio.run(get("/metrics/revenue_by_region?start_date=2024-03-02&end_date=2024-03-31"))["rows"],
+            asyncio.run(get("/metrics/mrr?month=2024-03"))["mrr"],
+            asyncio.run(get("/metrics/churn?day=2024-03-02")),
+        )
+
+    try:
+        expected = (
+            [
+                {"date_key": "2024-03-02", "region_key": "eu", "revenue_amount": "5.5"},
+                {"date_key": "2024-03-02", "region_key": "us", "revenue_amount": "1"},
+            ],
+            16.75,
+            {"date": "2024-03-02", "cancellations": 1, "prev_active": 2, "churn_rate": 0.5},
+        )
+        assert answers() == expected
+
+        assert lake.compact(today=date(2024, 4, 1)) == {"compacted": 4, "skipped": 1}
+        assert all(path.endswith(".parquet") for path in lake.get_lake().catalog()["payment"].values() if "2024-03" in path)
+        assert answers() == expected
+
+        # A late event lands in a compacted partition: the next compaction rewrites it and drops the old file
+        _put(tmp_path, "payment", "2024-03-02", _payment("p5", "2024-03-02T09:00:00Z", "us", 2.0))
+        assert lake.compact(today=date(2024, 4, 1)) == {"compacted": 1, "unchanged": 1, "skipped": 3}
+        assert len(os.listdir(tmp_path / "compact" / "payment" / "dt=2024-03-02")) == 1
+        assert asyncio.run(get("/metrics/revenue_by_region?start_date=2024-03-02&end_date=2024-03-02"))["rows"][1]["revenue_amount"] == "3"
+        assert lake.get_lake().fact("fact_subscriptions_snapshot", date(2024, 3, 1), date(2024, 3, 3)) == [
+            {"date_key": date(2024, 3, 1), "active_subscriptions": 2},
+            {"date_key": date(2024, 3, 2), "active_subscriptions": 1},
+            {"date_key": date(2024, 3, 3), "active_subscriptions": 1},
+        ]
+    finally:
+        lake.reset_lake()
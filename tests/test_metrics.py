@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import asyncio
+
+import httpx
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ingestion.app.main import app
+from ingestion.app.service import process_event
+from platform_common.db import Base
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_process_event_records_outcomes_and_stages(monkeypatch):
+    monkeypatch.setattr("ingestion.app.service.put_json", lambda *args, **kwargs: True)
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+
+    accepted = sample("ffdp_ingest_events_total", event_type="usage", status="accepted")
+    duplicate = sample("ffdp_ingest_events_total", event_type="usage", status="duplicate")
+    s3_puts = sample("ffdp_ingest_stage_seconds_count", stage="s3_put")
+
+    payload = {
+        "event_id": "evt-metrics-1",
+        "event_time": datetime.now(timezone.utc).isoformat(),
+        "customer_id": "cust-1",
+        "region": "us-east",
+        "metric_name": "api_calls",
+        "units": 3,
+    }
+    process_event(session, "usage", payload)
+    process_event(session, "usage", payload)
+    session.close()
+
+    assert sample("ffdp_ingest_events_total", event_type="usage", status="accepted") == accepted + 1
+    assert sample("ffdp_ingest_events_total", event_type="usage", status="duplicate") == duplicate + 1
+    assert sample("ffdp_ingest_stage_seconds_count", stage="s3_put") == s3_puts + 1
+
+
+def test_metrics_endpoint_uses_route_templates():
+    async def scrape() -> str:
+        # ASGI transport skips startup (Postgres, bucket)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.get("/health")
+            return (await client.get("/metrics")).text
+
+    body = asyncio.run(scrape())
+    assert 'ffdp_http_request_seconds_count{app="ingestion",method="GET",route="/health",status="200"}' in body
+    assert "ffdp_ingest_stage_seconds_bucket" in body
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from benchmarks import micro
+from benchmarks.harness import new_report
+
+
+def test_cases_are_timed_and_gated_against_the_baseline(sqlite_db, monkeypatch):
+    fake = micro.FakeS3()
+    monkeypatch.setattr("platform_common.s3.get_s3_client", lambda: fake)
+    try:
+        selected = [case for case in micro.cases("sqlite") if case.name.startswith(("s3_key_for", "process_event:"))]
+        assert [case.name for case in selected] == [
+            "s3_key_for", "process_event:accepted", "process_event:duplicate", "process_event:quarantined", "process_event:invalid"
+        ]
+        baseline = new_report("micro-sqlite")
+        micro.run(selected, min_time=0.001, repeat=2, report=baseline)
+        assert all(result.unit == "calls" and result.ops >= 1 and micro.per_call_ns(result) > 0 for result in baseline.stages)
+        assert len(fake.keys) > 0  # accepted events went through put_json to the stub
+    finally:
+        if micro._session is not None:
+            micro._session.close()
+
+    head = baseline.model_copy(deep=True)
+    assert micro.regressions(baseline, head, threshold_pct=20.0) == []
+    slower = head.stage("process_event:duplicate")
+    assert slower is not None
+    slower.extra["best_ns"] = micro.per_call_ns(slower) * 1.5
+    assert micro.regressions(baseline, head, threshold_pct=20.0) == ["process_event:duplicate"]
+    assert micro.regressions(baseline, head, threshold_pct=60.0) == []
+    slower.extra["tolerance_pct"] = 60.0  # a case's own tolerance wins over the threshold
+    assert micro.regressions(baseline, head, threshold_pct=20.0) == []
+    head.stages.append(head.stages[0].model_copy(update={"stage": "new_case"}))
+    assert micro.regressions(baseline, head, threshold_pct=20.0) == []
+    assert "new" in micro.format_check(baseline, head, 20.0, [])
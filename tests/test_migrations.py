@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+
+from platform_common import db
+from platform_common.migrations import TRANSFORMATIONS, migrate
+
+
+def test_migrations_apply_once_and_upgrade_legacy_tables(sqlite_dsn):
+    with db.get_engine().begin() as conn:
+        # model_runs as created before segments existed
+        conn.execute(text(
+            "create table model_runs (id integer primary key, target varchar(64) not null, model_name varchar(128) not null, "
+            "params json not null, train_start date not null, train_end date not null, created_at timestamp not null default current_timestamp)"
+        ))
+        # events_raw as created before its read-path indexes and payload tiering
+        conn.execute(text(
+            "create table events_raw (id integer primary key, event_id varchar(128) not null unique, event_type varchar(32) not null, "
+            "event_time timestamp not null, customer_id varchar(128) not null, region varchar(64) not null, payload json not null, "
+            "s3_key varchar(512) unique, is_late boolean not null, inserted_at timestamp not null default current_timestamp)"
+        ))
+
+    assert migrate(include_transformations=False) == ["0001", "0002", "0003", "0004", "0005"]
+    assert migrate(include_transformations=False) == []
+
+    insp = inspect(db.get_engine())
+    assert "segment" in {c["name"] for c in insp.get_columns("model_runs")}
+    assert "ix_model_runs_target_segment_id" in {i["name"] for i in insp.get_indexes("model_runs")}
+    assert insp.has_table("fact_forecast_variance")
+    assert "payload_tiered_at" in {c["name"] for c in insp.get_columns("events_raw")}
+    assert {"ix_events_raw_type_inserted_at", "ix_events_raw_inserted_at", "ix_events_raw_untiered_id"} <= {
+        i["name"] for i in insp.get_indexes("events_raw")
+    }
+
+
+def test_transformations_rerun_only_when_sql_changes(sqlite_dsn, tmp_path):
+    sql_dir = tmp_path / "sql"
+    sql_dir.mkdir()
+    (sql_dir / "001_v_one.sql").write_text("create view if not exists v_one as select 1 as x")
+
+    assert TRANSFORMATIONS in migrate(sql_dir=str(sql_dir))
+    assert migrate(sql_dir=str(sql_dir)) == []
+
+    (sql_dir / "002_v_two.sql").write_text("create view if not exists v_two as select 2 as x")
+    assert migrate(sql_dir=str(sql_dir)) == [TRANSFORMATIONS]
+    with db.get_engine().connect() as conn:
+        assert conn.execute(text("select x from v_two")).scalar() == 2
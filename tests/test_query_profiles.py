@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+from sqlalchemy import text
+
+from analytics.app.main import app
+from platform_common import db, query_profiles
+from platform_common.config import settings
+from transformations.runner import split_statements
+
+
+def test_model_files_split_into_statements():
+    sql = "\n".join([
+        "-- leading; comment",
+        "do $$ begin perform 1; end $$;",
+        "insert into t values ('a;b', \"x;y\"); /* trailing; */",
+        "select $tag$ ; $tag$",
+        "-- nothing after this;",
+    ])
+    assert split_statements(sql) == [
+        "-- leading; comment\ndo $$ begin perform 1; end $$",
+        "insert into t values ('a;b', \"x;y\")",
+        "/* trailing; */\nselect $tag$ ; $tag$\n-- nothing after this;",
+    ]
+
+
+def test_statements_are_aggregated_and_slow_ones_captured(sqlite_db, monkeypatch):
+    monkeypatch.setattr(settings, "SLOW_QUERY_MS", 0.0)
+    query_profiles.reset()
+
+    try:
+        with query_profiles.tagged("model:010_test"), db.get_engine().begin() as conn:
+            for i in range(3):
+                conn.execute(text(f"select {i} as n where 'x' in ('a', 'b')"))  # one fingerprint
+            conn.execute(text("select 1 union all select 2"))
+        query_profiles.flush()
+
+        async def get(path: str) -> dict:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return (await client.get(path)).json()
+
+        top = asyncio.run(get("/admin/queries?limit=50&order_by=p95"))["rows"]
+        counts = {row["statement"]: row["count"] for row in top if row["tag"] == "model:010_test"}
+        assert counts == {"select ? as n where ? in (?)": 3, "select ? union all select ?": 1}
+
+        # Sampled once per statement per interval; no plans off Postgres
+        profiles = asyncio.run(get("/admin/query_profiles?tag=model:010_test"))["rows"]
+        assert len(profiles) == 2 and {p["plan_kind"] for p in profiles} == {"none"}
+        assert len(asyncio.run(get("/admin/query_profiles?source=memory&tag=model:010_test"))["rows"]) == 2
+    finally:
+        query_profiles.reset()
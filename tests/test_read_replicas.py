@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import create_engine, text
+
+from analytics.app.main import app
+from platform_common import db
+from platform_common.config import settings
+
+_ACCURACY = (
+    "create table backtest_results (target text, segment text, model_name text, fold_origin date, "
+    "mape float, smape float, mase float, coverage float)"
+)
+
+
+def _database(dsn: str, model_name: str) -> str:
+    engine = create_engine(dsn)
+    with engine.begin() as conn:
+        conn.execute(text(_ACCURACY))
+        conn.execute(text("insert into backtest_results values ('revenue_daily', 'all', :m, '2024-01-01', 0.1, 0.1, 1.0, 0.9)"), {"m": model_name})
+    engine.dispose()
+    return dsn
+
+
+def test_reads_go_to_replicas_unless_writes_must_be_visible(sqlite_dsn, tmp_path, monkeypatch):
+    _database(sqlite_dsn, "on-primary")
+    monkeypatch.setattr(settings, "READ_DSNS", [
+        f"sqlite+pysqlite:///{tmp_path / 'missing' / 'down.db'}",  # unreachable: skipped
+        _database(f"sqlite+pysqlite:///{tmp_path / 'replica.db'}", "on-replica"),
+    ])
+
+    async def request(headers: dict[str, str]) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/metrics/forecast_accuracy", headers=headers)
+
+    def models(headers: dict[str, str]) -> list[str]:
+        return [row["model_name"] for row in asyncio.run(request(headers)).json()["rows"]]
+
+    assert models({}) == ["on-replica"]
+    assert models({}) == ["on-replica"]  # round robin passes over the one that is down
+    assert models({"X-Read-Your-Writes": "1"}) == ["on-primary"]
+    with db.read_your_writes():
+        assert db.get_read_engine() is db.get_engine()
+    assert models({"X-Read-Your-Writes": "0/16B3748"}) == ["on-replica"]  # not a standby: has every position
+    for bad in ("0/xyz", "1/2/3", "/"):
+        assert asyncio.run(request({"X-Read-Your-Writes": bad})).status_code == 400
+    with pytest.raises(ValueError), db.read_your_writes("0/"):
+        pass
+
+    monkeypatch.setattr(settings, "READ_MAX_LAG_SECONDS", -1.0)  # every replica is too far behind
+    assert models({}) == ["on-primary"]
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from ingestion.app.models import EventQuarantine, EventRaw
+from ingestion.app.quality import evaluate_quality
+from ingestion.app.reprocess import reprocess_quarantine
+from ingestion.app.service import process_event
+from platform_common import db
+from platform_common.config import QualityResult
+
+
+def test_reprocessing_moves_rows_that_pass_current_rules(sqlite_db, no_lake, payment, monkeypatch):
+    def strict(event: dict, event_type: str) -> QualityResult:
+        # A rule that has since been dropped
+        q = evaluate_quality(event, event_type)
+        if event.get("region") == "eu-west":
+            return QualityResult(is_valid=False, issues=q.issues + ["region_blocked"], is_late=q.is_late)
+        return q
+
+    monkeypatch.setattr("ingestion.app.service.evaluate_quality", strict)
+    with db.session_scope() as session:
+        for i in range(5):
+            process_event(session, "payment", payment(f"eu-{i}", region="eu-west"))
+        process_event(session, "payment", payment("neg", amount=-1))
+        process_event(session, "payment", payment("dup", region="eu-west"))
+        session.add(EventRaw(
+            event_id="dup", event_type="payment", event_time=datetime.now(timezone.utc), customer_id="cust-1",
+            region="eu-west", payload={}, s3_key="raw/payment/dup.json",
+        ))
+    monkeypatch.setattr("ingestion.app.service.evaluate_quality", evaluate_quality)
+
+    dry = reprocess_quarantine(chunk_size=2, dry_run=True)
+    assert (dry.scanned, dry.moved, dry.duplicates, dry.remaining) == (7, 5, 1, 1)
+    with db.session_scope() as session:
+        assert len(session.scalars(select(EventQuarantine)).all()) == 7
+
+    only_invalid = reprocess_quarantine(issue="validation_error", dry_run=True)
+    assert only_invalid.scanned == 1 and only_invalid.current_issues == {"validation_error": 1}
+
+    halves = [reprocess_quarantine(issue="region_blocked", partition=(i, 2), chunk_size=2) for i in range(2)]
+    report = halves[0].merge(halves[1])
+    assert (report.scanned, report.moved, report.duplicates, report.remaining) == (6, 5, 1, 0)
+    assert report.issues["region_blocked"].moved == 5
+    with db.session_scope() as session:
+        assert {e for e in session.scalars(select(EventRaw.event_id))} == {f"eu-{i}" for i in range(5)} | {"dup"}
+        assert set(session.scalars(select(EventQuarantine.event_id))) == {"neg", "dup"}
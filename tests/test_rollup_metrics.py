@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from analytics.app.main import app
+from platform_common.config import settings
+
+# The rollup tables as 024/025 create them; the models themselves need Postgres
+_TABLES = [
+    "create table margin_rollup (granularity text, period_start date, region_key text, revenue_amount numeric, "
+    "payments_count int, cost_amount numeric, costs_count int)",
+    "create table usage_rollup (granularity text, period_start date, metric_name text, plan_id text, region_key text, "
+    "total_units int, usage_events int)",
+    "insert into margin_rollup values ('day', '2024-03-04', 'eu', 100, 2, 40, 1), ('day', '2024-03-04', 'us', 0, 0, 5, 1), "
+    "('day', '2024-03-11', 'eu', 10, 1, 0, 0), ('week', '2024-03-04', 'eu', 100, 2, 40, 1), ('week', '2024-03-04', 'us', 0, 0, 5, 1), "
+    "('week', '2024-03-11', 'eu', 10, 1, 0, 0), ('month', '2024-03-01', 'eu', 110, 3, 40, 1), ('month', '2024-03-01', 'us', 0, 0, 5, 1)",
+    "insert into usage_rollup values ('month', '2024-03-01', 'api_calls', 'basic', 'eu', 12, 3), "
+    "('month', '2024-03-01', '', '', 'eu', 1, 1), ('month', '2024-04-01', 'api_calls', 'basic', 'eu', 7, 1)",
+]
+
+
+def test_margin_and_usage_are_served_from_rollups(sqlite_dsn, monkeypatch):
+    engine = create_engine(sqlite_dsn)
+    with engine.begin() as conn:
+        for statement in _TABLES:
+            conn.execute(text(statement))
+    engine.dispose()
+    monkeypatch.setattr(settings, "READ_DSNS", [])
+
+    async def request(path: str) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(path)
+
+    def get(path: str) -> list[dict]:
+        response = asyncio.run(request(path))
+        assert response.status_code == 200, response.text
+        return response.json()["rows"]
+
+    # A range starting mid-week or mid-month reports the periods containing it whole
+    weeks = get("/metrics/gross_margin?granularity=week&start_date=2024-03-06&region=eu")
+    assert [(r["period_start"], r["gross_margin"], r["margin_pct"]) for r in weeks] == [("2024-03-04", 60.0, 0.6), ("2024-03-11", 10.0, 1.0)]
+    months = get("/metrics/gross_margin?granularity=month&start_date=2024-03-15&end_date=2024-03-31")
+    assert [(r["region_key"], r["gross_margin"], r["margin_pct"]) for r in months] == [("eu", 70.0, 70 / 110), ("us", -5.0, None)]
+    assert len(get("/metrics/gross_margin?end_date=2024-03-10")) == 2
+
+    usage = get("/metrics/usage?granularity=month&end_date=2024-03-31")
+    assert [(r["metric_name"], r["plan_id"], r["total_units"]) for r in usage] == [(None, None, 1), ("api_calls", "basic", 12)]
+    assert [r["period_start"] for r in get("/metrics/usage?granularity=month&plan_id=basic")] == ["2024-03-01", "2024-04-01"]
+
+    assert asyncio.run(request("/metrics/usage?granularity=year")).status_code == 422
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import orjson
+from sqlalchemy import create_engine, inspect, select, text
+
+from analytics.app.main import app as analytics_app
+from ingestion.app.main import app as ingestion_app
+from ingestion.app.models import EventQuarantine, EventRaw
+from platform_common import db
+from platform_common.config import settings
+from platform_common.migrations import migrate
+
+
+def test_customers_keep_their_shard_and_a_new_shard_only_takes_its_share(monkeypatch):
+    customers = [f"cust-{i}" for i in range(20_000)]
+    monkeypatch.setattr(settings, "SHARD_DSNS", ["a", "b", "c"])
+    three = [db.shard_for(c) for c in customers]
+    assert three == [db.shard_for(c) for c in customers]  # stable
+    assert all(abs(three.count(s) / len(customers) - 1 / 3) < 0.02 for s in range(3))
+
+    monkeypatch.setattr(settings, "SHARD_DSNS", ["a", "b", "c", "d"])
+    moved = [(before, after) for before, after in zip(three, (db.shard_for(c) for c in customers)) if before != after]
+    assert {after for _, after in moved} == {3} and abs(len(moved) / len(customers) - 1 / 4) < 0.02
+
+
+def test_events_are_ingested_on_their_customers_shard_and_facts_merged(sqlite_dsn, no_lake, payment, tmp_path, monkeypatch):
+    shards = [f"sqlite+pysqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)]
+    monkeypatch.setattr(settings, "READ_DSNS", [])
+    monkeypatch.setattr(settings, "SHARD_DSNS", shards)
+    assert "shard2:0001" in migrate(include_transformations=False)
+    assert all(inspect(engine).has_table("events_raw") for engine in db.get_shard_engines())
+
+    batch = [payment(f"e-{i}", customer_id=f"cust-{i % 7}") for i in range(20)] + [{"event_id": "bad", "customer_id": "cust-3"}]
+
+    async def post(path: str, body) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=ingestion_app), base_url="http://test") as client:
+            return await client.post(path, content=orjson.dumps(body))
+
+    first = asyncio.run(post("/ingest/payment/batch", batch)).json()
+    assert (first["accepted"], first["quarantined"]) == (20, 1)
+    assert [r["event_id"] for r in first["results"]] == [*(f"e-{i}" for i in range(20)), "bad"]  # request order
+    again = asyncio.run(post("/ingest/payment/batch", batch)).json()
+    assert again["duplicates"] == 21
+    assert asyncio.run(post("/ingest/payment", payment("e-3", customer_id="cust-3"))).json()["status"] == "duplicate"
+
+    placed: dict[str, int] = {}
+    for shard in range(3):
+        with db.session_scope(shard) as session:
+            placed.update((customer, shard) for customer in session.scalars(select(EventRaw.customer_id)))
+            if session.scalar(select(EventQuarantine.event_id)) == "bad":
+                placed["bad"] = shard
+    assert placed == {**{f"cust-{i}": db.shard_for(f"cust-{i}") for i in range(7)}, "bad": db.shard_for("cust-3")}
+    assert len(set(placed.values())) > 1
+
+    # Each shard rolls up its own customers; the endpoint sums them
+    for i, engine in enumerate(db.get_shard_engines()):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "create table margin_rollup (granularity text, period_start date, region_key text, revenue_amount numeric, "
+                "payments_count int, cost_amount numeric, costs_count int)"
+            ))
+            conn.execute(text(f"insert into margin_rollup values ('day', '2024-03-0{i + 1}', 'eu', 10, 1, 4, 1), ('day', '2024-03-04', 'eu', 10, 1, 4, 1)"))
+
+    async def get(path: str) -> dict:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=analytics_app), base_url="http://test") as client:
+            return (await client.get(path)).json()
+
+    rows = asyncio.run(get("/metrics/gross_margin?granularity=day"))["rows"]
+    assert [(r["period_start"], r["gross_margin"], r["payments_count"]) for r in rows] == [
+        ("2024-03-01", 6.0, 1), ("2024-03-02", 6.0, 1), ("2024-03-03", 6.0, 1), ("2024-03-04", 18.0, 3),
+    ]
+    assert not inspect(create_engine(settings.POSTGRES_DSN)).has_table("margin_rollup")  # nothing on the primary
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import struct
+
+import httpx
+import orjson
+import pytest
+from sqlalchemy import func, select
+
+from ingestion.app import spool as spool_module
+from ingestion.app.main import app
+from ingestion.app.models import EventQuarantine, EventRaw
+from ingestion.app.spool import Spool, SpoolError, drain_once
+from ingestion.app.validation import validate_batch
+from platform_common import db
+
+
+def test_spool_rolls_segments_and_recovers_up_to_a_torn_record(tmp_path):
+    spool = Spool(tmp_path, segment_bytes=256, fsync_interval=0)
+    with pytest.raises(SpoolError):
+        Spool(tmp_path, segment_bytes=256, fsync_interval=0)  # directory is locked
+    records = [orjson.dumps({"n": i, "pad": "x" * 40}) for i in range(10)]
+    spool.append(records[:4])
+    spool.append(records[4:])
+    assert spool.lag_records == 10
+
+    batch = spool.read(3)
+    assert batch.payloads == records[:3]
+    spool.commit(batch)
+    spool.close()
+
+    # A crash mid-append: a header and half a payload after the last intact record
+    last = sorted(tmp_path.glob("*.seg"))[-1]
+    data = bytearray(last.read_bytes())
+    end = data.find(b"\0" * 16)
+    torn = struct.pack("<IId", 32, 12345, 0.0) + b'{"n": 99'
+    data[end:end + len(torn)] = torn
+    last.write_bytes(bytes(data))
+
+    spool = Spool(tmp_path, segment_bytes=256, fsync_interval=0)
+    try:
+        assert spool.lag_records == 7
+        spool.append([b'{"n": 10}'])
+        batch = spool.read(100)
+        assert batch.payloads == records[3:] + [b'{"n": 10}']
+        spool.commit(batch)
+        assert spool.lag_records == 0 and spool.lag_seconds() == 0
+        assert len(list(tmp_path.glob("*.seg"))) == 1  # drained segments are deleted
+    finally:
+        spool.close()
+
+
+def test_spooled_ingestion_is_acknowledged_then_drained(sqlite_db, no_lake, payment, tmp_path, monkeypatch):
+    spool = Spool(tmp_path / "spool", segment_bytes=1 << 16, fsync_interval=0)
+    monkeypatch.setattr(spool_module, "_spool", spool)
+
+    batch = [payment("w-1"), payment("w-2", amount=-1), {"event_id": "w-3"}, payment("w-1")]
+
+    async def post() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [
+                await client.post("/ingest/payment/batch", content=orjson.dumps(batch)),
+                await client.post("/ingest/payment", content=orjson.dumps(payment("w-4"))),
+            ]
+
+    try:
+        many, one = asyncio.run(post())
+        assert many.status_code == 200 and one.status_code == 202
+        assert many.json()["spooled"] == 4 and one.json()["status"] == "spooled"
+        assert [r["issues"] for r in many.json()["results"]] == [[], ["validation_error"], ["validation_error"], []]
+        with db.session_scope() as session:
+            assert session.scalar(select(func.count()).select_from(EventRaw)) == 0
+
+        # Applied but not checkpointed, as if the process died: the restart replays it as duplicates
+        pending = spool.read(100)
+        spool_module.ingest_items(spool_module.decode(pending.payloads))
+        spool.close()
+        spool = Spool(tmp_path / "spool", segment_bytes=1 << 16, fsync_interval=0)
+        assert spool.lag_records == 5
+        assert drain_once(spool, 100) == 5 and drain_once(spool, 100) == 0
+
+        with db.session_scope() as session:
+            assert set(session.scalars(select(EventRaw.event_id))) == {"w-1", "w-4"}
+            assert set(session.scalars(select(EventQuarantine.event_id))) == {"w-2", "w-3"}
+    finally:
+        spool.close()
+
+
+def test_records_that_fail_to_apply_stay_on_the_spool(sqlite_db, payment, tmp_path, monkeypatch):
+    spool = Spool(tmp_path / "spool", segment_bytes=1 << 16, fsync_interval=0)
+    lake: dict[str, object] = {}
+
+    def put_json(key: str, data: object) -> bool:
+        if lake.get("down"):
+            raise ConnectionError("lake unavailable")
+        lake[key] = data
+        return True
+
+    monkeypatch.setattr("ingestion.app.service.put_json", put_json)
+    try:
+        spool_module.spool_items(spool, validate_batch(orjson.dumps([payment("d-1"), payment("d-2")]), "payment"))
+
+        lake["down"] = True
+        with pytest.raises(SpoolError):
+            drain_once(spool, 100)
+        assert spool.lag_records == 2  # not checkpointed
+        with db.session_scope() as session:
+            assert session.scalar(select(func.count()).select_from(EventRaw)) == 0
+            assert session.scalar(select(func.count()).select_from(EventQuarantine)) == 0
+
+        lake["down"] = False
+        assert drain_once(spool, 100) == 2 and spool.lag_records == 0
+        with db.session_scope() as session:
+            assert set(session.scalars(select(EventRaw.event_id))) == {"d-1", "d-2"}
+    finally:
+        spool.close()
+
+
+def test_a_record_that_never_applies_is_dead_lettered_and_the_rest_drain(sqlite_db, payment, tmp_path, monkeypatch):
+    spool = Spool(tmp_path / "spool", segment_bytes=1 << 16, fsync_interval=0)
+
+    def put_json(key: str, data: object) -> bool:
+        if "d-2" in key:
+            raise ValueError("value too long for type character varying(128)")  # what the record holds, every time
+        return True
+
+    monkeypatch.setattr("ingestion.app.service.put_json", put_json)
+    try:
+        spool_module.spool_items(spool, validate_batch(orjson.dumps([payment(f"d-{i}") for i in range(1, 4)]), "payment"))
+        spool.append([b'{"event_type":"payment","payload":{"event_id":"torn'])  # intact on disk, corrupt inside
+        spool_module.spool_items(spool, validate_batch(orjson.dumps([payment("d-4")]), "payment"))
+
+        assert drain_once(spool, 100) == 5
+        assert spool.lag_records == 0 and drain_once(spool, 100) == 0
+        with db.session_scope() as session:
+            assert set(session.scalars(select(EventRaw.event_id))) == {"d-1", "d-3", "d-4"}
+        dead_letter = tmp_path / "spool" / "dead-letter.ndjson"
+        dead = [orjson.loads(line) for line in dead_letter.read_bytes().splitlines()]
+        assert [d["error"] for d in dead] == ["undecodable spool batch", "ValueError: value too long for type character varying(128)"]
+        assert '"torn' in dead[0]["payload"] and orjson.loads(dead[1]["payload"])["payload"]["event_id"] == "d-2"
+        assert spool.status()["dead_letter_bytes"] == dead_letter.stat().st_size
+    finally:
+        spool.close()
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+from typing import AsyncIterator
+
+import httpx
+import orjson
+import pytest
+import zstandard
+from sqlalchemy import func, select
+
+from ingestion.app.main import app
+from ingestion.app.models import EventQuarantine, EventRaw
+from ingestion.app.stream import _DECODE_STEP, StreamError, decode, split_lines
+from platform_common import db
+from platform_common.config import settings
+
+
+async def pieces(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(it: AsyncIterator[tuple[list[int], list[bytes]]]) -> list[tuple[list[int], list[bytes]]]:
+    return [chunk async for chunk in it]
+
+
+def test_decode_and_split_across_arbitrary_boundaries():
+    text = b'{"a": 1}\n\n{"a": 2}\r\n{"a": 3}\n{"a": 4}'
+    packed = zstandard.ZstdCompressor().compress(text)
+
+    chunks = asyncio.run(collect(split_lines(decode(pieces(packed, 3), "zstd"), chunk_size=2, max_line=64)))
+    assert chunks == [([1, 3], [b'{"a": 1}', b'{"a": 2}']), ([4, 5], [b'{"a": 3}', b'{"a": 4}'])]
+
+    # Concatenated gzip members decode as one stream
+    two_members = gzip.compress(text[:12]) + gzip.compress(text[12:])
+    assert asyncio.run(collect(split_lines(decode(pieces(two_members, 5), "gzip"), chunk_size=10, max_line=64)))[0][1] == chunks[0][1] + chunks[1][1]
+
+    with pytest.raises(StreamError):
+        asyncio.run(collect(split_lines(pieces(b"x" * 100, 10), chunk_size=10, max_line=64)))
+
+
+async def sizes(chunks: AsyncIterator[bytes]) -> list[int]:
+    return [len(chunk) async for chunk in chunks]
+
+
+def test_decode_bounds_output_and_rejects_truncated_uploads():
+    bomb = b"\0" * (64 << 20)
+    for encoding, packed in (("zstd", zstandard.ZstdCompressor(level=19).compress(bomb)), ("gzip", gzip.compress(bomb, 9))):
+        assert len(packed) < 128 << 10
+        out = asyncio.run(sizes(decode(pieces(packed, 1 << 16), encoding)))
+        assert sum(out) == len(bomb) and max(out) <= 2 * _DECODE_STEP  # one received chunk is many steps
+
+        with pytest.raises(StreamError, match="ends mid-"):
+            asyncio.run(sizes(decode(pieces(packed[:-3], 1 << 16), encoding)))
+
+    # Concatenated zstd frames decode as one stream, and an empty upload is no error
+    text = b'{"a": 1}\n{"a": 2}\n'
+    frames = zstandard.ZstdCompressor().compress(text[:9]) + zstandard.ZstdCompressor().compress(text[9:])
+    assert asyncio.run(collect(split_lines(decode(pieces(frames, 5), "zstd"), chunk_size=10, max_line=64)))[0][1] == text.splitlines()
+    assert asyncio.run(sizes(decode(pieces(b"", 1), "zstd"))) == []
+
+
+def test_stream_endpoint_ingests_gzip_ndjson_in_chunks(sqlite_db, no_lake, payment, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_CHUNK_SIZE", 2)
+
+    lines = [orjson.dumps({"event_type": "payment", "payload": payment(f"s-{i}")}) for i in range(5)]
+    lines += [
+        b"",
+        b"{not json",
+        orjson.dumps({"event_type": "payment", "payload": payment("s-bad", amount=-5)}),
+        lines[0],  # replay of line 1
+    ]
+    body = gzip.compress(b"\n".join(lines) + b"\n")
+
+    async def post() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            headers = {"content-type": "application/x-ndjson", "content-encoding": "gzip"}
+            return [
+                await client.post("/ingest/stream", content=pieces(body, 7), headers=headers),
+                await client.post("/ingest/stream", content=b"{}", headers={"content-type": "application/json"}),
+            ]
+
+    ok, wrong_type = asyncio.run(post())
+    assert ok.status_code == 200, ok.text
+    summary = ok.json()
+    assert (summary["events"], summary["accepted"], summary["duplicates"], summary["quarantined"]) == (8, 5, 1, 2)
+    assert summary["chunks"] == 4
+    assert [(r["line"], r["status"]) for r in summary["not_accepted"]] == [(7, "quarantined"), (8, "quarantined"), (9, "duplicate")]
+    assert wrong_type.status_code == 415
+
+    with db.session_scope() as session:
+        assert session.scalar(select(func.count()).select_from(EventRaw)) == 5
+        assert session.scalar(select(func.count()).select_from(EventQuarantine)) == 2
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import httpx
+import orjson
+from sqlalchemy import select, update
+
+from ingestion.app import tiering
+from ingestion.app.main import app
+from ingestion.app.models import EventRaw
+from platform_common import db
+
+
+def test_old_payloads_are_stripped_and_read_back_from_the_lake(sqlite_db, monkeypatch):
+    lake: dict[str, bytes] = {}
+    gets: list[str] = []
+
+    def get_json(key: str, client: object) -> dict:
+        gets.append(key)
+        return orjson.loads(lake[key])
+
+    monkeypatch.setattr("ingestion.app.service.put_json", lambda key, data: lake.setdefault(key, orjson.dumps(data)) is not None)
+    monkeypatch.setattr(tiering, "get_json", get_json)
+    monkeypatch.setattr(tiering, "get_s3_client", lambda: None)
+    tiering.clear_cache()
+    now = datetime.now(timezone.utc).isoformat()
+    events: list[tuple[str, dict[str, Any]]] = [
+        ("payment", {"event_id": "p1", "amount": 12.5, "currency": "USD", "payment_method": "card"}),
+        ("usage", {"event_id": "u1", "metric_name": "api_calls", "units": 7}),
+        ("subscription", {"event_id": "s1", "action": "created", "plan_id": "pro"}),
+        ("payment", {"event_id": "p2", "amount": 1.0, "currency": "EUR"}),
+    ]
+
+    async def call(method: str, path: str, body=None) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.request(method, path, content=orjson.dumps(body) if body is not None else None)
+
+    try:
+        for event_type, body in events:
+            body = {"event_time": now, "customer_id": "c1", "region": "eu", **body}
+            assert asyncio.run(call("POST", f"/ingest/{event_type}", body)).status_code == 202
+        with db.session_scope() as session:
+            # p2 is recent; the others arrived long ago
+            old = datetime.now(timezone.utc) - timedelta(days=40)
+            session.execute(update(EventRaw).where(EventRaw.event_id != "p2").values(inserted_at=old))
+
+        assert tiering.tier_payloads(dry_run=True).by_type == {"payment": 1, "subscription": 1, "usage": 1}
+        report = tiering.tier_payloads(chunk_size=2)
+        assert (report.tiered, report.chunks) == (3, 2)
+        assert tiering.tier_payloads().tiered == 0
+        with db.session_scope() as session:
+            stored = {e.event_id: (e.payload, e.payload_tiered_at) for e in session.scalars(select(EventRaw))}
+        assert stored["p1"][0] == {"amount": 12.5, "currency": "USD", "payment_method": "card"}
+        assert stored["u1"][0] == {"metric_name": "api_calls", "units": 7, "plan_id": None}
+        assert stored["s1"][0] == {"action": "created", "plan_id": "pro"}
+        assert stored["p2"][1] is None and stored["p2"][0]["customer_id"] == "c1"
+
+        # The full payloads come back as ingested: from the lake once, then from the cache
+        full = {key: orjson.loads(body) for key, body in lake.items()}
+        for event_id in ("p1", "p1", "u1", "p2"):
+            response = asyncio.run(call("GET", f"/events/{event_id}")).json()
+            assert response["payload"] == full[response["s3_key"]]
+            assert response["payload"]["customer_id"] == "c1" and (response["payload_tiered_at"] is None) == (event_id == "p2")
+        assert sorted(key.rsplit("/", 1)[1] for key in gets) == ["p1.json", "u1.json"]
+        assert asyncio.run(call("GET", "/events/nope")).status_code == 404
+    finally:
+        tiering.clear_cache()
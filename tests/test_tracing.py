@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import orjson
+from botocore.exceptions import ClientError
+
+from ingestion.app.bulk import ingest_stream
+from ingestion.app.main import app
+from platform_common import tracing
+from platform_common.config import settings
+
+INCOMING = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+class FakeS3:
+    def __init__(self) -> None:
+        self.keys: set[str] = set()
+
+    def head_object(self, Bucket: str, Key: str) -> None:
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+    def put_object(self, Bucket: str, Key: str, **kwargs) -> None:
+        self.keys.add(Key)
+
+
+def configure(monkeypatch, request_ratio: float, job_ratio: float) -> None:
+    monkeypatch.setattr(settings, "TRACING_ENABLED", True)
+    monkeypatch.setattr(settings, "TRACE_EXPORTER", "memory")
+    monkeypatch.setattr(settings, "TRACE_SAMPLE_RATIO", request_ratio)
+    monkeypatch.setattr(settings, "TRACE_JOB_SAMPLE_RATIO", job_ratio)
+    s3 = FakeS3()
+    monkeypatch.setattr("platform_common.s3.get_s3_client", lambda: s3)
+    tracing.configure()
+
+
+def test_a_request_is_one_trace_from_the_middleware_down_to_sql_and_s3(sqlite_db, usage, monkeypatch):
+    configure(monkeypatch, request_ratio=0.0, job_ratio=0.0)
+
+    async def post(body: dict, headers: dict[str, str]) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/ingest/usage", content=orjson.dumps(body), headers=headers)
+
+    try:
+        # Sampled out at ratio 0 unless the caller's traceparent says sampled
+        response = asyncio.run(post(usage("u-1"), {}))
+        assert response.status_code == 202 and "x-trace-id" not in response.headers
+        assert tracing.finished_spans() == []
+
+        response = asyncio.run(post(usage("u-2"), {"traceparent": INCOMING}))
+        assert response.headers["x-trace-id"] == INCOMING.split("-")[1]
+        spans = tracing.finished_spans()
+        assert {span.context.trace_id for span in spans} == {int(INCOMING.split("-")[1], 16)}
+        by_name = {span.name: span for span in spans}
+        server = by_name["POST /ingest/{event_type}"]
+        assert server.parent is not None and server.parent.span_id == int(INCOMING.split("-")[2], 16)
+        assert server.attributes is not None and server.attributes["http.response.status_code"] == 202
+        assert by_name["process_item"].parent.span_id == server.context.span_id  # type: ignore[union-attr]
+        assert by_name["process_item"].attributes == {"event.type": "usage", "ingest.status": "accepted"}
+
+        # Each stage under the event, each call under its stage
+        stages = {name: by_name[name] for name in ("ingest.dedup_lookup", "ingest.quality", "ingest.s3_put", "ingest.db_flush")}
+        assert all(span.parent.span_id == by_name["process_item"].context.span_id for span in stages.values())  # type: ignore[union-attr]
+        head, put = by_name["s3 head_object"], by_name["s3 put_object"]
+        assert head.parent.span_id == put.parent.span_id == stages["ingest.s3_put"].context.span_id  # type: ignore[union-attr]
+        assert not head.status.is_ok and head.events[0].name == "exception"  # the 404 that means "not there yet"
+        statements = [span for span in spans if span.name.startswith("sql ")]
+        assert {span.parent.span_id for span in statements} >= {  # type: ignore[union-attr]
+            stages["ingest.dedup_lookup"].context.span_id, stages["ingest.db_flush"].context.span_id
+        }
+        assert any(span.name == "sql INSERT" and "events_raw" in str(span.attributes["db.statement"]) for span in statements)  # type: ignore[index]
+        assert by_name["db.commit"].parent.span_id == server.context.span_id  # type: ignore[union-attr]
+    finally:
+        monkeypatch.setattr(settings, "TRACING_ENABLED", False)
+        tracing.configure()
+
+
+def test_jobs_carry_their_trace_into_worker_threads(sqlite_db, usage, monkeypatch):
+    configure(monkeypatch, request_ratio=0.0, job_ratio=1.0)
+    events = [("usage", usage(f"b-{i}")) for i in range(6)]
+    try:
+        report = ingest_stream(iter(events), chunk_size=2, workers=3)  # type: ignore[arg-type]
+        assert report.accepted == 6 and report.executor == "thread"
+        spans = tracing.finished_spans()
+        (root,) = [span for span in spans if span.name == "bulk ingest"]
+        assert {span.context.trace_id for span in spans} == {root.context.trace_id}
+        chunks = [span for span in spans if span.name == "bulk.chunk"]
+        assert len(chunks) == 3 and {span.attributes["bulk.chunk"] for span in chunks} == {0, 1, 2}  # type: ignore[index]
+        assert all(span.parent.span_id == root.context.span_id for span in chunks)  # type: ignore[union-attr]
+        assert len([span for span in spans if span.name == "process_event"]) == 6
+
+        # A failure is recorded on the span it escaped from
+        tracing.clear_spans()
+        try:
+            with tracing.span("job", root="job"):
+                with tracing.span("step"):
+                    raise ValueError("boom")
+        except ValueError:
+            pass
+        step, job = tracing.finished_spans()
+        assert (step.name, job.name) == ("step", "job")
+        assert not step.status.is_ok and step.status.description == "ValueError: boom"
+
+        # Unsampled jobs record nothing, nested roots included
+        monkeypatch.setattr(settings, "TRACE_JOB_SAMPLE_RATIO", 0.0)
+        tracing.configure()
+        with tracing.span("job", root="job"), tracing.span("nested", root="job"):
+            assert tracing.inject() is not None  # still propagated, as unsampled
+        assert tracing.finished_spans() == []
+    finally:
+        monkeypatch.setattr(settings, "TRACING_ENABLED", False)
+        tracing.configure()
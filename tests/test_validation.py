@@ -36,3 +36,14 @@ def test_quarantine_on_validation_error(monkeypatch):
     eq = session.scalar(select(EventQuarantine).where(EventQuarantine.event_id == "evt-bad-1"))
     assert eq is not None
     assert "validation_error" in (eq.issues or "")
+
+
+def test_replayed_invalid_event_is_duplicate(monkeypatch):
+    monkeypatch.setattr("platform_common.s3.put_json", lambda *args, **kwargs: True)
+
+    session = make_session()
+
+    payload = {"event_id": "evt-bad-2", "customer_id": "cust-42", "region": "us-east", "amount": -1.0, "currency": "USD"}
+
+    assert process_event(session, "payment", payload).status == "quarantined"
+    assert process_event(session, "payment", dict(payload)).status == "duplicate"
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+from orchestration.watermarks import SourceSnapshot, checksum, model_inputs, plan
+
+MODELS = [
+    ("002_stg_payment_events", "create or replace view stg_payment_events as select * from events_raw where event_type = 'payment';"),
+    ("020_fact_revenue_daily", "create or replace view fact_revenue_daily as select event_date from stg_payment_events group by 1;"),
+    ("030_customer_state", "create table if not exists customer_state (id text);\ninsert into customer_state select customer_id from events_raw;"),
+]
+
+
+def make_snapshot(now: datetime) -> SourceSnapshot:
+    return SourceSnapshot(
+        events={"payment": now, "subscription": None, "usage": None, "cost": None},
+        runs={"revenue_daily": (7, now - timedelta(hours=1)), "subscriptions_daily": (8, now)},
+        checksums={name: checksum(sql) for name, sql in MODELS},
+    )
+
+
+def test_model_inputs_follow_upstream_views():
+    inputs = model_inputs(MODELS)
+    assert inputs["020_fact_revenue_daily"] == {"payment"}
+    assert inputs["030_customer_state"] == {"subscription", "payment", "usage", "cost"}
+
+
+def test_plan_skips_unchanged_views_and_runs_stale_work():
+    now = datetime.now(timezone.utc)
+    snap = make_snapshot(now)
+    state = {
+        f"transform:{name}": {"checksum": checksum(sql), "inputs": {"payment": (now - timedelta(minutes=5)).isoformat()}}
+        for name, sql in MODELS
+    }
+
+    p = plan(MODELS, snap, state)
+    assert p.models == ["030_customer_state"]
+    assert p.targets == ["revenue_daily"]
+    assert p.reasons["transform:020_fact_revenue_daily"].startswith("skipped")
+    assert p.reasons["forecast:subscriptions_daily"] == "skipped: no new events since run 8"
+
+    state["transform:030_customer_state"]["inputs"] = {"payment": now.isoformat()}
+    assert plan(MODELS, snap, state).models == []
+
+
+def test_forecasts_without_a_run_wait_for_new_events_after_an_attempt():
+    now = datetime.now(timezone.utc)
+    snap = make_snapshot(now)
+    snap.runs.pop("revenue_daily")  # no payments to fit on last time
+    state = {f"transform:{name}": {"checksum": checksum(sql), "inputs": {"payment": now.isoformat()}} for name, sql in MODELS}
+
+    assert plan(MODELS, snap, state).reasons["forecast:revenue_daily"] == "no previous run"
+    state["forecast:revenue_daily"] = {"inputs": {"payment": now.isoformat()}}
+    p = plan(MODELS, snap, state)
+    assert p.targets == [] and p.reasons["forecast:revenue_daily"] == "skipped: no new events since the last attempt"
+    state["forecast:revenue_daily"] = {"inputs": {}}
+    assert plan(MODELS, snap, state).reasons["forecast:revenue_daily"] == "new events since the last attempt: payment"
@@ -2,35 +2,112 @@ from __future__ import annotations
 
 import glob
 import os
+import re
+import time
 from typing import Iterable
 
+from loguru import logger
 from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
 
-from platform_common.db import get_engine
+from platform_common import query_profiles
+from platform_common.config import settings
+from platform_common.db import scatter
+from platform_common.metrics import TRANSFORM_MODEL_SECONDS, timed
+from platform_common.tracing import span
 
+# Comments, quoted strings and identifiers, dollar-quoted bodies (DO blocks), or a statement-ending semicolon
+_TOKENS = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$).*?\1|;", re.S)
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
 
-def read_sql_files(directory: str) -> list[str]:
+
+def default_sql_dir() -> str:
+    return os.path.join(os.path.dirname(__file__), "sql")
+
+
+def read_sql_models(directory: str) -> list[tuple[str, str]]:
+    """(model name, sql) in execution order; the model name is the file stem, e.g. 020_fact_revenue_daily."""
     files = sorted(glob.glob(os.path.join(directory, "*.sql")))
-    statements: list[str] = []
+    models: list[tuple[str, str]] = []
     for f in files:
         with open(f, "r", encoding="utf-8") as fh:
             sql = fh.read().strip()
             if sql:
-                statements.append(sql)
-    return statements
+                models.append((os.path.splitext(os.path.basename(f))[0], sql))
+    return models
+
+
+def read_sql_files(directory: str) -> list[str]:
+    return [sql for _, sql in read_sql_models(directory)]
+
+
+def split_statements(sql: str) -> list[str]:
+    """Statements of a model file, in order; semicolons in comments, strings and $$ bodies do not split."""
+    statements: list[str] = []
+    start = 0
+    for match in _TOKENS.finditer(sql):
+        if match.group(0) == ";":
+            statements.append(sql[start:match.start()])
+            start = match.end()
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if _COMMENTS.sub("", statement).strip()]
 
 
 def run_sql(statements: Iterable[str]) -> None:
-    engine = get_engine()
-    with engine.begin() as conn:
-        for sql in statements:
-            conn.execute(text(sql))
+    statements = list(statements)
+
+    def run(engine: Engine) -> None:
+        with engine.begin() as conn:
+            for i, sql in enumerate(statements):
+                started = time.perf_counter()
+                conn.execute(text(sql))
+                logger.info("SQL #{} ran in {:.1f} ms", i, (time.perf_counter() - started) * 1000)
+
+    scatter(run, read=False)
+
+
+def _execute(conn: Connection, statement: str) -> None:
+    # A write that was slow last time runs under EXPLAIN ANALYZE, which performs it and returns its plan
+    if settings.QUERY_PROFILING_ENABLED and conn.dialect.name == "postgresql" and query_profiles.explain_inline(statement):
+        started = time.perf_counter()
+        plan = conn.execute(text(query_profiles.EXPLAIN + statement)).scalar()
+        query_profiles.capture(statement, time.perf_counter() - started, plan)
+    else:
+        conn.execute(text(statement))
+
+
+def execute_models(conn: Connection, models: list[tuple[str, str]]) -> None:
+    """Run models on an open connection one statement at a time, recording each model's run time under its
+    name; the query profiler sees each statement tagged model:<name>."""
+    for name, sql in models:
+        started = time.perf_counter()
+        with timed(TRANSFORM_MODEL_SECONDS.labels(name)), query_profiles.tagged(f"model:{name}"), span(f"model {name}", {"ffdp.model": name}):
+            for statement in split_statements(sql):
+                _execute(conn, statement)
+        logger.info("Model {} ran in {:.1f} ms", name, (time.perf_counter() - started) * 1000)
+
+
+def _run_timed(models: list[tuple[str, str]]) -> None:
+    # Every event shard builds its own models from its own events, all shards at once
+    def run(engine: Engine) -> None:
+        with engine.begin() as conn:
+            execute_models(conn, models)
+
+    with span("transformations", {"ffdp.models": len(models)}, root="job"):
+        scatter(run, read=False)
+
+
+def run_models(names: Iterable[str], sql_dir: str | None = None) -> list[str]:
+    """Run only the named models, keeping file order. Returns the names that ran."""
+    wanted = set(names)
+    selected = [(name, sql) for name, sql in read_sql_models(sql_dir or default_sql_dir()) if name in wanted]
+    _run_timed(selected)
+    return [name for name, _ in selected]
 
 
 def run_all(sql_dir: str | None = None) -> None:
-    directory = sql_dir or os.path.join(os.path.dirname(__file__), "sql")
-    statements = read_sql_files(directory)
-    run_sql(statements)
+    directory = sql_dir or default_sql_dir()
+    _run_timed(read_sql_models(directory))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+-- Per-model high-water marks (event inserted_at) for the incrementally maintained tables
+create table if not exists transform_marks (
+  model varchar(128) primary key,
+  mark timestamptz not null
+);
@@ -1,7 +1,32 @@
-create or replace view dim_customer as
-select distinct on (customer_id)
-  customer_id as customer_key,
-  region as default_region,
-  min(event_time) over (partition by customer_id) as first_seen_at
-from events_raw
-where customer_id is not null and customer_id <> '';
+-- Customer dimension, maintained incrementally: each run folds in the events inserted since the previous
+-- run. It re-reads 10 minutes before its mark, so rows from transactions still open at the last run are not
+-- missed; the upsert is idempotent (first_seen_at only moves earlier, default_region is the earliest event's).
+do $$
+begin
+  if exists (select 1 from pg_views where schemaname = current_schema() and viewname = 'dim_customer') then
+    drop view dim_customer;
+  end if;
+end $$;
+
+create table if not exists dim_customer (
+  customer_key varchar(128) primary key,
+  default_region varchar(64) not null,
+  first_seen_at timestamptz not null
+);
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'dim_customer') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), firsts as (
+  select distinct on (customer_id) customer_id, region, event_time
+  from events_raw, since
+  where inserted_at > since.ts and customer_id is not null and customer_id <> ''
+  order by customer_id, event_time, id
+)
+insert into dim_customer (customer_key, default_region, first_seen_at)
+select customer_id, region, event_time from firsts
+on conflict (customer_key) do update
+set default_region = case when excluded.first_seen_at < dim_customer.first_seen_at then excluded.default_region else dim_customer.default_region end,
+    first_seen_at = least(excluded.first_seen_at, dim_customer.first_seen_at);
+
+insert into transform_marks (model, mark) values ('dim_customer', now())
+on conflict (model) do update set mark = excluded.mark;
@@ -1,7 +1,7 @@
 create or replace view dim_time as
 with bounds as (
-  select coalesce(min(date_trunc('day', event_time))::date, current_date) as start_date,
-         coalesce(max(date_trunc('day', event_time))::date, current_date) as end_date
+  select coalesce(date_trunc('day', min(event_time))::date, current_date) as start_date,
+         coalesce(date_trunc('day', max(event_time))::date, current_date) as end_date
   from events_raw
 ), series as (
   select generate_series(start_date, greatest(end_date, current_date), interval '1 day')::date as date_key
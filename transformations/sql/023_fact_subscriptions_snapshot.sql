@@ -1,28 +1,106 @@
--- Active subscriptions snapshot per day
-create or replace view fact_subscriptions_snapshot as
-with changes as (
-  select event_date::date as date_key,
-         customer_id,
-         (payload::jsonb ->> 'plan_id') as plan_id,
-         case when (payload::jsonb ->> 'action') = 'created' then 1
-              when (payload::jsonb ->> 'action') = 'canceled' then -1
-              else 0 end as delta
-  from stg_subscription_events
-),
-net_changes as (
-  select date_key, sum(delta) as net_delta
-  from changes
-  group by 1
-),
-seq as (
-  select d.date_key
-  from dim_time d
-),
-agg as (
-  select s.date_key,
-         sum(n.net_delta) over (order by s.date_key rows between unbounded preceding and current row) as active_subscriptions
-  from seq s
-  left join net_changes n on n.date_key = s.date_key
+-- Subscription state, maintained incrementally from the events inserted since the previous run (re-reading
+-- 10 minutes before the mark, like the customer dimension). Every step recomputes what the new events touch rather
+-- than adding to it, so re-reading an event is harmless:
+--   subscription_state: per customer, rebuilt from that customer's subscription events
+--   subscriptions_active_daily: net change per day, rebuilt for the days with new events, and the running
+--     active count carried forward from the day before the earliest touched day
+drop view if exists fact_subscriptions_snapshot;
+
+create table if not exists subscription_state (
+  customer_id varchar(128) primary key,
+  net_subscriptions bigint not null,  -- created minus canceled
+  plan_id text,
+  last_action text,
+  last_event_at timestamptz not null
+);
+
+create table if not exists subscriptions_active_daily (
+  date_key date primary key,
+  net_delta bigint not null,
+  active_subscriptions bigint not null
+);
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'subscriptions') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), changed as (
+  select distinct customer_id from events_raw, since
+  where event_type = 'subscription' and inserted_at > since.ts
+)
+insert into subscription_state (customer_id, net_subscriptions, plan_id, last_action, last_event_at)
+select s.customer_id,
+       sum(case when s.action = 'created' then 1 when s.action = 'canceled' then -1 else 0 end),
+       (array_agg(s.plan_id order by s.event_time desc, s.event_id desc))[1],
+       (array_agg(s.action order by s.event_time desc, s.event_id desc))[1],
+       max(s.event_time)
+from stg_subscription_events s
+join changed c on c.customer_id = s.customer_id
+group by s.customer_id
+on conflict (customer_id) do update
+set net_subscriptions = excluded.net_subscriptions,
+    plan_id = excluded.plan_id,
+    last_action = excluded.last_action,
+    last_event_at = excluded.last_event_at;
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'subscriptions') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), touched as (
+  select distinct date_trunc('day', event_time)::date as date_key
+  from events_raw, since
+  where event_type = 'subscription' and inserted_at > since.ts
 )
-select date_key, coalesce(active_subscriptions, 0) as active_subscriptions
-from agg;
+insert into subscriptions_active_daily (date_key, net_delta, active_subscriptions)
+select t.date_key,
+       coalesce(sum(case when e.payload::jsonb ->> 'action' = 'created' then 1
+                         when e.payload::jsonb ->> 'action' = 'canceled' then -1
+                         else 0 end), 0),
+       0  -- set by the next statement
+from touched t
+left join events_raw e
+  on e.event_type = 'subscription' and e.event_time >= t.date_key and e.event_time < t.date_key + 1
+group by t.date_key
+on conflict (date_key) do update set net_delta = excluded.net_delta;
+
+-- Recompute the running count from the earliest touched day (or the day after the last materialized one)
+-- through the end of dim_time, starting from the count the day before
+with since as (
+  select coalesce((select mark from transform_marks where model = 'subscriptions') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), fresh as (
+  select min(date_trunc('day', event_time))::date as lo
+  from events_raw, since
+  where event_type = 'subscription' and inserted_at > since.ts
+), span as (
+  select min(date_key) as lo, max(date_key) as hi from dim_time
+), bounds as (
+  select least(
+           f.lo,
+           (select max(date_key) + 1 from subscriptions_active_daily),
+           case when s.lo < coalesce((select min(date_key) from subscriptions_active_daily), 'infinity'::date) then s.lo end
+         ) as lo,
+         s.hi
+  from fresh f, span s
+), days as (
+  select generate_series(b.lo, b.hi, interval '1 day')::date as date_key
+  from bounds b
+  where b.lo <= b.hi
+), carried as (
+  select coalesce((select a.active_subscriptions from subscriptions_active_daily a, bounds b where a.date_key = b.lo - 1), 0) as active
+)
+insert into subscriptions_active_daily (date_key, net_delta, active_subscriptions)
+select d.date_key,
+       coalesce(a.net_delta, 0),
+       (select active from carried) + sum(coalesce(a.net_delta, 0)) over (order by d.date_key)
+from days d
+left join subscriptions_active_daily a on a.date_key = d.date_key
+on conflict (date_key) do update set active_subscriptions = excluded.active_subscriptions;
+
+insert into transform_marks (model, mark) values ('subscriptions', now())
+on conflict (model) do update set mark = excluded.mark;
+
+-- Days after the last run carry its count forward, so the snapshot always reaches today
+create or replace view fact_subscriptions_snapshot as
+select date_key, active_subscriptions
+from subscriptions_active_daily
+union all
+select g::date, last_day.active_subscriptions
+from (select date_key, active_subscriptions from subscriptions_active_daily order by date_key desc limit 1) last_day
+cross join generate_series(last_day.date_key + 1, current_date, interval '1 day') g;
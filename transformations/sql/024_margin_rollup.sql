@@ -0,0 +1,61 @@
+-- Revenue and cost per region at day, week and month grain, maintained incrementally like the subscription
+-- state: each run recomputes the days that the events inserted since its previous run (less 10 minutes) fall on,
+-- then the weeks and months containing them from the day rows. Periods start on their first day (weeks on Monday).
+create table if not exists margin_rollup (
+  granularity varchar(8) not null,  -- day, week or month
+  period_start date not null,
+  region_key varchar(64) not null,
+  revenue_amount numeric not null,
+  payments_count bigint not null,
+  cost_amount numeric not null,
+  costs_count bigint not null,
+  primary key (granularity, period_start, region_key)
+);
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'margin_rollup') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), touched as (
+  select distinct date_trunc('day', event_time)::date as date_key
+  from events_raw, since
+  where event_type in ('payment', 'cost') and inserted_at > since.ts
+)
+insert into margin_rollup (granularity, period_start, region_key, revenue_amount, payments_count, cost_amount, costs_count)
+select 'day',
+       t.date_key,
+       e.region,
+       coalesce(sum((e.payload::jsonb ->> 'amount')::numeric) filter (where e.event_type = 'payment'), 0),
+       count(*) filter (where e.event_type = 'payment'),
+       coalesce(sum((e.payload::jsonb ->> 'amount')::numeric) filter (where e.event_type = 'cost'), 0),
+       count(*) filter (where e.event_type = 'cost')
+from touched t
+join events_raw e
+  on e.event_type in ('payment', 'cost') and e.event_time >= t.date_key and e.event_time < t.date_key + 1
+group by t.date_key, e.region
+on conflict (granularity, period_start, region_key) do update
+set revenue_amount = excluded.revenue_amount,
+    payments_count = excluded.payments_count,
+    cost_amount = excluded.cost_amount,
+    costs_count = excluded.costs_count;
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'margin_rollup') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), periods as (
+  select distinct g.granularity, date_trunc(g.granularity, e.event_time)::date as period_start
+  from events_raw e, since, (values ('week'), ('month')) g(granularity)
+  where e.event_type in ('payment', 'cost') and e.inserted_at > since.ts
+)
+insert into margin_rollup (granularity, period_start, region_key, revenue_amount, payments_count, cost_amount, costs_count)
+select p.granularity, p.period_start, d.region_key,
+       sum(d.revenue_amount), sum(d.payments_count), sum(d.cost_amount), sum(d.costs_count)
+from periods p
+join margin_rollup d
+  on d.granularity = 'day' and d.period_start >= p.period_start and d.period_start < p.period_start + ('1 ' || p.granularity)::interval
+group by p.granularity, p.period_start, d.region_key
+on conflict (granularity, period_start, region_key) do update
+set revenue_amount = excluded.revenue_amount,
+    payments_count = excluded.payments_count,
+    cost_amount = excluded.cost_amount,
+    costs_count = excluded.costs_count;
+
+insert into transform_marks (model, mark) values ('margin_rollup', now())
+on conflict (model) do update set mark = excluded.mark;
@@ -0,0 +1,55 @@
+-- Usage units per metric, plan and region at day, week and month grain, maintained like margin_rollup (024).
+-- A usage event without a metric or plan is rolled up under ''.
+create table if not exists usage_rollup (
+  granularity varchar(8) not null,  -- day, week or month
+  period_start date not null,
+  metric_name text not null,
+  plan_id text not null,
+  region_key varchar(64) not null,
+  total_units bigint not null,
+  usage_events bigint not null,
+  primary key (granularity, period_start, metric_name, plan_id, region_key)
+);
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'usage_rollup') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), touched as (
+  select distinct date_trunc('day', event_time)::date as date_key
+  from events_raw, since
+  where event_type = 'usage' and inserted_at > since.ts
+)
+insert into usage_rollup (granularity, period_start, metric_name, plan_id, region_key, total_units, usage_events)
+select 'day',
+       t.date_key,
+       coalesce(e.payload::jsonb ->> 'metric_name', ''),
+       coalesce(e.payload::jsonb ->> 'plan_id', ''),
+       e.region,
+       coalesce(sum((e.payload::jsonb ->> 'units')::int), 0),
+       count(*)
+from touched t
+join events_raw e
+  on e.event_type = 'usage' and e.event_time >= t.date_key and e.event_time < t.date_key + 1
+group by 1, 2, 3, 4, 5
+on conflict (granularity, period_start, metric_name, plan_id, region_key) do update
+set total_units = excluded.total_units,
+    usage_events = excluded.usage_events;
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'usage_rollup') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), periods as (
+  select distinct g.granularity, date_trunc(g.granularity, e.event_time)::date as period_start
+  from events_raw e, since, (values ('week'), ('month')) g(granularity)
+  where e.event_type = 'usage' and e.inserted_at > since.ts
+)
+insert into usage_rollup (granularity, period_start, metric_name, plan_id, region_key, total_units, usage_events)
+select p.granularity, p.period_start, d.metric_name, d.plan_id, d.region_key, sum(d.total_units), sum(d.usage_events)
+from periods p
+join usage_rollup d
+  on d.granularity = 'day' and d.period_start >= p.period_start and d.period_start < p.period_start + ('1 ' || p.granularity)::interval
+group by 1, 2, 3, 4, 5
+on conflict (granularity, period_start, metric_name, plan_id, region_key) do update
+set total_units = excluded.total_units,
+    usage_events = excluded.usage_events;
+
+insert into transform_marks (model, mark) values ('usage_rollup', now())
+on conflict (model) do update set mark = excluded.mark;
@@ -0,0 +1,76 @@
+-- Distinct customers per day and per month, region and event type as HyperLogLog sketches, merged and estimated at
+-- query time by analytics/sketches.py. Maintained like margin_rollup (024): the days and months that events inserted
+-- since the previous run (less 10 minutes) fall on are rebuilt from events_raw.
+--
+-- Each customer id hashes to 64 bits (hashtextextended). The top 12 bits pick one of 4096 registers, which keeps the
+-- largest position of the first 1 bit in the low 52 bits (53 when they are all 0). A sketch is stored sparse, 3 bytes
+-- per non-empty register (index << 8 | value), or dense, one byte per register, once that is smaller.
+create table if not exists customer_sketches (
+  granularity varchar(8) not null,  -- day or month
+  period_start date not null,
+  region_key varchar(64) not null,
+  event_type varchar(32) not null,
+  registers bytea not null,
+  primary key (granularity, period_start, region_key, event_type)
+);
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'customer_sketches') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), touched as (
+  select distinct date_trunc('day', event_time)::date as period_start
+  from events_raw, since
+  where inserted_at > since.ts
+), registers as (
+  select t.period_start, e.region, e.event_type,
+         ((hashtextextended(e.customer_id, 0) >> 52) & 4095)::int as idx,
+         max(coalesce(nullif(position('1' in hashtextextended(e.customer_id, 0)::bit(52)::text), 0), 53)) as value
+  from touched t
+  join events_raw e on e.event_time >= t.period_start and e.event_time < t.period_start + 1
+  where e.customer_id <> ''
+  group by 1, 2, 3, 4
+), sketches as (
+  select period_start, region, event_type, array_agg(idx order by idx) as idxs, array_agg(value order by idx) as vals
+  from registers
+  group by 1, 2, 3
+)
+insert into customer_sketches (granularity, period_start, region_key, event_type, registers)
+select 'day', period_start, region, event_type,
+       case when cardinality(idxs) * 3 < 4096
+            then (select string_agg(substring(int4send(r.i << 8 | r.v) from 2), ''::bytea order by r.i) from unnest(idxs, vals) r(i, v))
+            else (select string_agg(set_byte('\x00'::bytea, 0, coalesce(r.v, 0)), ''::bytea order by g)
+                  from generate_series(0, 4095) g left join unnest(idxs, vals) r(i, v) on r.i = g)
+       end
+from sketches
+on conflict (granularity, period_start, region_key, event_type) do update set registers = excluded.registers;
+
+with since as (
+  select coalesce((select mark from transform_marks where model = 'customer_sketches') - interval '10 minutes', '-infinity'::timestamptz) as ts
+), touched as (
+  select distinct date_trunc('month', event_time)::date as period_start
+  from events_raw, since
+  where inserted_at > since.ts
+), registers as (
+  select t.period_start, e.region, e.event_type,
+         ((hashtextextended(e.customer_id, 0) >> 52) & 4095)::int as idx,
+         max(coalesce(nullif(position('1' in hashtextextended(e.customer_id, 0)::bit(52)::text), 0), 53)) as value
+  from touched t
+  join events_raw e on e.event_time >= t.period_start and e.event_time < t.period_start + interval '1 month'
+  where e.customer_id <> ''
+  group by 1, 2, 3, 4
+), sketches as (
+  select period_start, region, event_type, array_agg(idx order by idx) as idxs, array_agg(value order by idx) as vals
+  from registers
+  group by 1, 2, 3
+)
+insert into customer_sketches (granularity, period_start, region_key, event_type, registers)
+select 'month', period_start, region, event_type,
+       case when cardinality(idxs) * 3 < 4096
+            then (select string_agg(substring(int4send(r.i << 8 | r.v) from 2), ''::bytea order by r.i) from unnest(idxs, vals) r(i, v))
+            else (select string_agg(set_byte('\x00'::bytea, 0, coalesce(r.v, 0)), ''::bytea order by g)
+                  from generate_series(0, 4095) g left join unnest(idxs, vals) r(i, v) on r.i = g)
+       end
+from sketches
+on conflict (granularity, period_start, region_key, event_type) do update set registers = excluded.registers;
+
+insert into transform_marks (model, mark) values ('customer_sketches', now())
+on conflict (model) do update set mark = excluded.mark;
@@ -0,0 +1,118 @@
+"""Compare incrementally maintained models with a full recomputation: python -m transformations.verify
+
+The reference queries are the view definitions the tables replaced. The dim_customer view took default_region
+from an arbitrary row; the reference takes it from the customer's earliest event, as the table does.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from platform_common.db import scatter
+
+REFERENCE: dict[str, str] = {
+    "dim_customer": """
+        select distinct on (customer_id)
+          customer_id as customer_key,
+          region as default_region,
+          min(event_time) over (partition by customer_id) as first_seen_at
+        from events_raw
+        where customer_id is not null and customer_id <> ''
+        order by customer_id, event_time, id
+    """,
+    "fact_subscriptions_snapshot": """
+        with net_changes as (
+          select event_date as date_key,
+                 sum(case when action = 'created' then 1 when action = 'canceled' then -1 else 0 end) as net_delta
+          from stg_subscription_events
+          group by 1
+        )
+        select d.date_key,
+               coalesce(sum(n.net_delta) over (order by d.date_key rows between unbounded preceding and current row), 0)::bigint
+                 as active_subscriptions
+        from dim_time d
+        left join net_changes n on n.date_key = d.date_key
+    """,
+    "margin_rollup": """
+        with daily as (
+          select coalesce(r.date_key, c.date_key) as date_key, coalesce(r.region_key, c.region_key) as region_key,
+                 coalesce(r.revenue_amount, 0) as revenue_amount, coalesce(r.payments_count, 0) as payments_count,
+                 coalesce(c.cost_amount, 0) as cost_amount, coalesce(c.costs_count, 0) as costs_count
+          from fact_revenue_daily r
+          full join fact_costs_daily c on c.date_key = r.date_key and c.region_key = r.region_key
+        )
+        select g.granularity, date_trunc(g.granularity, d.date_key)::date, d.region_key,
+               sum(d.revenue_amount), sum(d.payments_count), sum(d.cost_amount), sum(d.costs_count)
+        from daily d, (values ('day'), ('week'), ('month')) g(granularity)
+        group by 1, 2, 3
+    """,
+    "usage_rollup": """
+        select g.granularity, date_trunc(g.granularity, u.event_date)::date, coalesce(u.metric_name, ''),
+               coalesce(u.plan_id, ''), u.region, coalesce(sum(u.units), 0), count(*)
+        from stg_usage_events u, (values ('day'), ('week'), ('month')) g(granularity)
+        group by 1, 2, 3, 4, 5
+    """,
+    "customer_sketches": """
+        with registers as (
+          select g.granularity, date_trunc(g.granularity, e.event_time)::date as period_start, e.region, e.event_type,
+                 ((hashtextextended(e.customer_id, 0) >> 52) & 4095)::int as idx,
+                 max(coalesce(nullif(position('1' in hashtextextended(e.customer_id, 0)::bit(52)::text), 0), 53)) as value
+          from events_raw e, (values ('day'), ('month')) g(granularity)
+          where e.customer_id <> ''
+          group by 1, 2, 3, 4, 5
+        ), sketches as (
+          select granularity, period_start, region, event_type, array_agg(idx order by idx) as idxs, array_agg(value order by idx) as vals
+          from registers
+          group by 1, 2, 3, 4
+        )
+        select granularity, period_start, region, event_type,
+               case when cardinality(idxs) * 3 < 4096
+                    then (select string_agg(substring(int4send(r.i << 8 | r.v) from 2), ''::bytea order by r.i) from unnest(idxs, vals) r(i, v))
+                    else (select string_agg(set_byte('\\x00'::bytea, 0, coalesce(r.v, 0)), ''::bytea order by g)
+                          from generate_series(0, 4095) g left join unnest(idxs, vals) r(i, v) on r.i = g)
+               end
+        from sketches
+    """,
+}
+
+
+def mismatches(conn: Connection, relation: str) -> int:
+    """Rows in the relation or in its reference but not in both (multiset difference)."""
+    reference = REFERENCE[relation]
+    return int(conn.execute(text(f"""
+        select count(*) from (
+          (select * from {relation} except all select * from ({reference}) r)
+          union all
+          (select * from ({reference}) r except all select * from {relation})
+        ) d
+    """)).scalar_one())
+
+
+def verify(relations: list[str] | None = None) -> dict[str, int]:
+    """Mismatched rows per relation, summed over the event shards."""
+    def check(engine: Engine) -> dict[str, int]:
+        with engine.connect() as conn:
+            return {relation: mismatches(conn, relation) for relation in relations or sorted(REFERENCE)}
+
+    per_shard = scatter(check, read=False)
+    return {relation: sum(result[relation] for result in per_shard) for relation in per_shard[0]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check incremental models against a full recomputation")
+    parser.add_argument("relations", nargs="*", help="Default: " + ", ".join(sorted(REFERENCE)))
+    args = parser.parse_args()
+    unknown = set(args.relations) - set(REFERENCE)
+    if unknown:
+        parser.error("no reference query for " + ", ".join(sorted(unknown)))
+    result = verify(args.relations)
+    for relation, n in result.items():
+        print(f"{relation}: {'ok' if n == 0 else f'{n} mismatched rows'}")
+    sys.exit(1 if any(result.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()